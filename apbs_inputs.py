@@ -0,0 +1,376 @@
+"""Write APBS inputs for every complex, with grids sized for the whole dataset at once.
+
+For a binding energy, APBS solves the Poisson-Boltzmann equation for the
+complex, the receptor and the ligand. Each complex gets three `mg-auto`
+inputs, `<ID>_complex.in`, `<ID>_receptor.in` and `<ID>_ligand.in`. They
+read `<ID>_combined.pqr`, `<ID>_protein.pqr` and `<ID>_ligand.pqr`. All
+three share the grid of the complex, dimensions and centre, so discretization
+errors cancel in the difference.
+
+Grids are sized as pdb2pqr's `psize` does, but without a process per file:
+
+- The protein and ligand PQR files are read once each, in a process pool.
+  The extent of a molecule is the bounding box of its atom spheres,
+  `coords +/- radius`. The combined file is not read, since its extent is
+  the union of the two.
+- The coarse length is `--coarse-factor` times the extent, and the fine
+  length is the extent plus `--fine-padding`, but no more than the coarse
+  length.
+- Grid points follow the multigrid rule `n = 32 k + 1`, at least 33, at
+  about `--spacing` Angstrom.
+- Where a grid would need more than `--memory-mb` (about 200 bytes per
+  point), it loses 32 points at a time from the dimension whose spacing
+  stays finest, until it fits. The fine spacing grows instead of the grid
+  being split into parallel focusing runs. Grids coarsened beyond
+  `SPACING_WARNING_FACTOR` times `--spacing` are logged with the memory
+  the requested spacing would need.
+
+These steps are array operations over all complexes. A summary CSV lists the
+chosen grid, its estimated memory and whether it was coarsened that far::
+
+    python apbs_inputs.py --input-dir data/generated --summary apbs_grids.csv
+    cd data/generated/1bcu && apbs 1bcu_complex.in
+"""
+import argparse
+import csv
+import logging
+import os
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from atom_table import read_atoms
+from file_io import compression_of, find_file
+from pqr_arrays import find_complexes
+from scheduler import file_cost, map_longest_first
+
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Defaults of pdb2pqr's psize
+COARSE_FACTOR = 1.7
+FINE_PADDING = 20.0
+SPACING = 0.5
+MEMORY_MB = 400.0
+#: Bytes of APBS memory per grid point
+BYTES_PER_POINT = 200
+#: Fine spacing, as a multiple of `--spacing`, above which a coarsened grid is reported
+SPACING_WARNING_FACTOR = 1.5
+#: Multigrid levels give dimensions of the form 32 k + 1
+GRID_MULTIPLE = 32
+MIN_POINTS = GRID_MULTIPLE + 1
+
+PDIE = 2.0
+SDIE = 78.54
+IONIC_STRENGTH = 0.150
+TEMPERATURE = 298.15
+
+#: Input file of each calculation, and the PQR file it reads
+CALCULATIONS = (("complex", "combined"), ("receptor", "protein"), ("ligand", "ligand"))
+
+APBS_INPUT_FORMAT = """read
+    mol pqr {pqr_file}
+end
+elec name {name}
+    mg-auto
+    dime {dime[0]} {dime[1]} {dime[2]}
+    cglen {coarse[0]:.4f} {coarse[1]:.4f} {coarse[2]:.4f}
+    fglen {fine[0]:.4f} {fine[1]:.4f} {fine[2]:.4f}
+    cgcent {center[0]:.4f} {center[1]:.4f} {center[2]:.4f}
+    fgcent {center[0]:.4f} {center[1]:.4f} {center[2]:.4f}
+    mol 1
+    lpbe
+    bcfl sdh
+{ions}    pdie {pdie:.4f}
+    sdie {sdie:.4f}
+    srfm smol
+    chgm spl2
+    sdens 10.00
+    srad 1.40
+    swin 0.30
+    temp {temperature:.2f}
+    calcenergy total
+    calcforce no
+end
+print elecEnergy {name} end
+quit
+"""
+
+ION_FORMAT = "    ion charge {charge:+d} conc {concentration:.3f} radius 2.0\n"
+
+
+class GridSizes(NamedTuple):
+    """APBS grids of several complexes, one row per complex."""
+
+    #: Grid points per dimension, (C, 3)
+    dime: np.ndarray
+    #: Coarse grid lengths in Angstrom, (C, 3)
+    coarse_length: np.ndarray
+    #: Fine grid lengths in Angstrom, (C, 3)
+    fine_length: np.ndarray
+    #: Grid centres, (C, 3)
+    center: np.ndarray
+    #: Fine grid spacing in Angstrom, (C, 3)
+    spacing: np.ndarray
+    #: Estimated APBS memory in MB, (C,)
+    memory_mb: np.ndarray
+
+
+def molecule_extent(pqr_file: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the bounding box of the atom spheres of a PQR file.
+
+    Atoms without a radius (NaN, e.g. unmapped ligand atoms) count as points.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Lower and upper corners, each of shape (3,).
+    """
+    atoms = read_atoms(pqr_file, "pqr")
+    if atoms.n_atoms == 0:
+        raise ValueError(f"No atoms in {pqr_file}")
+    radius = np.nan_to_num(atoms["radius"], nan=0.0)[:, None]
+    coords = atoms["coords"]
+    return (coords - radius).min(axis=0), (coords + radius).max(axis=0)
+
+
+def _complex_extent(job: Tuple[str, str, str]) -> np.ndarray:
+    _, protein_file, ligand_file = job
+    protein_low, protein_high = molecule_extent(protein_file)
+    ligand_low, ligand_high = molecule_extent(ligand_file)
+    return np.stack([np.minimum(protein_low, ligand_low), np.maximum(protein_high, ligand_high)])
+
+
+def size_grids(
+    lower: np.ndarray,
+    upper: np.ndarray,
+    coarse_factor: float = COARSE_FACTOR,
+    fine_padding: float = FINE_PADDING,
+    spacing: float = SPACING,
+    memory_mb: float = MEMORY_MB,
+) -> GridSizes:
+    """
+    Size the `mg-auto` grids of many molecules at once.
+
+    Parameters
+    ----------
+    lower, upper : np.ndarray
+        Corners of the molecular extents, shape (C, 3).
+    coarse_factor : float
+        Coarse grid length as a multiple of the extent.
+    fine_padding : float
+        Fine grid length beyond the extent, in Angstrom.
+    spacing : float
+        Target fine grid spacing, in Angstrom.
+    memory_mb : float
+        Memory budget of one APBS run, in MB.
+
+    Returns
+    -------
+    GridSizes
+        The grid of each molecule.
+    """
+    lower = np.asarray(lower, dtype=np.float64).reshape(-1, 3)
+    upper = np.asarray(upper, dtype=np.float64).reshape(-1, 3)
+    extent = np.maximum(upper - lower, 0.1)
+    coarse = coarse_factor * extent
+    fine = np.minimum(extent + fine_padding, coarse)
+
+    points = np.floor(fine / spacing + 0.5)
+    dime = GRID_MULTIPLE * np.floor((points - 1) / GRID_MULTIPLE + 0.5).astype(np.int64) + 1
+    dime = np.maximum(dime, MIN_POINTS)
+
+    max_points = memory_mb * 2 ** 20 / BYTES_PER_POINT
+    rows = np.arange(len(dime))
+    while True:
+        over = (dime.prod(axis=1) > max_points) & (dime.max(axis=1) > MIN_POINTS)
+        if not over.any():
+            break
+        # Shrink the dimension of every grid over budget whose spacing stays
+        # finest after the cut
+        reduced = dime[over] - GRID_MULTIPLE
+        spacing_after = np.where(reduced >= MIN_POINTS, fine[over] / np.maximum(reduced - 1, 1), np.inf)
+        dime[rows[over], spacing_after.argmin(axis=1)] -= GRID_MULTIPLE
+
+    return GridSizes(
+        dime=dime,
+        coarse_length=coarse,
+        fine_length=fine,
+        center=(lower + upper) / 2,
+        spacing=fine / (dime - 1),
+        memory_mb=dime.prod(axis=1) * BYTES_PER_POINT / 2 ** 20,
+    )
+
+
+def format_apbs_input(
+    pqr_file: str,
+    name: str,
+    dime: Sequence[int],
+    coarse_length: Sequence[float],
+    fine_length: Sequence[float],
+    center: Sequence[float],
+    pdie: float = PDIE,
+    sdie: float = SDIE,
+    ionic_strength: float = IONIC_STRENGTH,
+    temperature: float = TEMPERATURE,
+) -> str:
+    """
+    Format the text of one `mg-auto` APBS input.
+    """
+    ions = ""
+    if ionic_strength > 0:
+        ions = "".join(ION_FORMAT.format(charge=charge, concentration=ionic_strength)
+                       for charge in (1, -1))
+    return APBS_INPUT_FORMAT.format(
+        pqr_file=pqr_file, name=name, dime=[int(n) for n in dime], coarse=coarse_length,
+        fine=fine_length, center=center, ions=ions, pdie=pdie, sdie=sdie, temperature=temperature,
+    )
+
+
+def write_apbs_inputs(
+    root_dir: str,
+    output_dir: Optional[str] = None,
+    workers: int = 1,
+    coarse_factor: float = COARSE_FACTOR,
+    fine_padding: float = FINE_PADDING,
+    spacing: float = SPACING,
+    memory_mb: float = MEMORY_MB,
+    pdie: float = PDIE,
+    sdie: float = SDIE,
+    ionic_strength: float = IONIC_STRENGTH,
+    temperature: float = TEMPERATURE,
+    summary_file: Optional[str] = None,
+    timings_file: Optional[str] = None,
+) -> List[str]:
+    """
+    Write the complex, receptor and ligand APBS inputs of every complex.
+
+    Parameters
+    ----------
+    root_dir : str
+        Directory of the generated PQR files, e.g. `data/generated`.
+    output_dir : Optional[str]
+        Tree for the `<ID>/<ID>_<calculation>.in` files; `root_dir` if None.
+        The PQR paths in the inputs are relative to the input file.
+    workers : int
+        Number of worker processes reading the PQR files.
+    coarse_factor, fine_padding, spacing, memory_mb
+        Grid sizing, see `size_grids`.
+    pdie, sdie : float
+        Solute and solvent dielectric constants.
+    ionic_strength : float
+        Concentration of the +1 and -1 ions, in M; no ions if 0.
+    temperature : float
+        Temperature in K.
+    summary_file : Optional[str]
+        CSV file with the grid of each complex; not written if None. Its
+        `coarsened` column is 1 where the fine spacing exceeds
+        `SPACING_WARNING_FACTOR` times `spacing`.
+    timings_file : Optional[str]
+        JSON file of run times for longest-first scheduling, see
+        `scheduler.map_longest_first`.
+
+    Returns
+    -------
+    List[str]
+        Paths of the written input files.
+    """
+    output_dir = output_dir or root_dir
+    jobs = []
+    for pdb_id, protein_file, ligand_file in find_complexes(root_dir):
+        combined_file = find_file(os.path.join(root_dir, pdb_id, f"{pdb_id}_combined.pqr"))
+        if combined_file is None:
+            _LOGGER.warning(f"Skipping {pdb_id}: no combined PQR file")
+            continue
+        if any(compression_of(file) for file in (protein_file, ligand_file, combined_file)):
+            _LOGGER.warning(f"Skipping {pdb_id}: APBS cannot read compressed PQR files")
+            continue
+        jobs.append((pdb_id, protein_file, ligand_file, combined_file))
+    if not jobs:
+        return []
+
+    extents = np.stack(list(map_longest_first(
+        _complex_extent, [job[:3] for job in jobs], [file_cost(job[1], job[2]) for job in jobs],
+        workers, [job[0] for job in jobs], "apbs_extent", timings_file,
+    )))
+    grids = size_grids(extents[:, 0], extents[:, 1], coarse_factor, fine_padding, spacing, memory_mb)
+    coarsened = grids.spacing.max(axis=1) > SPACING_WARNING_FACTOR * spacing
+    if coarsened.any():
+        needed_mb = size_grids(extents[coarsened, 0], extents[coarsened, 1], coarse_factor, fine_padding,
+                               spacing, np.inf).memory_mb
+        for i, mb in zip(np.flatnonzero(coarsened), needed_mb):
+            _LOGGER.warning(
+                f"{jobs[i][0]}: fine spacing {grids.spacing[i].max():.3f} A exceeds {spacing} A by more "
+                f"than {SPACING_WARNING_FACTOR}x; --memory-mb {np.ceil(mb):.0f} would keep the requested spacing"
+            )
+
+    written = []
+    for i, (pdb_id, protein_file, ligand_file, combined_file) in enumerate(jobs):
+        directory = os.path.join(output_dir, pdb_id)
+        os.makedirs(directory, exist_ok=True)
+        pqr_files = {"combined": combined_file, "protein": protein_file, "ligand": ligand_file}
+        for calculation, part in CALCULATIONS:
+            input_file = os.path.join(directory, f"{pdb_id}_{calculation}.in")
+            with open(input_file, "w") as file:
+                file.write(format_apbs_input(
+                    os.path.relpath(pqr_files[part], directory), f"{pdb_id}_{calculation}",
+                    grids.dime[i], grids.coarse_length[i], grids.fine_length[i], grids.center[i],
+                    pdie, sdie, ionic_strength, temperature,
+                ))
+            written.append(input_file)
+
+    if summary_file is not None:
+        with open(summary_file, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["pdb_id", "nx", "ny", "nz", "fine_spacing", "coarse_x", "coarse_y", "coarse_z",
+                             "fine_x", "fine_y", "fine_z", "memory_mb", "coarsened"])
+            for i, job in enumerate(jobs):
+                writer.writerow([job[0], *grids.dime[i].tolist(), f"{grids.spacing[i].max():.3f}",
+                                 *(f"{value:.3f}" for value in grids.coarse_length[i]),
+                                 *(f"{value:.3f}" for value in grids.fine_length[i]),
+                                 f"{grids.memory_mb[i]:.1f}", int(coarsened[i])])
+    return written
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Write complex, receptor and ligand APBS inputs for every generated complex.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--output-dir", dest="output_dir", default=None,
+                        help="Directory for the .in files (default: the input directory)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    parser.add_argument("--coarse-factor", dest="coarse_factor", type=float, default=COARSE_FACTOR,
+                        help=f"Coarse grid length over molecular extent (default: {COARSE_FACTOR})")
+    parser.add_argument("--fine-padding", dest="fine_padding", type=float, default=FINE_PADDING,
+                        help=f"Fine grid padding beyond the extent in Angstrom (default: {FINE_PADDING})")
+    parser.add_argument("--spacing", type=float, default=SPACING,
+                        help=f"Target fine grid spacing in Angstrom (default: {SPACING})")
+    parser.add_argument("--memory-mb", dest="memory_mb", type=float, default=MEMORY_MB,
+                        help=f"Memory budget of one APBS run in MB (default: {MEMORY_MB:g})")
+    parser.add_argument("--pdie", type=float, default=PDIE,
+                        help=f"Solute dielectric constant (default: {PDIE})")
+    parser.add_argument("--sdie", type=float, default=SDIE,
+                        help=f"Solvent dielectric constant (default: {SDIE})")
+    parser.add_argument("--ionic-strength", dest="ionic_strength", type=float, default=IONIC_STRENGTH,
+                        help=f"Concentration of +1/-1 ions in M, 0 for none (default: {IONIC_STRENGTH})")
+    parser.add_argument("--temperature", type=float, default=TEMPERATURE,
+                        help=f"Temperature in K (default: {TEMPERATURE})")
+    parser.add_argument("--summary", default=None,
+                        help="CSV file of the grid of each complex (default: not written)")
+    parser.add_argument("--timings", default=None,
+                        help="JSON file of run times for longest-first scheduling (default: not kept)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    input_files = write_apbs_inputs(
+        args.input_dir, args.output_dir, args.workers, args.coarse_factor, args.fine_padding,
+        args.spacing, args.memory_mb, args.pdie, args.sdie, args.ionic_strength, args.temperature,
+        args.summary, args.timings,
+    )
+    print(f"Wrote {len(input_files)} APBS input files")
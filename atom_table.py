@@ -0,0 +1,684 @@
+"""One columnar atom table for every structure format, and readers and
+writers for each format.
+
+An `AtomTable` holds one NumPy array per column, with one row per atom:
+
+- "record": "ATOM" or "HETATM"
+- "serial", "res_seq": integers
+- "atom_name", "res_name", "chain", "ins_code": strings, empty if missing
+- "coords": (N x 3) coordinates
+- "charge", "radius": floats; NaN radius where the format has none
+- "element": element codes, see `ELEMENTS`
+
+Readers may add columns of their own, e.g. "atom_type" for the SYBYL types
+of a MOL2 file, and callers may add flags such as "is_ligand". Bonds, where
+the format has them, are kept as a (M x 2) array of zero-based atom indices.
+A table is a mapping of column name to array, so the stages written against
+the `Dict[str, np.ndarray]` of `pqr_arrays` take it unchanged, and merging a
+protein and a ligand is `AtomTable.concatenate`, one array concatenation per
+column.
+
+Readers and writers are registered per format with `register_reader` and
+`register_writer`. `read_atoms` and `write_atoms` pick the format from the
+file extension, ignoring a `.gz` or `.zst` suffix, and `read_atoms` falls
+back to sniffing the first lines of the file. The built-in formats are PQR,
+PDB, MOL2 and SDF (the first record of each; see
+`multi_pose_complex.split_records` for multi-pose files) for reading, and
+PQR and PDB for writing::
+
+    python atom_table.py data/pdbbind/1a30/1a30_ligand.mol2 1a30_ligand.pdb
+"""
+import argparse
+import math
+import os
+import re
+from typing import IO, Callable, Dict, Iterator, List, Mapping, MutableMapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from file_io import open_file, strip_compression
+
+
+#: Element symbols known to the array stages. The index of a symbol in this
+#: tuple is its element code; code 0 is reserved for unknown elements.
+ELEMENTS: Tuple[str, ...] = (
+    "X", "H", "C", "N", "O", "F", "P", "S", "Cl", "Br", "I", "B", "Si", "Se",
+    "Na", "K", "Mg", "Ca", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Cd", "Hg",
+)
+
+#: Mapping from (capitalized) element symbol to element code.
+ELEMENT_CODES: Dict[str, int] = {symbol: code for code, symbol in enumerate(ELEMENTS)}
+
+#: Format of an ATOM/HETATM line written by this repository: record name,
+#: serial, atom name, residue name, residue number, x, y, z, charge, radius.
+PQR_ATOM_FORMAT = "{:<6}{:>5} {:>4} {:3} {:>4} {:>11.3f} {:>8.3f} {:>8.3f} {:>8.4f} {:>7.4f}\n"
+
+
+def element_code(symbol: str) -> int:
+    """
+    Look up the element code of an element symbol.
+
+    Parameters
+    ----------
+    symbol : str
+        Element symbol in any case, e.g. "CL" or "Cl".
+
+    Returns
+    -------
+    int
+        Index of the element in `ELEMENTS`, or 0 if the element is unknown.
+    """
+    return ELEMENT_CODES.get(symbol.capitalize(), 0)
+
+
+def _infer_element(atom_name: str, res_name: str) -> str:
+    """
+    Infer the element of a PQR atom that has no element column.
+
+    pdb2pqr does not write elements, so the element is taken from the first
+    letter of the atom name, except for single-atom ions such as "ZN" in
+    residue "ZN" where the whole name is the element.
+    """
+    if atom_name == res_name and atom_name.capitalize() in ELEMENT_CODES:
+        return atom_name.capitalize()
+    for char in atom_name:
+        if char.isalpha():
+            return char.upper()
+    return "X"
+
+
+#: Residue number token with an optional fused chain identifier and insertion
+#: code, e.g. "16", "16A" or "A1000".
+_RES_SEQ_PATTERN = re.compile(r"([A-Za-z]?)(-?\d+)([A-Za-z]?)")
+
+#: Decimal number; used to separate coordinates that run into each other
+#: when they do not fit their columns, e.g. "-11.798-100.494". "nan" is the
+#: radius written for atoms without one.
+_FLOAT_PATTERN = re.compile(r"[-+]?\d*\.\d+|nan")
+
+
+def _is_number(token: str) -> bool:
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def split_pqr_atom_line(line: str) -> Tuple[str, int, str, str, str, int, str,
+                                            float, float, float, float, float, str]:
+    """
+    Split an ATOM/HETATM line of a PQR file into its fields.
+
+    PQR files are whitespace delimited, but the files in this repository do
+    not all have the same number of columns: pdb2pqr may fuse the record name
+    with 5-digit serial numbers ("HETATM17305") and appends insertion codes to
+    residue numbers ("16A"), some files carry a chain identifier, and Open
+    Babel appends the element symbol. Large coordinates can also run into
+    each other. The fields before the coordinates and the five decimal
+    values are therefore split separately.
+
+    Parameters
+    ----------
+    line : str
+        An ATOM or HETATM line.
+
+    Returns
+    -------
+    Tuple
+        (record, serial, atom name, residue name, chain, residue number,
+        insertion code, x, y, z, charge, radius, element). `chain`, the
+        insertion code and `element` are empty strings when the line does not
+        have them.
+    """
+    record = "HETATM" if line.startswith("HETATM") else "ATOM"
+    parts = line[len(record):].split()
+    element = ""
+    if not _is_number(parts[-1]):
+        element = parts[-1]
+        parts = parts[:-1]
+    # The first token with a decimal point starts the coordinates
+    first_float = next(i for i, part in enumerate(parts) if "." in part)
+    values = _FLOAT_PATTERN.findall(" ".join(parts[first_float:]))
+    fields = parts[:first_float]
+    if len(values) != 5 or len(fields) < 4:
+        raise ValueError(f"Unable to parse PQR line: {line}")
+    match = _RES_SEQ_PATTERN.fullmatch(fields[-1])
+    if match is None:
+        raise ValueError(f"Unable to parse residue number in PQR line: {line}")
+    fused_chain, res_seq, ins_code = match.groups()
+    chain = fused_chain or (fields[3] if len(fields) > 4 else "")
+    x, y, z, charge, radius = (float(value) for value in values)
+    return (
+        record, int(fields[0]), fields[1], fields[2], chain, int(res_seq), ins_code,
+        x, y, z, charge, radius, element,
+    )
+
+
+class AtomTable(MutableMapping[str, np.ndarray]):
+    """
+    Atoms of a structure as one array per column, plus optional bonds.
+
+    Parameters
+    ----------
+    columns : Mapping[str, np.ndarray]
+        Arrays with one row per atom, keyed by column name; the arrays are
+        used as they are, not copied.
+    bonds : Optional[np.ndarray]
+        Zero-based atom index pairs, shape (M, 2).
+    bond_types : Optional[np.ndarray]
+        Type of each bond as written in the file, e.g. "1", "2" or "ar".
+
+    Notes
+    -----
+    `len` of a table is its number of columns, as for any mapping; the number
+    of atoms is `n_atoms`.
+    """
+
+    def __init__(
+        self,
+        columns: Mapping[str, np.ndarray],
+        bonds: Optional[np.ndarray] = None,
+        bond_types: Optional[np.ndarray] = None,
+    ) -> None:
+        self._columns: Dict[str, np.ndarray] = {}
+        self._n_atoms: Optional[int] = None
+        for key, values in columns.items():
+            self[key] = values
+        self.bonds = (np.empty((0, 2), dtype=np.intp) if bonds is None
+                      else np.asarray(bonds, dtype=np.intp).reshape(-1, 2))
+        self.bond_types = bond_types
+
+    @property
+    def n_atoms(self) -> int:
+        return self._n_atoms or 0
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self._columns[key]
+
+    def __setitem__(self, key: str, values: np.ndarray) -> None:
+        values = np.asarray(values)
+        if self._n_atoms is None:
+            self._n_atoms = len(values)
+        elif len(values) != self._n_atoms:
+            raise ValueError(f"Column {key} has {len(values)} rows, expected {self._n_atoms}")
+        self._columns[key] = values
+
+    def __delitem__(self, key: str) -> None:
+        del self._columns[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._columns)
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def __repr__(self) -> str:
+        return f"AtomTable({self.n_atoms} atoms, {len(self.bonds)} bonds, columns={list(self._columns)})"
+
+    @classmethod
+    def empty(cls) -> "AtomTable":
+        """
+        A table with the standard columns and no atoms.
+        """
+        return cls({
+            "record": np.empty(0, dtype=str),
+            "serial": np.empty(0, dtype=np.int64),
+            "atom_name": np.empty(0, dtype=str),
+            "res_name": np.empty(0, dtype=str),
+            "chain": np.empty(0, dtype=str),
+            "res_seq": np.empty(0, dtype=np.int64),
+            "ins_code": np.empty(0, dtype=str),
+            "coords": np.empty((0, 3), dtype=np.float64),
+            "charge": np.empty(0, dtype=np.float64),
+            "radius": np.empty(0, dtype=np.float64),
+            "element": np.empty(0, dtype=np.uint8),
+        })
+
+    def select(self, index: np.ndarray) -> "AtomTable":
+        """
+        Take a subset of the atoms, by boolean mask or indices, keeping the
+        bonds between the atoms taken.
+        """
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        table = AtomTable({key: values[index] for key, values in self._columns.items()})
+        if len(self.bonds):
+            position = np.full(self.n_atoms, -1, dtype=np.intp)
+            position[index] = np.arange(len(index))
+            bonds = position[self.bonds]
+            kept = (bonds >= 0).all(axis=1)
+            table.bonds = bonds[kept]
+            if self.bond_types is not None:
+                table.bond_types = self.bond_types[kept]
+        return table
+
+    @classmethod
+    def concatenate(cls, tables: Sequence[Mapping[str, np.ndarray]]) -> "AtomTable":
+        """
+        Stack tables, e.g. a protein and its ligand, into one.
+
+        Only the columns present in every table are kept. Bond indices are
+        shifted to the rows of the stacked table.
+        """
+        keys = [key for key in tables[0] if all(key in table for table in tables[1:])]
+        table = cls({key: np.concatenate([t[key] for t in tables]) for key in keys})
+        bonds, bond_types = [], []
+        offset = 0
+        for t in tables:
+            t_bonds = getattr(t, "bonds", None)
+            if t_bonds is not None and len(t_bonds):
+                bonds.append(t_bonds + offset)
+                t_types = getattr(t, "bond_types", None)
+                bond_types.append(t_types if t_types is not None
+                                  else np.full(len(t_bonds), "", dtype=str))
+            offset += len(t["charge"])
+        if bonds:
+            table.bonds = np.concatenate(bonds)
+            table.bond_types = np.concatenate(bond_types)
+        return table
+
+
+def _build_table(
+    records: List[str],
+    serials: List[int],
+    atom_names: List[str],
+    res_names: List[str],
+    chains: List[str],
+    res_seqs: List[int],
+    ins_codes: List[str],
+    coords: List[Tuple[float, float, float]],
+    charges: List[float],
+    radii: List[float],
+    elements: List[str],
+) -> AtomTable:
+    if not records:
+        return AtomTable.empty()
+    element_codes = [
+        element_code(element or _infer_element(atom_name, res_name))
+        for atom_name, res_name, element in zip(atom_names, res_names, elements)
+    ]
+    return AtomTable({
+        "record": np.array(records),
+        "serial": np.array(serials, dtype=np.int64),
+        "atom_name": np.array(atom_names),
+        "res_name": np.array(res_names),
+        "chain": np.array(chains),
+        "res_seq": np.array(res_seqs, dtype=np.int64),
+        "ins_code": np.array(ins_codes),
+        "coords": np.array(coords, dtype=np.float64).reshape(-1, 3),
+        "charge": np.array(charges, dtype=np.float64),
+        "radius": np.array(radii, dtype=np.float64),
+        "element": np.array(element_codes, dtype=np.uint8),
+    })
+
+
+Reader = Callable[[IO[str]], AtomTable]
+Writer = Callable[[Mapping[str, np.ndarray], IO[str]], None]
+
+#: Readers and writers by format name
+READERS: Dict[str, Reader] = {}
+WRITERS: Dict[str, Writer] = {}
+#: Format by file extension, without the dot or any compression suffix
+EXTENSIONS: Dict[str, str] = {}
+
+
+def register_reader(fmt: str, *extensions: str) -> Callable[[Reader], Reader]:
+    """
+    Register a function reading an `AtomTable` from an open text file as
+    the reader of a format, for files with the given extensions.
+    """
+    def decorator(reader: Reader) -> Reader:
+        READERS[fmt] = reader
+        EXTENSIONS.update({extension: fmt for extension in extensions})
+        return reader
+    return decorator
+
+
+def register_writer(fmt: str, *extensions: str) -> Callable[[Writer], Writer]:
+    """
+    Register a function writing an atom table to an open text file as the
+    writer of a format, for files with the given extensions.
+    """
+    def decorator(writer: Writer) -> Writer:
+        WRITERS[fmt] = writer
+        EXTENSIONS.update({extension: fmt for extension in extensions})
+        return writer
+    return decorator
+
+
+#: Lines sniffed by `sniff_format`
+SNIFF_LINES = 64
+
+#: Occupancy and temperature factor columns of PDB ATOM records, which
+#: separate them from PQR records with charge and radius in their place
+_PDB_OCCUPANCY_PATTERN = re.compile(r" *-?\d+\.\d\d *-?\d+\.\d\d")
+
+
+def sniff_format(lines: Sequence[str]) -> Optional[str]:
+    """
+    Guess the format of a structure file from its first lines.
+
+    Returns
+    -------
+    Optional[str]
+        "mol2", "sdf", "pdb" or "pqr", or None if no format fits.
+    """
+    if any(line.startswith("@<TRIPOS>") for line in lines):
+        return "mol2"
+    if (len(lines) > 3 and ("V2000" in lines[3] or "V3000" in lines[3])) \
+            or any(line.startswith("$$$$") for line in lines):
+        return "sdf"
+    atom_lines = [line for line in lines if line.startswith(("ATOM", "HETATM"))]
+    if not atom_lines:
+        return "pdb" if any(line.startswith(("HEADER", "CRYST1", "MODEL")) for line in lines) else None
+    if all(_PDB_OCCUPANCY_PATTERN.fullmatch(line[54:66]) for line in atom_lines):
+        return "pdb"
+    return "pqr"
+
+
+def detect_format(file_path: str) -> str:
+    """
+    Get the format of a file from its extension, or else from its content.
+    """
+    extension = os.path.splitext(strip_compression(file_path))[1].lstrip(".").lower()
+    if extension in EXTENSIONS:
+        return EXTENSIONS[extension]
+    with open_file(file_path, "r") as file:
+        lines = [line for _, line in zip(range(SNIFF_LINES), file)]
+    fmt = sniff_format(lines)
+    if fmt is None:
+        raise ValueError(f"Unable to detect the structure format of {file_path}")
+    return fmt
+
+
+def read_atoms(file_path: str, fmt: Optional[str] = None) -> AtomTable:
+    """
+    Read a structure file into an atom table.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file, optionally `.gz` or `.zst` compressed.
+    fmt : Optional[str]
+        Format name, see `READERS`; detected from the file if None.
+
+    Returns
+    -------
+    AtomTable
+        The atoms, and bonds where the format has them.
+    """
+    fmt = fmt or detect_format(file_path)
+    if fmt not in READERS:
+        raise ValueError(f"No reader for format {fmt}; known formats: {', '.join(sorted(READERS))}")
+    with open_file(file_path, "r") as file:
+        return READERS[fmt](file)
+
+
+def write_atoms(atoms: Mapping[str, np.ndarray], file_path: str, fmt: Optional[str] = None) -> None:
+    """
+    Write an atom table, or any mapping with its columns, to a file.
+
+    Parameters
+    ----------
+    atoms : Mapping[str, np.ndarray]
+        The atoms to write.
+    file_path : str
+        Path of the file; a `.gz` or `.zst` suffix compresses it.
+    fmt : Optional[str]
+        Format name, see `WRITERS`; taken from the file extension if None.
+    """
+    if fmt is None:
+        extension = os.path.splitext(strip_compression(file_path))[1].lstrip(".").lower()
+        fmt = EXTENSIONS.get(extension)
+    if fmt not in WRITERS:
+        raise ValueError(f"No writer for {file_path}; known formats: {', '.join(sorted(WRITERS))}")
+    with open_file(file_path, "w") as file:
+        WRITERS[fmt](atoms, file)
+
+
+@register_reader("pqr", "pqr")
+def read_pqr(file: IO[str]) -> AtomTable:
+    """
+    Read the ATOM/HETATM records of a PQR file, see `split_pqr_atom_line`.
+    """
+    columns: Tuple[List, ...] = tuple([] for _ in range(11))
+    (records, serials, atom_names, res_names, chains, res_seqs, ins_codes,
+     coords, charges, radii, elements) = columns
+    for line in file:
+        if not line.startswith(("ATOM", "HETATM")):
+            continue
+        (record, serial, atom_name, res_name, chain, res_seq, ins_code,
+         x, y, z, charge, radius, element) = split_pqr_atom_line(line)
+        records.append(record)
+        serials.append(serial)
+        atom_names.append(atom_name)
+        res_names.append(res_name)
+        chains.append(chain)
+        res_seqs.append(res_seq)
+        ins_codes.append(ins_code)
+        coords.append((x, y, z))
+        charges.append(charge)
+        radii.append(radius)
+        elements.append(element)
+    return _build_table(*columns)
+
+
+@register_reader("pdb", "pdb", "ent")
+def read_pdb(file: IO[str]) -> AtomTable:
+    """
+    Read the ATOM/HETATM records of the first model of a PDB file by column,
+    and its CONECT records as bonds. Charges are 0 and radii NaN.
+    """
+    columns: Tuple[List, ...] = tuple([] for _ in range(11))
+    (records, serials, atom_names, res_names, chains, res_seqs, ins_codes,
+     coords, charges, radii, elements) = columns
+    conect: List[Tuple[int, int]] = []
+    for line in file:
+        if line.startswith(("ATOM", "HETATM")):
+            records.append(line[:6].strip())
+            serials.append(int(line[6:11]))
+            atom_names.append(line[12:16].strip())
+            res_names.append(line[17:20].strip())
+            chains.append(line[21:22].strip())
+            # Some files shift the insertion code into the residue number
+            # columns, e.g. " 256B"
+            match = _RES_SEQ_PATTERN.fullmatch(line[22:27].strip())
+            if match is None:
+                raise ValueError(f"Unable to parse residue number in PDB line: {line}")
+            res_seqs.append(int(match.group(2)))
+            ins_codes.append(match.group(3))
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            charges.append(0.0)
+            radii.append(math.nan)
+            elements.append(line[76:78].strip())
+        elif line.startswith("CONECT"):
+            # Serials take 5 columns each: 7-11 for the atom, then its neighbours
+            fields = [line[i:i + 5].strip() for i in range(6, len(line.rstrip("\n")), 5)]
+            serial_numbers = [int(field) for field in fields if field]
+            conect.extend((serial_numbers[0], other) for other in serial_numbers[1:])
+        elif line.startswith("ENDMDL"):
+            break
+    table = _build_table(*columns)
+    if conect:
+        position = {serial: i for i, serial in enumerate(serials)}
+        pairs = {tuple(sorted((position[a], position[b]))) for a, b in conect
+                 if a in position and b in position}
+        table.bonds = np.array(sorted(pairs), dtype=np.intp).reshape(-1, 2)
+    return table
+
+
+@register_reader("mol2", "mol2")
+def read_mol2(file: IO[str]) -> AtomTable:
+    """
+    Read the atoms and bonds of the first molecule of a MOL2 file.
+
+    The partial charges of the file become the "charge" column (0 if it has
+    none), the substructure the residue, and the SYBYL types are kept in an
+    "atom_type" column. Radii are NaN.
+    """
+    columns: Tuple[List, ...] = tuple([] for _ in range(11))
+    (records, serials, atom_names, res_names, chains, res_seqs, ins_codes,
+     coords, charges, radii, elements) = columns
+    atom_types: List[str] = []
+    bonds: List[Tuple[int, int]] = []
+    bond_types: List[str] = []
+    section = None
+    for line in file:
+        if line.startswith("@<TRIPOS>"):
+            section = line.strip()
+            if section == "@<TRIPOS>MOLECULE" and records:
+                break
+            continue
+        words = line.split()
+        if not words or words[0].startswith("#"):
+            continue
+        if section == "@<TRIPOS>ATOM":
+            records.append("HETATM")
+            serials.append(int(words[0]))
+            atom_names.append(words[1])
+            coords.append((float(words[2]), float(words[3]), float(words[4])))
+            atom_types.append(words[5])
+            res_seqs.append(int(words[6]) if len(words) > 6 else 1)
+            res_names.append(words[7] if len(words) > 7 else "")
+            charges.append(float(words[8]) if len(words) > 8 else 0.0)
+            chains.append("")
+            ins_codes.append("")
+            radii.append(math.nan)
+            elements.append(words[5].split(".")[0])
+        elif section == "@<TRIPOS>BOND":
+            bonds.append((int(words[1]), int(words[2])))
+            bond_types.append(words[3])
+    table = _build_table(*columns)
+    if records:
+        table["atom_type"] = np.array(atom_types)
+    if bonds:
+        position = {serial: i for i, serial in enumerate(serials)}
+        table.bonds = np.array([(position[a], position[b]) for a, b in bonds], dtype=np.intp)
+        table.bond_types = np.array(bond_types)
+    return table
+
+
+#: Formal charge of the charge code in the atom block of a V2000 molfile
+_SDF_CHARGE_CODES = {0: 0, 1: 3, 2: 2, 3: 1, 4: 0, 5: -1, 6: -2, 7: -3}
+
+
+@register_reader("sdf", "sdf", "mol", "sd")
+def read_sdf(file: IO[str]) -> AtomTable:
+    """
+    Read the atoms and bonds of the first record of a V2000 SDF file.
+
+    SDF files carry no partial charges, so "charge" is 0 and the formal
+    charges, from the atom block or `M  CHG` lines, are kept in a
+    "formal_charge" column. Atoms are named by element and position, e.g.
+    "C1", as in `multi_pose_complex`. Radii are NaN.
+    """
+    header = [next(file, "") for _ in range(4)]
+    counts = header[3]
+    if "V3000" in counts:
+        raise ValueError("V3000 SDF files are not supported")
+    n_atoms, n_bonds = int(counts[0:3]), int(counts[3:6])
+    columns: Tuple[List, ...] = tuple([] for _ in range(11))
+    (records, serials, atom_names, res_names, chains, res_seqs, ins_codes,
+     coords, charges, radii, elements) = columns
+    formal_charges: List[int] = []
+    for i in range(1, n_atoms + 1):
+        line = next(file)
+        element = line[31:34].strip()
+        records.append("HETATM")
+        serials.append(i)
+        atom_names.append(f"{element}{i}")
+        res_names.append("UNL")
+        chains.append("")
+        res_seqs.append(1)
+        ins_codes.append("")
+        coords.append((float(line[0:10]), float(line[10:20]), float(line[20:30])))
+        charges.append(0.0)
+        radii.append(math.nan)
+        elements.append(element)
+        formal_charges.append(_SDF_CHARGE_CODES.get(int(line[36:39] or 0), 0))
+    bonds, bond_types = [], []
+    for _ in range(n_bonds):
+        line = next(file)
+        bonds.append((int(line[0:3]) - 1, int(line[3:6]) - 1))
+        bond_types.append(line[6:9].strip())
+    charge_lines_seen = False
+    for line in file:
+        if line.startswith("M  CHG"):
+            # `M  CHG` replaces the charges of the atom block
+            if not charge_lines_seen:
+                formal_charges = [0] * n_atoms
+                charge_lines_seen = True
+            words = line.split()[3:]
+            for atom, charge in zip(words[0::2], words[1::2]):
+                formal_charges[int(atom) - 1] = int(charge)
+        elif line.startswith(("M  END", "$$$$")):
+            break
+    table = _build_table(*columns)
+    if n_atoms:
+        table["formal_charge"] = np.array(formal_charges, dtype=np.int64)
+    if bonds:
+        table.bonds = np.array(bonds, dtype=np.intp)
+        table.bond_types = np.array(bond_types)
+    return table
+
+
+@register_writer("pqr", "pqr")
+def write_pqr(atoms: Mapping[str, np.ndarray], file: IO[str]) -> None:
+    """
+    Write ATOM/HETATM records in `PQR_ATOM_FORMAT`.
+    """
+    for row in zip(atoms["record"].tolist(), atoms["serial"].tolist(), atoms["atom_name"].tolist(),
+                   atoms["res_name"].tolist(), atoms["res_seq"].tolist(), atoms["coords"].tolist(),
+                   atoms["charge"].tolist(), atoms["radius"].tolist()):
+        record, serial, atom_name, res_name, res_seq, (x, y, z), charge, radius = row
+        file.write(PQR_ATOM_FORMAT.format(record, serial, atom_name, res_name, res_seq,
+                                          x, y, z, charge, radius))
+
+
+#: Format of a PDB ATOM/HETATM record: record, serial, atom name (padded as
+#: in the PDB format), residue name, chain, residue number, insertion code,
+#: x, y, z, occupancy, temperature factor, element.
+PDB_ATOM_FORMAT = "{:<6}{:>5} {:<4} {:>3} {:1}{:>4}{:1}   {:>8.3f}{:>8.3f}{:>8.3f}{:>6.2f}{:>6.2f}          {:>2}\n"
+
+
+@register_writer("pdb", "pdb", "ent")
+def write_pdb(atoms: Mapping[str, np.ndarray], file: IO[str]) -> None:
+    """
+    Write ATOM/HETATM records in fixed PDB columns, with occupancy 1 and
+    temperature factor 0.
+    """
+    n_atoms = len(atoms["charge"])
+    chains = atoms["chain"].tolist() if "chain" in atoms else [""] * n_atoms
+    ins_codes = atoms["ins_code"].tolist() if "ins_code" in atoms else [""] * n_atoms
+    element_codes = atoms["element"].tolist() if "element" in atoms else [0] * n_atoms
+    for row in zip(atoms["record"].tolist(), atoms["serial"].tolist(), atoms["atom_name"].tolist(),
+                   atoms["res_name"].tolist(), chains, atoms["res_seq"].tolist(), ins_codes,
+                   atoms["coords"].tolist(), element_codes):
+        record, serial, atom_name, res_name, chain, res_seq, ins_code, (x, y, z), code = row
+        element = ELEMENTS[code] if code else ""
+        # Names of one-letter elements start in the second column of the field
+        if len(atom_name) < 4 and len(element) < 2:
+            atom_name = f" {atom_name}"
+        file.write(PDB_ATOM_FORMAT.format(record, serial % 100000, atom_name, res_name, chain,
+                                          res_seq, ins_code, x, y, z, 1.0, 0.0, element.upper()))
+    file.write("END\n")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert a structure file between formats.")
+    parser.add_argument("input_file", help="Input structure file, e.g. .pqr, .pdb, .mol2 or .sdf")
+    parser.add_argument("output_file", help="Output structure file, .pqr or .pdb")
+    parser.add_argument("--input-format", dest="input_format", choices=sorted(READERS), default=None,
+                        help="Format of the input file (default: from its extension or content)")
+    parser.add_argument("--output-format", dest="output_format", choices=sorted(WRITERS), default=None,
+                        help="Format of the output file (default: from its extension)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    table = read_atoms(args.input_file, args.input_format)
+    write_atoms(table, args.output_file, args.output_format)
+    print(f"Wrote {table.n_atoms} atoms to {args.output_file}")
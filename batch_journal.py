@@ -0,0 +1,194 @@
+"""Append-only journal of a batch run, for resuming it after a crash.
+
+Each line of the journal is a JSON record of one job (a stage of one
+complex, e.g. ("obabel", "1bcu_ligand")) being started, succeeding, failing
+with an error, or being quarantined. Every record is flushed to disk before
+the job goes on, so after a crash replaying the journal tells exactly which
+jobs finished. A job that was started but never finished counts as a failed
+attempt, so a ligand that crashes the process every time is eventually
+quarantined instead of stopping every resumed run.
+
+Failed jobs are retried after an exponential back-off,
+`backoff * backoff_factor ** (attempts - 1)` seconds after their last
+failure, and quarantined after `max_attempts` attempts in total over all
+runs.
+"""
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+STARTED = "started"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+QUARANTINED = "quarantined"
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 1.0
+
+
+class JobState(NamedTuple):
+    """Replayed state of one job."""
+
+    #: Status of the last record of the job
+    status: str
+    #: Number of times the job was started
+    attempts: int
+    #: Error of the last failure
+    error: Optional[str]
+    #: Time of the last record, in seconds since the epoch
+    time: float
+
+
+class BatchJournal:
+    """
+    Journal of the jobs of a batch run, kept in a JSONL file.
+
+    Parameters
+    ----------
+    file_path : str
+        Journal file.
+    resume : bool
+        Replay an existing journal and append to it. Otherwise any existing
+        journal is replaced, starting a new run.
+    max_attempts : int
+        Attempts of a job, over all runs, before it is quarantined.
+    backoff : float
+        Seconds to wait before the first retry of a failed job.
+    backoff_factor : float
+        Factor by which the wait grows with each further attempt.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        resume: bool = False,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff: float = DEFAULT_BACKOFF,
+        backoff_factor: float = 2.0,
+    ) -> None:
+        self.file_path = file_path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.jobs: Dict[Tuple[str, str], JobState] = {}
+        if resume and os.path.isfile(file_path):
+            with open(file_path) as file:
+                for line in file:
+                    if line.strip():
+                        self._apply(json.loads(line))
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._file = open(file_path, "a" if resume else "w")
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        key = (record["stage"], record["key"])
+        previous = self.jobs.get(key)
+        attempts = previous.attempts if previous is not None else 0
+        if record["status"] == STARTED:
+            attempts += 1
+        error = record.get("error") or (previous.error if previous is not None else None)
+        self.jobs[key] = JobState(record["status"], attempts, error, record["time"])
+
+    def record(self, stage: str, key: str, status: str, error: Optional[str] = None) -> None:
+        """
+        Append a record and flush it to disk.
+
+        Parameters
+        ----------
+        stage : str
+            Stage of the job, e.g. "obabel".
+        key : str
+            Key of the job within its stage, e.g. "1bcu_ligand".
+        status : str
+            One of `STARTED`, `SUCCEEDED`, `FAILED` and `QUARANTINED`.
+        error : Optional[str]
+            Error of a failure.
+        """
+        record = {"time": time.time(), "stage": stage, "key": key, "status": status}
+        if error is not None:
+            record["error"] = error
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._apply(record)
+
+    def state(self, stage: str, key: str) -> Optional[JobState]:
+        """
+        Get the replayed state of a job, or None if it was never started.
+        """
+        return self.jobs.get((stage, key))
+
+    def is_pending(self, stage: str, key: str) -> bool:
+        """
+        Check whether a job still has to run: it has not succeeded and has
+        attempts left. Raising `max_attempts` releases quarantined jobs.
+        """
+        state = self.state(stage, key)
+        if state is None:
+            return True
+        if state.status == QUARANTINED:
+            return state.attempts < self.max_attempts
+        return state.status != SUCCEEDED
+
+    def retry_delay(self, stage: str, key: str) -> float:
+        """
+        Get the seconds left before a failed job may be retried; 0 otherwise.
+        """
+        state = self.state(stage, key)
+        if state is None or state.status not in (STARTED, FAILED) or state.attempts == 0:
+            return 0.0
+        wait = self.backoff * self.backoff_factor ** (state.attempts - 1)
+        return max(0.0, state.time + wait - time.time())
+
+    def quarantined(self) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        List the (stage, key, last error) of every quarantined job.
+        """
+        return [(stage, key, state.error) for (stage, key), state in self.jobs.items()
+                if state.status == QUARANTINED]
+
+    def run(self, stage: str, key: str, func: Callable[..., Any], *args: Any) -> bool:
+        """
+        Run a job unless it already succeeded, retrying failures with back-off.
+
+        Parameters
+        ----------
+        stage : str
+            Stage of the job.
+        key : str
+            Key of the job within its stage.
+        func : Callable[..., Any]
+            Function doing the job; any exception it raises is a failure.
+        *args : Any
+            Arguments of `func`.
+
+        Returns
+        -------
+        bool
+            Whether the job has succeeded, now or in an earlier run. False
+            when it is quarantined.
+        """
+        while self.is_pending(stage, key):
+            state = self.state(stage, key)
+            if state is not None and state.attempts >= self.max_attempts:
+                self.record(stage, key, QUARANTINED)
+                break
+            time.sleep(self.retry_delay(stage, key))
+            self.record(stage, key, STARTED)
+            try:
+                func(*args)
+            except Exception as error:
+                self.record(stage, key, FAILED, f"{type(error).__name__}: {error}")
+            else:
+                self.record(stage, key, SUCCEEDED)
+        return self.state(stage, key).status == SUCCEEDED
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "BatchJournal":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
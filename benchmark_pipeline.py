@@ -0,0 +1,520 @@
+"""Benchmark every stage of the conversion pipeline.
+
+Each stage is timed on the bundled complexes (ligand MOL2 files from
+`data/pdbbind`, PQR files from `data/generated`) and on synthetic scaled-up
+inputs: a long chain of benzene rings for the ligand stages and a receptor
+replicated side by side for the protein stages. For every stage the best of
+`--repeat` runs is reported as seconds and atoms per second, together with
+the peak memory of one extra run. That run happens in a spawned process,
+whose peak resident set size is measured above its size when the run
+starts, so native allocations (NumPy, Polars) count as well as Python
+objects.
+
+Results are written as JSON. Given a `--baseline` from an earlier run, every
+stage that got slower by more than `--threshold` is reported as a regression
+and the script exits with status 1::
+
+    python benchmark_pipeline.py --output benchmarks/baseline.json
+    python benchmark_pipeline.py --baseline benchmarks/baseline.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+import polars as pl
+
+import peoe
+from atom_table import AtomTable, read_atoms
+from convert_sdf_to_pqr import update_pqr_radii
+from form_complex_pqr import combine_pqr_files
+from mol2_classes import Mol2Molecule
+from mol2_to_pqr import (append_ligand_to_protein_pqr, convert_mol2_to_polars_dataframe,
+                         convert_pqr_to_polars_dataframe, write_pqr)
+from pqr_arrays import PQR_ATOM_FORMAT, find_complexes, read_pqr_atoms
+from radii import RADII
+
+
+#: Complexes whose ligands have fused ring systems on which `set_rings` takes
+#: minutes; benchmarking them would time the known blow-up, not a change.
+SLOW_RING_IDS = ("1nvq", "2xys", "3arv")
+
+DEFAULT_COMPLEXES = 20
+DEFAULT_RINGS = 6
+DEFAULT_COPIES = 8
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+
+
+class BenchmarkCase(NamedTuple):
+    """One timed stage."""
+
+    name: str
+    #: Atoms processed by one run
+    n_atoms: int
+    #: Prepares the input of one run; not timed
+    setup: Callable[[], Any]
+    #: The timed stage, called with the output of `setup`
+    run: Callable[[Any], Any]
+
+
+def polyphenyl_mol2(n_rings: int) -> str:
+    """
+    Write a MOL2 molecule of `n_rings` benzene rings joined in a para chain.
+
+    Every ring adds 6 aromatic carbons and one ring to `set_rings`, so the
+    molecule scales the ring, torsion and PEOE stages without fused rings.
+    `set_rings` still grows as 2 ** `n_rings`, so keep `n_rings` small.
+
+    Parameters
+    ----------
+    n_rings : int
+        Number of rings.
+
+    Returns
+    -------
+    str
+        MOL2 text with ATOM and BOND sections.
+    """
+    ring_radius, ch_length, spacing = 1.39, 1.08, 2 * 1.39 + 1.49
+    atoms: List[Tuple[str, str, float, float]] = []
+    bonds: List[Tuple[int, int, str]] = []
+    for k in range(n_rings):
+        center = k * spacing
+        first = len(atoms) + 1
+        for i in range(6):
+            angle = np.pi - i * np.pi / 3
+            atoms.append((f"C{first + i}", "C.ar", center + ring_radius * np.cos(angle),
+                          ring_radius * np.sin(angle)))
+        bonds += [(first + i, first + (i + 1) % 6, "ar") for i in range(6)]
+        if k > 0:
+            # Para link to the previous ring
+            bonds.append((first - 3, first, "1"))
+        for i in range(6):
+            linked = (i == 0 and k > 0) or (i == 3 and k < n_rings - 1)
+            if linked:
+                continue
+            angle = np.pi - i * np.pi / 3
+            atoms.append((f"H{len(atoms) + 1}", "H", center + (ring_radius + ch_length) * np.cos(angle),
+                          (ring_radius + ch_length) * np.sin(angle)))
+            bonds.append((first + i, len(atoms), "1"))
+    lines = ["@<TRIPOS>MOLECULE", f"polyphenyl_{n_rings}", f"{len(atoms)} {len(bonds)} 1 0 0",
+             "SMALL", "NO_CHARGES", "", "@<TRIPOS>ATOM"]
+    lines += [f"{i:>7} {name:<8} {x:>9.4f} {y:>9.4f} {0.0:>9.4f} {atom_type:<6} 1 LIG 0.0000"
+              for i, (name, atom_type, x, y) in enumerate(atoms, start=1)]
+    lines.append("@<TRIPOS>BOND")
+    lines += [f"{i:>6} {a:>5} {b:>5} {order}" for i, (a, b, order) in enumerate(bonds, start=1)]
+    return "\n".join(lines) + "\n"
+
+
+def replicate_pqr(pqr_file: str, output_file: str, copies: int, shift: float = 100.0) -> int:
+    """
+    Write a PQR file with `copies` translated copies of the atoms of another.
+
+    Every atom is written as an ATOM record: with five-digit serials a
+    HETATM record runs into its serial, which whitespace splitting cannot
+    take apart.
+
+    Parameters
+    ----------
+    pqr_file : str
+        PQR file to replicate.
+    output_file : str
+        Where the replicated PQR file is written.
+    copies : int
+        Number of copies.
+    shift : float
+        Translation along x between copies, in Angstrom.
+
+    Returns
+    -------
+    int
+        Number of atoms written.
+    """
+    atoms = read_pqr_atoms(pqr_file)
+    n_atoms = len(atoms["charge"])
+    serial = 0
+    with open(output_file, "w") as output:
+        for copy in range(copies):
+            coords = atoms["coords"] + [copy * shift, 0.0, 0.0]
+            for i in range(n_atoms):
+                serial += 1
+                output.write(PQR_ATOM_FORMAT.format(
+                    "ATOM", serial, atoms["atom_name"][i], atoms["res_name"][i],
+                    int(atoms["res_seq"][i]), *coords[i], atoms["charge"][i], atoms["radius"][i],
+                ))
+    return copies * n_atoms
+
+
+def _count_atoms(file_path: str) -> int:
+    with open(file_path) as file:
+        return sum(line.startswith(("ATOM", "HETATM")) for line in file)
+
+
+def _parsable_pqr(file_path: str) -> bool:
+    # The polars reader does not handle insertion codes or header records
+    try:
+        convert_pqr_to_polars_dataframe(file_path)
+    except (ValueError, IndexError):
+        return False
+    return True
+
+
+def _parsed(texts: List[str], bonds: bool = False, topology: bool = False) -> List[Mol2Molecule]:
+    molecules = []
+    for text in texts:
+        molecule = Mol2Molecule()
+        mol2_file = molecule.parse_atoms(io.StringIO(text))
+        if bonds:
+            molecule.parse_bonds(mol2_file, set_topology=topology)
+        molecules.append(molecule)
+    return molecules
+
+
+def _parse_bonds(texts: List[str]) -> None:
+    for text in texts:
+        molecule = Mol2Molecule()
+        molecule.parse_bonds(molecule.parse_atoms(io.StringIO(text)), set_topology=False)
+
+
+def _equilibrate(molecules: List[Mol2Molecule]) -> None:
+    for molecule in molecules:
+        for atom in molecule.atoms.values():
+            atom.charge = atom.formal_charge
+        peoe.equilibrate(molecule.atoms.values())
+
+
+def build_cases(
+    complexes: List[Tuple[str, str, str, str]],
+    work_dir: str,
+    n_rings: int = DEFAULT_RINGS,
+    copies: int = DEFAULT_COPIES,
+) -> List[BenchmarkCase]:
+    """
+    Build the benchmark cases of every stage, bundled and synthetic.
+
+    Parameters
+    ----------
+    complexes : List[Tuple[str, str, str, str]]
+        (PDB ID, protein PQR, ligand PQR, ligand MOL2) of the bundled complexes.
+    work_dir : str
+        Directory for synthetic inputs and outputs.
+    n_rings : int
+        Rings of the synthetic ligand.
+    copies : int
+        Copies of the replicated receptor.
+
+    Returns
+    -------
+    List[BenchmarkCase]
+        Cases named "<stage>[<input set>]".
+    """
+    mol2_texts = []
+    for _, _, _, mol2_file in complexes:
+        with open(mol2_file) as file:
+            mol2_texts.append(file.read())
+    input_sets = {"bundled": mol2_texts, "polyphenyl": [polyphenyl_mol2(n_rings)]}
+
+    cases = []
+    for set_name, texts in input_sets.items():
+        n_atoms = sum(len(molecule.atoms) for molecule in _parsed(texts))
+        cases += [
+            BenchmarkCase(f"parse_atoms[{set_name}]", n_atoms, lambda texts=texts: texts,
+                          lambda texts: _parsed(texts)),
+            BenchmarkCase(f"parse_bonds[{set_name}]", n_atoms, lambda texts=texts: texts, _parse_bonds),
+            BenchmarkCase(f"set_torsions[{set_name}]", n_atoms,
+                          lambda texts=texts: _parsed(texts, bonds=True),
+                          lambda molecules: [molecule.set_torsions() for molecule in molecules]),
+            BenchmarkCase(f"set_rings[{set_name}]", n_atoms,
+                          lambda texts=texts: _parsed(texts, bonds=True),
+                          lambda molecules: [molecule.set_rings() for molecule in molecules]),
+            BenchmarkCase(f"peoe.equilibrate[{set_name}]", n_atoms,
+                          lambda texts=texts: _parsed(texts, bonds=True, topology=True), _equilibrate),
+        ]
+
+    # Protein stages: bundled proteins the polars reader can parse, and one
+    # of them replicated into a large receptor
+    proteins = [protein for _, protein, _, _ in complexes if _parsable_pqr(protein)]
+    ligands = [ligand for _, _, ligand, _ in complexes]
+    if proteins:
+        replicated = os.path.join(work_dir, "replicated_protein.pqr")
+        replicate_pqr(proteins[0], replicated, copies)
+        big_ligand = os.path.join(work_dir, "replicated_ligand.pqr")
+        with open(big_ligand, "w") as output:
+            for _ in range(copies):
+                for ligand in ligands:
+                    with open(ligand) as file:
+                        output.write(file.read())
+        ligand_df = convert_mol2_to_polars_dataframe(complexes[0][3])
+        atom_info = {element.upper(): radius for element, radius in RADII["bondi"].items()}
+        output_file = os.path.join(work_dir, "output.pqr")
+        file_sets = {
+            "bundled": (proteins, ligands, [(ligand, protein) for _, protein, ligand, _ in complexes]),
+            "replicated": ([replicated], [big_ligand], [(big_ligand, replicated)]),
+        }
+        for set_name, (protein_files, ligand_files, pairs) in file_sets.items():
+            n_protein = sum(_count_atoms(file) for file in protein_files)
+            n_ligand = sum(_count_atoms(file) for file in ligand_files)
+            n_pairs = sum(_count_atoms(ligand) + _count_atoms(protein) for ligand, protein in pairs)
+            n_combined = n_protein + len(protein_files) * ligand_df.height
+            cases += [
+                BenchmarkCase(f"convert_pqr_to_polars_dataframe[{set_name}]", n_protein,
+                              lambda files=protein_files: files,
+                              lambda files: [convert_pqr_to_polars_dataframe(file) for file in files]),
+                BenchmarkCase(f"read_atoms[{set_name}]", n_protein,
+                              lambda files=protein_files: files,
+                              lambda files: [read_atoms(file) for file in files]),
+                BenchmarkCase(f"AtomTable.concatenate[{set_name}]", n_pairs,
+                              lambda pairs=pairs: [(read_atoms(protein), read_atoms(ligand))
+                                                   for ligand, protein in pairs],
+                              lambda tables: [AtomTable.concatenate(pair) for pair in tables]),
+                BenchmarkCase(f"append_ligand_to_protein_pqr[{set_name}]", n_combined,
+                              lambda files=protein_files: [convert_pqr_to_polars_dataframe(file)
+                                                           for file in files],
+                              lambda frames: [append_ligand_to_protein_pqr(frame, ligand_df, atom_info)
+                                              for frame in frames]),
+                BenchmarkCase(f"write_pqr[{set_name}]", n_combined,
+                              lambda files=protein_files: [
+                                  append_ligand_to_protein_pqr(convert_pqr_to_polars_dataframe(file),
+                                                               ligand_df, atom_info)
+                                  for file in files],
+                              lambda frames: [write_pqr(frame, output_file) for frame in frames]),
+                BenchmarkCase(f"update_pqr_radii[{set_name}]", n_ligand,
+                              lambda files=ligand_files: files,
+                              lambda files: [update_pqr_radii(file, output_file) for file in files]),
+                BenchmarkCase(f"combine_pqr_files[{set_name}]", n_pairs,
+                              lambda pairs=pairs: pairs,
+                              lambda pairs: [combine_pqr_files(ligand, protein, output_file)
+                                             for ligand, protein in pairs]),
+            ]
+    return cases
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _reset_peak_rss() -> int:
+    """
+    Reset the peak RSS of this process to its current RSS where the OS
+    allows it (Linux), and return the peak in kB.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return _status_kb("VmHWM")
+    except OSError:
+        return _peak_rss()
+
+
+def _peak_rss() -> int:
+    try:
+        return _status_kb("VmHWM")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kB elsewhere
+        return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _memory_run(build_args: Tuple[Any, ...], name: str, connection: Any) -> None:
+    # A spawned process does not inherit the logging set up in __main__;
+    # keep the MOL2 bond order warnings out of the results table
+    logging.basicConfig(level=logging.ERROR)
+    case = next(case for case in build_cases(*build_args) if case.name == name)
+    state = case.setup()
+    start = _reset_peak_rss()
+    case.run(state)
+    connection.send(_peak_rss() - start)
+
+
+def peak_rss_growth(name: str, build_args: Tuple[Any, ...]) -> float:
+    """
+    Run a case once in a fresh process and measure how far its peak resident
+    set size rises above the size at the start of the run.
+
+    The process is spawned rather than forked, since forking after Polars
+    has started its thread pool can deadlock; it rebuilds the cases from
+    `build_args` and runs the one named `name`. Without `/proc` (e.g. on
+    macOS) the peak cannot be reset after setup, so setup memory counts.
+
+    Returns
+    -------
+    float
+        Peak RSS growth in MB.
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_memory_run, args=(build_args, name, sender))
+    process.start()
+    sender.close()
+    try:
+        growth_kb = receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"Memory run of {name} failed") from None
+    finally:
+        process.join()
+    return growth_kb / 1024
+
+
+def time_case(case: BenchmarkCase, build_args: Tuple[Any, ...], repeat: int = DEFAULT_REPEAT) -> Dict[str, float]:
+    """
+    Time a case, best of `repeat` runs, and measure the peak memory of one
+    more, see `peak_rss_growth`.
+
+    Parameters
+    ----------
+    case : BenchmarkCase
+        The case.
+    build_args : Tuple[Any, ...]
+        Arguments of `build_cases` that built the case.
+    repeat : int
+        Number of timed runs.
+
+    Returns
+    -------
+    Dict[str, float]
+        "atoms", "seconds", "atoms_per_second" and "peak_rss_mb".
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        state = case.setup()
+        start = time.perf_counter()
+        case.run(state)
+        best = min(best, time.perf_counter() - start)
+
+    return {
+        "atoms": case.n_atoms,
+        "seconds": best,
+        "atoms_per_second": case.n_atoms / best if best > 0 else float("inf"),
+        "peak_rss_mb": peak_rss_growth(case.name, build_args),
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """
+    Find the cases that got slower than a baseline by more than `threshold`.
+
+    Cases are compared by throughput, so a baseline recorded with different
+    input sizes is still comparable.
+
+    Parameters
+    ----------
+    results : Dict[str, Dict[str, float]]
+        Results of this run, by case name.
+    baseline : Dict[str, Dict[str, float]]
+        Results of the baseline run, by case name.
+    threshold : float
+        Allowed relative loss of throughput, e.g. 0.2 for 20 %.
+
+    Returns
+    -------
+    List[str]
+        Names of the regressed cases.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result["atoms_per_second"] < baseline[name]["atoms_per_second"] * (1 - threshold):
+            regressions.append(name)
+    return regressions
+
+
+def select_complexes(input_dir: str, pdbbind_dir: str, n_complexes: int) -> List[Tuple[str, str, str, str]]:
+    """
+    Pick the first `n_complexes` complexes with a ligand MOL2 file, leaving
+    out `SLOW_RING_IDS`.
+    """
+    selected = []
+    for pdb_id, protein_file, ligand_file in find_complexes(input_dir):
+        mol2_file = os.path.join(pdbbind_dir, pdb_id, f"{pdb_id}_ligand.mol2")
+        if pdb_id in SLOW_RING_IDS or not os.path.isfile(mol2_file):
+            continue
+        selected.append((pdb_id, protein_file, ligand_file, mol2_file))
+        if len(selected) == n_complexes:
+            break
+    return selected
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages and compare against a baseline.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--pdbbind-dir", dest="pdbbind_dir", default="data/pdbbind",
+                        help="Directory of the ligand MOL2 files (default: data/pdbbind)")
+    parser.add_argument("--complexes", type=int, default=DEFAULT_COMPLEXES,
+                        help=f"Number of bundled complexes (default: {DEFAULT_COMPLEXES})")
+    parser.add_argument("--rings", type=int, default=DEFAULT_RINGS,
+                        help=f"Rings of the synthetic ligand (default: {DEFAULT_RINGS})")
+    parser.add_argument("--copies", type=int, default=DEFAULT_COPIES,
+                        help=f"Copies of the replicated receptor (default: {DEFAULT_COPIES})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"Timed runs per stage, best kept (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--only", default=None,
+                        help="Only run the cases whose name contains this text (default: all)")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="JSON file of the results (default: benchmark_results.json)")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON results of an earlier run to compare against (default: none)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Allowed relative loss of throughput (default: {DEFAULT_THRESHOLD})")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Bond-order corrections are logged once per setup run; keep the table readable
+    logging.basicConfig(level=logging.ERROR)
+    bundled = select_complexes(args.input_dir, args.pdbbind_dir, args.complexes)
+    all_results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        build_args = (bundled, tmp_dir, args.rings, args.copies)
+        for benchmark in build_cases(*build_args):
+            if args.only is not None and args.only not in benchmark.name:
+                continue
+            all_results[benchmark.name] = time_case(benchmark, build_args, args.repeat)
+            result = all_results[benchmark.name]
+            print(f"{benchmark.name:<50} {result['seconds']:>9.4f} s {result['atoms_per_second']:>12.0f} atoms/s "
+                  f"{result['peak_rss_mb']:>8.1f} MB RSS")
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "metadata": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__,
+                "polars": pl.__version__,
+                "complexes": [pdb_id for pdb_id, _, _, _ in bundled],
+                "rings": args.rings,
+                "copies": args.copies,
+            },
+            "results": all_results,
+        }, file, indent=1)
+    print(f"Wrote {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline_results = json.load(file)["results"]
+        regressed = compare(all_results, baseline_results, args.threshold)
+        for name in regressed:
+            ratio = all_results[name]["atoms_per_second"] / baseline_results[name]["atoms_per_second"]
+            print(f"Regression: {name} runs at {ratio:.0%} of the baseline throughput")
+        if regressed:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
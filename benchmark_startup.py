@@ -0,0 +1,133 @@
+"""Check that the command-line scripts start quickly.
+
+Scripts that only dispatch work, such as `convert_sdf_to_pqr.py --help`,
+should not pay for numpy and polars before doing anything. Each script in
+`LIGHT_SCRIPTS` is started `--repeat` times in a fresh interpreter and the
+best wall time, minus that of a bare `python -c pass`, is compared against
+`--budget`. Each module is also imported in a fresh interpreter to check that
+none of `HEAVY_MODULES` is loaded at import time.
+
+On a violation the slowest imports reported by `python -X importtime` are
+printed and the script exits with status 1::
+
+    python benchmark_startup.py --budget 100
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import List, Sequence
+
+#: Scripts that must start without the numeric libraries, and how to start them
+LIGHT_SCRIPTS = {
+    "convert_sdf_to_pqr": ["convert_sdf_to_pqr.py", "--help"],
+    "form_complex_pqr": ["form_complex_pqr.py", "--help"],
+    "watch_inputs": ["watch_inputs.py", "--help"],
+    "work_queue": ["work_queue.py", "--help"],
+    "tool_runner": ["tool_runner.py", "--help"],
+    "catalog": ["catalog.py", "--help"],
+    "mol2_to_pqr": ["-c", "import mol2_to_pqr"],
+}
+
+#: Modules only loaded once a script converts or analyses something
+HEAVY_MODULES = ("numpy", "polars")
+
+DEFAULT_BUDGET_MS = 100.0
+DEFAULT_REPEAT = 5
+DEFAULT_SLOWEST = 10
+
+
+def best_time(command: Sequence[str], repeat: int) -> float:
+    """
+    Best wall time in seconds of running a command `repeat` times.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def heavy_imports(module: str) -> List[str]:
+    """
+    Names of the `HEAVY_MODULES` loaded by importing a module.
+    """
+    check = (f"import sys, {module}; "
+             f"print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def slowest_imports(module: str, n: int = DEFAULT_SLOWEST) -> List[str]:
+    """
+    The `n` imports of a module with the largest cumulative time, as reported
+    by `-X importtime`.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            rows.append((int(fields[1]), fields[2].rstrip()))
+    rows.sort(reverse=True)
+    return [f"{cumulative / 1000:8.1f} ms {name}" for cumulative, name in rows[:n]]
+
+
+def check_startup(scripts: Sequence[str], budget_ms: float, repeat: int) -> List[str]:
+    """
+    Time the scripts and check their imports.
+
+    Parameters
+    ----------
+    scripts : Sequence[str]
+        Keys of `LIGHT_SCRIPTS`.
+    budget_ms : float
+        Allowed start-up time over a bare interpreter, in milliseconds.
+    repeat : int
+        Runs per script, best kept.
+
+    Returns
+    -------
+    List[str]
+        The scripts over budget or loading a heavy module.
+    """
+    interpreter = best_time([sys.executable, "-c", "pass"], repeat)
+    print(f"{'python -c pass':<20} {interpreter * 1000:8.1f} ms")
+    failed = []
+    for name in scripts:
+        overhead_ms = (best_time([sys.executable, *LIGHT_SCRIPTS[name]], repeat) - interpreter) * 1000
+        heavy = heavy_imports(name)
+        status = "ok" if overhead_ms <= budget_ms and not heavy else "FAIL"
+        print(f"{name:<20} {overhead_ms:+8.1f} ms  {status}" + (f"  imports {', '.join(heavy)}" if heavy else ""))
+        if status != "ok":
+            failed.append(name)
+    return failed
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Check that the command-line scripts start without importing numpy and polars.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"Allowed start-up time over a bare interpreter, in ms (default: {DEFAULT_BUDGET_MS:g})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"Runs per script, best kept (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--only", default=None,
+                        help="Only check the scripts whose name contains this text (default: all)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # The scripts import their sibling modules, so run from this directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    selected = [name for name in LIGHT_SCRIPTS if args.only is None or args.only in name]
+    over = check_startup(selected, args.budget, args.repeat)
+    for name in over:
+        print(f"\nSlowest imports of {name}:")
+        print("\n".join(slowest_imports(name)))
+    if over:
+        sys.exit(1)
+    print(f"All scripts start within {args.budget:g} ms of a bare interpreter")
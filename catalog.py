@@ -0,0 +1,367 @@
+"""SQLite catalog of the generated PQR files and their summary statistics.
+
+The PQR writers (`combine_pqr_files`, `write_pqr`, `update_pqr_radii`) take
+an optional `PQRStats` and fill it from the lines they write, so the
+statistics cost no extra pass over the file. The batch scripts record them
+with `--catalog`, together with the SHA-256 of each input file, in a table
+with one row per output file. pdb2pqr writes its files itself, so the
+pdb2pqr stages of `tool_runner.py` and `work_queue.py` read each file once
+after it is written instead:
+
+    path, pdb_id, kind, n_atoms, n_hetatm, net_charge,
+    min_x, min_y, min_z, max_x, max_y, max_z, n_zero_radius, inputs, written_at
+
+`kind` is the part of the file name after the PDB ID, e.g. "protein",
+"ligand" or "combined", and `inputs` is a JSON object of input path to hash.
+Dataset selection then runs against the catalog instead of the PQR files::
+
+    python catalog.py query --kind combined --min-atoms 3000 --max-atoms 6000
+    python catalog.py query --kind ligand --min-charge -1 --max-charge 1 --order-by net_charge
+    python catalog.py query --missing-radii
+    python catalog.py summary
+    python catalog.py scan --output-dir data/generated   # index files written without --catalog
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from file_io import has_suffix, open_file, strip_compression
+
+
+DEFAULT_CATALOG = "data/generated/catalog.sqlite"
+
+#: Columns of the catalog, in table order
+COLUMNS = (
+    "path", "pdb_id", "kind", "n_atoms", "n_hetatm", "net_charge",
+    "min_x", "min_y", "min_z", "max_x", "max_y", "max_z",
+    "n_zero_radius", "inputs", "written_at",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    path TEXT PRIMARY KEY,
+    pdb_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    n_atoms INTEGER NOT NULL,
+    n_hetatm INTEGER NOT NULL,
+    net_charge REAL NOT NULL,
+    min_x REAL, min_y REAL, min_z REAL,
+    max_x REAL, max_y REAL, max_z REAL,
+    n_zero_radius INTEGER NOT NULL,
+    inputs TEXT NOT NULL,
+    written_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_pdb_id ON outputs (pdb_id);
+CREATE INDEX IF NOT EXISTS outputs_kind_atoms ON outputs (kind, n_atoms);
+"""
+
+
+class PQRStats:
+    """
+    Summary statistics of the atoms of a PQR file, accumulated line by line.
+    """
+
+    def __init__(self) -> None:
+        self.n_atoms = 0
+        self.n_hetatm = 0
+        self.net_charge = 0.0
+        self.n_zero_radius = 0
+        self.minimum = [float("inf")] * 3
+        self.maximum = [float("-inf")] * 3
+
+    def add(self, hetatm: bool, x: float, y: float, z: float, charge: float, radius: float) -> None:
+        """
+        Add one atom.
+        """
+        self.n_atoms += 1
+        self.n_hetatm += hetatm
+        self.net_charge += charge
+        # NaN radii, e.g. from an unmapped ligand atom, count as missing
+        self.n_zero_radius += not radius > 0.0
+        minimum, maximum = self.minimum, self.maximum
+        for axis, value in enumerate((x, y, z)):
+            if value < minimum[axis]:
+                minimum[axis] = value
+            if value > maximum[axis]:
+                maximum[axis] = value
+
+    def add_columns(self, hetatm: Sequence[bool], x: Sequence[float], y: Sequence[float],
+                    z: Sequence[float], charge: Sequence[float], radius: Sequence[float]) -> None:
+        """
+        Add atoms given as columns, e.g. numpy arrays, without a loop per atom.
+        """
+        # Imported here to keep numpy out of the catalog's start-up
+        import numpy as np
+
+        n_atoms = len(charge)
+        if n_atoms == 0:
+            return
+        self.n_atoms += n_atoms
+        self.n_hetatm += int(np.count_nonzero(hetatm))
+        self.net_charge += float(np.sum(charge))
+        self.n_zero_radius += int(np.count_nonzero(~(np.asarray(radius) > 0.0)))
+        for axis, values in enumerate((x, y, z)):
+            self.minimum[axis] = min(self.minimum[axis], float(np.min(values)))
+            self.maximum[axis] = max(self.maximum[axis], float(np.max(values)))
+
+    def add_line(self, line: str) -> None:
+        """
+        Add the atom of an ATOM or HETATM line; other lines are ignored.
+
+        Open Babel writes the element after the radius, so a trailing
+        non-numeric field is skipped. Lines whose coordinates run into each
+        other, e.g. "-64.019-110.103", are split by
+        `atom_table.split_pqr_atom_line`.
+        """
+        if not line.startswith(("ATOM", "HETATM")):
+            return
+        parts = line.split()
+        try:
+            values = [float(value) for value in parts[-5:]]
+        except ValueError:
+            try:
+                values = [float(value) for value in parts[-6:-1]]
+            except ValueError:
+                # Imported here to keep numpy out of the catalog's start-up
+                from atom_table import split_pqr_atom_line
+
+                values = split_pqr_atom_line(line)[7:12]
+        self.add(line.startswith("HETATM"), *values)
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "PQRStats":
+        """
+        Compute the statistics of an existing, possibly compressed, PQR file.
+        """
+        stats = cls()
+        with open_file(file_path, "r") as file:
+            for line in file:
+                stats.add_line(line)
+        return stats
+
+    def bounding_box(self) -> Tuple[Optional[float], ...]:
+        """
+        Get (min_x, min_y, min_z, max_x, max_y, max_z); all None without atoms.
+        """
+        if self.n_atoms == 0:
+            return (None,) * 6
+        return (*self.minimum, *self.maximum)
+
+
+def file_hash(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Get the SHA-256 hex digest of a file's bytes, as stored on disk.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_output(file_path: str) -> Tuple[str, str]:
+    """
+    Get the (PDB ID, kind) of an output file named `<ID>_<kind>.pqr`, e.g.
+    "data/generated/1bcu/1bcu_protein.pqr.gz" -> ("1bcu", "protein").
+    """
+    name = os.path.basename(strip_compression(file_path))
+    stem = name[:-len(".pqr")] if name.endswith(".pqr") else name
+    pdb_id, _, kind = stem.partition("_")
+    return pdb_id, kind
+
+
+class Catalog:
+    """
+    Catalog of output files in a SQLite database.
+
+    Parameters
+    ----------
+    db_path : str
+        Database file; created with its table if it does not exist.
+
+    Notes
+    -----
+    `record` may be called from several threads, e.g. the job hooks of
+    `tool_runner.py`, which run in an executor.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_CATALOG) -> None:
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def record(self, file_path: str, stats: PQRStats, inputs: Sequence[str] = ()) -> None:
+        """
+        Record or replace the row of an output file.
+
+        Parameters
+        ----------
+        file_path : str
+            The output file; its PDB ID and kind are taken from its name.
+        stats : PQRStats
+            Statistics of the atoms written to it.
+        inputs : Sequence[str]
+            Files it was generated from, hashed into the `inputs` column.
+        """
+        pdb_id, kind = describe_output(file_path)
+        input_hashes = {input_file: file_hash(input_file) for input_file in inputs}
+        with self._lock, self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO outputs ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                (os.path.normpath(file_path), pdb_id, kind, stats.n_atoms, stats.n_hetatm,
+                 stats.net_charge, *stats.bounding_box(), stats.n_zero_radius,
+                 json.dumps(input_hashes, sort_keys=True), time.time()),
+            )
+
+    def query(
+        self,
+        kind: Optional[str] = None,
+        pdb_ids: Optional[Iterable[str]] = None,
+        min_atoms: Optional[int] = None,
+        max_atoms: Optional[int] = None,
+        min_charge: Optional[float] = None,
+        max_charge: Optional[float] = None,
+        missing_radii: bool = False,
+        max_extent: Optional[float] = None,
+        order_by: str = "path",
+    ) -> List[Dict[str, Any]]:
+        """
+        Select output files by their statistics; every filter is optional.
+
+        Parameters
+        ----------
+        kind : Optional[str]
+            Kind of file, e.g. "combined".
+        pdb_ids : Optional[Iterable[str]]
+            Only these complexes.
+        min_atoms, max_atoms : Optional[int]
+            Inclusive range of the atom count.
+        min_charge, max_charge : Optional[float]
+            Inclusive range of the net charge.
+        missing_radii : bool
+            Only files with at least one atom of zero radius.
+        max_extent : Optional[float]
+            Largest edge of the bounding box, in Angstrom.
+        order_by : str
+            Column to sort by.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            Matching rows, as column to value.
+        """
+        if order_by not in COLUMNS:
+            raise ValueError(f"Unknown column '{order_by}', expected one of {COLUMNS}")
+        conditions: List[str] = []
+        values: List[Any] = []
+        for condition, value in (
+            ("kind = ?", kind),
+            ("n_atoms >= ?", min_atoms),
+            ("n_atoms <= ?", max_atoms),
+            ("net_charge >= ?", min_charge),
+            ("net_charge <= ?", max_charge),
+            ("MAX(max_x - min_x, max_y - min_y, max_z - min_z) <= ?", max_extent),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                values.append(value)
+        if pdb_ids is not None:
+            pdb_ids = list(pdb_ids)
+            conditions.append(f"pdb_id IN ({', '.join('?' * len(pdb_ids))})")
+            values += pdb_ids
+        if missing_radii:
+            conditions.append("n_zero_radius > 0")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM outputs {where} ORDER BY {order_by}", values)
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def summary(self) -> List[Tuple[str, int, float, float, int]]:
+        """
+        Get (kind, files, mean atoms, mean net charge, files with missing radii) per kind.
+        """
+        return self.connection.execute(
+            "SELECT kind, COUNT(*), AVG(n_atoms), AVG(net_charge), SUM(n_zero_radius > 0) "
+            "FROM outputs GROUP BY kind ORDER BY kind").fetchall()
+
+    def scan(self, output_dir: str) -> int:
+        """
+        Record every PQR file under a directory by reading it, for files
+        written without a catalog. Input hashes are left empty.
+        """
+        n_files = 0
+        for root, _, files in os.walk(output_dir):
+            for name in sorted(files):
+                if has_suffix(name, ".pqr") and not name.startswith("."):
+                    file_path = os.path.join(root, name)
+                    self.record(file_path, PQRStats.from_file(file_path))
+                    n_files += 1
+        return n_files
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Query the catalog of generated PQR files.")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG,
+                        help=f"Catalog database (default: {DEFAULT_CATALOG})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query = subparsers.add_parser("query", help="List the files matching every given filter")
+    query.add_argument("--kind", default=None, help="Kind of file, e.g. protein, ligand or combined")
+    query.add_argument("--pdb-id", dest="pdb_ids", nargs="+", default=None, help="Only these complexes")
+    query.add_argument("--min-atoms", dest="min_atoms", type=int, default=None)
+    query.add_argument("--max-atoms", dest="max_atoms", type=int, default=None)
+    query.add_argument("--min-charge", dest="min_charge", type=float, default=None)
+    query.add_argument("--max-charge", dest="max_charge", type=float, default=None)
+    query.add_argument("--missing-radii", dest="missing_radii", action="store_true",
+                       help="Only files with atoms of zero radius")
+    query.add_argument("--max-extent", dest="max_extent", type=float, default=None,
+                       help="Largest edge of the bounding box, in Angstrom")
+    query.add_argument("--order-by", dest="order_by", choices=COLUMNS, default="path",
+                       help="Column to sort by (default: path)")
+    query.add_argument("--columns", nargs="+", choices=COLUMNS,
+                       default=["path", "n_atoms", "net_charge", "n_zero_radius"],
+                       help="Columns to print (default: path n_atoms net_charge n_zero_radius)")
+
+    subparsers.add_parser("summary", help="Count the files and average their statistics per kind")
+
+    scan = subparsers.add_parser("scan", help="Record every PQR file under a directory")
+    scan.add_argument("--output-dir", dest="output_dir", default="data/generated",
+                      help="Directory of generated PQR files (default: data/generated)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with Catalog(args.catalog) as catalog:
+        if args.command == "query":
+            rows = catalog.query(args.kind, args.pdb_ids, args.min_atoms, args.max_atoms,
+                                 args.min_charge, args.max_charge, args.missing_radii,
+                                 args.max_extent, args.order_by)
+            print("\t".join(args.columns))
+            for row in rows:
+                print("\t".join(str(row[column]) for column in args.columns))
+            print(f"{len(rows)} files", file=sys.stderr)
+        elif args.command == "summary":
+            print("kind\tfiles\tmean_atoms\tmean_net_charge\tmissing_radii")
+            for kind, n_files, mean_atoms, mean_charge, n_missing in catalog.summary():
+                print(f"{kind}\t{n_files}\t{mean_atoms:.1f}\t{mean_charge:.3f}\t{n_missing}")
+        elif args.command == "scan":
+            print(f"Recorded {catalog.scan(args.output_dir)} files in {args.catalog}")
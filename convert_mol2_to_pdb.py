@@ -2,6 +2,7 @@ import numpy as np
 
 from typing import List, Dict, Any
 
+from file_io import open_file
 from mol2_classes import Mol2Bond, Mol2Molecule, Mol2Atom, RADII
 
 
@@ -10,7 +11,7 @@ def read_mol2_file(mol2_file_path: str) -> Mol2Molecule:
     Reads a MOL2 file and returns a populated Mol2Molecule object.
     """
     molecule = Mol2Molecule()
-    with open(mol2_file_path, 'r') as file:
+    with open_file(mol2_file_path, 'r') as file:
         molecule.read(file)
     return molecule
 
@@ -41,7 +42,7 @@ def write_to_pdb_file(pdb_lines: List[str], output_file_path: str) -> None:
     """
     Writes given PDB lines to a file.
     """
-    with open(output_file_path, 'w') as file:
+    with open_file(output_file_path, 'w') as file:
         for line in pdb_lines:
             file.write(line + "\n")
 
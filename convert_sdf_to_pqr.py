@@ -22,102 +22,31 @@ obabel -isdf data/pdbbind/{pdbank_id}/{pdbank_id}_ligand.sdf \
 
 import argparse
 from argparse import Namespace
+from functools import partial
 import logging
 import os
+import shutil
 import subprocess
-from typing import List, Dict
+import tempfile
+from typing import Iterator, List, Optional, Union
 from pathlib import Path
 
-from polars.datatypes.classes import Struct
+from batch_journal import DEFAULT_BACKOFF, DEFAULT_MAX_ATTEMPTS, BatchJournal
+from catalog import Catalog, PQRStats
+from file_io import (COMPRESSION_SUFFIXES, atomic_output, compression_of, has_suffix, open_file,
+                     strip_compression, temp_path, with_compression)
+from instrumentation import complex_scope, count, span, traced, tracing
+from radii import RADII, get_resolver, parse_missing_policy
 
 
 _LOGGER = logging.getLogger(__name__)
 
+#: Radius of atom types found in neither radius table; "raise" raises a
+#: KeyError instead, see `radii.RadiusResolver`.
+DEFAULT_MISSING_RADIUS: Union[str, float] = 0.0
 
-#: Radii for different atom types.
-#: When using these tables, the most specific Sybyl atom type should be used
-#: first and then the generic element should be used
-RADII: Dict[str, Dict[str, float]] = {
-    # NOTE - these are not the original PARSE radii but they are the ones
-    # included in the previous version of PDB2PKA so I'm preserving them for
-    # posterity. There's a claim they came from
-    # http://amber.ch.ic.ac.uk/archive/ but that link no longer works.
-    "not parse - do not use": {
-        "C": 1.70,
-        "N": 1.50,
-        "O": 1.40,
-        "S": 1.85,
-        "H": 1.00,
-        "Br": 2.50,
-        "F": 1.20,
-        "P": 1.90,
-        "Cl": 1.75,
-    },
-    #: These are the PARSE radii from Table 4 of
-    #: http://doi.org/10.1021/j100058a043
-    "parse": {
-        "C.1": 2.00,
-        "C.2": 2.00,
-        "C.3": 2.00,
-        "C": 1.70,
-        "H": 1.00,
-        "O": 1.40,
-        "N": 1.50,
-        "S": 1.85,
-    },
-    #: These are the ZAP radii from Table 2 of
-    #: http://doi.org/10.1021/jm070549%2B. Bondi radii should be used for
-    #: atoms not found in this table.
-    "zap9": {
-        "C": 1.87,
-        "H": 1.10,
-        "O.co2": 1.76,
-        "N": 1.40,
-        "S": 2.15,
-        "F": 2.40,
-        "Cl": 1.82,
-        "I": 2.65,
-    },
-    #: These are the Bondi radii from Table 2 of
-    #: http://doi.org/10.1021/jm070549%2B
-    "bondi-zap": {
-        "C": 1.7,
-        "H": 1.20,
-        "O.co2": 1.52,
-        "N": 1.55,
-        "S": 1.80,
-        "F": 1.47,
-        "Cl": 1.75,
-        "I": 1.98,
-    },
-    #: These are the Bondi radii from Table I of
-    #: http://doi.org/10.1021/j100785a001. NOTE - there are some variations to
-    #: the halogens in Table V that we might want to consider in the future.
-    "bondi": {
-        "H": 1.20,
-        "He": 1.40,
-        "C": 1.70,
-        "N": 1.55,
-        "O": 1.52,
-        "F": 1.47,
-        "Ne": 1.54,
-        "Si": 2.10,
-        "P": 1.80,
-        "S": 1.80,
-        "Cl": 1.75,
-        "Ar": 1.88,
-        "As": 1.85,
-        "Se": 1.90,
-        "Br": 1.85,
-        "Kr": 2.02,
-        "Te": 2.06,
-        "I": 1.98,
-        "Xe": 2.16,
-    },
-}
-
-
-def _get_radius(atom_type: str) -> float:
+
+def _get_radius(atom_type: str, on_missing: Union[str, float] = -1.0) -> float:
     """
     Get the radius for a given atom type.
 
@@ -125,24 +54,44 @@ def _get_radius(atom_type: str) -> float:
     ----------
     atom_type : str
         The atom type for which to retrieve the radius.
+    on_missing : Union[str, float]
+        Radius returned for an atom type found in neither table, or "raise"
+        to raise a KeyError.
 
     Returns
     -------
     float
-        The radius corresponding to the given atom type. Returns -1 if the atom type
-        was not found in the predefined radii dictionaries.
+        The radius corresponding to the given atom type, or `on_missing` if
+        the atom type was not found in the predefined radii dictionaries.
+    """
+    return get_resolver(RADII["zap9"], RADII["bondi"], on_missing=on_missing).radius(atom_type)
+
+
+def iter_sdf_files(start_dir: str) -> Iterator[Path]:
+    """
+    Lazily walk the directory tree starting at start_dir for .sdf files,
+    including `.gz` and `.zst` compressed ones.
+
+    Parameters
+    ----------
+    start_dir : str
+        The directory to start searching for .sdf files.
+
+    Yields
+    ------
+    Path
+        The path of each .sdf file, as soon as its directory is listed.
     """
-    if atom_type in RADII["zap9"]:
-        return RADII["zap9"][atom_type]
-    elif atom_type in RADII["bondi"]:
-        return RADII["bondi"][atom_type]
-    else:
-        return -1  # Indicates the atom type was not found
+    for root, dirs, files in os.walk(start_dir):
+        for file in files:
+            if has_suffix(file, ".sdf"):
+                yield Path(root) / file
 
 
 def find_sdf_files(start_dir: str) -> List[Path]:
     """
-    Find all .sdf files in the directory tree starting at start_dir.
+    Find all .sdf files in the directory tree starting at start_dir, including
+    `.gz` and `.zst` compressed ones.
 
     Parameters
     ----------
@@ -154,12 +103,113 @@ def find_sdf_files(start_dir: str) -> List[Path]:
     List[Path]
         A list of Path objects representing the paths to the found .sdf files.
     """
-    sdf_files = [
-        Path(root) / file
-        for root, dirs, files in os.walk(start_dir)
-        for file in files if file.endswith(".sdf")
-    ]
-    return sdf_files
+    return list(iter_sdf_files(start_dir))
+
+
+def pqr_output_file(sdf_path: Path, save_dir: str, input_dir: str = "data/pdbbind") -> str:
+    """
+    Get the uncompressed .pqr path of an .sdf file, mirroring its directory
+    under save_dir, and create its directory.
+
+    Parameters
+    ----------
+    sdf_path : Path
+        Path of the .sdf file, under input_dir.
+    save_dir : str
+        The directory where the output PQR files will be saved.
+    input_dir : str
+        The directory the .sdf files were found in.
+
+    Returns
+    -------
+    str
+        Path of the .pqr file Open Babel writes.
+    """
+    output_dir = Path(save_dir) / sdf_path.parent.relative_to(input_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = Path(strip_compression(sdf_path.name)).stem
+    return str(output_dir / f"{stem}.pqr")
+
+
+def finish_pqr(raw_file: str, output_file: str, compress: Optional[str] = None,
+               stats: Optional[PQRStats] = None,
+               on_missing: Union[str, float] = DEFAULT_MISSING_RADIUS) -> str:
+    """
+    Replace the radii of a PQR file written by Open Babel, compressing it if asked.
+
+    The final file is written atomically, so it only exists once complete.
+
+    Parameters
+    ----------
+    raw_file : str
+        The .pqr file written by Open Babel; removed afterwards.
+    output_file : str
+        The uncompressed path of the final PQR file.
+    compress : Optional[str]
+        Write the PQR file compressed, "gz" or "zst"; plain text if None.
+    stats : Optional[PQRStats]
+        Accumulates the statistics of the atoms written.
+    on_missing : Union[str, float]
+        Radius of atom types found in neither radius table, or "raise".
+
+    Returns
+    -------
+    str
+        Path of the final PQR file.
+    """
+    final_file = with_compression(output_file, compress)
+    with atomic_output(final_file) as partial_file:
+        update_pqr_radii(raw_file, partial_file, stats, on_missing)
+    os.remove(raw_file)
+    return final_file
+
+
+def convert_one(sdf_path: Path, save_dir: str, forcefield: str,
+                compress: Optional[str] = None, input_dir: str = "data/pdbbind",
+                catalog: Optional[Catalog] = None,
+                on_missing: Union[str, float] = DEFAULT_MISSING_RADIUS) -> str:
+    """
+    Convert one .sdf file into its final .pqr file.
+
+    Parameters
+    ----------
+    sdf_path : Path
+        Path of the .sdf file.
+    save_dir : str
+        The directory where the output PQR files will be saved.
+    forcefield : str
+        Forcefield for the charges.
+    compress : Optional[str]
+        Write the PQR file compressed, "gz" or "zst"; plain text if None.
+    input_dir : str
+        The directory the .sdf file was found in.
+    catalog : Optional[Catalog]
+        Catalog in which the PQR file is recorded.
+    on_missing : Union[str, float]
+        Radius of atom types found in neither radius table, or "raise".
+
+    Returns
+    -------
+    str
+        Path of the final PQR file.
+    """
+    # Construct the output file path based on the sdf file path
+    output_file = pqr_output_file(sdf_path, save_dir, input_dir)
+
+    # Convert SDF to PQR under a temporary name, then update its radii into
+    # the final file
+    raw_file = temp_path(output_file, "raw")
+    try:
+        convert_sdf_to_pqr(str(sdf_path), raw_file, forcefield)
+    except Exception:
+        if os.path.exists(raw_file):
+            os.remove(raw_file)
+        raise
+    stats = PQRStats() if catalog is not None else None
+    final_file = finish_pqr(raw_file, output_file, compress, stats, on_missing)
+    if catalog is not None:
+        catalog.record(final_file, stats, [str(sdf_path)])
+    return final_file
 
 
 def convert_sdf_to_pqr(input_file: str, output_file: str, forcefield: str) -> None:
@@ -173,13 +223,37 @@ def convert_sdf_to_pqr(input_file: str, output_file: str, forcefield: str) -> No
         file.
     output_file : str
         Where the output .pqr file will be saved.
-    """
-    subprocess.run(["obabel", "-isdf", input_file,
-                              "-opqr", "-O", output_file,
-                              "--FF", forcefield])
-
 
-def update_pqr_radii(input_file: str, output_file: str) -> None:
+    Raises
+    ------
+    RuntimeError
+        If Open Babel fails or converts no molecule, with its error output.
+    """
+    if compression_of(input_file) is not None:
+        # Open Babel reads plain files; stream the SDF into a temporary copy
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plain_file = os.path.join(tmp_dir, os.path.basename(strip_compression(input_file)))
+            with open_file(input_file, "rb") as source, open(plain_file, "wb") as target:
+                shutil.copyfileobj(source, target)
+            convert_sdf_to_pqr(plain_file, output_file, forcefield)
+        return
+    with span("obabel", input_file=input_file):
+        try:
+            result = subprocess.run(["obabel", "-isdf", input_file,
+                                               "-opqr", "-O", output_file,
+                                               "--FF", forcefield],
+                                    check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        except subprocess.CalledProcessError as error:
+            raise RuntimeError(f"obabel failed on {input_file} with exit status {error.returncode}: "
+                               f"{error.stderr.strip()}") from error
+    # Open Babel exits with status 0 when it cannot read any molecule
+    if not os.path.isfile(output_file) or os.path.getsize(output_file) == 0:
+        raise RuntimeError(f"obabel wrote no molecule for {input_file}: {result.stderr.strip()}")
+
+
+@traced()
+def update_pqr_radii(input_file: str, output_file: str, stats: Optional[PQRStats] = None,
+                     on_missing: Union[str, float] = DEFAULT_MISSING_RADIUS) -> None:
     """
     Update the radii in a PQR file based on atom type.
 
@@ -188,22 +262,30 @@ def update_pqr_radii(input_file: str, output_file: str) -> None:
     input_file : str
         The path to the input PQR file.
     output_file : str
-        The path where the updated PQR file will be saved.
+        The path where the updated PQR file will be saved. Either path may
+        end in `.gz` or `.zst` to be read or written compressed.
+    stats : Optional[PQRStats]
+        Accumulates the statistics of the atoms written.
+    on_missing : Union[str, float]
+        Radius of atom types found in neither radius table, zero by default,
+        or "raise" to raise a KeyError naming the atom type.
     """
-    with open(input_file, "r") as f:
+    with open_file(input_file, "r") as f:
         lines = f.readlines()
 
-    with open(output_file, "w") as f:
+    resolver = get_resolver(RADII["zap9"], RADII["bondi"], on_missing=on_missing)
+    n_atoms = 0
+    with open_file(output_file, "w") as f:
         for line in lines:
             if line.startswith("ATOM") or line.startswith("HETATM"):
+                n_atoms += 1
                 parts = line.split()
                 atom_type = parts[-1]
-                radius = _get_radius(atom_type)
-                if radius != -1:
-                    parts[-2] = f"{radius:.6f}"
-                else:
-                    parts[-2] = f"{0:.6f}"
+                parts[-2] = f"{resolver.radius(atom_type):.6f}"
                 f.write(" ".join(parts) + "\n")
+                if stats is not None:
+                    stats.add(parts[0] == "HETATM", float(parts[-6]), float(parts[-5]), float(parts[-4]),
+                              float(parts[-3]), float(parts[-2]))
                 # TODO:
                 # Configure whitespace for `f.write()`
                 # e.g.
@@ -225,9 +307,13 @@ def update_pqr_radii(input_file: str, output_file: str) -> None:
                 # ```
             else:
                 f.write(line)
+    count("ligand_atoms", n_atoms)
 
 
-def process_files(sdf_files: List[Path], save_dir: str, forcefield: str) -> None:
+def process_files(sdf_files: List[Path], save_dir: str, forcefield: str,
+                  compress: Optional[str] = None, journal: Optional[BatchJournal] = None,
+                  catalog: Optional[Catalog] = None,
+                  on_missing: Union[str, float] = DEFAULT_MISSING_RADIUS) -> None:
     """
     Process each .sdf file found.
 
@@ -237,21 +323,26 @@ def process_files(sdf_files: List[Path], save_dir: str, forcefield: str) -> None
         A list of Path objects representing the paths to .sdf files to be processed.
     save_dir : str
         The directory where the output PQR files will be saved.
+    compress : Optional[str]
+        Write the PQR files compressed, "gz" or "zst"; plain text if None.
+    journal : Optional[BatchJournal]
+        Journal of the run; files converted in an earlier run are skipped and
+        failures are retried and quarantined by its policy. Without a journal
+        the first failure stops the run.
+    catalog : Optional[Catalog]
+        Catalog in which the PQR files are recorded.
+    on_missing : Union[str, float]
+        Radius of atom types found in neither radius table, or "raise".
     """
     for sdf_path in sdf_files:
-        # Construct the output directory based on the sdf file path
-        output_dir = Path(save_dir) / sdf_path.parent.relative_to("data/pdbbind")
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        # Construct input and output file paths
-        input_file = str(sdf_path)
-        output_file = str(output_dir / f"{sdf_path.stem}.pqr")
-
-        # Convert SDF to PQR
-        convert_sdf_to_pqr(input_file, output_file, forcefield)
-
-        # Update radii in the PQR file, assuming temp file is the same as output for simplicity
-        update_pqr_radii(output_file, output_file)
+        key = Path(strip_compression(sdf_path.name)).stem
+        with complex_scope(key):
+            if journal is None:
+                convert_one(sdf_path, save_dir, forcefield, compress, catalog=catalog, on_missing=on_missing)
+                continue
+            if not journal.run("obabel", key, partial(convert_one, catalog=catalog, on_missing=on_missing),
+                               sdf_path, save_dir, forcefield, compress):
+                _LOGGER.warning(f"Quarantined {sdf_path}: {journal.state('obabel', key).error}")
 
 
 def parse_args() -> Namespace:
@@ -262,10 +353,40 @@ def parse_args() -> Namespace:
                         help="Output directory for .pqr files (default: data/generated)")
     parser.add_argument("--FF", dest="forcefield", default="AMBER",
                         help="Forcefield for calculating charges for .pqr files (default: AMBER)")
-    return parser.parse_args()
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                        help="Compress the .pqr files (default: not compressed)")
+    parser.add_argument("--journal", default=None,
+                        help="Journal of the run (default: <output-dir>/convert_sdf_to_pqr.journal.jsonl)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip files converted by an earlier run and retry failed ones")
+    parser.add_argument("--max-attempts", dest="max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f"Attempts before a file is quarantined (default: {DEFAULT_MAX_ATTEMPTS})")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF,
+                        help=f"Seconds before the first retry, doubling after each (default: {DEFAULT_BACKOFF:g})")
+    parser.add_argument("--catalog", default=None,
+                        help="Record the .pqr files in this SQLite catalog (default: none)")
+    parser.add_argument("--on-missing-radius", dest="on_missing", type=parse_missing_policy,
+                        default=DEFAULT_MISSING_RADIUS,
+                        help="Radius of atom types in neither radius table, or 'raise' to fail the file "
+                             f"(default: {DEFAULT_MISSING_RADIUS:g})")
+    parser.add_argument("--trace", default=None,
+                        help="Write a Chrome trace and per-complex metrics CSV to this directory (default: off)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Also write cProfile statistics of each stage to the --trace directory")
+    args = parser.parse_args()
+    if args.profile and args.trace is None:
+        parser.error("--profile needs --trace")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
     sdf_files = find_sdf_files(args.input_dir)
-    process_files(sdf_files, args.output_dir, args.forcefield)
+    journal_file = args.journal or os.path.join(args.output_dir, "convert_sdf_to_pqr.journal.jsonl")
+    run_catalog = Catalog(args.catalog) if args.catalog is not None else None
+    with tracing(args.trace, args.profile), \
+            BatchJournal(journal_file, args.resume, args.max_attempts, args.backoff) as run_journal:
+        process_files(sdf_files, args.output_dir, args.forcefield, args.compress, run_journal, run_catalog,
+                      args.on_missing)
+    if run_catalog is not None:
+        run_catalog.close()
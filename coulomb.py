@@ -0,0 +1,263 @@
+"""Protein-ligand Coulomb interaction energies from PQR charges.
+
+The protein atoms are indexed once in a `spatial.CellList`, and only the
+protein atoms within the cutoff of each ligand atom are visited, so the cost
+grows with the number of ligand atoms times the local atom density rather
+than with the size of the protein. Energies are reported in kcal/mol.
+"""
+import argparse
+import csv
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from pqr_arrays import find_complexes, read_pqr_atoms
+from scheduler import file_cost, map_longest_first
+from spatial import CellList
+
+
+#: Coulomb constant in kcal * Angstrom / (mol * e^2)
+COULOMB_CONSTANT = 332.0636
+
+DEFAULT_CUTOFF = 12.0
+DEFAULT_DIELECTRIC = 4.0
+
+
+class CoulombResult(NamedTuple):
+    """Protein-ligand Coulomb energy and its decompositions, in kcal/mol."""
+
+    #: Total interaction energy
+    energy: float
+    #: Interaction energy of each ligand atom with the protein
+    ligand_atom_energy: np.ndarray
+    #: Interaction energy of each protein atom with the ligand
+    protein_atom_energy: np.ndarray
+    #: Interaction energy of each protein residue with the ligand, keyed by
+    #: "<chain>:<residue name><residue number><insertion code>"
+    residue_energy: Dict[str, float]
+    #: Number of protein-ligand pairs within the cutoff
+    n_pairs: int
+
+
+def pair_energies(
+    charge_products: np.ndarray,
+    distances: np.ndarray,
+    dielectric: float = DEFAULT_DIELECTRIC,
+    distance_dependent: bool = False,
+) -> np.ndarray:
+    """
+    Coulomb energy of atom pairs.
+
+    Parameters
+    ----------
+    charge_products : np.ndarray
+        Product of the two charges of each pair, in e^2.
+    distances : np.ndarray
+        Pair distances, in Angstrom.
+    dielectric : float
+        Relative dielectric constant, or its prefactor when
+        `distance_dependent` is set.
+    distance_dependent : bool
+        Use the distance-dependent dielectric `dielectric * r`.
+
+    Returns
+    -------
+    np.ndarray
+        Pair energies in kcal/mol.
+    """
+    denominator = dielectric * distances
+    if distance_dependent:
+        denominator = denominator * distances
+    return COULOMB_CONSTANT * charge_products / denominator
+
+
+def residue_labels(atoms: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Build a residue label for every atom, e.g. "A:HIS57" or ":GLY16A".
+    """
+    return np.array([
+        f"{chain}:{res_name}{res_seq}{ins_code}"
+        for chain, res_name, res_seq, ins_code in zip(
+            atoms["chain"], atoms["res_name"], atoms["res_seq"], atoms["ins_code"]
+        )
+    ])
+
+
+def coulomb_interaction(
+    protein: Dict[str, np.ndarray],
+    ligand: Dict[str, np.ndarray],
+    cutoff: Optional[float] = DEFAULT_CUTOFF,
+    dielectric: float = DEFAULT_DIELECTRIC,
+    distance_dependent: bool = False,
+    cell_list: Optional[CellList] = None,
+) -> CoulombResult:
+    """
+    Compute the Coulomb interaction energy between a protein and a ligand.
+
+    Parameters
+    ----------
+    protein : Dict[str, np.ndarray]
+        Protein atom arrays, see `pqr_arrays.read_pqr_atoms`.
+    ligand : Dict[str, np.ndarray]
+        Ligand atom arrays.
+    cutoff : Optional[float]
+        Interaction cutoff, in Angstrom. `None` includes all pairs.
+    dielectric : float
+        Relative dielectric constant, or its prefactor when
+        `distance_dependent` is set.
+    distance_dependent : bool
+        Use the distance-dependent dielectric `dielectric * r`.
+    cell_list : Optional[CellList]
+        Prebuilt cell list of the protein coordinates, to reuse one protein
+        index across many ligands.
+
+    Returns
+    -------
+    CoulombResult
+        Total energy and per-atom and per-residue decompositions.
+    """
+    protein_coords = protein["coords"]
+    ligand_coords = ligand["coords"]
+    if cutoff is None:
+        # Every pair; only meant as a reference for small systems.
+        ligand_index = np.repeat(np.arange(len(ligand_coords)), len(protein_coords))
+        protein_index = np.tile(np.arange(len(protein_coords)), len(ligand_coords))
+        distances = np.linalg.norm(
+            ligand_coords[ligand_index] - protein_coords[protein_index], axis=1
+        )
+    else:
+        if cell_list is None:
+            cell_list = CellList(protein_coords, cutoff)
+        ligand_index, protein_index, distances = cell_list.query(ligand_coords, cutoff)
+
+    energies = pair_energies(
+        ligand["charge"][ligand_index] * protein["charge"][protein_index],
+        distances, dielectric, distance_dependent,
+    )
+    ligand_atom_energy = np.bincount(ligand_index, energies, minlength=len(ligand_coords))
+    protein_atom_energy = np.bincount(protein_index, energies, minlength=len(protein_coords))
+
+    residue_energy: Dict[str, float] = {}
+    contacted = np.flatnonzero(protein_atom_energy)
+    if len(contacted):
+        labels = residue_labels({key: protein[key][contacted] for key in
+                                 ("chain", "res_name", "res_seq", "ins_code")})
+        unique_labels, inverse = np.unique(labels, return_inverse=True)
+        sums = np.bincount(inverse, protein_atom_energy[contacted])
+        residue_energy = dict(zip(unique_labels.tolist(), sums.tolist()))
+
+    return CoulombResult(
+        energy=float(energies.sum()),
+        ligand_atom_energy=ligand_atom_energy,
+        protein_atom_energy=protein_atom_energy,
+        residue_energy=residue_energy,
+        n_pairs=len(energies),
+    )
+
+
+def _complex_energy(
+    job: Tuple[str, str, str, Optional[float], float, bool],
+) -> Tuple[str, int, int, CoulombResult]:
+    pdb_id, protein_file, ligand_file, cutoff, dielectric, distance_dependent = job
+    protein = read_pqr_atoms(protein_file)
+    ligand = read_pqr_atoms(ligand_file)
+    result = coulomb_interaction(protein, ligand, cutoff, dielectric, distance_dependent)
+    return pdb_id, len(protein["charge"]), len(ligand["charge"]), result
+
+
+def process_dataset(
+    root_dir: str,
+    output_file: str,
+    cutoff: Optional[float] = DEFAULT_CUTOFF,
+    dielectric: float = DEFAULT_DIELECTRIC,
+    distance_dependent: bool = False,
+    residue_dir: Optional[str] = None,
+    workers: int = 1,
+    timings_file: Optional[str] = None,
+) -> List[Tuple[str, float]]:
+    """
+    Compute the protein-ligand Coulomb energy of every complex in a tree.
+
+    Parameters
+    ----------
+    root_dir : str
+        Root directory of the generated PQR files, e.g. `data/generated`.
+    output_file : str
+        CSV file with one row of totals per complex.
+    cutoff : Optional[float]
+        Interaction cutoff, in Angstrom.
+    dielectric : float
+        Relative dielectric constant (or prefactor).
+    distance_dependent : bool
+        Use the distance-dependent dielectric.
+    residue_dir : Optional[str]
+        If given, write `<PDB_ID>_residues.csv` with the per-residue
+        decomposition of each complex into this directory.
+    workers : int
+        Number of worker processes.
+    timings_file : Optional[str]
+        JSON file of run times of earlier runs, used to start the slowest
+        complexes first and updated with this run, see
+        `scheduler.map_longest_first`.
+
+    Returns
+    -------
+    List[Tuple[str, float]]
+        (PDB ID, energy) of each complex.
+    """
+    jobs = [
+        (pdb_id, protein_file, ligand_file, cutoff, dielectric, distance_dependent)
+        for pdb_id, protein_file, ligand_file in find_complexes(root_dir)
+    ]
+    if residue_dir is not None:
+        os.makedirs(residue_dir, exist_ok=True)
+
+    energies = []
+    results = map_longest_first(
+        _complex_energy, jobs, [file_cost(job[1], job[2]) for job in jobs], workers,
+        [job[0] for job in jobs], f"coulomb:{cutoff}:{distance_dependent}", timings_file,
+    )
+    with open(output_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["pdb_id", "n_protein_atoms", "n_ligand_atoms", "n_pairs", "energy"])
+        for pdb_id, n_protein, n_ligand, result in results:
+            writer.writerow([pdb_id, n_protein, n_ligand, result.n_pairs, f"{result.energy:.6f}"])
+            energies.append((pdb_id, result.energy))
+            if residue_dir is not None:
+                residue_file = os.path.join(residue_dir, f"{pdb_id}_residues.csv")
+                with open(residue_file, "w", newline="") as residue_csv:
+                    residue_writer = csv.writer(residue_csv)
+                    residue_writer.writerow(["residue", "energy"])
+                    for label, energy in sorted(result.residue_energy.items(), key=lambda x: x[1]):
+                        residue_writer.writerow([label, f"{energy:.6f}"])
+    return energies
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compute protein-ligand Coulomb interaction energies from PQR files.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--output", default="coulomb_energies.csv",
+                        help="CSV file of per-complex energies (default: coulomb_energies.csv)")
+    parser.add_argument("--cutoff", type=float, default=DEFAULT_CUTOFF,
+                        help=f"Interaction cutoff in Angstrom (default: {DEFAULT_CUTOFF})")
+    parser.add_argument("--dielectric", type=float, default=DEFAULT_DIELECTRIC,
+                        help=f"Relative dielectric constant (default: {DEFAULT_DIELECTRIC})")
+    parser.add_argument("--distance-dependent", dest="distance_dependent", action="store_true",
+                        help="Use a distance-dependent dielectric, dielectric * r")
+    parser.add_argument("--residue-dir", dest="residue_dir", default=None,
+                        help="Directory for per-residue decompositions (default: not written)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    parser.add_argument("--timings", default=None,
+                        help="JSON file of run times for longest-first scheduling (default: not kept)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = process_dataset(args.input_dir, args.output, args.cutoff, args.dielectric,
+                              args.distance_dependent, args.residue_dir, args.workers, args.timings)
+    print(f"Computed Coulomb energies of {len(results)} complexes into {args.output}")
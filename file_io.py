@@ -0,0 +1,183 @@
+"""Open PQR, MOL2 and SDF files with transparent compression.
+
+Files ending in `.gz` are read and written with `gzip`, files ending in
+`.zst` with the optional `zstandard` package; both stream, so a compressed
+file is never fully decompressed in memory. Every other path is opened as a
+plain file. Readers and writers across the repository open their files
+through `open_file`, so `<ID>_protein.pqr.gz` can be used wherever
+`<ID>_protein.pqr` is.
+
+The conversion stages write through `atomic_output`, which writes a temporary
+file next to the target and renames it into place, so an interrupted run
+never leaves a truncated file under the final name.
+"""
+import gzip
+import io
+import os
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional, Sequence, Union
+
+
+#: Compression formats and the file suffix of each.
+COMPRESSION_SUFFIXES = {"gz": ".gz", "zst": ".zst"}
+
+#: Compression levels used when writing; chosen for speed over ratio.
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression_of(file_path: Union[str, os.PathLike]) -> Optional[str]:
+    """
+    Get the compression format of a path from its suffix, "gz", "zst" or None.
+    """
+    file_path = os.fspath(file_path)
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if file_path.endswith(suffix):
+            return compression
+    return None
+
+
+def strip_compression(file_path: Union[str, os.PathLike]) -> str:
+    """
+    Remove a compression suffix from a path, e.g. "a.pqr.gz" -> "a.pqr".
+    """
+    file_path = os.fspath(file_path)
+    compression = compression_of(file_path)
+    if compression is None:
+        return file_path
+    return file_path[:-len(COMPRESSION_SUFFIXES[compression])]
+
+
+def with_compression(file_path: Union[str, os.PathLike], compression: Optional[str]) -> str:
+    """
+    Add the suffix of a compression format to a path; `None` leaves it plain.
+    """
+    file_path = os.fspath(file_path)
+    if compression is None:
+        return file_path
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression format: {compression}")
+    return file_path + COMPRESSION_SUFFIXES[compression]
+
+
+def has_suffix(file_path: Union[str, os.PathLike], suffixes: Union[str, Sequence[str]]) -> bool:
+    """
+    Check the suffix of a path, ignoring any compression suffix.
+
+    Parameters
+    ----------
+    file_path : Union[str, os.PathLike]
+        Path to check.
+    suffixes : Union[str, Sequence[str]]
+        Accepted suffixes, e.g. ".sdf" or ("_ligand.pqr",).
+
+    Returns
+    -------
+    bool
+        Whether the path, without compression suffix, ends in one of them.
+    """
+    if isinstance(suffixes, str):
+        suffixes = (suffixes,)
+    return strip_compression(file_path).endswith(tuple(suffixes))
+
+
+def find_file(stem: Union[str, os.PathLike]) -> Optional[str]:
+    """
+    Find a file that is stored plain or compressed.
+
+    Parameters
+    ----------
+    stem : Union[str, os.PathLike]
+        Uncompressed path, e.g. "data/generated/1bcu/1bcu_protein.pqr".
+
+    Returns
+    -------
+    Optional[str]
+        The existing path, trying the plain file first, or None.
+    """
+    stem = os.fspath(stem)
+    for candidate in [stem] + [stem + suffix for suffix in COMPRESSION_SUFFIXES.values()]:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def open_file(file_path: Union[str, os.PathLike], mode: str = "r") -> IO:
+    """
+    Open a file, compressing or decompressing by its suffix.
+
+    Parameters
+    ----------
+    file_path : Union[str, os.PathLike]
+        Path of the file.
+    mode : str
+        "r", "w" or "a", optionally with "b"; text modes are the default.
+
+    Returns
+    -------
+    IO
+        A file object that streams through the compression; readers can be
+        iterated by line in both text and binary modes.
+
+    Raises
+    ------
+    ImportError
+        When a `.zst` file is opened and `zstandard` is not installed.
+    """
+    compression = compression_of(file_path)
+    if compression is None:
+        return open(file_path, mode)
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    if compression == "gz":
+        return gzip.open(file_path, mode, compresslevel=GZIP_LEVEL)
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            f"Reading or writing {file_path} requires the zstandard package: pip install zstandard"
+        ) from error
+    opened = zstandard.open(file_path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+    if "r" in mode and "b" in mode:
+        # The zstandard reader cannot be iterated by line, unlike gzip's
+        return io.BufferedReader(opened)
+    return opened
+
+
+def temp_path(file_path: Union[str, os.PathLike], tag: str = "tmp") -> str:
+    """
+    Get a temporary path next to a file that keeps its suffixes, e.g.
+    "dir/a.pqr.gz" -> "dir/.tmp-<pid>-a.pqr.gz", so it is opened the same way.
+    Different tags give different paths for the same file.
+    """
+    directory, name = os.path.split(os.fspath(file_path))
+    return os.path.join(directory, f".{tag}-{os.getpid()}-{name}")
+
+
+@contextmanager
+def atomic_output(file_path: Union[str, os.PathLike]) -> Iterator[str]:
+    """
+    Write a file under a temporary name and rename it into place on success.
+
+    The rename is atomic on POSIX filesystems, so `file_path` either keeps
+    its old content or has the complete new content. On an error the
+    temporary file is removed.
+
+    Parameters
+    ----------
+    file_path : Union[str, os.PathLike]
+        Final path of the file.
+
+    Yields
+    ------
+    str
+        Temporary path to write to, in the same directory and with the same
+        suffixes as `file_path`.
+    """
+    partial = temp_path(file_path)
+    try:
+        yield partial
+        os.replace(partial, file_path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
@@ -3,11 +3,19 @@ import os
 from pathlib import Path
 from typing import List, Tuple, Optional
 
+from catalog import Catalog, PQRStats
+from file_io import COMPRESSION_SUFFIXES, atomic_output, has_suffix, open_file, with_compression
+from instrumentation import complex_scope, count, traced, tracing
 
-def combine_pqr_files(ligand_file: str, protein_file: str, output_file: str) -> None:
+
+@traced()
+def combine_pqr_files(ligand_file: str, protein_file: str, output_file: str,
+                      stats: Optional[PQRStats] = None) -> None:
     """
     Combine lines starting with "ATOM" or "HETATM" from ligand and protein PQR files.
 
+    Any of the files may be `.gz` or `.zst` compressed, by suffix.
+
     Parameters
     ----------
     ligand_file : str
@@ -16,14 +24,25 @@ def combine_pqr_files(ligand_file: str, protein_file: str, output_file: str) ->
         The path to the protein PQR file.
     output_file : str
         The path where the combined PQR file will be saved.
+    stats : Optional[PQRStats]
+        Accumulates the statistics of the atoms written.
     """
-    with open(ligand_file, "r") as ligand, open(protein_file, "r") as protein, open(output_file, "w") as output:
+    with open_file(ligand_file, "r") as ligand, open_file(protein_file, "r") as protein, \
+            open_file(output_file, "w") as output:
+        n_atoms = 0
         for line in protein:
             if line.startswith(("ATOM", "HETATM")):
                 output.write(line)
+                n_atoms += 1
+                if stats is not None:
+                    stats.add_line(line)
         for line in ligand:
             if line.startswith(("ATOM", "HETATM")):
                 output.write(line)
+                n_atoms += 1
+                if stats is not None:
+                    stats.add_line(line)
+    count("atoms_written", n_atoms)
 
 
 def find_pqr_pair(directory: str) -> Tuple[str, str]:
@@ -42,7 +61,7 @@ def find_pqr_pair(directory: str) -> Tuple[str, str]:
     """
     ligand_file: Optional[str] = None
     for file in os.listdir(directory):
-        if file.endswith("_ligand.pqr"):
+        if has_suffix(file, "_ligand.pqr"):
             ligand_file = os.path.join(directory, file)
             break
     if ligand_file is None:
@@ -50,7 +69,7 @@ def find_pqr_pair(directory: str) -> Tuple[str, str]:
 
     protein_file: Optional[str] = None
     for file in os.listdir(directory):
-        if file.endswith("_protein.pqr"):
+        if has_suffix(file, "_protein.pqr"):
             protein_file = os.path.join(directory, file)
             break
     if protein_file is None:
@@ -59,7 +78,8 @@ def find_pqr_pair(directory: str) -> Tuple[str, str]:
     return (protein_file, ligand_file)
 
 
-def process_directory(root_dir: str) -> None:
+def process_directory(root_dir: str, compress: Optional[str] = None,
+                      catalog: Optional[Catalog] = None) -> None:
     """
     Process PQR file pair in the given directory.
 
@@ -67,11 +87,20 @@ def process_directory(root_dir: str) -> None:
     ----------
     root_dir : str
         The root directory to start processing from.
+    compress : Optional[str]
+        Compress the combined file, "gz" or "zst"; plain text if None.
+    catalog : Optional[Catalog]
+        Catalog in which the combined file is recorded.
     """
     relative_dir = root_dir.split("/")[-1]
     protein_file, ligand_file = find_pqr_pair(root_dir)
-    output_file = os.path.join(root_dir, f"{relative_dir}_combined.pqr")
-    combine_pqr_files(ligand_file, protein_file, output_file)
+    output_file = with_compression(os.path.join(root_dir, f"{relative_dir}_combined.pqr"), compress)
+    stats = PQRStats() if catalog is not None else None
+    # Written under a temporary name, so a failed run leaves no truncated file
+    with complex_scope(relative_dir), atomic_output(output_file) as partial_file:
+        combine_pqr_files(ligand_file, protein_file, partial_file, stats)
+    if catalog is not None:
+        catalog.record(output_file, stats, [protein_file, ligand_file])
     print(f"Combined {ligand_file} and {protein_file} into {output_file}")
 
 
@@ -79,9 +108,24 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Combine ligand and protein PQR files.")
     parser.add_argument("directory",
         help="The directory containing the PQR files from the same protein to process.")
-    return parser.parse_args()
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                        help="Compress the combined PQR file (default: not compressed)")
+    parser.add_argument("--catalog", default=None,
+                        help="Record the combined file in this SQLite catalog (default: none)")
+    parser.add_argument("--trace", default=None,
+                        help="Write a Chrome trace and per-complex metrics CSV to this directory (default: off)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Also write cProfile statistics of each stage to the --trace directory")
+    args = parser.parse_args()
+    if args.profile and args.trace is None:
+        parser.error("--profile needs --trace")
+    return args
 
 
 if __name__ == "__main__":
     args = parse_args()
-    process_directory(args.directory)
+    run_catalog = Catalog(args.catalog) if args.catalog is not None else None
+    with tracing(args.trace, args.profile):
+        process_directory(args.directory, args.compress, run_catalog)
+    if run_catalog is not None:
+        run_catalog.close()
@@ -0,0 +1,370 @@
+"""Generalized Born solvation energies from PQR charges.
+
+A quick alternative to a Poisson-Boltzmann run for triaging complexes. The
+PQR radii are forcefield radii (AMBER gives hydrogens 0.6 or 0 Angstrom), so
+atoms get the mbondi2 GB radii of their element instead. Born radii are
+computed with the pairwise descreening integral of Hawkins, Cramer
+and Truhlar (HCT), optionally rescaled as in Onufriev, Bashford and Case
+(OBC-II), and the polar solvation energy uses the Still formula
+
+    dG = -0.5 * k * (1 / eps_in - 1 / eps_out) * sum_ij q_i q_j / f_GB(r_ij),
+    f_GB = sqrt(r^2 + R_i R_j exp(-r^2 / (4 R_i R_j)))
+
+Atom pairs come from a `spatial.CellList` and are visited in blocks of atoms
+so that memory stays bounded for large complexes. The descreening has its own
+cutoff, a little longer than the pair cutoff because truncating it
+underestimates the burial of every atom; without one it visits every atom
+pair, which is several times slower on a whole receptor. The pair energies are
+shifted to zero at the pair cutoff, so the energies change little with the
+cutoff. The descreening of every atom is split into its protein and ligand
+parts, so one call gives the energies of the complex, the unbound receptor and
+the unbound ligand, and their difference, the solvation energy of binding.
+
+Compute the binding solvation energy of every generated complex::
+
+    python gb_solvation.py --input-dir data/generated --output gb_energies.csv
+"""
+import argparse
+import csv
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from coulomb import COULOMB_CONSTANT
+from pqr_arrays import ELEMENT_CODES, ELEMENTS, crop_pocket, find_complexes, load_complex
+from radii import RADII, get_resolver
+from scheduler import file_cost, map_longest_first
+from spatial import CellList
+
+
+GB_MODELS = ("obc", "hct")
+DEFAULT_CUTOFF = 12.0
+#: Descreening cutoff; None includes every atom pair.
+DEFAULT_DESCREEN_CUTOFF: Optional[float] = 16.0
+SOLUTE_DIELECTRIC = 1.0
+SOLVENT_DIELECTRIC = 78.5
+#: Offset subtracted from the GB radii to get the intrinsic radii.
+DIELECTRIC_OFFSET = 0.09
+#: GB radius of elements in neither mbondi2 nor Bondi, e.g. metal ions; the
+#: default radius of AMBER's tleap.
+DEFAULT_GB_RADIUS = 1.5
+#: mbondi2 radius of hydrogens bonded to nitrogen, and the longest H-N
+#: distance counted as a bond.
+AMIDE_HYDROGEN_RADIUS = 1.3
+HN_BOND_LENGTH = 1.2
+#: Upper bound of the HCT Born radii, reached by deeply buried atoms.
+MAX_BORN_RADIUS = 30.0
+#: OBC-II rescaling parameters (alpha, beta, gamma).
+OBC_PARAMETERS = (1.0, 0.8, 4.85)
+
+#: HCT descreening scale factor per element; other elements use 0.8.
+SCREENING_FACTORS: Dict[str, float] = {
+    "H": 0.85, "C": 0.72, "N": 0.79, "O": 0.85, "F": 0.88, "P": 0.86, "S": 0.96,
+}
+
+
+def _screening_lookup() -> np.ndarray:
+    lookup = np.full(len(ELEMENTS), 0.8)
+    for symbol, factor in SCREENING_FACTORS.items():
+        lookup[ELEMENT_CODES[symbol]] = factor
+    return lookup
+
+
+#: Descreening scale factor of every element code.
+_SCREENING = _screening_lookup()
+
+#: mbondi2 radius of every element code.
+_GB_RADII = get_resolver(RADII["mbondi2"], RADII["bondi"], DEFAULT_GB_RADIUS).radii(ELEMENTS)
+
+
+class GBResult(NamedTuple):
+    """Generalized Born solvation energies, in kcal/mol."""
+
+    #: Polar solvation energy of the complex
+    complex_energy: float
+    #: Polar solvation energy of the unbound receptor
+    receptor_energy: float
+    #: Polar solvation energy of the unbound ligand
+    ligand_energy: float
+    #: complex - receptor - ligand
+    delta_energy: float
+    #: Born radius of each atom in the complex
+    born_radii: np.ndarray
+    #: Born radius of each atom in its unbound partner
+    born_radii_unbound: np.ndarray
+
+
+def gb_radii(coords: np.ndarray, elements: np.ndarray) -> np.ndarray:
+    """
+    Assign mbondi2 GB radii by element.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        Atom coordinates, shape (N, 3).
+    elements : np.ndarray
+        Element codes, see `pqr_arrays.ELEMENTS`.
+
+    Returns
+    -------
+    np.ndarray
+        The GB radius of each atom; hydrogens within `HN_BOND_LENGTH` of a
+        nitrogen get `AMIDE_HYDROGEN_RADIUS`.
+    """
+    elements = np.asarray(elements, dtype=np.int64)
+    radii = _GB_RADII[elements]
+    hydrogens = np.flatnonzero(elements == ELEMENT_CODES["H"])
+    nitrogens = np.flatnonzero(elements == ELEMENT_CODES["N"])
+    if len(hydrogens) and len(nitrogens):
+        i, _, _ = CellList(coords[nitrogens], HN_BOND_LENGTH).query(coords[hydrogens], HN_BOND_LENGTH)
+        radii[hydrogens[np.unique(i)]] = AMIDE_HYDROGEN_RADIUS
+    return radii
+
+
+def _blocks(cell_list: CellList, coords: np.ndarray, cutoff: float, block_size: int):
+    """
+    Yield the ordered pairs (i, j, r), i != j, within `cutoff`, a block of
+    atoms `i` at a time.
+    """
+    for start in range(0, len(coords), block_size):
+        i, j, dist = cell_list.query(coords[start:start + block_size], cutoff)
+        i += start
+        distinct = i != j
+        yield i[distinct], j[distinct], dist[distinct]
+
+
+def _descreening(dist: np.ndarray, rho_i: np.ndarray, scaled_j: np.ndarray) -> np.ndarray:
+    """
+    HCT descreening integral of atom i by the scaled sphere of atom j.
+    """
+    overlaps = rho_i < dist + scaled_j
+    dist, rho_i, scaled_j = dist[overlaps], rho_i[overlaps], scaled_j[overlaps]
+    lower = 1 / np.maximum(rho_i, np.abs(dist - scaled_j))
+    upper = 1 / (dist + scaled_j)
+    term = (lower - upper
+            + 0.25 * dist * (upper ** 2 - lower ** 2)
+            + 0.5 * np.log(upper / lower) / dist
+            + 0.25 * scaled_j ** 2 / dist * (lower ** 2 - upper ** 2))
+    # Atom i entirely inside the sphere of atom j
+    engulfed = rho_i < scaled_j - dist
+    term[engulfed] += 2 * (1 / rho_i[engulfed] - lower[engulfed])
+    integral = np.zeros(len(overlaps))
+    integral[overlaps] = 0.5 * term
+    return integral
+
+
+def _born_radii(integral: np.ndarray, rho: np.ndarray, model: str) -> np.ndarray:
+    if model == "hct":
+        inverse = 1 / rho - integral
+        return 1 / np.maximum(inverse, 1 / MAX_BORN_RADIUS)
+    alpha, beta, gamma = OBC_PARAMETERS
+    psi = integral * rho
+    return 1 / (1 / rho - np.tanh(alpha * psi - beta * psi ** 2 + gamma * psi ** 3)
+                / (rho + DIELECTRIC_OFFSET))
+
+
+def _f_gb(dist_sq: np.ndarray, born_product: np.ndarray) -> np.ndarray:
+    return np.sqrt(dist_sq + born_product * np.exp(-dist_sq / (4 * born_product)))
+
+
+def _pair_terms(charges: np.ndarray, born_radii: np.ndarray, i: np.ndarray, j: np.ndarray,
+                dist: np.ndarray, cutoff: float) -> np.ndarray:
+    """
+    Pair terms q_i q_j / f_GB, shifted to zero at the cutoff.
+    """
+    born_product = born_radii[i] * born_radii[j]
+    shifted = 1 / _f_gb(dist * dist, born_product) - 1 / _f_gb(cutoff * cutoff, born_product)
+    return charges[i] * charges[j] * shifted
+
+
+def gb_solvation(
+    atoms: Dict[str, np.ndarray],
+    model: str = "obc",
+    cutoff: float = DEFAULT_CUTOFF,
+    descreen_cutoff: Optional[float] = DEFAULT_DESCREEN_CUTOFF,
+    solute_dielectric: float = SOLUTE_DIELECTRIC,
+    solvent_dielectric: float = SOLVENT_DIELECTRIC,
+    block_size: int = 2048,
+) -> GBResult:
+    """
+    Compute GB solvation energies of a complex and of its unbound partners.
+
+    Parameters
+    ----------
+    atoms : Dict[str, np.ndarray]
+        Complex atom arrays with "coords", "charge", "element" and
+        "is_ligand" columns, e.g. from `pqr_arrays.load_complex`.
+    model : str
+        "obc" (OBC-II rescaled Born radii) or "hct".
+    cutoff : float
+        Cutoff of the pair energies, in Angstrom; they are shifted to zero
+        there.
+    descreen_cutoff : Optional[float]
+        Cutoff of the descreening integrals, in Angstrom; None for no cutoff.
+    solute_dielectric, solvent_dielectric : float
+        Dielectric constants of the solute interior and of the solvent.
+    block_size : int
+        Number of atoms whose pairs are held in memory at once.
+
+    Returns
+    -------
+    GBResult
+        Complex, receptor and ligand energies and the Born radii.
+    """
+    if model not in GB_MODELS:
+        raise ValueError(f"Unknown GB model '{model}', expected one of {GB_MODELS}")
+    coords = np.asarray(atoms["coords"], dtype=np.float64)
+    charges = np.asarray(atoms["charge"], dtype=np.float64)
+    is_ligand = np.asarray(atoms["is_ligand"], dtype=bool)
+    elements = np.asarray(atoms["element"], dtype=np.int64)
+    rho = gb_radii(coords, elements) - DIELECTRIC_OFFSET
+    scaled = rho * _SCREENING[elements]
+    cell_list = CellList(coords, cutoff)
+    if descreen_cutoff is None and len(coords):
+        # Just past the largest distance, so every pair is found
+        descreen_cutoff = float(np.linalg.norm(np.ptp(coords, axis=0))) + 1.0
+    descreen_cell_list = cell_list if descreen_cutoff == cutoff else CellList(coords, descreen_cutoff)
+
+    # Descreening of every atom by protein atoms and by ligand atoms
+    from_protein = np.zeros(len(coords))
+    from_ligand = np.zeros(len(coords))
+    for i, j, dist in _blocks(descreen_cell_list, coords, descreen_cutoff, block_size):
+        integral = _descreening(dist, rho[i], scaled[j])
+        by_ligand = is_ligand[j]
+        from_ligand += np.bincount(i[by_ligand], integral[by_ligand], minlength=len(coords))
+        from_protein += np.bincount(i[~by_ligand], integral[~by_ligand], minlength=len(coords))
+    born_radii = _born_radii(from_protein + from_ligand, rho, model)
+    born_radii_unbound = _born_radii(np.where(is_ligand, from_ligand, from_protein), rho, model)
+
+    # Self terms, then both orders of every pair within the cutoff
+    self_bound = charges ** 2 * (1 / born_radii - 1 / _f_gb(cutoff * cutoff, born_radii ** 2))
+    self_unbound = charges ** 2 * (1 / born_radii_unbound
+                                   - 1 / _f_gb(cutoff * cutoff, born_radii_unbound ** 2))
+    complex_sum = self_bound.sum()
+    receptor_sum = self_unbound[~is_ligand].sum()
+    ligand_sum = self_unbound[is_ligand].sum()
+    for i, j, dist in _blocks(cell_list, coords, cutoff, block_size):
+        complex_sum += _pair_terms(charges, born_radii, i, j, dist, cutoff).sum()
+        same = is_ligand[i] == is_ligand[j]
+        i, j, dist = i[same], j[same], dist[same]
+        unbound = _pair_terms(charges, born_radii_unbound, i, j, dist, cutoff)
+        ligand_pair = is_ligand[i]
+        ligand_sum += unbound[ligand_pair].sum()
+        receptor_sum += unbound[~ligand_pair].sum()
+
+    prefactor = -0.5 * COULOMB_CONSTANT * (1 / solute_dielectric - 1 / solvent_dielectric)
+    complex_energy = prefactor * float(complex_sum)
+    receptor_energy = prefactor * float(receptor_sum)
+    ligand_energy = prefactor * float(ligand_sum)
+    return GBResult(
+        complex_energy=complex_energy,
+        receptor_energy=receptor_energy,
+        ligand_energy=ligand_energy,
+        delta_energy=complex_energy - receptor_energy - ligand_energy,
+        born_radii=born_radii,
+        born_radii_unbound=born_radii_unbound,
+    )
+
+
+def _complex_gb(job: Tuple[str, str, str, str, float, Optional[float], Optional[float]]
+                ) -> Tuple[str, GBResult]:
+    pdb_id, protein_file, ligand_file, model, cutoff, descreen_cutoff, pocket_cutoff = job
+    atoms = load_complex(protein_file, ligand_file)
+    if pocket_cutoff is not None:
+        atoms = crop_pocket(atoms, pocket_cutoff)
+    return pdb_id, gb_solvation(atoms, model, cutoff, descreen_cutoff)
+
+
+def process_dataset(
+    root_dir: str,
+    output_file: str,
+    model: str = "obc",
+    cutoff: float = DEFAULT_CUTOFF,
+    descreen_cutoff: Optional[float] = DEFAULT_DESCREEN_CUTOFF,
+    pocket_cutoff: Optional[float] = None,
+    workers: int = 1,
+    timings_file: Optional[str] = None,
+) -> List[Tuple[str, float]]:
+    """
+    Compute the GB binding solvation energy of every complex in a tree.
+
+    Parameters
+    ----------
+    root_dir : str
+        Root directory of the generated PQR files, e.g. `data/generated`.
+    output_file : str
+        CSV file with one row of energies per complex.
+    model : str
+        "obc" or "hct".
+    cutoff : float
+        Pair cutoff, in Angstrom.
+    descreen_cutoff : Optional[float]
+        Descreening cutoff, in Angstrom; None for no cutoff.
+    pocket_cutoff : Optional[float]
+        If given, only keep the protein atoms within this distance of the
+        ligand, see `pqr_arrays.crop_pocket`; much faster for triage.
+    workers : int
+        Number of worker processes.
+    timings_file : Optional[str]
+        JSON file of run times of earlier runs, used to start the slowest
+        complexes first and updated with this run, see
+        `scheduler.map_longest_first`.
+
+    Returns
+    -------
+    List[Tuple[str, float]]
+        (PDB ID, binding solvation energy) of each complex.
+    """
+    jobs = [
+        (pdb_id, protein_file, ligand_file, model, cutoff, descreen_cutoff, pocket_cutoff)
+        for pdb_id, protein_file, ligand_file in find_complexes(root_dir)
+    ]
+    energies = []
+    results = map_longest_first(
+        _complex_gb, jobs, [file_cost(job[1], job[2]) for job in jobs], workers,
+        [job[0] for job in jobs], f"gb_solvation:{model}:{cutoff}:{descreen_cutoff}:{pocket_cutoff}", timings_file,
+    )
+    with open(output_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["pdb_id", "complex_energy", "receptor_energy", "ligand_energy", "delta_energy"])
+        for pdb_id, result in results:
+            writer.writerow([pdb_id, f"{result.complex_energy:.4f}", f"{result.receptor_energy:.4f}",
+                             f"{result.ligand_energy:.4f}", f"{result.delta_energy:.4f}"])
+            energies.append((pdb_id, result.delta_energy))
+    return energies
+
+
+def _optional_cutoff(value: str) -> Optional[float]:
+    return None if value.lower() == "none" else float(value)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compute Generalized Born solvation energies of protein-ligand complexes.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--output", default="gb_energies.csv",
+                        help="CSV file of per-complex energies (default: gb_energies.csv)")
+    parser.add_argument("--model", choices=GB_MODELS, default="obc",
+                        help="Born radius model (default: obc)")
+    parser.add_argument("--cutoff", type=float, default=DEFAULT_CUTOFF,
+                        help=f"Pair cutoff in Angstrom (default: {DEFAULT_CUTOFF})")
+    parser.add_argument("--descreen-cutoff", dest="descreen_cutoff", type=_optional_cutoff,
+                        default=DEFAULT_DESCREEN_CUTOFF,
+                        help="Descreening cutoff in Angstrom, or 'none' to include every atom pair "
+                             f"(default: {DEFAULT_DESCREEN_CUTOFF})")
+    parser.add_argument("--pocket-cutoff", dest="pocket_cutoff", type=float, default=None,
+                        help="Only keep protein atoms within this distance of the ligand (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    parser.add_argument("--timings", default=None,
+                        help="JSON file of run times for longest-first scheduling (default: not kept)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = process_dataset(args.input_dir, args.output, args.model, args.cutoff,
+                              args.descreen_cutoff, args.pocket_cutoff, args.workers, args.timings)
+    print(f"Computed GB energies of {len(results)} complexes into {args.output}")
@@ -0,0 +1,472 @@
+"""Export protein-ligand complexes as graphs for graph neural networks.
+
+Nodes are the ligand atoms and the protein atoms of the binding pocket.
+Edges are stored in `edge_index` form, both directions of every edge:
+
+* covalent edges between ligand atoms, from the MOL2 bonds read by
+  `Mol2Molecule.parse_bonds`;
+* protein-ligand contact edges within a cutoff;
+* protein-protein contact edges within the pocket.
+
+All contact edges come from a single `spatial.CellList` radius search over
+the nodes. Ligand charges and radii come from the generated ligand PQR file.
+Open Babel may reorder the atoms of that file, so each MOL2 atom is matched
+to its PQR atom by position (`match_ligand_atoms`) before the MOL2 types
+and bonds are attached. Complexes without a one-to-one match are skipped.
+
+A dataset is written as `.npz` shards of many graphs each; the arrays of all
+graphs in a shard are concatenated, with node and edge offsets::
+
+    python graph_export.py --input-dir data/generated --pdbbind-dir data/pdbbind \\
+                           --output-dir data/graphs --graphs-per-shard 256
+"""
+import argparse
+import logging
+import os
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from atom_table import ELEMENT_CODES, element_code
+from file_io import find_file, open_file
+from mol2_classes import NONBONDED_BY_TYPE, Mol2Molecule
+from pqr_arrays import crop_pocket, find_complexes, load_complex
+from scheduler import file_cost, map_longest_first
+from spatial import CellList
+
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Sybyl atom types known to the exporter. The index of a type in this tuple
+#: is its type code; code 0 is used for protein atoms and unknown types.
+SYBYL_TYPES: Tuple[str, ...] = ("X",) + tuple(sorted(set(NONBONDED_BY_TYPE) | {"C.cat"}))
+SYBYL_CODES: Dict[str, int] = {sybyl_type: code for code, sybyl_type in enumerate(SYBYL_TYPES)}
+
+#: Node roles
+ROLE_PROTEIN = 0
+ROLE_LIGAND = 1
+
+#: Edge types
+EDGE_COVALENT = 0
+EDGE_PROTEIN_LIGAND = 1
+EDGE_PROTEIN_PROTEIN = 2
+
+#: Bond order of each `Mol2Bond.type`
+BOND_ORDERS = {"single": 1.0, "double": 2.0, "triple": 3.0, "aromatic": 1.5}
+
+DEFAULT_POCKET_CUTOFF = 8.0
+DEFAULT_CONTACT_CUTOFF = 4.5
+#: Largest distance between a MOL2 atom and its PQR atom, in Angstrom; PQR
+#: coordinates are rounded to 3 decimals
+DEFAULT_MATCH_TOLERANCE = 0.01
+
+#: Node and edge arrays of a graph, with their dtype in the shards.
+NODE_COLUMNS = {"coords": "float32", "element": "uint8", "sybyl_type": "uint8",
+                "charge": "float32", "radius": "float32", "role": "uint8"}
+EDGE_COLUMNS = {"edge_type": "uint8", "bond_order": "float32", "edge_length": "float32"}
+
+
+class Mol2Ligand(NamedTuple):
+    """Atoms and bonds of a MOL2 ligand, in file order."""
+
+    #: Sybyl type of each atom
+    types: List[str]
+    #: Bonded atom indices, (n_bonds, 2)
+    bonds: np.ndarray
+    #: Order of each bond
+    orders: np.ndarray
+    #: Atom coordinates, (n_atoms, 3)
+    coords: np.ndarray
+    #: Element code of each atom, see `atom_table.ELEMENTS`
+    elements: np.ndarray
+
+
+def read_ligand_bonds(mol2_file: str) -> Mol2Ligand:
+    """
+    Read the atom types, positions and bonds of a MOL2 ligand.
+
+    Parameters
+    ----------
+    mol2_file : str
+        Path of the MOL2 file.
+
+    Returns
+    -------
+    Mol2Ligand
+        Atoms in file order and bonds indexing into that order.
+    """
+    molecule = Mol2Molecule()
+    with open_file(mol2_file, "r") as mol2:
+        molecule.parse_bonds(molecule.parse_atoms(mol2), set_topology=False)
+    position = {serial: i for i, serial in enumerate(molecule.atoms)}
+    bonds = np.array([(position[bond.atoms[0].serial], position[bond.atoms[1].serial])
+                      for bond in molecule.bonds], dtype=np.int64).reshape(-1, 2)
+    orders = np.array([BOND_ORDERS[bond.type] for bond in molecule.bonds], dtype=np.float64)
+    atoms = list(molecule.atoms.values())
+    coords = np.array([(atom.x, atom.y, atom.z) for atom in atoms], dtype=np.float64).reshape(-1, 3)
+    elements = np.array([element_code(atom.element) for atom in atoms], dtype=np.int64)
+    return Mol2Ligand([atom.type for atom in atoms], bonds, orders, coords, elements)
+
+
+def match_ligand_atoms(
+    pqr_coords: np.ndarray,
+    pqr_elements: np.ndarray,
+    mol2_coords: np.ndarray,
+    mol2_elements: np.ndarray,
+    mol2_bonds: np.ndarray,
+    tolerance: float = DEFAULT_MATCH_TOLERANCE,
+) -> np.ndarray:
+    """
+    Match each MOL2 atom to its atom in the ligand PQR file.
+
+    Heavy atoms are matched by position and element. Open Babel places the
+    hydrogens again, so a hydrogen is matched among the PQR hydrogens
+    closest to the PQR atom of its bonded heavy atom, nearest first.
+    Hydrogens on one heavy atom are interchangeable in the graph.
+
+    Parameters
+    ----------
+    pqr_coords, mol2_coords : np.ndarray
+        Ligand atom coordinates of the PQR and MOL2 files, shape (n, 3).
+    pqr_elements, mol2_elements : np.ndarray
+        Element codes; matched heavy atoms must agree where both are known.
+    mol2_bonds : np.ndarray
+        Bonded MOL2 atom indices, shape (n_bonds, 2).
+    tolerance : float
+        Largest distance between matched heavy atoms, in Angstrom.
+
+    Returns
+    -------
+    np.ndarray
+        Index of the PQR atom of each MOL2 atom.
+
+    Raises
+    ------
+    ValueError
+        If the atom counts differ or the match is not one-to-one.
+    """
+    if len(pqr_coords) != len(mol2_coords):
+        raise ValueError(f"Ligand PQR has {len(pqr_coords)} atoms but the MOL2 file has {len(mol2_coords)}")
+    mol2_hydrogen = mol2_elements == ELEMENT_CODES["H"]
+    pqr_hydrogen = pqr_elements == ELEMENT_CODES["H"]
+    mol2_heavy, pqr_heavy = np.flatnonzero(~mol2_hydrogen), np.flatnonzero(~pqr_hydrogen)
+    if len(mol2_heavy) != len(pqr_heavy):
+        raise ValueError(f"Ligand PQR has {len(pqr_heavy)} heavy atoms but the MOL2 file has {len(mol2_heavy)}")
+
+    distance = np.linalg.norm(mol2_coords[mol2_heavy, None] - pqr_coords[None, pqr_heavy], axis=2)
+    mol2_codes, pqr_codes = mol2_elements[mol2_heavy, None], pqr_elements[None, pqr_heavy]
+    match = (distance <= tolerance) & ((mol2_codes == pqr_codes) | (mol2_codes == 0) | (pqr_codes == 0))
+    if not (np.all(match.sum(axis=1) == 1) and np.all(match.sum(axis=0) == 1)):
+        n_unmatched = int(np.count_nonzero(match.sum(axis=1) != 1))
+        raise ValueError(f"{n_unmatched} MOL2 heavy atoms have no unique ligand PQR atom "
+                         f"within {tolerance} A")
+    pqr_index = np.full(len(mol2_coords), -1, dtype=np.int64)
+    pqr_index[mol2_heavy] = pqr_heavy[match.argmax(axis=1)]
+
+    # Parent heavy atom of each hydrogen: bonded in the MOL2 file, nearest in
+    # the PQR file
+    mol2_parent = np.full(len(mol2_coords), -1, dtype=np.int64)
+    for a, b in mol2_bonds.tolist():
+        if mol2_hydrogen[a] and not mol2_hydrogen[b]:
+            mol2_parent[a] = pqr_index[b]
+        elif mol2_hydrogen[b] and not mol2_hydrogen[a]:
+            mol2_parent[b] = pqr_index[a]
+    pqr_hydrogens = np.flatnonzero(pqr_hydrogen)
+    to_heavy = np.linalg.norm(pqr_coords[pqr_hydrogens, None] - pqr_coords[None, pqr_heavy], axis=2)
+    pqr_parent = pqr_heavy[to_heavy.argmin(axis=1)] if len(pqr_heavy) else np.full(len(pqr_hydrogens), -1)
+
+    taken = np.zeros(len(pqr_hydrogens), dtype=bool)
+    for hydrogen in np.flatnonzero(mol2_hydrogen).tolist():
+        candidates = np.flatnonzero((pqr_parent == mol2_parent[hydrogen]) & ~taken)
+        if mol2_parent[hydrogen] < 0 or not len(candidates):
+            raise ValueError(f"MOL2 hydrogen {hydrogen + 1} has no ligand PQR hydrogen on the same atom")
+        nearest = candidates[np.linalg.norm(
+            pqr_coords[pqr_hydrogens[candidates]] - mol2_coords[hydrogen], axis=1).argmin()]
+        taken[nearest] = True
+        pqr_index[hydrogen] = pqr_hydrogens[nearest]
+    return pqr_index
+
+
+def build_graph(
+    atoms: Dict[str, np.ndarray],
+    ligand_types: List[str],
+    ligand_bonds: np.ndarray,
+    bond_orders: np.ndarray,
+    pocket_cutoff: float = DEFAULT_POCKET_CUTOFF,
+    contact_cutoff: float = DEFAULT_CONTACT_CUTOFF,
+    heavy_only: bool = False,
+) -> Dict[str, np.ndarray]:
+    """
+    Build the graph of a complex.
+
+    Parameters
+    ----------
+    atoms : Dict[str, np.ndarray]
+        Complex atom arrays, see `pqr_arrays.load_complex`.
+    ligand_types : List[str]
+        Sybyl type of each ligand atom, in the order of the ligand atoms of
+        `atoms`.
+    ligand_bonds : np.ndarray
+        Bonded ligand atom indices into that order, shape (n_bonds, 2); see
+        `match_ligand_atoms` to renumber MOL2 bonds.
+    bond_orders : np.ndarray
+        Order of each bond.
+    pocket_cutoff : float
+        Protein atoms within this distance of the ligand become nodes.
+    contact_cutoff : float
+        Distance cutoff of the contact edges, in Angstrom.
+    heavy_only : bool
+        Leave out hydrogen atoms and their bonds.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Node arrays (`NODE_COLUMNS`), "edge_index" of shape (2, n_edges), and
+        edge arrays (`EDGE_COLUMNS`).
+    """
+    n_ligand = int(np.count_nonzero(atoms["is_ligand"]))
+    if n_ligand != len(ligand_types):
+        raise ValueError(f"Complex has {n_ligand} ligand atoms but {len(ligand_types)} ligand types")
+    sybyl = np.zeros(len(atoms["charge"]), dtype=np.int64)
+    sybyl[atoms["is_ligand"]] = [SYBYL_CODES.get(sybyl_type, 0) for sybyl_type in ligand_types]
+    atoms = dict(atoms, sybyl_type=sybyl)
+    # Ligand atom number of every complex atom, to follow the ligand through
+    # cropping; -1 for protein atoms
+    ligand_number = np.full(len(sybyl), -1, dtype=np.int64)
+    ligand_number[atoms["is_ligand"]] = np.arange(n_ligand)
+    atoms["ligand_number"] = ligand_number
+
+    nodes = crop_pocket(atoms, pocket_cutoff)
+    if heavy_only:
+        heavy = nodes["element"] != ELEMENT_CODES["H"]
+        nodes = {key: values[heavy] for key, values in nodes.items()}
+    is_ligand = nodes["is_ligand"]
+
+    # Covalent edges, renumbered from ligand atom order to node order
+    node_of_ligand_atom = np.full(n_ligand, -1, dtype=np.int64)
+    node_of_ligand_atom[nodes["ligand_number"][is_ligand]] = np.flatnonzero(is_ligand)
+    bonded = node_of_ligand_atom[ligand_bonds] if len(ligand_bonds) else np.empty((0, 2), dtype=np.int64)
+    kept = np.all(bonded >= 0, axis=1)
+    bonded, orders = bonded[kept], bond_orders[kept]
+
+    # Contact edges; ligand-ligand pairs are only connected by bonds
+    i, j, dist = CellList(nodes["coords"], contact_cutoff).pairs(contact_cutoff)
+    contact = ~(is_ligand[i] & is_ligand[j])
+    i, j, dist = i[contact], j[contact], dist[contact]
+    contact_type = np.where(is_ligand[i] | is_ligand[j], EDGE_PROTEIN_LIGAND, EDGE_PROTEIN_PROTEIN)
+
+    source = np.concatenate([bonded[:, 0], i])
+    target = np.concatenate([bonded[:, 1], j])
+    edge_type = np.concatenate([np.full(len(bonded), EDGE_COVALENT), contact_type])
+    bond_order = np.concatenate([orders, np.zeros(len(i))])
+    coords = nodes["coords"]
+    edge_length = np.linalg.norm(coords[source] - coords[target], axis=1)
+
+    graph = {
+        "coords": coords,
+        "element": nodes["element"],
+        "sybyl_type": nodes["sybyl_type"],
+        "charge": nodes["charge"],
+        "radius": nodes["radius"],
+        "role": is_ligand.astype(np.int64) * ROLE_LIGAND,
+        "edge_index": np.stack([np.concatenate([source, target]),
+                                np.concatenate([target, source])]),
+        "edge_type": np.tile(edge_type, 2),
+        "bond_order": np.tile(bond_order, 2),
+        "edge_length": np.tile(edge_length, 2),
+    }
+    for column, dtype in {**NODE_COLUMNS, **EDGE_COLUMNS}.items():
+        graph[column] = graph[column].astype(dtype)
+    graph["edge_index"] = graph["edge_index"].astype(np.int32)
+    return graph
+
+
+def complex_graph(
+    protein_file: str,
+    ligand_file: str,
+    mol2_file: str,
+    pocket_cutoff: float = DEFAULT_POCKET_CUTOFF,
+    contact_cutoff: float = DEFAULT_CONTACT_CUTOFF,
+    heavy_only: bool = False,
+) -> Dict[str, np.ndarray]:
+    """
+    Read a complex and build its graph, see `build_graph`.
+
+    The MOL2 atoms are matched to the ligand PQR atoms by position, and the
+    MOL2 types and bonds renumbered into PQR order.
+    """
+    ligand = read_ligand_bonds(mol2_file)
+    atoms = load_complex(protein_file, ligand_file)
+    is_ligand = atoms["is_ligand"]
+    pqr_index = match_ligand_atoms(atoms["coords"][is_ligand], atoms["element"][is_ligand],
+                                   ligand.coords, ligand.elements, ligand.bonds)
+    ligand_types = [""] * len(pqr_index)
+    for mol2_index, index in enumerate(pqr_index.tolist()):
+        ligand_types[index] = ligand.types[mol2_index]
+    return build_graph(atoms, ligand_types, pqr_index[ligand.bonds], ligand.orders,
+                       pocket_cutoff, contact_cutoff, heavy_only)
+
+
+def write_graph_shard(output_file: str, ids: List[str], graphs: List[Dict[str, np.ndarray]]) -> None:
+    """
+    Concatenate graphs into one compressed `.npz` shard.
+
+    Parameters
+    ----------
+    output_file : str
+        Path of the shard.
+    ids : List[str]
+        PDB ID of each graph.
+    graphs : List[Dict[str, np.ndarray]]
+        Graphs from `build_graph`.
+    """
+    node_counts = [len(graph["element"]) for graph in graphs]
+    edge_counts = [graph["edge_index"].shape[1] for graph in graphs]
+    arrays = {
+        "ids": np.array(ids),
+        "node_offsets": np.concatenate([[0], np.cumsum(node_counts)]).astype(np.int64),
+        "edge_offsets": np.concatenate([[0], np.cumsum(edge_counts)]).astype(np.int64),
+        "edge_index": np.concatenate([graph["edge_index"] for graph in graphs], axis=1)
+        if graphs else np.empty((2, 0), dtype=np.int32),
+    }
+    for column, dtype in {**NODE_COLUMNS, **EDGE_COLUMNS}.items():
+        arrays[column] = (np.concatenate([graph[column] for graph in graphs])
+                          if graphs else np.empty(0, dtype=dtype))
+    np.savez_compressed(output_file, **arrays)
+
+
+def read_graph_shard(file_path: str) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+    """
+    Iterate over the graphs of a shard written by `write_graph_shard`.
+
+    Yields
+    ------
+    Tuple[str, Dict[str, np.ndarray]]
+        PDB ID and graph arrays; `edge_index` is local to the graph.
+    """
+    with np.load(file_path) as data:
+        arrays = {key: data[key] for key in data.files}
+    node_offsets, edge_offsets = arrays["node_offsets"], arrays["edge_offsets"]
+    for k, pdb_id in enumerate(arrays["ids"].tolist()):
+        nodes = slice(node_offsets[k], node_offsets[k + 1])
+        edges = slice(edge_offsets[k], edge_offsets[k + 1])
+        graph = {column: arrays[column][nodes] for column in NODE_COLUMNS}
+        graph.update({column: arrays[column][edges] for column in EDGE_COLUMNS})
+        graph["edge_index"] = arrays["edge_index"][:, edges]
+        yield pdb_id, graph
+
+
+def _graph_job(job: Tuple[str, str, str, str, float, float, bool]) -> Tuple[str, Optional[Dict]]:
+    pdb_id, protein_file, ligand_file, mol2_file, pocket_cutoff, contact_cutoff, heavy_only = job
+    try:
+        return pdb_id, complex_graph(protein_file, ligand_file, mol2_file,
+                                     pocket_cutoff, contact_cutoff, heavy_only)
+    except (KeyError, ValueError, NotImplementedError) as error:
+        _LOGGER.warning(f"Skipping {pdb_id}: {error}")
+        return pdb_id, None
+
+
+def export_dataset(
+    input_dir: str,
+    pdbbind_dir: str,
+    output_dir: str,
+    graphs_per_shard: int = 256,
+    pocket_cutoff: float = DEFAULT_POCKET_CUTOFF,
+    contact_cutoff: float = DEFAULT_CONTACT_CUTOFF,
+    heavy_only: bool = False,
+    workers: int = 1,
+    timings_file: Optional[str] = None,
+) -> int:
+    """
+    Write the graphs of every complex into `graphs_<k>.npz` shards.
+
+    Parameters
+    ----------
+    input_dir : str
+        Root directory of the generated PQR files, e.g. `data/generated`.
+    pdbbind_dir : str
+        Root directory of the MOL2 files, `<pdbbind_dir>/<ID>/<ID>_ligand.mol2`.
+    output_dir : str
+        Directory of the shards.
+    graphs_per_shard : int
+        Number of graphs per shard.
+    pocket_cutoff, contact_cutoff, heavy_only
+        See `build_graph`.
+    workers : int
+        Number of worker processes.
+    timings_file : Optional[str]
+        JSON file of run times of earlier runs, used to start the slowest
+        complexes first and updated with this run, see
+        `scheduler.map_longest_first`.
+
+    Returns
+    -------
+    int
+        Number of graphs written. Complexes whose MOL2 file is missing or
+        does not match the ligand PQR file are skipped with a warning.
+    """
+    jobs = []
+    for pdb_id, protein_file, ligand_file in find_complexes(input_dir):
+        mol2_file = find_file(os.path.join(pdbbind_dir, pdb_id, f"{pdb_id}_ligand.mol2"))
+        if mol2_file is None:
+            _LOGGER.warning(f"Skipping {pdb_id}: no MOL2 file in {pdbbind_dir}/{pdb_id}")
+            continue
+        jobs.append((pdb_id, protein_file, ligand_file, mol2_file,
+                     pocket_cutoff, contact_cutoff, heavy_only))
+    os.makedirs(output_dir, exist_ok=True)
+
+    n_written, shard = 0, 0
+    ids: List[str] = []
+    graphs: List[Dict[str, np.ndarray]] = []
+    results = map_longest_first(
+        _graph_job, jobs, [file_cost(job[1], job[2]) for job in jobs], workers,
+        [job[0] for job in jobs], f"graph_export:{pocket_cutoff}:{contact_cutoff}:{heavy_only}",
+        timings_file,
+    )
+    for pdb_id, graph in results:
+        if graph is None:
+            continue
+        ids.append(pdb_id)
+        graphs.append(graph)
+        if len(graphs) == graphs_per_shard:
+            write_graph_shard(os.path.join(output_dir, f"graphs_{shard:05d}.npz"), ids, graphs)
+            n_written, shard, ids, graphs = n_written + len(graphs), shard + 1, [], []
+    if graphs:
+        write_graph_shard(os.path.join(output_dir, f"graphs_{shard:05d}.npz"), ids, graphs)
+        n_written += len(graphs)
+    return n_written
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Export protein-ligand complexes as graphs in .npz shards.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--pdbbind-dir", dest="pdbbind_dir", default="data/pdbbind",
+                        help="Directory of the ligand MOL2 files (default: data/pdbbind)")
+    parser.add_argument("--output-dir", dest="output_dir", default="data/graphs",
+                        help="Directory of the graph shards (default: data/graphs)")
+    parser.add_argument("--graphs-per-shard", dest="graphs_per_shard", type=int, default=256,
+                        help="Number of graphs per shard (default: 256)")
+    parser.add_argument("--pocket-cutoff", dest="pocket_cutoff", type=float,
+                        default=DEFAULT_POCKET_CUTOFF,
+                        help=f"Pocket radius around the ligand (default: {DEFAULT_POCKET_CUTOFF})")
+    parser.add_argument("--contact-cutoff", dest="contact_cutoff", type=float,
+                        default=DEFAULT_CONTACT_CUTOFF,
+                        help=f"Contact edge cutoff in Angstrom (default: {DEFAULT_CONTACT_CUTOFF})")
+    parser.add_argument("--heavy-only", dest="heavy_only", action="store_true",
+                        help="Leave out hydrogen atoms")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    parser.add_argument("--timings", default=None,
+                        help="JSON file of run times for longest-first scheduling (default: not kept)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    n_graphs = export_dataset(args.input_dir, args.pdbbind_dir, args.output_dir,
+                              args.graphs_per_shard, args.pocket_cutoff, args.contact_cutoff,
+                              args.heavy_only, args.workers, args.timings)
+    print(f"Exported {n_graphs} graphs into {args.output_dir}")
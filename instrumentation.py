@@ -0,0 +1,301 @@
+"""Per-stage timers and counters for finding where a batch spends its time.
+
+The pipeline stages are wrapped in named spans (`span`, `traced`) and count
+what they process (`count`): atoms parsed, bonds, rings found, PEOE cycles,
+and so on. Spans and counts are attributed to the complex being processed,
+set with `complex_scope`.
+
+Instrumentation is off by default. A disabled `span` hands out one shared
+no-op context manager and a disabled `count` returns at once, so the
+instrumented code costs one global lookup per call. The `tracing` context
+manager, behind the `--trace` and `--profile` flags of the batch scripts,
+turns it on and writes:
+
+- `trace.json`, a Chrome trace of every span, viewable in `chrome://tracing`
+  or https://ui.perfetto.dev;
+- `metrics.csv`, one row per complex with the seconds of each stage and the
+  total of each counter;
+- with `--profile`, `<stage>.prof`, cProfile statistics of each stage
+  (excluding the stages nested in it), readable with `pstats` or snakeviz.
+"""
+import csv
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    import cProfile
+
+
+#: Key of the spans and counts made outside any `complex_scope`
+NO_COMPLEX = ""
+
+_NULL_SPAN = nullcontext()
+
+
+class Recorder:
+    """
+    Spans, counters and profiles of one instrumented run.
+
+    Parameters
+    ----------
+    profile : bool
+        Also run a cProfile profiler for each stage.
+    """
+
+    def __init__(self, profile: bool = False) -> None:
+        self.profile = profile
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events: List[Dict[str, Any]] = []
+        #: Per complex, seconds of each stage ("<stage>_seconds") and counter totals
+        self.metrics: Dict[str, Dict[str, float]] = {}
+        self.profilers: Dict[str, "cProfile.Profile"] = {}
+        self._local = threading.local()
+
+    @property
+    def _stack(self) -> List[str]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @property
+    def complex_key(self) -> str:
+        return getattr(self._local, "complex_key", NO_COMPLEX)
+
+    @complex_key.setter
+    def complex_key(self, key: str) -> None:
+        self._local.complex_key = key
+
+    def _add(self, name: str, value: float, complex_key: Optional[str] = None) -> None:
+        row = self.metrics.setdefault(self.complex_key if complex_key is None else complex_key, {})
+        row[name] = row.get(name, 0.0) + value
+
+    def _switch_profiler(self, old: Optional[str], new: Optional[str]) -> None:
+        if old is not None:
+            self.profilers[old].disable()
+        if new is not None:
+            if new not in self.profilers:
+                import cProfile
+
+                self.profilers[new] = cProfile.Profile()
+            self.profilers[new].enable()
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        """
+        Time a stage as a span nested in the enclosing one.
+        """
+        stack = self._stack
+        parent = stack[-1] if stack else None
+        # cProfile allows one active profiler per thread, so only the main
+        # thread is profiled
+        profiled = self.profile and threading.current_thread() is threading.main_thread()
+        if profiled:
+            self._switch_profiler(parent, name)
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            if profiled:
+                self._switch_profiler(name, parent)
+            self.add_span(name, start, end, **args)
+
+    def add_span(self, name: str, start: float, end: float, complex_key: Optional[str] = None,
+                 **args: Any) -> None:
+        """
+        Record a stage timed elsewhere, e.g. an external tool awaited by an
+        event loop, where spans of concurrent jobs cannot nest.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        start, end : float
+            `time.perf_counter` times of its start and end.
+        complex_key : Optional[str]
+            Complex the stage belongs to; the current complex if None.
+        **args : Any
+            JSON-serializable details shown with the span in the trace.
+        """
+        complex_key = self.complex_key if complex_key is None else complex_key
+        args.setdefault("complex", complex_key)
+        self.events.append({
+            "name": name, "ph": "X", "pid": self.pid, "tid": threading.get_ident(),
+            "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6, "args": args,
+        })
+        self._add(f"{name}_seconds", end - start, complex_key)
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Add to a counter of the current complex.
+        """
+        self._add(name, value)
+        self.events.append({
+            "name": name, "ph": "C", "pid": self.pid, "tid": threading.get_ident(),
+            "ts": (time.perf_counter() - self.origin) * 1e6,
+            "args": {name: self.metrics[self.complex_key][name]},
+        })
+
+    def write_trace(self, file_path: str) -> None:
+        """
+        Write the spans and counters as Chrome trace JSON.
+        """
+        with open(file_path, "w") as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+
+    def write_metrics(self, file_path: str) -> None:
+        """
+        Write one CSV row per complex with its stage seconds and counter totals.
+        """
+        columns = sorted({column for row in self.metrics.values() for column in row})
+        with open(file_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["complex", *columns])
+            for key, row in self.metrics.items():
+                writer.writerow([key, *(row.get(column, 0.0) for column in columns)])
+
+    def write_profiles(self, directory: str) -> List[str]:
+        """
+        Dump the cProfile statistics of each stage as `<stage>.prof`.
+        """
+        file_paths = []
+        for name, profiler in self.profilers.items():
+            file_path = os.path.join(directory, f"{name.replace(os.sep, '_')}.prof")
+            profiler.dump_stats(file_path)
+            file_paths.append(file_path)
+        return file_paths
+
+
+_recorder: Optional[Recorder] = None
+
+
+def enable(profile: bool = False) -> Recorder:
+    """
+    Start recording, replacing any earlier recorder.
+    """
+    global _recorder
+    _recorder = Recorder(profile)
+    return _recorder
+
+
+def disable() -> Optional[Recorder]:
+    """
+    Stop recording and return the recorder, if any.
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def is_enabled() -> bool:
+    return _recorder is not None
+
+
+def span(name: str, **args: Any) -> Any:
+    """
+    Time a stage; a shared no-op context manager when disabled.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. "set_rings".
+    **args : Any
+        JSON-serializable details shown with the span in the trace.
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return _recorder.span(name, **args)
+
+
+def add_span(name: str, seconds: float, complex_key: Optional[str] = None, **args: Any) -> None:
+    """
+    Record a stage that just ended after `seconds`; no-op when disabled. See
+    `Recorder.add_span`.
+    """
+    if _recorder is not None:
+        end = time.perf_counter()
+        _recorder.add_span(name, end - seconds, end, complex_key, **args)
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Add to a counter, e.g. `count("bonds", len(bonds))`; no-op when disabled.
+    """
+    if _recorder is not None:
+        _recorder.count(name, value)
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorate a function to run in a span named after it, or `name`.
+    """
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with _recorder.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def complex_scope(key: str) -> Iterator[None]:
+    """
+    Attribute the spans and counts within to a complex, in a span named "complex".
+    """
+    if _recorder is None:
+        yield
+        return
+    previous = _recorder.complex_key
+    _recorder.complex_key = key
+    try:
+        with _recorder.span("complex"):
+            yield
+    finally:
+        _recorder.complex_key = previous
+
+
+@contextmanager
+def tracing(trace_dir: Optional[str], profile: bool = False) -> Iterator[Optional[Recorder]]:
+    """
+    Record the enclosed run and write its trace, metrics and profiles.
+
+    Parameters
+    ----------
+    trace_dir : Optional[str]
+        Directory for `trace.json`, `metrics.csv` and the `.prof` files.
+        Nothing is recorded if None.
+    profile : bool
+        Also write cProfile statistics of each stage.
+
+    Yields
+    ------
+    Optional[Recorder]
+        The recorder, or None when not tracing.
+    """
+    if trace_dir is None:
+        yield None
+        return
+    recorder = enable(profile)
+    try:
+        yield recorder
+    finally:
+        disable()
+        os.makedirs(trace_dir, exist_ok=True)
+        recorder.write_trace(os.path.join(trace_dir, "trace.json"))
+        recorder.write_metrics(os.path.join(trace_dir, "metrics.csv"))
+        if profile:
+            recorder.write_profiles(trace_dir)
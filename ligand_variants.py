@@ -0,0 +1,240 @@
+"""Charge several protonation states of one ligand in a single PEOE run.
+
+Charging a protonation state through `Mol2Molecule.assign_parameters` means
+editing the MOL2 file, parsing it again and re-running ring and torsion
+perception and PEOE. Here the ligand is parsed once, and each
+`ProtonationVariant` only lists its edits to that molecule:
+
+- `formal_charges`: new formal charge of an atom, by atom name (or serial
+  number, for names that repeat);
+- `atom_types`: new SYBYL type of an atom, e.g. "N.4" -> "N.3", which
+  selects its PEOE parameters;
+- `remove_hydrogens`: hydrogens taken off as protons. Each removal lowers
+  the formal charge of the bonded atom by one unless `formal_charges` sets
+  it explicitly.
+
+Hydrogens cannot be added, since they would need coordinates, so start from
+the most protonated state of the ligand. The bonds, radii and base formal
+charges are shared, and all variants run through `peoe.equilibrate_batch`
+together. The result is a (variants x atoms) charge matrix, with NaN for
+removed atoms, and optionally one PQR file per variant::
+
+    python ligand_variants.py data/pdbbind/1bcu/1bcu_ligand.mol2 --variants variants.json --output-dir variants/
+
+where `variants.json` maps variant names to their edits::
+
+    {"protonated": {}, "neutral": {"remove_hydrogens": ["H12"], "atom_types": {"N3": "N.pl3"}}}
+"""
+import argparse
+import json
+import os
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+import peoe
+from file_io import open_file
+from mol2_classes import RADII, Mol2Molecule
+from pqr_arrays import PQR_ATOM_FORMAT
+
+
+class ProtonationVariant(NamedTuple):
+    """Edits to a parsed ligand giving one protonation state."""
+
+    name: str
+    #: Formal charge by atom name or serial number
+    formal_charges: Mapping[str, float] = {}
+    #: SYBYL atom type by atom name or serial number
+    atom_types: Mapping[str, str] = {}
+    #: Names or serial numbers of the hydrogens removed as protons
+    remove_hydrogens: Tuple[str, ...] = ()
+
+
+class VariantTopology:
+    """
+    Shared data of one parsed ligand: atom order, bonds, types, base formal
+    charges and radii.
+
+    Parameters
+    ----------
+    molecule : Mol2Molecule
+        Ligand with atoms and bonds parsed; torsions and rings are not needed.
+    primary_dict, secondary_dict : Dict[str, float]
+        Radius tables, see `Mol2Molecule.assign_radii`.
+    """
+
+    def __init__(
+        self,
+        molecule: Mol2Molecule,
+        primary_dict: Dict[str, float] = RADII["zap9"],
+        secondary_dict: Dict[str, float] = RADII["bondi"],
+    ) -> None:
+        self.molecule = molecule
+        self.atoms = list(molecule.atoms.values())
+        # Atoms are edited by name, or by serial where names repeat
+        self.index: Dict[str, Optional[int]] = {}
+        for i, atom in enumerate(self.atoms):
+            self.index[atom.name] = None if atom.name in self.index else i
+        for i, atom in enumerate(self.atoms):
+            self.index[str(atom.serial)] = i
+        position = {id(atom): i for i, atom in enumerate(self.atoms)}
+        self.bonds = np.array([(position[id(bond.atoms[0])], position[id(bond.atoms[1])])
+                               for bond in molecule.bonds], dtype=np.intp).reshape(-1, 2)
+        self.types = [atom.type for atom in self.atoms]
+        self.hydrogen = np.array([atom_type == "H" for atom_type in self.types])
+        self.formal_charges = np.array([atom.formal_charge for atom in self.atoms], dtype=np.float64)
+        molecule.assign_radii(primary_dict, secondary_dict)
+        self.radii = np.array([atom.radius for atom in self.atoms], dtype=np.float64)
+
+    def _atom(self, name: str, variant: ProtonationVariant) -> int:
+        if name not in self.index:
+            raise KeyError(f"Variant {variant.name} edits unknown atom {name}")
+        if self.index[name] is None:
+            raise KeyError(f"Variant {variant.name} edits atom {name}, whose name is not unique; "
+                           f"use its serial number")
+        return self.index[name]
+
+    def edits(self, variants: Sequence[ProtonationVariant]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Apply the edits of each variant to the shared data.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+            Formal charges and atom presence, each of shape (variants, atoms),
+            and PEOE terms of shape (variants, atoms, 4).
+        """
+        formal_charges = np.tile(self.formal_charges, (len(variants), 1))
+        present = np.ones(formal_charges.shape, dtype=bool)
+        base_terms = peoe.term_array(self.types)
+        terms = np.tile(base_terms, (len(variants), 1, 1))
+        for v, variant in enumerate(variants):
+            for name in variant.remove_hydrogens:
+                i = self._atom(name, variant)
+                if not self.hydrogen[i]:
+                    raise ValueError(f"Variant {variant.name} removes {name}, which is not a hydrogen")
+                present[v, i] = False
+                for a, b in self.bonds[(self.bonds == i).any(axis=1)]:
+                    formal_charges[v, b if a == i else a] -= 1
+            for name, charge in variant.formal_charges.items():
+                formal_charges[v, self._atom(name, variant)] = charge
+            for name, atom_type in variant.atom_types.items():
+                terms[v, self._atom(name, variant)] = peoe.term_array([atom_type])[0]
+        return formal_charges, present, terms
+
+    def charges(self, variants: Sequence[ProtonationVariant]) -> np.ndarray:
+        """
+        Compute the PEOE charges of every variant in one batch.
+
+        Returns
+        -------
+        np.ndarray
+            Charges of shape (variants, atoms), in molecule atom order, NaN
+            for removed hydrogens.
+        """
+        formal_charges, present, terms = self.edits(variants)
+        return peoe.equilibrate_batch(formal_charges, terms, self.hydrogen, self.bonds, present)
+
+    def write_pqr(self, charges: np.ndarray, output_file: str) -> None:
+        """
+        Write one variant's charges as a ligand PQR file, leaving out
+        removed atoms.
+        """
+        serial = 0
+        with open_file(output_file, "w") as output:
+            for atom, charge, radius in zip(self.atoms, charges.tolist(), self.radii.tolist()):
+                if np.isnan(charge):
+                    continue
+                serial += 1
+                output.write(PQR_ATOM_FORMAT.format(
+                    "HETATM", serial, atom.name, atom.res_name, atom.res_seq,
+                    atom.x, atom.y, atom.z, charge, radius,
+                ))
+
+
+def read_ligand(mol2_file: str) -> Mol2Molecule:
+    """
+    Parse the atoms and bonds of a MOL2 file, skipping torsion and ring
+    perception, which PEOE does not use.
+    """
+    molecule = Mol2Molecule()
+    with open_file(mol2_file, "r") as file:
+        molecule.parse_bonds(molecule.parse_atoms(file), set_topology=False)
+    return molecule
+
+
+def read_variants(file_path: str) -> List[ProtonationVariant]:
+    """
+    Read variants from a JSON object of variant name to edits.
+    """
+    with open(file_path) as file:
+        spec = json.load(file)
+    return [
+        ProtonationVariant(
+            name,
+            edits.get("formal_charges", {}),
+            edits.get("atom_types", {}),
+            tuple(edits.get("remove_hydrogens", ())),
+        )
+        for name, edits in spec.items()
+    ]
+
+
+def enumerate_variants(
+    mol2_file: str,
+    variants: Sequence[ProtonationVariant],
+    output_dir: Optional[str] = None,
+) -> Tuple[np.ndarray, List[str]]:
+    """
+    Charge the variants of a MOL2 ligand and optionally write their PQR files.
+
+    Parameters
+    ----------
+    mol2_file : str
+        Ligand MOL2 file, optionally compressed.
+    variants : Sequence[ProtonationVariant]
+        The protonation states.
+    output_dir : Optional[str]
+        Directory for `<ligand>_<variant>.pqr` files; none are written if None.
+
+    Returns
+    -------
+    Tuple[np.ndarray, List[str]]
+        The (variants x atoms) charge matrix and the written files.
+    """
+    topology = VariantTopology(read_ligand(mol2_file))
+    charges = topology.charges(variants)
+    output_files = []
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        stem = os.path.basename(mol2_file).split(".")[0]
+        for variant, variant_charges in zip(variants, charges):
+            output_file = os.path.join(output_dir, f"{stem}_{variant.name}.pqr")
+            topology.write_pqr(variant_charges, output_file)
+            output_files.append(output_file)
+    return charges, output_files
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compute PEOE charges of several protonation states of a ligand at once.")
+    parser.add_argument("mol2_file", help="Ligand MOL2 file")
+    parser.add_argument("--variants", required=True,
+                        help="JSON file mapping variant names to their edits")
+    parser.add_argument("--output-dir", dest="output_dir", default=None,
+                        help="Write one PQR file per variant to this directory (default: none)")
+    parser.add_argument("--charges", default=None,
+                        help="Save the (variants x atoms) charge matrix as a .npy file (default: none)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    all_variants = read_variants(args.variants)
+    charge_matrix, written = enumerate_variants(args.mol2_file, all_variants, args.output_dir)
+    if args.charges is not None:
+        np.save(args.charges, charge_matrix)
+    for variant, row in zip(all_variants, charge_matrix):
+        print(f"{variant.name}: net charge {np.nansum(row):+.3f}")
+    for output_file in written:
+        print(f"Wrote {output_file}")
@@ -1,10 +1,13 @@
 import logging
+import math
+import os
 from collections import OrderedDict
 from itertools import combinations
-from numpy import array
-from numpy.linalg import norm
 
 import peoe
+from file_io import open_file
+from instrumentation import count, traced
+from radii import RADII, get_resolver
 
 
 """Ligand support functions.
@@ -20,89 +23,6 @@ import sys
 assert sys.version_info >= (3, 5)
 
 
-#: Radii for different atom types.
-#: When using these tables, the most specific Sybyl atom type should be used
-#: first and then the generic element should be used
-RADII = {
-    # NOTE - these are not the original PARSE radii but they are the ones
-    # included in the previous version of PDB2PKA so I'm preserving them for
-    # posterity. There's a claim they came from
-    # http://amber.ch.ic.ac.uk/archive/ but that link no longer works.
-    "not parse - do not use": {
-        "C": 1.70,
-        "N": 1.50,
-        "O": 1.40,
-        "S": 1.85,
-        "H": 1.00,
-        "Br": 2.50,
-        "F": 1.20,
-        "P": 1.90,
-        "Cl": 1.75,
-    },
-    #: These are the PARSE radii from Table 4 of
-    #: http://doi.org/10.1021/j100058a043
-    "parse": {
-        "C.1": 2.00,
-        "C.2": 2.00,
-        "C.3": 2.00,
-        "C": 1.70,
-        "H": 1.00,
-        "O": 1.40,
-        "N": 1.50,
-        "S": 1.85,
-    },
-    #: These are the ZAP radii from Table 2 of
-    #: http://doi.org/10.1021/jm070549%2B. Bondi radii should be used for
-    #: atoms not found in this table.
-    "zap9": {
-        "C": 1.87,
-        "H": 1.10,
-        "O.co2": 1.76,
-        "N": 1.40,
-        "S": 2.15,
-        "F": 2.40,
-        "Cl": 1.82,
-        "I": 2.65,
-    },
-    #: These are the Bondi radii from Table 2 of
-    #: http://doi.org/10.1021/jm070549%2B
-    "bondi-zap": {
-        "C": 1.7,
-        "H": 1.20,
-        "O.co2": 1.52,
-        "N": 1.55,
-        "S": 1.80,
-        "F": 1.47,
-        "Cl": 1.75,
-        "I": 1.98,
-    },
-    #: These are the Bondi radii from Table I of
-    #: http://doi.org/10.1021/j100785a001. NOTE - there are some variations to
-    #: the halogens in Table V that we might want to consider in the future.
-    "bondi": {
-        "H": 1.20,
-        "He": 1.40,
-        "C": 1.70,
-        "N": 1.55,
-        "O": 1.52,
-        "F": 1.47,
-        "Ne": 1.54,
-        "Si": 2.10,
-        "P": 1.80,
-        "S": 1.80,
-        "Cl": 1.75,
-        "Ar": 1.88,
-        "As": 1.85,
-        "Se": 1.90,
-        "Br": 1.85,
-        "Kr": 2.02,
-        "Te": 2.06,
-        "I": 1.98,
-        "Xe": 2.16,
-    },
-}
-
-
 #: Numbers of valence electrons for the groups of the periodic table
 VALENCE_BY_GROUP = {1: 1, 2: 2, 13: 3, 14: 4, 15: 5, 16: 6, 17: 7, 18: 8}
 
@@ -266,7 +186,7 @@ class Mol2Atom:
         :return:  distance
         :rtype:  float
         """
-        return norm(other.coords - self.coords)
+        return math.dist((other.x, other.y, other.z), (self.x, self.y, self.z))
 
     def __str__(self):
         """Generate PDB line from MOL2."""
@@ -276,7 +196,7 @@ class Mol2Atom:
         )
         return mol2
 
-    def assign_radius(self, primary_dict, secondary_dict):
+    def assign_radius(self, primary_dict, secondary_dict, on_missing="raise"):
         """Assign radius to atom.
 
         .. todo::
@@ -289,23 +209,12 @@ class Mol2Atom:
         :param secondary_dict:  backup dictionary for radii not found in
             primary dictionary
         :type secondary_dict:  dict
+        :param on_missing:  "raise" for a KeyError when the type is in
+            neither dictionary, or the radius to use instead
+        :type on_missing:  str or float
         """
-        radius = None
-        for rdict in [primary_dict, secondary_dict]:
-            if radius is not None:
-                break
-            for key in [self.type, self.element]:
-                if key in rdict:
-                    radius = rdict[key]
-                    break
-        if radius is not None:
-            self.radius = radius
-        else:
-            err = (
-                f"Unable to find radius parameter for self of type "
-                f"{self.type} in radius dictionary: {primary_dict}"
-            )
-            raise KeyError(err)
+        resolver = get_resolver(primary_dict, secondary_dict, on_missing)
+        self.radius = resolver.radius(self.type)
 
     @property
     def coords(self):
@@ -314,7 +223,9 @@ class Mol2Atom:
         :return:  coordinates
         :rtype:  numpy.ndarray
         """
-        return array([self.x, self.y, self.z])
+        import numpy as np
+
+        return np.array([self.x, self.y, self.z])
 
     @property
     def bonded_atom_names(self):
@@ -469,7 +380,10 @@ class Mol2Molecule:
         self.res_seq = None
 
     def assign_parameters(
-        self, primary_dict=RADII["zap9"], secondary_dict=RADII["bondi"]
+        self,
+        primary_dict=RADII["zap9"],
+        secondary_dict=RADII["bondi"],
+        on_missing="raise",
     ):
         """Assign charges and radii to atoms in molecule.
 
@@ -478,11 +392,13 @@ class Mol2Molecule:
                            element
             secondary_dict:  backup dictionary for radii not found in primary
                              dictionary
+            on_missing:  "raise" for a KeyError on atom types without a
+                         radius, or the radius to use for them
         """
-        self.assign_radii(primary_dict, secondary_dict)
+        self.assign_radii(primary_dict, secondary_dict, on_missing)
         self.assign_charges()
 
-    def assign_radii(self, primary_dict, secondary_dict):
+    def assign_radii(self, primary_dict, secondary_dict, on_missing="raise"):
         """Assign radii to atoms in molecule.
 
         :param primary_dict:  primary dictionary of radii indexed by atom
@@ -491,9 +407,16 @@ class Mol2Molecule:
         :param secondary_dict:  backup dictionary for radii not found in
             primary dictionary
         :type secondary_dict:  dict
+        :param on_missing:  "raise" for a KeyError on atom types in neither
+            dictionary, or the radius to use for them
+        :type on_missing:  str or float
         """
-        for atom in self.atoms.values():
-            atom.assign_radius(primary_dict, secondary_dict)
+        atoms = list(self.atoms.values())
+        radii = get_resolver(primary_dict, secondary_dict, on_missing).radii(
+            [atom.type for atom in atoms]
+        )
+        for atom, radius in zip(atoms, radii.tolist()):
+            atom.radius = radius
 
     def assign_charges(self):
         """Assign charges to atoms in molecule."""
@@ -502,29 +425,33 @@ class Mol2Molecule:
         peoe.equilibrate(self.atoms.values())
 
     def find_atom_torsions(self, start_atom):
-        """Set the torsion angles that start with this atom (name).
+        """Set the torsion angles that start with this atom (serial).
 
-        :param start_atom:  starting atom name
-        :type start_atom:  str
-        :return: list of 4-tuples containing atom names comprising torsions
+        :param start_atom:  starting atom serial
+        :type start_atom:  int
+        :return: list of 4-tuples containing atom serials comprising torsions
         """
         torsions = []
-        for bonded1 in self.atoms[start_atom].bonded_atom_names:
-            for bonded2 in self.atoms[bonded1].bonded_atom_names:
-                if bonded2 == start_atom:
+        for bonded1 in self.atoms[start_atom].bonded_atoms:
+            for bonded2 in bonded1.bonded_atoms:
+                if bonded2.serial == start_atom:
                     continue
-                for end_atom in self.atoms[bonded2].bonded_atom_names:
-                    if end_atom == bonded1:
+                for end_atom in bonded2.bonded_atoms:
+                    if end_atom is bonded1:
                         continue
-                    torsions.append((start_atom, bonded1, bonded2, end_atom))
+                    torsions.append(
+                        (start_atom, bonded1.serial, bonded2.serial, end_atom.serial)
+                    )
         return torsions
 
+    @traced()
     def set_torsions(self):
         """Set all torsions in molecule."""
         for atom_name, atom in self.atoms.items():
             atom.torsions = self.find_atom_torsions(atom_name)
             for torsion in atom.torsions:
                 self.torsions.add(torsion)
+        count("torsions", len(self.torsions))
 
     @staticmethod
     def rotate_to_smallest(path):
@@ -532,10 +459,10 @@ class Mol2Molecule:
 
         This was borrowed from StackOverflow: https://j.mp/2AHaukj
 
-        :param path:  list of atom names
-        :type path:  list of str
+        :param path:  list of atom serials
+        :type path:  list of int
         :return:  rotated path
-        :rtype:  list of str
+        :rtype:  list of int
         """
         n = path.index(min(path))
         return path[n:] + path[:n]
@@ -545,10 +472,10 @@ class Mol2Molecule:
 
         This was borrowed from StackOverflow: https://j.mp/2AHaukj
 
-        :param path:  list of atom names
-        :type path:  list of str
+        :param path:  list of atom serials
+        :type path:  list of int
         :param rings:  current list of rings
-        :type rings:  list of str
+        :type rings:  list of int
         :param level:  recursion level
         :type level:  int
         :return:  new list of rings
@@ -558,8 +485,8 @@ class Mol2Molecule:
         next_node = None
         sub_path = []
         for bond in self.bonds:
-            atom1 = bond.atoms[0].name
-            atom2 = bond.atoms[1].name
+            atom1 = bond.atoms[0].serial
+            atom2 = bond.atoms[1].serial
             if start_node in (atom1, atom2):
                 next_node = atom2 if atom1 == start_node else atom1
                 if next_node not in path:
@@ -573,6 +500,7 @@ class Mol2Molecule:
                         rings.add(tuple(path_))
         return rings
 
+    @traced()
     def set_rings(self):
         """Set all rings in molecule.
 
@@ -582,8 +510,8 @@ class Mol2Molecule:
         rings = set()
         # Generate all rings
         for bond in self.bonds:
-            for atom_name in bond.atom_names:
-                rings = self.find_new_rings([atom_name], rings)
+            for atom in bond.atoms:
+                rings = self.find_new_rings([atom.serial], rings)
         # Prune rings that are products of other rings
         # TODO - testing on molecules like phenalene shows that this is broken
         ring_sets = []
@@ -601,15 +529,22 @@ class Mol2Molecule:
         for ring in self.rings:
             for atom in ring:
                 self.atoms[atom].num_rings += 1
+        count("rings", len(self.rings))
 
     def read(self, mol2_file):
         """Routines for reading MOL2 file.
 
-        :param mol2_file:  file-like object with MOL2 data
+        :param mol2_file:  file-like object with MOL2 data, or the path of
+            a MOL2 file, optionally ``.gz`` or ``.zst`` compressed
         """
+        if isinstance(mol2_file, (str, os.PathLike)):
+            with open_file(mol2_file, "r") as opened:
+                self.read(opened)
+            return
         mol2_file = self.parse_atoms(mol2_file)
         # mol2_file = self.parse_bonds(mol2_file)
 
+    @traced()
     def parse_atoms(self, mol2_file):
         """Parse @<TRIPOS>ATOM section of file.
 
@@ -672,18 +607,23 @@ class Mol2Molecule:
             raise KeyError(
                 f"Found duplicate atoms names in MOL2 file: {duplicates}"
             )
+        count("atoms", len(self.atoms))
         return mol2_file
 
-    def parse_bonds(self, mol2_file):
+    @traced()
+    def parse_bonds(self, mol2_file, set_topology=True):
         """Parse @<TRIPOS>BOND section of file.
 
         Atoms must already have been parsed.
-        Also sets up torsions and rings.
+        Also sets up torsions and rings unless ``set_topology`` is false.
 
         :param mol2_file:  file-like object with MOL2 data
+        :param set_topology:  set up torsions and rings, which charge
+            assignment needs but plain bond lookups do not
+        :type set_topology:  bool
         :return:  file-like object advanced to SUBSTRUCTURE section
         """
-        atom_names = list(self.atoms.keys())
+        atom_serials = list(self.atoms.keys())
         for line in mol2_file:
             line = line.strip()
             if not line:
@@ -702,10 +642,9 @@ class Mol2Molecule:
             elif bond_type == "3":
                 bond_type = "triple"
             elif bond_type == "am":
-                raise NotImplementedError(
-                    "PDB2PQR does not currently support the amide (am) bond "
-                    "type."
-                )
+                # Amide bonds count as single bonds for formal charges; the
+                # N.am correction in Mol2Atom.formal_charge relies on this.
+                bond_type = "single"
             elif bond_type == "ar":
                 bond_type = "aromatic"
             elif bond_type == "du":
@@ -729,20 +668,18 @@ class Mol2Molecule:
             bond_id = int(words[0])
             atom_id1 = int(words[1])
             atom_id2 = int(words[2])
-            atom_name1 = atom_names[atom_id1 - 1]
-            atom1 = self.atoms[atom_name1]
-            atom_name2 = atom_names[atom_id2 - 1]
-            atom2 = self.atoms[atom_name2]
+            atom1 = self.atoms[atom_serials[atom_id1 - 1]]
+            atom2 = self.atoms[atom_serials[atom_id2 - 1]]
             bond = Mol2Bond(
                 atom1=atom1, atom2=atom2, bond_type=bond_type, bond_id=bond_id
             )
             atom1.bonds.append(bond)
-            atom1.bonded_atom_names.append(atom_name2)
             atom1.bonded_atoms.append(atom2)
             atom2.bonds.append(bond)
-            atom2.bonded_atom_names.append(atom_name1)
             atom2.bonded_atoms.append(atom1)
             self.bonds.append(bond)
-        self.set_torsions()
-        self.set_rings()
+        count("bonds", len(self.bonds))
+        if set_topology:
+            self.set_torsions()
+            self.set_rings()
         return mol2_file
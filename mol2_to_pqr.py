@@ -1,113 +1,79 @@
-import polars as pl
-import numpy as np
-
 from argparse import ArgumentParser
-from math import isclose
 import sys
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, Dict, Optional
 
+from catalog import Catalog, PQRStats
+from instrumentation import count, traced
 
-def _parse_pqr_line(line: str) -> Dict[str, Any]:
-    """
-    Parse each individual line of the PQR schema.
+if TYPE_CHECKING:
+    import polars as pl
 
-    Args:
-        line (str): Text-based string representing a line in the PQR file.
-    Returns:
-        Dict[str, Any]: Dictionary representation of a row.
-    """
-    parts = line.split()  # Splitting by whitespace
-    return {
-        'recordName': parts[0],
-        'serial': int(parts[1]),
-        'atomName': parts[2],
-        'residueName': parts[3],
-        'residueNumber': float(parts[4]),
-        'X': float(parts[5]),
-        'Y': float(parts[6]),
-        'Z': float(parts[7]),
-        'charge': float(parts[8]),
-        'radius': float(parts[9]),
-    }
-
-
-def _parse_mol2_atom_line(line: str) -> Dict[str, Any]:
-    """
-    Parse each individual line of the ATOM section in the MOL2 file.
 
-    Args:
-        line (str): Text-based string representing a line in the MOL2 file.
-    Returns:
-        Dict[str, Any]: Dictionary representation of a row.
-    """
-    parts = line.split()
-    return {
-        "atom_id": int(parts[0]),
-        "atom_name": parts[1],
-        "x": float(parts[2]),
-        "y": float(parts[3]),
-        "z": float(parts[4]),
-        "atom_type": parts[5],
-        "subst_id": int(parts[6]) if len(parts) > 6 else None,
-        "subst_name": parts[7] if len(parts) > 7 else None,
-        "charge": float(parts[8]) if len(parts) > 8 else None,
-        "status_bit": parts[9] if len(parts) > 9 else None,
-    }
-
-
-def convert_pqr_to_polars_dataframe(file_path: str) -> pl.DataFrame:
+@traced()
+def convert_pqr_to_polars_dataframe(file_path: str) -> "pl.DataFrame":
     """
     Represent PQR file in the form of a Polars DataFrame.
 
+    The columns of the `atom_table.AtomTable` read from the file become the
+    columns of the DataFrame, without building a dictionary per atom.
+
     Args:
-        file_path (str): File path of PQR file.
+        file_path (str): File path of PQR file, optionally `.gz` or `.zst` compressed.
     Returns:
         polars.DataFrame
     """
-    parsed_lines = []
-
-    with open(file_path, 'r') as file:
-        for line in file:
-            # Stop iterating if we reach terminating point of PQR file
-            if line.startswith("TER") or line.startswith("END") or not line:
-                continue
-            elif line.strip() and not line.startswith('#'):
-                parsed_data = _parse_pqr_line(line)
-                parsed_lines.append(parsed_data)
-
-    return pl.DataFrame(parsed_lines)
-
-
-def convert_mol2_to_polars_dataframe(file_path: str) -> pl.DataFrame:
+    import polars as pl
+
+    from atom_table import read_atoms
+
+    atoms = read_atoms(file_path, "pqr")
+    count("pqr_atoms", atoms.n_atoms)
+    coords = atoms["coords"]
+    return pl.DataFrame({
+        'recordName': atoms["record"].astype(str),
+        'serial': atoms["serial"],
+        'atomName': atoms["atom_name"].astype(str),
+        'residueName': atoms["res_name"].astype(str),
+        'residueNumber': atoms["res_seq"].astype(float),
+        'X': coords[:, 0],
+        'Y': coords[:, 1],
+        'Z': coords[:, 2],
+        'charge': atoms["charge"],
+        'radius': atoms["radius"],
+    })
+
+
+@traced()
+def convert_mol2_to_polars_dataframe(file_path: str) -> "pl.DataFrame":
     """
     Represent MOL2 file in the form of a Polars DataFrame.
 
     Args:
-        file_path (str): File path of MOL2 file.
+        file_path (str): File path of MOL2 file, optionally `.gz` or `.zst` compressed.
     Returns:
         polars.DataFrame
     """
-    parsed_lines = []
-    parsing_atoms = False
-
-    with open(file_path, "r") as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith("@<TRIPOS>ATOM"):
-                parsing_atoms = True
-                continue
-            elif line.startswith("@<TRIPOS>") and not line.startswith("@<TRIPOS>ATOM"):
-                parsing_atoms = False
-                continue
-
-            if parsing_atoms and line:
-                parsed_data = _parse_mol2_atom_line(line)
-                parsed_lines.append(parsed_data)
-
-    return pl.DataFrame(parsed_lines)
-
-
-def create_atom_info_mapping(pqr_df: pl.DataFrame) -> Dict[str, float]:
+    import polars as pl
+
+    from atom_table import read_atoms
+
+    atoms = read_atoms(file_path, "mol2")
+    count("mol2_atoms", atoms.n_atoms)
+    coords = atoms["coords"]
+    return pl.DataFrame({
+        "atom_id": atoms["serial"],
+        "atom_name": atoms["atom_name"].astype(str),
+        "x": coords[:, 0],
+        "y": coords[:, 1],
+        "z": coords[:, 2],
+        "atom_type": atoms["atom_type"].astype(str) if atoms.n_atoms else [],
+        "subst_id": atoms["res_seq"],
+        "subst_name": atoms["res_name"].astype(str),
+        "charge": atoms["charge"],
+    })
+
+
+def create_atom_info_mapping(pqr_df: "pl.DataFrame") -> Dict[str, float]:
     """
     Create a dictionary mapping from atom names to their radii.
 
@@ -120,34 +86,41 @@ def create_atom_info_mapping(pqr_df: pl.DataFrame) -> Dict[str, float]:
     Note:
         It seems that atomic radii are all equivalent with the exception of Hydrogen atoms.
         This may be because of the x-ray reading and predicted Hydrogen locations.
+        The names are normalized once per distinct atom name, and the first
+        radius of each name is taken from the radius column at once.
     """
-    atom_info = {}
-    for row in pqr_df.to_dicts():
-        atom_name = row["atomName"]
-
-        # If not hydrogen, strip trailing numbers (e.g., 'CA1' -> 'CA')
-        if not atom_name.startswith("H"):
-            atom_name = ''.join(filter(str.isalpha, atom_name))
+    import numpy as np
 
-        radius = row["radius"]
+    names, inverse = np.unique(pqr_df["atomName"].to_numpy().astype(str), return_inverse=True)
+    # If not hydrogen, strip trailing numbers (e.g., 'CA1' -> 'CA')
+    keys = np.array([name if name.startswith("H") else ''.join(filter(str.isalpha, name))
+                     for name in names.tolist()], dtype=str)[inverse.reshape(-1)]
+    radii = pqr_df["radius"].to_numpy()
+    heavy = ~np.char.startswith(keys, "H")
+    keys, radii = keys[heavy], radii[heavy]
+    unique_keys, first, key_index = np.unique(keys, return_index=True, return_inverse=True)
 
-        if atom_name in atom_info and not isclose(atom_info[atom_name], radius, rel_tol=1e-5):
-            print(f"Warning: Multiple radius values found for {atom_name}. Using the first encountered value.")
-        # else:
-        elif not atom_name.startswith("H"):
-            atom_info[atom_name] = radius
+    conflicts = ~np.isclose(radii, radii[first][key_index.reshape(-1)], rtol=1e-5, atol=0.0)
+    for atom_name in np.unique(keys[conflicts]).tolist():
+        print(f"Warning: Multiple radius values found for {atom_name}. Using the first encountered value.")
 
-    return atom_info
+    # In order of first occurrence, as found in the file
+    order = np.argsort(first, kind="stable")
+    return dict(zip(unique_keys[order].tolist(), radii[first][order].tolist()))
 
 
+@traced()
 def append_ligand_to_protein_pqr(
-    protein_df: pl.DataFrame,
-    ligand_df: pl.DataFrame,
+    protein_df: "pl.DataFrame",
+    ligand_df: "pl.DataFrame",
     atom_info: Dict[str, float],
-) -> pl.DataFrame:
+) -> "pl.DataFrame":
     """
     Append ligand atoms from the MOL2 file to the protein structure from the PQR file.
 
+    The radius lookup runs once per distinct ligand atom name rather than
+    once per row.
+
     Args:
         protein_df (polars.DataFrame): DataFrame of the protein PQR file.
         ligand_df (polars.DataFrame): DataFrame of the ligand MOL2 file.
@@ -156,18 +129,15 @@ def append_ligand_to_protein_pqr(
     Returns:
         polars.DataFrame: Combined DataFrame of protein and ligand with all necessary columns.
     """
-    # Normalize atom names in ligand to match protein atom naming for radius mapping
-    ligand_df = ligand_df.with_columns([
-        pl.col("atom_name") \
-          .map_elements(lambda x: ''.join(filter(str.isalpha, x)), return_dtype=pl.Utf8) \
-          .alias("normalized_atom_name")
-    ])
-
-    # Map radius to each atom in the ligand
-    ligand_df = ligand_df.with_columns(
-        pl.col("normalized_atom_name") \
-          .map_elements(lambda x: atom_info.get(x, np.nan), return_dtype=pl.Float64) \
-          .alias("radius")
+    import numpy as np
+    import polars as pl
+
+    # Normalize atom names in ligand to match protein atom naming for radius
+    # mapping; each distinct name is looked up once
+    names, inverse = np.unique(ligand_df["atom_name"].to_numpy().astype(str), return_inverse=True)
+    name_radii = np.array(
+        [atom_info.get(''.join(filter(str.isalpha, name)), float("nan")) for name in names],
+        dtype=np.float64,
     )
 
     # Convert necessary columns to appropriate types to match the protein dataframe
@@ -181,8 +151,7 @@ def append_ligand_to_protein_pqr(
         pl.col("y").alias("Y"),
         pl.col("z").alias("Z"),
         pl.col("charge").cast(pl.Float64),  # Cast to match the protein dataframe type
-        pl.col("radius"),
-    ])
+    ]).with_columns(pl.Series("radius", name_radii[inverse.reshape(-1)], dtype=pl.Float64))
 
     # Append ligand DataFrame to protein DataFrame
     combined_df = pl.concat([protein_df, ligand_df_formatted])
@@ -196,22 +165,41 @@ def append_ligand_to_protein_pqr(
     return combined_df
 
 
-def write_pqr(dataframe: pl.DataFrame, file_path: str) -> None:
+@traced()
+def write_pqr(dataframe: "pl.DataFrame", file_path: str, stats: Optional[PQRStats] = None) -> None:
     """
     Write the contents of a Polars DataFrame to a PQR file.
 
+    The columns are handed to `atom_table.write_atoms` as arrays, without a
+    dictionary per row.
+
     Args:
         dataframe (polars.DataFrame): DataFrame to write to a PQR file.
-        file_path (str): Path of the file to write.
+        file_path (str): Path of the file to write; a `.gz` or `.zst` suffix compresses it.
+        stats (Optional[PQRStats]): Accumulates the statistics of the atoms written.
     """
-    with open(file_path, 'w') as file:
-        for row in dataframe.to_dicts():
-            file.write(
-                "{:<6}{:>5} {:>4} {:3} {:>4} {:>11.3f} {:>8.3f} {:>8.3f} {:>8.4f} {:>7.4f}\n".format(
-                    row['recordName'], row['serial'], row['atomName'], row['residueName'],
-                    int(row['residueNumber']), row['X'], row['Y'], row['Z'], row['charge'], row['radius']
-                )
-            )
+    import numpy as np
+    import polars as pl
+
+    from atom_table import write_atoms
+
+    records = dataframe["recordName"].to_numpy().astype(str)
+    x, y, z = (dataframe[axis].to_numpy() for axis in ("X", "Y", "Z"))
+    charges = dataframe["charge"].to_numpy()
+    radii = dataframe["radius"].to_numpy()
+    write_atoms({
+        "record": records,
+        "serial": dataframe["serial"].to_numpy(),
+        "atom_name": dataframe["atomName"].to_numpy().astype(str),
+        "res_name": dataframe["residueName"].to_numpy().astype(str),
+        "res_seq": dataframe["residueNumber"].cast(pl.Int64).to_numpy(),
+        "coords": np.column_stack([x, y, z]),
+        "charge": charges,
+        "radius": radii,
+    }, file_path, "pqr")
+    if stats is not None:
+        stats.add_columns(records == "HETATM", x, y, z, charges, radii)
+    count("atoms_written", dataframe.height)
 
 
 def main() -> None:
@@ -219,6 +207,8 @@ def main() -> None:
     PROTEIN_PQR_FILE: str = sys.argv[2]
     COMPLEX_PQR_FILE: str = sys.argv[3]
     OUTPUT_PQR_FILE: str  = sys.argv[4]
+    # Optional SQLite catalog in which the output file is recorded
+    CATALOG_FILE: Optional[str] = sys.argv[5] if len(sys.argv) > 5 else None
 
     df_ligand_mol2 = convert_mol2_to_polars_dataframe(LIGAND_MOL2_FILE)
     print(df_ligand_mol2.select(["atom_name", "x", "y", "z"]))
@@ -240,8 +230,12 @@ def main() -> None:
     input()
 
     df_combined = append_ligand_to_protein_pqr(df_protein_pqr, df_ligand_mol2, atom_info_mapping)
-    write_pqr(df_combined, OUTPUT_PQR_FILE)
+    stats = PQRStats() if CATALOG_FILE is not None else None
+    write_pqr(df_combined, OUTPUT_PQR_FILE, stats)
     print(f"Combined PQR file written to {OUTPUT_PQR_FILE}")
+    if CATALOG_FILE is not None:
+        with Catalog(CATALOG_FILE) as catalog:
+            catalog.record(OUTPUT_PQR_FILE, stats, [LIGAND_MOL2_FILE, PROTEIN_PQR_FILE, COMPLEX_PQR_FILE])
 
     """
     Note:
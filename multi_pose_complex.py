@@ -0,0 +1,262 @@
+"""Write one complex PQR per docking pose while parsing the receptor once.
+
+`form_complex_pqr.combine_pqr_files` re-reads the whole protein for every
+ligand. For a docking run with many poses of the same ligand, this script
+reads the receptor's ATOM/HETATM block once and keeps it as a bytes buffer,
+then streams the poses from a multi-pose MOL2 or SDF file. Charges and radii
+are only computed again when the topology of a pose differs from the
+previous one; otherwise only the coordinates of the preformatted ligand
+lines change. Each pose is written as `<ID>_pose<k>_combined.pqr`.
+
+MOL2 poses are charged with PEOE through `Mol2Molecule.assign_parameters`.
+SDF poses are charged by Open Babel, as in `convert_sdf_to_pqr.py`.
+"""
+import argparse
+import io
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from convert_sdf_to_pqr import convert_sdf_to_pqr, update_pqr_radii
+from file_io import COMPRESSION_SUFFIXES, open_file, strip_compression, with_compression
+from mol2_classes import RADII, Mol2Molecule
+from pqr_arrays import PQRTemplate, read_pqr_atoms
+
+
+#: Residue name and number given to ligand atoms, as in
+#: `mol2_to_pqr.append_ligand_to_protein_pqr`.
+LIGAND_RES_NAME = "LIG"
+LIGAND_RES_SEQ = 1
+
+
+def read_receptor_block(protein_file: str) -> Tuple[bytes, int]:
+    """
+    Read the ATOM/HETATM lines of a receptor PQR file into one buffer.
+
+    Parameters
+    ----------
+    protein_file : str
+        Path of the receptor PQR file.
+
+    Returns
+    -------
+    Tuple[bytes, int]
+        The receptor lines and the number of atoms they contain.
+    """
+    lines = []
+    with open_file(protein_file, "rb") as protein:
+        for line in protein:
+            if line.startswith((b"ATOM", b"HETATM")):
+                lines.append(line if line.endswith(b"\n") else line + b"\n")
+    return b"".join(lines), len(lines)
+
+
+def split_records(pose_file: str, fmt: str) -> Iterator[str]:
+    """
+    Stream the records of a multi-pose MOL2 or SDF file, one pose at a time.
+
+    Parameters
+    ----------
+    pose_file : str
+        Path of the multi-pose file.
+    fmt : str
+        "mol2" or "sdf".
+
+    Yields
+    ------
+    str
+        The text of one pose.
+    """
+    record: List[str] = []
+    with open_file(pose_file, "r") as poses:
+        for line in poses:
+            if fmt == "mol2":
+                # A new pose starts at its MOLECULE record or at the comment
+                # header preceding it
+                if line.startswith(("@<TRIPOS>MOLECULE", "#")) and any(
+                    text.startswith("@<TRIPOS>ATOM") for text in record
+                ):
+                    yield "".join(record)
+                    record = []
+                record.append(line)
+            else:
+                record.append(line)
+                if line.startswith("$$$$"):
+                    yield "".join(record)
+                    record = []
+    if any(text.strip() for text in record):
+        yield "".join(record)
+
+
+class _Pose:
+    """Coordinates and topology of one pose."""
+
+    def __init__(self, coords: np.ndarray, topology: Tuple, atom_names: List[str]) -> None:
+        self.coords = coords
+        self.topology = topology
+        self.atom_names = atom_names
+
+
+def _parse_mol2_pose(text: str) -> _Pose:
+    """
+    Read the coordinates and topology of a MOL2 pose without building a
+    `Mol2Molecule`; bonds are only compared, not perceived.
+    """
+    section = None
+    coords, types, names, bonds = [], [], [], []
+    for line in text.splitlines():
+        if line.startswith("@<TRIPOS>"):
+            section = line.strip()
+            continue
+        words = line.split()
+        if not words:
+            continue
+        if section == "@<TRIPOS>ATOM":
+            names.append(words[1])
+            coords.append((float(words[2]), float(words[3]), float(words[4])))
+            types.append(words[5])
+        elif section == "@<TRIPOS>BOND":
+            bonds.append(tuple(words[1:4]))
+    return _Pose(np.array(coords), (tuple(types), tuple(bonds)), names)
+
+
+def _mol2_charges(text: str, primary_dict: Dict[str, float],
+                  secondary_dict: Dict[str, float]) -> Tuple[List[float], List[float]]:
+    """
+    Assign PEOE charges and radii to one MOL2 pose.
+
+    Ring and torsion perception is skipped: neither is used for charges or
+    radii, and ring perception is exponential on fused ring systems.
+    """
+    molecule = Mol2Molecule()
+    mol2_file = molecule.parse_atoms(io.StringIO(text))
+    molecule.parse_bonds(mol2_file, set_topology=False)
+    molecule.assign_parameters(primary_dict, secondary_dict)
+    atoms = list(molecule.atoms.values())
+    return [atom.charge for atom in atoms], [atom.radius for atom in atoms]
+
+
+def _parse_sdf_pose(text: str) -> _Pose:
+    lines = text.splitlines()
+    n_atoms, n_bonds = int(lines[3][0:3]), int(lines[3][3:6])
+    atom_lines = lines[4:4 + n_atoms]
+    bond_lines = lines[4 + n_atoms:4 + n_atoms + n_bonds]
+    coords = np.array([[float(line[0:10]), float(line[10:20]), float(line[20:30])]
+                       for line in atom_lines])
+    elements = [line[31:34].strip() for line in atom_lines]
+    topology = (tuple(elements), tuple(line[:9] for line in bond_lines))
+    names = [f"{element}{i}" for i, element in enumerate(elements, start=1)]
+    return _Pose(coords, topology, names)
+
+
+def _sdf_charges(text: str, forcefield: str) -> Dict[str, np.ndarray]:
+    """
+    Charge one SDF pose with Open Babel and fix its radii.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sdf_file = os.path.join(tmp_dir, "pose.sdf")
+        pqr_file = os.path.join(tmp_dir, "pose.pqr")
+        with open(sdf_file, "w") as sdf:
+            sdf.write(text)
+        convert_sdf_to_pqr(sdf_file, pqr_file, forcefield)
+        update_pqr_radii(pqr_file, pqr_file)
+        return read_pqr_atoms(pqr_file)
+
+
+def write_pose_complexes(
+    protein_file: str,
+    pose_file: str,
+    output_dir: str,
+    pdb_id: str,
+    forcefield: str = "AMBER",
+    primary_dict: Dict[str, float] = RADII["zap9"],
+    secondary_dict: Dict[str, float] = RADII["bondi"],
+    compress: Optional[str] = None,
+) -> List[str]:
+    """
+    Write a combined receptor-ligand PQR file for every pose in a file.
+
+    Parameters
+    ----------
+    protein_file : str
+        Path of the receptor PQR file.
+    pose_file : str
+        Multi-pose ligand file, `.mol2` or `.sdf`.
+    output_dir : str
+        Directory where the combined PQR files are written.
+    pdb_id : str
+        ID used in the output file names, `<ID>_pose<k>_combined.pqr`.
+    forcefield : str
+        Open Babel forcefield for charging SDF poses.
+    primary_dict, secondary_dict : Dict[str, float]
+        Radius tables for MOL2 poses, see `Mol2Molecule.assign_parameters`.
+    compress : Optional[str]
+        Write the complexes compressed, "gz" or "zst"; plain text if None.
+
+    Returns
+    -------
+    List[str]
+        Paths of the written files, in pose order.
+    """
+    fmt = os.path.splitext(strip_compression(pose_file))[1].lstrip(".").lower()
+    if fmt not in ("mol2", "sdf"):
+        raise ValueError(f"Unsupported pose file format: {pose_file}")
+    receptor_block, n_receptor_atoms = read_receptor_block(protein_file)
+    os.makedirs(output_dir, exist_ok=True)
+
+    template: Optional[PQRTemplate] = None
+    topology = None
+    output_files = []
+    for k, text in enumerate(split_records(pose_file, fmt), start=1):
+        pose = _parse_mol2_pose(text) if fmt == "mol2" else _parse_sdf_pose(text)
+        if template is None or pose.topology != topology:
+            # New topology: charge this pose and preformat its lines
+            if fmt == "mol2":
+                charges, radii = _mol2_charges(text, primary_dict, secondary_dict)
+            else:
+                charged = _sdf_charges(text, forcefield)
+                charges, radii = charged["charge"], charged["radius"]
+            n_atoms = len(pose.coords)
+            template = PQRTemplate(
+                ["HETATM"] * n_atoms,
+                range(n_receptor_atoms + 1, n_receptor_atoms + n_atoms + 1),
+                pose.atom_names, [LIGAND_RES_NAME] * n_atoms, [LIGAND_RES_SEQ] * n_atoms,
+                charges, radii,
+            )
+            topology = pose.topology
+        output_file = with_compression(
+            os.path.join(output_dir, f"{pdb_id}_pose{k}_combined.pqr"), compress
+        )
+        with open_file(output_file, "wb") as output:
+            output.write(receptor_block)
+            output.write(template.format(pose.coords).encode())
+        output_files.append(output_file)
+    return output_files
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Combine a receptor PQR file with every pose of a multi-pose ligand file.")
+    parser.add_argument("--protein", required=True,
+                        help="Receptor PQR file")
+    parser.add_argument("--poses", required=True,
+                        help="Multi-pose ligand file (.mol2 or .sdf)")
+    parser.add_argument("--output-dir", dest="output_dir", required=True,
+                        help="Directory for the combined PQR files")
+    parser.add_argument("--id", dest="pdb_id", default=None,
+                        help="ID used in output file names (default: receptor file name before '_')")
+    parser.add_argument("--FF", dest="forcefield", default="AMBER",
+                        help="Forcefield for charging SDF poses with Open Babel (default: AMBER)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                        help="Compress the combined PQR files (default: not compressed)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    pdb_id = args.pdb_id or os.path.basename(args.protein).split("_")[0]
+    written = write_pose_complexes(args.protein, args.poses, args.output_dir, pdb_id, args.forcefield,
+                                   compress=args.compress)
+    print(f"Wrote {len(written)} pose complexes to {args.output_dir}")
@@ -0,0 +1,226 @@
+"""Pack the generated complexes into memory-mappable arrays for training.
+
+Every complex under `data/generated` is parsed once and its atoms are written
+into contiguous `.npy` arrays, one array per column, with an offsets index:
+the atoms of complex `i` are rows `offsets[i]:offsets[i + 1]` of each array.
+The arrays are opened with `numpy.load(..., mmap_mode="r")`, so opening the
+store costs nothing, reading complex `i` only touches its own pages, and
+dataloader workers share those pages through the OS page cache.
+
+Store layout::
+
+    <store>/manifest.json   PDB IDs, float dtype, atom count
+    <store>/offsets.npy     int64, (n_complexes + 1,)
+    <store>/coords.npy      float64/float32, (n_atoms, 3)
+    <store>/charge.npy      float64/float32, (n_atoms,)
+    <store>/radius.npy      float64/float32, (n_atoms,)
+    <store>/element.npy     uint8 element codes, see `pqr_arrays.ELEMENTS`
+    <store>/is_ligand.npy   bool, (n_atoms,)
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from file_io import open_file
+from pqr_arrays import find_complexes, load_complex
+
+
+#: Columns stored for each atom, with the dtype used when `float32` is off.
+PACKED_COLUMNS: Dict[str, Tuple[str, Tuple[int, ...]]] = {
+    "coords": ("float64", (3,)),
+    "charge": ("float64", ()),
+    "radius": ("float64", ()),
+    "element": ("uint8", ()),
+    "is_ligand": ("bool", ()),
+}
+
+MANIFEST_FILE = "manifest.json"
+OFFSETS_FILE = "offsets.npy"
+
+
+def _count_atom_records(file_path: str) -> int:
+    """
+    Count the ATOM/HETATM records of a PQR file without parsing them.
+    """
+    with open_file(file_path, "rb") as file:
+        data = b"\n" + file.read()
+    return data.count(b"\nATOM") + data.count(b"\nHETATM")
+
+
+def _load_packed_columns(paths: Tuple[str, str]) -> Dict[str, np.ndarray]:
+    atoms = load_complex(*paths)
+    return {column: atoms[column] for column in PACKED_COLUMNS}
+
+
+def pack_complexes(
+    input_dir: str,
+    output_dir: str,
+    float32: bool = False,
+    workers: int = 1,
+) -> int:
+    """
+    Pack every complex under `input_dir` into a memory-mappable store.
+
+    Parameters
+    ----------
+    input_dir : str
+        Root directory of the generated PQR files, e.g. `data/generated`.
+    output_dir : str
+        Directory where the store is written.
+    float32 : bool
+        Store coordinates, charges and radii as float32 instead of float64.
+    workers : int
+        Number of processes used to parse the PQR files.
+
+    Returns
+    -------
+    int
+        The number of complexes packed.
+    """
+    complexes = find_complexes(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Count atoms first so every column can be written straight into its
+    # final memory-mapped file instead of being accumulated in memory.
+    counts = [
+        _count_atom_records(protein_file) + _count_atom_records(ligand_file)
+        for _, protein_file, ligand_file in complexes
+    ]
+    offsets = np.zeros(len(complexes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    n_atoms = int(offsets[-1])
+
+    columns = {}
+    for column, (dtype, shape) in PACKED_COLUMNS.items():
+        if float32 and dtype == "float64":
+            dtype = "float32"
+        columns[column] = np.lib.format.open_memmap(
+            os.path.join(output_dir, f"{column}.npy"), mode="w+",
+            dtype=dtype, shape=(n_atoms, *shape),
+        )
+
+    paths = [(protein_file, ligand_file) for _, protein_file, ligand_file in complexes]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, atoms in enumerate(executor.map(_load_packed_columns, paths, chunksize=4)):
+            start, stop = offsets[i], offsets[i + 1]
+            if len(atoms["charge"]) != stop - start:
+                raise ValueError(
+                    f"Atom count of {complexes[i][0]} changed while packing."
+                )
+            for column, values in atoms.items():
+                columns[column][start:stop] = values
+
+    for array in columns.values():
+        array.flush()
+    del columns
+
+    np.save(os.path.join(output_dir, OFFSETS_FILE), offsets)
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as file:
+        json.dump({
+            "ids": [pdb_id for pdb_id, _, _ in complexes],
+            "float_dtype": "float32" if float32 else "float64",
+            "n_atoms": n_atoms,
+        }, file, indent=2)
+    return len(complexes)
+
+
+class PackedComplexStore:
+    """
+    Random-access reader for a store written by `pack_complexes`.
+
+    Columns are memory-mapped lazily on first access, so constructing the
+    store only reads the manifest and the offsets. Indexing returns views
+    into the mapped arrays; nothing outside the requested complex is read.
+    The mapped arrays are not pickled, so a store handed to dataloader worker
+    processes reopens its own mappings of the same (shared) pages.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the packed store.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE), "r") as file:
+            manifest = json.load(file)
+        self.ids: List[str] = manifest["ids"]
+        self.float_dtype: str = manifest["float_dtype"]
+        self.offsets: np.ndarray = np.load(os.path.join(directory, OFFSETS_FILE))
+        self._index = {pdb_id: i for i, pdb_id in enumerate(self.ids)}
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state["_columns"] = {}
+        return state
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Get the memory-mapped array of a column for all atoms in the store.
+
+        Parameters
+        ----------
+        name : str
+            Column name, one of `PACKED_COLUMNS`.
+
+        Returns
+        -------
+        np.ndarray
+            Read-only memory-mapped array.
+        """
+        if name not in self._columns:
+            if name not in PACKED_COLUMNS:
+                raise KeyError(f"Unknown packed column: {name}")
+            self._columns[name] = np.load(
+                os.path.join(self.directory, f"{name}.npy"), mmap_mode="r"
+            )
+        return self._columns[name]
+
+    def index(self, pdb_id: str) -> int:
+        """
+        Get the position of a complex in the store from its PDB ID.
+        """
+        return self._index[pdb_id]
+
+    def __getitem__(self, i: int) -> Dict[str, np.ndarray]:
+        """
+        Get the atom arrays of complex `i` as views into the mapped columns.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Complex index {i} out of range for {len(self)} complexes.")
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return {column: self.column(column)[start:stop] for column in PACKED_COLUMNS}
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Pack generated PQR complexes into memory-mappable arrays.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--output-dir", dest="output_dir", default="data/packed",
+                        help="Directory where the packed store is written (default: data/packed)")
+    parser.add_argument("--float32", action="store_true",
+                        help="Store coordinates, charges and radii as float32")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of parsing processes (default: all CPUs)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    n_complexes = pack_complexes(args.input_dir, args.output_dir, args.float32, args.workers)
+    print(f"Packed {n_complexes} complexes into {args.output_dir}")
@@ -9,6 +9,8 @@ https://doi.org/10.1002/prot.21110
 import logging
 from math import isclose
 
+from instrumentation import count, traced
+
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -118,6 +120,7 @@ def assign_terms(atoms, term_dict):
     return atoms
 
 
+@traced("peoe")
 def equilibrate(
     atoms,
     damp=DAMPING_FACTOR,
@@ -190,4 +193,142 @@ def equilibrate(
                 )
     for atom in atoms:
         atom.charge = scale * atom.charge
+    count("peoe_cycles", num_cycles)
     return atoms
+
+
+def electronegativity_array(charges, poly_terms, hydrogen):
+    """Calculate electronegativities for arrays of atoms.
+
+    Array version of :func:`electronegativity`; the arguments broadcast
+    against each other.
+
+    :param charges:  atomic charges, e.g. of shape (variants, atoms)
+    :type charges:  numpy.ndarray
+    :param poly_terms:  polynomial terms in the last axis, ordered from 0th-
+        to 3rd-order
+    :type poly_terms:  numpy.ndarray
+    :param hydrogen:  whether each atom has type "H"
+    :type hydrogen:  numpy.ndarray
+    :return:  electronegativity values
+    :rtype:  numpy.ndarray
+    """
+    import numpy as np
+
+    charges = np.clip(charges, -MAX_CHARGE, MAX_CHARGE)
+    chi = (
+        poly_terms[..., 0]
+        + poly_terms[..., 1] * charges
+        + poly_terms[..., 2] * charges * charges
+        + poly_terms[..., 3] * charges * charges * charges
+    )
+    at_default = hydrogen & np.isclose(charges, DEFAULT_H_CHARGE, rtol=1e-9, atol=0.0)
+    return np.where(at_default, DEFAULT_H_ELECTRONEG, chi)
+
+
+def term_array(atom_types, term_dict=POLY_TERMS):
+    """Look up the polynomial terms of atom types as an array.
+
+    Types are matched as in :func:`assign_terms`; three-term polynomials are
+    padded with a zero third-order term.
+
+    :param atom_types:  SYBYL atom types
+    :type atom_types:  list of str
+    :param term_dict:  dictionary of polynomial terms
+    :type term_dict:  dict
+    :return:  array of shape (len(atom_types), 4)
+    :rtype:  numpy.ndarray
+    """
+    import numpy as np
+
+    terms = []
+    for atom_type in atom_types:
+        atom_type = atom_type.upper()
+        if atom_type == "O.3":
+            atom_type = "O.OH"
+        try:
+            poly_terms = term_dict[atom_type]
+        except KeyError:
+            raise KeyError(
+                f"Unable to find polynomial terms for atom type {atom_type}"
+            )
+        if len(poly_terms) not in (3, 4):
+            err = f"Cannot parse length-{len(poly_terms):d} polynomial"
+            raise IndexError(err)
+        terms.append(tuple(poly_terms) + (0.0,) * (4 - len(poly_terms)))
+    return np.array(terms, dtype=np.float64)
+
+
+@traced("peoe")
+def equilibrate_batch(
+    formal_charges,
+    poly_terms,
+    hydrogen,
+    bonds,
+    present=None,
+    damp=DAMPING_FACTOR,
+    scale=SCALING_FACTOR,
+    num_cycles=NUM_CYCLES,
+):
+    """Equilibrate the charges of several variants of one molecule at once.
+
+    Runs the same cycles as :func:`equilibrate` on every variant together,
+    as array operations over the bonds, so variants that differ only in
+    formal charges, atom types or removed atoms share one topology.
+
+    :param formal_charges:  formal charges, shape (variants, atoms)
+    :type formal_charges:  numpy.ndarray
+    :param poly_terms:  polynomial terms, shape (atoms, 4) or
+        (variants, atoms, 4), e.g. from :func:`term_array`
+    :type poly_terms:  numpy.ndarray
+    :param hydrogen:  whether each atom has type "H", shape (atoms,)
+    :type hydrogen:  numpy.ndarray
+    :param bonds:  atom index pairs of the bonds, shape (bonds, 2)
+    :type bonds:  numpy.ndarray
+    :param present:  whether each atom exists in each variant, shape
+        (variants, atoms); absent atoms and their bonds are ignored
+    :type present:  numpy.ndarray or None
+    :param damp:  damping factor for equilibration process
+    :type damp:  float
+    :param scale:  scaling factor for equilibration process
+    :type scale:  float
+    :param num_cycles:  number of PEOE cycles
+    :type num_cycles:  int
+    :return:  charges of shape (variants, atoms), NaN for absent atoms
+    :rtype:  numpy.ndarray
+    """
+    import numpy as np
+
+    formal_charges = np.asarray(formal_charges, dtype=np.float64)
+    n_variants, n_atoms = formal_charges.shape
+    poly_terms = np.broadcast_to(poly_terms, (n_variants, n_atoms, 4))
+    hydrogen = np.asarray(hydrogen, dtype=bool)
+    if present is None:
+        present = np.ones((n_variants, n_atoms), dtype=bool)
+    formal_charges = np.where(present, formal_charges, 0.0)
+
+    equil_formal_charges = np.where(formal_charges != 0.0, formal_charges * (1.0 / scale), 0.0)
+    abs_qges = np.abs(formal_charges).sum(axis=1)
+    # As in equilibrate, the formal charges are only spread when there are any
+    formal_step = np.where(abs_qges[:, None] != 0.0, (1.0 / num_cycles) * equil_formal_charges, 0.0)
+
+    # Every bond in both directions: atom1 gains from its neighbour atom2
+    bonds = np.asarray(bonds, dtype=np.intp).reshape(-1, 2)
+    atom1 = np.concatenate([bonds[:, 0], bonds[:, 1]])
+    atom2 = np.concatenate([bonds[:, 1], bonds[:, 0]])
+    edge_present = present[:, atom1] & present[:, atom2]
+    incidence = np.zeros((len(atom1), n_atoms))
+    incidence[np.arange(len(atom1)), atom1] = 1.0
+
+    chi_plus = electronegativity_array(np.ones((n_variants, n_atoms)), poly_terms, hydrogen)
+    charges = np.zeros((n_variants, n_atoms))
+    for icycle in range(num_cycles):
+        chi = electronegativity_array(charges, poly_terms, hydrogen)
+        chi1, chi2 = chi[:, atom1], chi[:, atom2]
+        chi_norm = np.where(chi2 > chi1, chi_plus[:, atom1], chi_plus[:, atom2])
+        # Damping is used in PEOE to accelerate convergence
+        flow = np.where(edge_present, (chi2 - chi1) / chi_norm * (damp ** (icycle + 1)), 0.0)
+        charges += flow @ incidence + formal_step
+    charges = scale * charges
+    charges[~present] = np.nan
+    return charges
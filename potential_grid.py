@@ -0,0 +1,317 @@
+"""Precomputed receptor electrostatic potential grids for pose scoring.
+
+The Coulomb potential of the receptor's PQR charges is computed once on a
+regular 3D grid around the binding pocket and cached on disk. A ligand pose
+is then scored by trilinear interpolation of the grid at its atom positions,
+multiplied by the ligand charges, so the cost of a pose only depends on the
+number of ligand atoms. All poses of one ligand are scored in a single array
+operation.
+
+Build a grid around the crystal ligand and score docked poses::
+
+    python potential_grid.py --protein data/generated/1bcu/1bcu_protein.pqr \\
+                             --ligand data/generated/1bcu/1bcu_ligand.pqr \\
+                             --poses pose1.pqr pose2.pqr ...
+"""
+import argparse
+import hashlib
+import os
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from coulomb import DEFAULT_CUTOFF, DEFAULT_DIELECTRIC, pair_energies
+from file_io import atomic_output
+from pqr_arrays import read_pqr_atoms
+from spatial import CellList
+
+
+DEFAULT_SPACING = 0.375
+DEFAULT_SIZE = 24.0
+#: Distances below this value (Angstrom) are clamped when evaluating the
+#: potential on grid points that fall inside receptor atoms.
+MIN_DISTANCE = 0.5
+
+
+class PotentialGrid:
+    """
+    Receptor Coulomb potential sampled on a regular grid, in kcal/(mol*e).
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Potential at the grid points, shape (nx, ny, nz).
+    origin : np.ndarray
+        Coordinates of grid point (0, 0, 0).
+    spacing : float
+        Distance between neighbouring grid points, in Angstrom.
+    """
+
+    def __init__(self, values: np.ndarray, origin: np.ndarray, spacing: float) -> None:
+        self.values = np.asarray(values, dtype=np.float64)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.spacing = float(spacing)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def points(self) -> np.ndarray:
+        """
+        Coordinates of all grid points, shape (nx * ny * nz, 3), in C order.
+        """
+        axes = [self.origin[d] + self.spacing * np.arange(n) for d, n in enumerate(self.shape)]
+        mesh = np.meshgrid(*axes, indexing="ij")
+        return np.stack([axis.ravel() for axis in mesh], axis=1)
+
+    def inside(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Mask of the positions that fall inside the grid.
+        """
+        index = (np.asarray(coords) - self.origin) / self.spacing
+        return np.all((index >= 0) & (index <= np.array(self.shape) - 1), axis=-1)
+
+    def interpolate(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Trilinearly interpolate the potential at arbitrary positions.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            Positions, shape (..., 3).
+
+        Returns
+        -------
+        np.ndarray
+            Potential at each position, shape (...). Positions outside the
+            grid get a potential of zero.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        index = (coords - self.origin) / self.spacing
+        upper = np.array(self.shape) - 2
+        base = np.clip(np.floor(index).astype(np.int64), 0, upper)
+        frac = index - base
+        x, y, z = base[..., 0], base[..., 1], base[..., 2]
+        fx, fy, fz = frac[..., 0], frac[..., 1], frac[..., 2]
+        v = self.values
+        c00 = v[x, y, z] * (1 - fx) + v[x + 1, y, z] * fx
+        c10 = v[x, y + 1, z] * (1 - fx) + v[x + 1, y + 1, z] * fx
+        c01 = v[x, y, z + 1] * (1 - fx) + v[x + 1, y, z + 1] * fx
+        c11 = v[x, y + 1, z + 1] * (1 - fx) + v[x + 1, y + 1, z + 1] * fx
+        c0 = c00 * (1 - fy) + c10 * fy
+        c1 = c01 * (1 - fy) + c11 * fy
+        potential = c0 * (1 - fz) + c1 * fz
+        return np.where(self.inside(coords), potential, 0.0)
+
+    def score(self, coords: np.ndarray, charges: np.ndarray) -> np.ndarray:
+        """
+        Score ligand poses against the receptor potential.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            Ligand atom coordinates of one pose, shape (N, 3), or of many
+            poses of the same ligand, shape (P, N, 3).
+        charges : np.ndarray
+            Ligand atom charges, shape (N,).
+
+        Returns
+        -------
+        np.ndarray
+            Interaction energy of each pose in kcal/mol; a scalar array for a
+            single pose, otherwise shape (P,).
+        """
+        return self.interpolate(coords) @ np.asarray(charges, dtype=np.float64)
+
+    def save(self, file_path: str) -> None:
+        """
+        Save the grid to an `.npz` file, atomically, so a crashed or
+        concurrent run never leaves a truncated cache file.
+        """
+        with atomic_output(file_path) as partial_file:
+            # Through a file object, np.savez does not append ".npz" to the name
+            with open(partial_file, "wb") as file:
+                np.savez(file, values=self.values, origin=self.origin, spacing=self.spacing)
+
+    @classmethod
+    def load(cls, file_path: str) -> "PotentialGrid":
+        """
+        Load a grid saved with `save`.
+        """
+        with np.load(file_path) as data:
+            return cls(data["values"], data["origin"], float(data["spacing"]))
+
+
+def compute_potential_grid(
+    protein: Dict[str, np.ndarray],
+    center: Sequence[float],
+    size: float = DEFAULT_SIZE,
+    spacing: float = DEFAULT_SPACING,
+    cutoff: float = DEFAULT_CUTOFF,
+    dielectric: float = DEFAULT_DIELECTRIC,
+    distance_dependent: bool = False,
+    chunk_size: int = 8192,
+) -> PotentialGrid:
+    """
+    Compute the receptor Coulomb potential on a cubic grid.
+
+    Parameters
+    ----------
+    protein : Dict[str, np.ndarray]
+        Receptor atom arrays, see `pqr_arrays.read_pqr_atoms`.
+    center : Sequence[float]
+        Centre of the grid, e.g. the centroid of a reference ligand.
+    size : float
+        Edge length of the grid box, in Angstrom.
+    spacing : float
+        Grid spacing, in Angstrom.
+    cutoff : float
+        Cutoff of the receptor atoms contributing to each grid point.
+    dielectric : float
+        Relative dielectric constant (or prefactor), as in `coulomb.py`.
+    distance_dependent : bool
+        Use the distance-dependent dielectric `dielectric * r`.
+    chunk_size : int
+        Number of grid points evaluated at once, to cap memory.
+
+    Returns
+    -------
+    PotentialGrid
+        The potential grid.
+    """
+    n_points = int(np.ceil(size / spacing)) + 1
+    origin = np.asarray(center, dtype=np.float64) - spacing * (n_points - 1) / 2
+    grid = PotentialGrid(np.zeros((n_points,) * 3), origin, spacing)
+    points = grid.points()
+    # Cells of half the cutoff visit far fewer out-of-range atoms than cells
+    # of the full cutoff for the dense, regular set of grid points.
+    cell_list = CellList(protein["coords"], cutoff / 2)
+    values = np.zeros(len(points))
+    for start in range(0, len(points), chunk_size):
+        point_index, atom_index, distances = cell_list.query(points[start:start + chunk_size], cutoff)
+        potentials = pair_energies(
+            protein["charge"][atom_index], np.maximum(distances, MIN_DISTANCE),
+            dielectric, distance_dependent,
+        )
+        values[start:start + chunk_size] = np.bincount(
+            point_index, potentials, minlength=len(points[start:start + chunk_size])
+        )
+    grid.values = values.reshape(grid.shape)
+    return grid
+
+
+def grid_cache_key(protein_file: str, center: Sequence[float], size: float, spacing: float,
+                   cutoff: float, dielectric: float, distance_dependent: bool) -> str:
+    """
+    Hash the receptor file contents and the grid parameters into a cache key.
+    """
+    digest = hashlib.sha256()
+    with open(protein_file, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    params = (tuple(np.round(np.asarray(center, dtype=float), 3)), size, spacing,
+              cutoff, dielectric, distance_dependent)
+    digest.update(repr(params).encode())
+    return digest.hexdigest()[:16]
+
+
+def load_or_compute_grid(
+    protein_file: str,
+    center: Sequence[float],
+    cache_dir: str,
+    size: float = DEFAULT_SIZE,
+    spacing: float = DEFAULT_SPACING,
+    cutoff: float = DEFAULT_CUTOFF,
+    dielectric: float = DEFAULT_DIELECTRIC,
+    distance_dependent: bool = False,
+) -> PotentialGrid:
+    """
+    Load the potential grid of a receptor from the cache, computing it once.
+
+    The cache file name is derived from the receptor file contents and the
+    grid parameters, so changing either produces a new grid.
+
+    Parameters
+    ----------
+    protein_file : str
+        Path of the receptor PQR file.
+    center : Sequence[float]
+        Centre of the grid.
+    cache_dir : str
+        Directory of cached grids.
+    size, spacing, cutoff, dielectric, distance_dependent
+        See `compute_potential_grid`.
+
+    Returns
+    -------
+    PotentialGrid
+        The potential grid.
+    """
+    key = grid_cache_key(protein_file, center, size, spacing, cutoff, dielectric, distance_dependent)
+    stem = os.path.basename(protein_file).split(".")[0]
+    cache_file = os.path.join(cache_dir, f"{stem}_{key}.npz")
+    if os.path.exists(cache_file):
+        return PotentialGrid.load(cache_file)
+    grid = compute_potential_grid(read_pqr_atoms(protein_file), center, size, spacing,
+                                  cutoff, dielectric, distance_dependent)
+    os.makedirs(cache_dir, exist_ok=True)
+    grid.save(cache_file)
+    return grid
+
+
+def score_pose_files(grid: PotentialGrid, pose_files: List[str]) -> np.ndarray:
+    """
+    Score ligand pose PQR files against a potential grid.
+
+    Parameters
+    ----------
+    grid : PotentialGrid
+        Receptor potential grid.
+    pose_files : List[str]
+        PQR files of the poses.
+
+    Returns
+    -------
+    np.ndarray
+        Interaction energy of each pose in kcal/mol.
+    """
+    scores = np.empty(len(pose_files))
+    for i, pose_file in enumerate(pose_files):
+        pose = read_pqr_atoms(pose_file)
+        scores[i] = grid.score(pose["coords"], pose["charge"])
+    return scores
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Build a receptor potential grid and score ligand poses against it.")
+    parser.add_argument("--protein", required=True,
+                        help="Receptor PQR file")
+    parser.add_argument("--ligand", required=True,
+                        help="Reference ligand PQR file; the grid is centred on its centroid")
+    parser.add_argument("--poses", nargs="*", default=[],
+                        help="Ligand pose PQR files to score")
+    parser.add_argument("--cache-dir", dest="cache_dir", default="data/grids",
+                        help="Directory of cached potential grids (default: data/grids)")
+    parser.add_argument("--size", type=float, default=DEFAULT_SIZE,
+                        help=f"Grid edge length in Angstrom (default: {DEFAULT_SIZE})")
+    parser.add_argument("--spacing", type=float, default=DEFAULT_SPACING,
+                        help=f"Grid spacing in Angstrom (default: {DEFAULT_SPACING})")
+    parser.add_argument("--cutoff", type=float, default=DEFAULT_CUTOFF,
+                        help=f"Potential cutoff in Angstrom (default: {DEFAULT_CUTOFF})")
+    parser.add_argument("--dielectric", type=float, default=DEFAULT_DIELECTRIC,
+                        help=f"Relative dielectric constant (default: {DEFAULT_DIELECTRIC})")
+    parser.add_argument("--distance-dependent", dest="distance_dependent", action="store_true",
+                        help="Use a distance-dependent dielectric, dielectric * r")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    reference = read_pqr_atoms(args.ligand)
+    potential_grid = load_or_compute_grid(
+        args.protein, reference["coords"].mean(axis=0), args.cache_dir, args.size,
+        args.spacing, args.cutoff, args.dielectric, args.distance_dependent,
+    )
+    for pose_file, score in zip(args.poses, score_pose_files(potential_grid, args.poses)):
+        print(f"{pose_file}\t{score:.4f}")
@@ -0,0 +1,290 @@
+"""Parse PQR files into column arrays.
+
+The array-oriented stages (packing, featurization, energies) work on the
+columns of an `atom_table.AtomTable`. The functions in this module read the
+ATOM/HETATM records of a PQR file straight into such a table and pair up the
+protein and ligand PQR files of each complex under `data/generated`.
+"""
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# The element codes and the PQR line format moved to `atom_table`. They are
+# re-exported here because the array stages import them from this module.
+from atom_table import ELEMENT_CODES, ELEMENTS, PQR_ATOM_FORMAT, AtomTable, read_atoms
+from file_io import find_file
+
+__all__ = [
+    "ELEMENT_CODES", "ELEMENTS", "PQR_ATOM_FORMAT", "PQRTemplate", "concatenate_atoms", "crop_pocket",
+    "find_complexes", "load_complex", "read_combined_pqr", "read_pqr_atoms",
+]
+
+
+def read_pqr_atoms(file_path: str) -> AtomTable:
+    """
+    Read the atoms of a PQR file into column arrays.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the PQR file.
+
+    Returns
+    -------
+    AtomTable
+        Arrays keyed by column: "record", "serial", "atom_name", "res_name",
+        "chain", "res_seq", "ins_code", "coords" (N x 3), "charge", "radius" and
+        "element" (element codes, see `ELEMENTS`).
+    """
+    return read_atoms(file_path, "pqr")
+
+
+def concatenate_atoms(protein: Dict[str, np.ndarray],
+                      ligand: Dict[str, np.ndarray]) -> AtomTable:
+    """
+    Concatenate protein and ligand atom arrays into one complex.
+
+    Protein atoms come first, matching the order used by
+    `form_complex_pqr.combine_pqr_files`. An "is_ligand" flag column is added.
+
+    Parameters
+    ----------
+    protein : Dict[str, np.ndarray]
+        Protein atom arrays from `read_pqr_atoms`.
+    ligand : Dict[str, np.ndarray]
+        Ligand atom arrays from `read_pqr_atoms`.
+
+    Returns
+    -------
+    AtomTable
+        Complex atom arrays.
+    """
+    complex_atoms = AtomTable.concatenate([protein, ligand])
+    complex_atoms["is_ligand"] = np.concatenate([
+        np.zeros(len(protein["charge"]), dtype=bool),
+        np.ones(len(ligand["charge"]), dtype=bool),
+    ])
+    return complex_atoms
+
+
+#: Residue names of ligand atoms in combined PQR files: "UNL" is written by
+#: Open Babel, "LIG" by `mol2_to_pqr.append_ligand_to_protein_pqr`.
+LIGAND_RES_NAMES: Tuple[str, ...] = ("UNL", "LIG")
+
+
+def read_combined_pqr(file_path: str,
+                      ligand_res_names: Sequence[str] = LIGAND_RES_NAMES) -> AtomTable:
+    """
+    Read a combined protein-ligand PQR file into complex atom arrays.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the combined PQR file, e.g. from `form_complex_pqr.py`.
+    ligand_res_names : Sequence[str]
+        Residue names that mark ligand atoms.
+
+    Returns
+    -------
+    AtomTable
+        Atom arrays with an "is_ligand" column, see `concatenate_atoms`.
+    """
+    atoms = read_pqr_atoms(file_path)
+    atoms["is_ligand"] = np.isin(atoms["res_name"], list(ligand_res_names))
+    return atoms
+
+
+def find_complexes(root_dir: str) -> List[Tuple[str, str, str]]:
+    """
+    Find the complexes with both a protein and a ligand PQR file.
+
+    Each complex lives in `<root_dir>/<PDB_ID>/` and consists of
+    `<PDB_ID>_protein.pqr` and `<PDB_ID>_ligand.pqr`, either of which may be
+    stored `.gz` or `.zst` compressed.
+
+    Parameters
+    ----------
+    root_dir : str
+        Directory containing one subdirectory per complex, e.g. `data/generated`.
+
+    Returns
+    -------
+    List[Tuple[str, str, str]]
+        Sorted (PDB ID, protein PQR path, ligand PQR path) tuples.
+    """
+    complexes = []
+    for pdb_id in sorted(os.listdir(root_dir)):
+        directory = os.path.join(root_dir, pdb_id)
+        protein_file = find_file(os.path.join(directory, f"{pdb_id}_protein.pqr"))
+        ligand_file = find_file(os.path.join(directory, f"{pdb_id}_ligand.pqr"))
+        if protein_file is not None and ligand_file is not None:
+            complexes.append((pdb_id, protein_file, ligand_file))
+    return complexes
+
+
+def load_complex(protein_file: str, ligand_file: str) -> AtomTable:
+    """
+    Read a protein and a ligand PQR file into one set of complex arrays.
+
+    Parameters
+    ----------
+    protein_file : str
+        Path of the protein PQR file.
+    ligand_file : str
+        Path of the ligand PQR file.
+
+    Returns
+    -------
+    AtomTable
+        Complex atom arrays, see `concatenate_atoms`.
+    """
+    return concatenate_atoms(read_pqr_atoms(protein_file), read_pqr_atoms(ligand_file))
+
+
+def crop_pocket(atoms: Dict[str, np.ndarray], cutoff: float) -> AtomTable:
+    """
+    Keep the ligand and the protein atoms within `cutoff` of any ligand atom.
+
+    Parameters
+    ----------
+    atoms : Dict[str, np.ndarray]
+        Complex atom arrays with an "is_ligand" column.
+    cutoff : float
+        Pocket radius around the ligand atoms, in Angstrom.
+
+    Returns
+    -------
+    AtomTable
+        Atom arrays restricted to the pocket and the ligand.
+    """
+    coords = atoms["coords"]
+    is_ligand = np.asarray(atoms["is_ligand"], dtype=bool)
+    ligand_coords = coords[is_ligand]
+    keep = is_ligand.copy()
+    if len(ligand_coords):
+        # Discard everything outside the padded ligand bounding box before
+        # computing any distances.
+        low = ligand_coords.min(axis=0) - cutoff
+        high = ligand_coords.max(axis=0) + cutoff
+        candidates = np.flatnonzero(
+            ~is_ligand & np.all((coords >= low) & (coords <= high), axis=1)
+        )
+        cutoff_sq = cutoff * cutoff
+        for start in range(0, len(candidates), 4096):
+            chunk = candidates[start:start + 4096]
+            diff = coords[chunk, None, :] - ligand_coords[None, :, :]
+            within = (np.einsum("ijk,ijk->ij", diff, diff) <= cutoff_sq).any(axis=1)
+            keep[chunk[within]] = True
+    if not isinstance(atoms, AtomTable):
+        atoms = AtomTable(atoms)
+    return atoms.select(keep)
+
+
+class PQRTemplate:
+    """
+    Preformatted PQR lines of a fixed topology with placeholders for coordinates.
+
+    Everything but the coordinates (record, serial, names, residue, charge
+    and radius) is formatted once. Formatting a new set of coordinates is a
+    single `str.format` call over the whole block, which is what makes
+    writing many poses or frames of the same molecule cheap.
+
+    Parameters
+    ----------
+    records, serials, atom_names, res_names, res_seqs, charges, radii
+        Per-atom fields, formatted as in `PQR_ATOM_FORMAT`.
+    """
+
+    def __init__(
+        self,
+        records: Sequence[str],
+        serials: Sequence[int],
+        atom_names: Sequence[str],
+        res_names: Sequence[str],
+        res_seqs: Sequence[int],
+        charges: Sequence[float],
+        radii: Sequence[float],
+    ) -> None:
+        head_format, tail_format = PQR_ATOM_FORMAT.split(" {:>11.3f} {:>8.3f} {:>8.3f}")
+        pieces = []
+        self._coord_offsets: List[int] = []
+        offset = 0
+        for record, serial, atom_name, res_name, res_seq, charge, radius in zip(
+            records, serials, atom_names, res_names, res_seqs, charges, radii
+        ):
+            head = head_format.format(record, int(serial), atom_name, res_name, int(res_seq))
+            tail = tail_format.format(float(charge), float(radius))
+            pieces.append(
+                head.replace("{", "{{").replace("}", "}}")
+                + " {:>11.3f} {:>8.3f} {:>8.3f}"
+                + tail.replace("{", "{{").replace("}", "}}")
+            )
+            self._coord_offsets.append(offset + len(head))
+            offset += len(head) + 30 + len(tail)
+        self.n_atoms = len(pieces)
+        self._format = "".join(pieces)
+        self._buffer: Optional[np.ndarray] = None
+        self._field_index: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_atoms(cls, atoms: Dict[str, np.ndarray], first_serial: int = 1) -> "PQRTemplate":
+        """
+        Build a template from atom arrays, renumbering serials from `first_serial`.
+        """
+        n_atoms = len(atoms["charge"])
+        return cls(atoms["record"], range(first_serial, first_serial + n_atoms),
+                   atoms["atom_name"], atoms["res_name"], atoms["res_seq"],
+                   atoms["charge"], atoms["radius"])
+
+    def format(self, coords: np.ndarray) -> str:
+        """
+        Format the PQR lines of the template for one set of coordinates.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            Atom coordinates, shape (n_atoms, 3).
+
+        Returns
+        -------
+        str
+            The ATOM/HETATM lines, newline terminated.
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        if coords.shape != (self.n_atoms, 3):
+            raise ValueError(
+                f"Expected coordinates of shape ({self.n_atoms}, 3), got {coords.shape}"
+            )
+        return self._format.format(*coords.ravel().tolist())
+
+    def format_fields(self, fields: bytes) -> bytes:
+        """
+        Format the PQR lines of the template from coordinates that are already text.
+
+        `fields` holds three 8-character `%8.3f` columns per atom, such as
+        columns 31-54 of PDB ATOM records. The text is copied into the lines
+        as it is, which skips parsing and formatting the numbers and gives the
+        same bytes as `format` for coordinates of that precision.
+
+        Parameters
+        ----------
+        fields : bytes
+            24 bytes of coordinate text per atom, in template order.
+
+        Returns
+        -------
+        bytes
+            The ATOM/HETATM lines, newline terminated.
+        """
+        if len(fields) != 24 * self.n_atoms:
+            raise ValueError(f"Expected {24 * self.n_atoms} bytes of coordinates, got {len(fields)}")
+        if self._buffer is None:
+            # Lines with blank coordinates, and where each coordinate byte goes
+            self._buffer = np.frombuffer(
+                self.format(np.zeros((self.n_atoms, 3))).encode(), dtype=np.uint8
+            ).copy()
+            columns = np.concatenate([np.arange(4, 12), np.arange(13, 21), np.arange(22, 30)])
+            self._field_index = (np.asarray(self._coord_offsets)[:, None] + columns).ravel()
+        self._buffer[self._field_index] = np.frombuffer(fields, dtype=np.uint8)
+        return self._buffer.tobytes()
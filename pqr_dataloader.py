@@ -0,0 +1,260 @@
+"""Prefetching iterable over the generated PQR complexes.
+
+`PQRComplexDataset` streams batches of complexes for training. Parsing and
+collating run in a background thread or process pool and are kept a bounded
+number of batches ahead of the consumer, so the training loop does not wait
+on PQR parsing. Complexes are read either from the `data/generated` tree or
+from a store written by `pack_complexes.py`.
+
+Example::
+
+    dataset = PQRComplexDataset("data/generated", batch_size=8, shuffle=True,
+                                rank=rank, world_size=world_size)
+    for epoch in range(num_epochs):
+        dataset.set_epoch(epoch)
+        for batch in dataset:
+            batch["coords"], batch["charge"], batch["radius"], batch["mask"]
+"""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from pack_complexes import PackedComplexStore
+from pqr_arrays import crop_pocket, find_complexes, load_complex
+
+
+#: Numeric columns that are collated into batches.
+BATCH_COLUMNS = ("coords", "charge", "radius", "element", "is_ligand")
+
+COLLATE_MODES = ("padded", "packed")
+
+
+def collate_padded(complexes: Sequence[Dict[str, np.ndarray]],
+                   dtype: str = "float32") -> Dict[str, np.ndarray]:
+    """
+    Collate complexes into zero-padded arrays of shape (batch, max atoms, ...).
+
+    Parameters
+    ----------
+    complexes : Sequence[Dict[str, np.ndarray]]
+        Atom arrays of the complexes in the batch.
+    dtype : str
+        Float dtype of the coordinates, charges and radii.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Padded columns, a boolean "mask" of real atoms and "n_atoms".
+    """
+    n_atoms = np.array([len(atoms["charge"]) for atoms in complexes], dtype=np.int64)
+    max_atoms = int(n_atoms.max()) if len(n_atoms) else 0
+    batch = {}
+    for column in BATCH_COLUMNS:
+        first = complexes[0][column]
+        column_dtype = dtype if first.dtype.kind == "f" else first.dtype
+        values = np.zeros((len(complexes), max_atoms, *first.shape[1:]), dtype=column_dtype)
+        for i, atoms in enumerate(complexes):
+            values[i, :n_atoms[i]] = atoms[column]
+        batch[column] = values
+    batch["mask"] = np.arange(max_atoms)[None, :] < n_atoms[:, None]
+    batch["n_atoms"] = n_atoms
+    return batch
+
+
+def collate_packed(complexes: Sequence[Dict[str, np.ndarray]],
+                   dtype: str = "float32") -> Dict[str, np.ndarray]:
+    """
+    Collate complexes by concatenating their atoms, with an offsets index.
+
+    Parameters
+    ----------
+    complexes : Sequence[Dict[str, np.ndarray]]
+        Atom arrays of the complexes in the batch.
+    dtype : str
+        Float dtype of the coordinates, charges and radii.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Concatenated columns and "offsets"; the atoms of complex `i` are rows
+        `offsets[i]:offsets[i + 1]`.
+    """
+    n_atoms = np.array([len(atoms["charge"]) for atoms in complexes], dtype=np.int64)
+    batch = {}
+    for column in BATCH_COLUMNS:
+        values = np.concatenate([atoms[column] for atoms in complexes])
+        batch[column] = values.astype(dtype) if values.dtype.kind == "f" else values
+    batch["offsets"] = np.concatenate([[0], np.cumsum(n_atoms)])
+    batch["n_atoms"] = n_atoms
+    return batch
+
+
+def _load_batch(
+    source: Union[str, PackedComplexStore],
+    items: List[Any],
+    pocket_cutoff: Optional[float],
+    collate: str,
+    dtype: str,
+) -> Dict[str, Any]:
+    """
+    Load, crop and collate one batch. Runs in the prefetch pool.
+    """
+    complexes = []
+    ids = []
+    for item in items:
+        if isinstance(source, PackedComplexStore):
+            atoms = source[item]
+            ids.append(source.ids[item])
+        else:
+            pdb_id, protein_file, ligand_file = item
+            atoms = load_complex(protein_file, ligand_file)
+            ids.append(pdb_id)
+        atoms = {column: np.asarray(atoms[column]) for column in BATCH_COLUMNS}
+        if pocket_cutoff is not None:
+            atoms = crop_pocket(atoms, pocket_cutoff)
+        complexes.append(atoms)
+    if collate == "padded":
+        batch = collate_padded(complexes, dtype)
+    else:
+        batch = collate_packed(complexes, dtype)
+    batch["ids"] = ids
+    return batch
+
+
+class PQRComplexDataset:
+    """
+    Iterable of collated batches of protein-ligand complexes.
+
+    Parameters
+    ----------
+    source : Union[str, PackedComplexStore]
+        Root directory of the generated PQR files, or a packed store.
+    batch_size : int
+        Number of complexes per batch.
+    shuffle : bool
+        Shuffle the complexes at the start of every epoch.
+    seed : int
+        Base seed of the shuffle; the epoch number is added to it, so all
+        ranks see the same permutation in a given epoch.
+    rank : int
+        Index of this consumer among `world_size` consumers. Combine the
+        node rank and the dataloader worker id into one rank when both are
+        used.
+    world_size : int
+        Total number of consumers; each one iterates over a disjoint shard.
+    prefetch : int
+        Maximum number of batches loaded ahead of consumption.
+    workers : int
+        Number of threads or processes used for loading.
+    use_processes : bool
+        Load in a process pool instead of a thread pool. Parsing text PQR
+        files holds the GIL, so processes scale better for directory sources;
+        a packed store is cheap enough to read from threads.
+    pocket_cutoff : Optional[float]
+        If given, crop every complex to the ligand and the protein atoms
+        within this distance of it, in Angstrom.
+    collate : str
+        "padded" for (batch, max atoms, ...) arrays with a mask, or "packed"
+        for concatenated atoms with offsets.
+    dtype : str
+        Float dtype of the collated coordinates, charges and radii.
+    drop_last : bool
+        Drop the last batch of a shard if it is smaller than `batch_size`.
+    """
+
+    def __init__(
+        self,
+        source: Union[str, PackedComplexStore] = "data/generated",
+        batch_size: int = 8,
+        shuffle: bool = False,
+        seed: int = 0,
+        rank: int = 0,
+        world_size: int = 1,
+        prefetch: int = 4,
+        workers: int = 2,
+        use_processes: bool = False,
+        pocket_cutoff: Optional[float] = None,
+        collate: str = "padded",
+        dtype: str = "float32",
+        drop_last: bool = False,
+    ) -> None:
+        if collate not in COLLATE_MODES:
+            raise ValueError(f"Unknown collate mode {collate}; expected one of {COLLATE_MODES}")
+        if not 0 <= rank < world_size:
+            raise ValueError(f"Rank {rank} is out of range for world size {world_size}")
+        if batch_size < 1 or prefetch < 1 or workers < 1:
+            raise ValueError("batch_size, prefetch and workers must be positive")
+        self.source = source
+        if isinstance(source, PackedComplexStore):
+            self.items: List[Any] = list(range(len(source)))
+        else:
+            self.items = find_complexes(source)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.prefetch = prefetch
+        self.workers = workers
+        self.use_processes = use_processes
+        self.pocket_cutoff = pocket_cutoff
+        self.collate = collate
+        self.dtype = dtype
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Set the epoch used to seed the shuffle of the next iteration.
+        """
+        self.epoch = epoch
+
+    def _shard(self) -> List[Any]:
+        order = np.arange(len(self.items))
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(order)
+        return [self.items[i] for i in order[self.rank::self.world_size]]
+
+    def _batches(self) -> List[List[Any]]:
+        shard = self._shard()
+        batches = [shard[i:i + self.batch_size] for i in range(0, len(shard), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        return batches
+
+    def __len__(self) -> int:
+        return len(self._batches())
+
+    def _executor(self) -> Executor:
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        batches = iter(self._batches())
+        with self._executor() as executor:
+            pending: Deque = deque()
+            try:
+                # Keep at most `prefetch` batches in flight; a new batch is
+                # only submitted when the consumer takes one.
+                for items in batches:
+                    pending.append(executor.submit(
+                        _load_batch, self.source, items, self.pocket_cutoff, self.collate, self.dtype
+                    ))
+                    if len(pending) >= self.prefetch:
+                        break
+                while pending:
+                    batch = pending.popleft().result()
+                    items = next(batches, None)
+                    if items is not None:
+                        pending.append(executor.submit(
+                            _load_batch, self.source, items, self.pocket_cutoff, self.collate, self.dtype
+                        ))
+                    yield batch
+            finally:
+                # Do not keep loading batches nobody will consume if the
+                # iteration is abandoned early.
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,272 @@
+"""Atomic radius tables and a compiled radius lookup.
+
+`RADII` is the single copy of the radius tables used by `mol2_classes.py`
+and `convert_sdf_to_pqr.py`. A `RadiusResolver` turns a (primary, secondary)
+pair of tables into one lookup table from Sybyl atom type or element to
+radius, built once and shared by every caller through `get_resolver`, so
+assigning radii costs one dictionary lookup per atom type, or one
+vectorised lookup for a whole column of types.
+"""
+from typing import TYPE_CHECKING, Dict, Sequence, Tuple, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+#: Radii for different atom types.
+#: When using these tables, the most specific Sybyl atom type should be used
+#: first and then the generic element should be used
+RADII: Dict[str, Dict[str, float]] = {
+    # NOTE - these are not the original PARSE radii but they are the ones
+    # included in the previous version of PDB2PKA so I'm preserving them for
+    # posterity. There's a claim they came from
+    # http://amber.ch.ic.ac.uk/archive/ but that link no longer works.
+    "not parse - do not use": {
+        "C": 1.70,
+        "N": 1.50,
+        "O": 1.40,
+        "S": 1.85,
+        "H": 1.00,
+        "Br": 2.50,
+        "F": 1.20,
+        "P": 1.90,
+        "Cl": 1.75,
+    },
+    #: These are the PARSE radii from Table 4 of
+    #: http://doi.org/10.1021/j100058a043
+    "parse": {
+        "C.1": 2.00,
+        "C.2": 2.00,
+        "C.3": 2.00,
+        "C": 1.70,
+        "H": 1.00,
+        "O": 1.40,
+        "N": 1.50,
+        "S": 1.85,
+    },
+    #: These are the ZAP radii from Table 2 of
+    #: http://doi.org/10.1021/jm070549%2B. Bondi radii should be used for
+    #: atoms not found in this table.
+    "zap9": {
+        "C": 1.87,
+        "H": 1.10,
+        "O.co2": 1.76,
+        "N": 1.40,
+        "S": 2.15,
+        "F": 2.40,
+        "Cl": 1.82,
+        "I": 2.65,
+    },
+    #: These are the Bondi radii from Table 2 of
+    #: http://doi.org/10.1021/jm070549%2B
+    "bondi-zap": {
+        "C": 1.7,
+        "H": 1.20,
+        "O.co2": 1.52,
+        "N": 1.55,
+        "S": 1.80,
+        "F": 1.47,
+        "Cl": 1.75,
+        "I": 1.98,
+    },
+    #: These are the Bondi radii from Table I of
+    #: http://doi.org/10.1021/j100785a001. NOTE - there are some variations to
+    #: the halogens in Table V that we might want to consider in the future.
+    "bondi": {
+        "H": 1.20,
+        "He": 1.40,
+        "C": 1.70,
+        "N": 1.55,
+        "O": 1.52,
+        "F": 1.47,
+        "Ne": 1.54,
+        "Si": 2.10,
+        "P": 1.80,
+        "S": 1.80,
+        "Cl": 1.75,
+        "Ar": 1.88,
+        "As": 1.85,
+        "Se": 1.90,
+        "Br": 1.85,
+        "Kr": 2.02,
+        "Te": 2.06,
+        "I": 1.98,
+        "Xe": 2.16,
+    },
+    #: These are the mbondi2 radii of Onufriev, Bashford and Case,
+    #: http://doi.org/10.1002/prot.20033, for Generalized Born; hydrogens
+    #: bonded to nitrogen use 1.30 instead. Bondi radii should be used for
+    #: elements not found in this table.
+    "mbondi2": {
+        "H": 1.20,
+        "C": 1.70,
+        "N": 1.55,
+        "O": 1.50,
+        "F": 1.50,
+        "Si": 2.10,
+        "P": 1.85,
+        "S": 1.80,
+        "Cl": 1.70,
+    },
+}
+
+
+#: Behaviours for atom types found in neither table.
+MISSING_POLICIES = ("raise",)
+
+
+def parse_missing_policy(value: str) -> Union[str, float]:
+    """
+    Parse a missing radius policy given on the command line: "raise" or a
+    radius such as "0".
+    """
+    if value in MISSING_POLICIES:
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Expected one of {MISSING_POLICIES} or a radius, got '{value}'") from None
+
+
+class RadiusResolver:
+    """
+    Radius lookup compiled from a primary and a secondary radius table.
+
+    The radius of an atom type is the first match of, in order: the type in
+    the primary table, its element in the primary table, the type in the
+    secondary table, and its element in the secondary table. This is the
+    order of `Mol2Atom.assign_radius`.
+
+    Parameters
+    ----------
+    primary_dict : Dict[str, float]
+        Primary table of radii indexed by Sybyl atom type or element.
+    secondary_dict : Dict[str, float]
+        Backup table for types not found in the primary table.
+    on_missing : Union[str, float]
+        "raise" to raise a `KeyError` for types found in neither table, or
+        the radius to return for them, e.g. 0.0.
+    """
+
+    def __init__(
+        self,
+        primary_dict: Dict[str, float],
+        secondary_dict: Dict[str, float],
+        on_missing: Union[str, float] = "raise",
+    ) -> None:
+        if isinstance(on_missing, str) and on_missing not in MISSING_POLICIES:
+            raise ValueError(f"Unknown missing radius policy: {on_missing}")
+        self.primary_dict = primary_dict
+        self.secondary_dict = secondary_dict
+        self.on_missing = on_missing
+        self._table: Dict[str, float] = {}
+        for atom_type in list(primary_dict) + list(secondary_dict):
+            self._compile(atom_type)
+
+    def _compile(self, atom_type: str) -> float:
+        """
+        Resolve an atom type through both tables and cache the result; NaN
+        marks a type found in neither table.
+        """
+        element = atom_type.split(".")[0].upper()
+        radius = float("nan")
+        for rdict in (self.primary_dict, self.secondary_dict):
+            if atom_type in rdict:
+                radius = rdict[atom_type]
+                break
+            if element in rdict:
+                radius = rdict[element]
+                break
+        self._table[atom_type] = radius
+        return radius
+
+    def _missing(self, atom_types: Sequence[str]) -> float:
+        if self.on_missing == "raise":
+            raise KeyError(
+                f"Unable to find radius parameter for atom type(s) {sorted(set(atom_types))} "
+                f"in radius dictionary: {self.primary_dict}"
+            )
+        return float(self.on_missing)
+
+    def radius(self, atom_type: str) -> float:
+        """
+        Look up the radius of one atom type or element.
+
+        Parameters
+        ----------
+        atom_type : str
+            Sybyl atom type, e.g. "C.ar", or element symbol, e.g. "Cl".
+
+        Returns
+        -------
+        float
+            The radius, or the `on_missing` radius.
+        """
+        radius = self._table.get(atom_type)
+        if radius is None:
+            radius = self._compile(atom_type)
+        if radius != radius:
+            return self._missing([atom_type])
+        return radius
+
+    def radii(self, atom_types: Sequence[str]) -> "np.ndarray":
+        """
+        Look up the radii of a column of atom types at once.
+
+        Each distinct type is resolved once, and the radii are gathered with
+        one array lookup.
+
+        Parameters
+        ----------
+        atom_types : Sequence[str]
+            Sybyl atom types or element symbols.
+
+        Returns
+        -------
+        np.ndarray
+            The radius of each atom.
+        """
+        import numpy as np
+
+        unique_types, inverse = np.unique(np.asarray(atom_types, dtype=str), return_inverse=True)
+        unique_radii = np.array([
+            self._table[atom_type] if atom_type in self._table else self._compile(atom_type)
+            for atom_type in unique_types.tolist()
+        ], dtype=np.float64)
+        missing = np.isnan(unique_radii)
+        if missing.any():
+            unique_radii[missing] = self._missing(unique_types[missing].tolist())
+        return unique_radii[inverse.reshape(-1)]
+
+
+#: Resolvers built so far, keyed by the identity of their tables.
+_RESOLVERS: Dict[Tuple[int, int, Union[str, float]], RadiusResolver] = {}
+
+
+def get_resolver(
+    primary_dict: Dict[str, float] = RADII["zap9"],
+    secondary_dict: Dict[str, float] = RADII["bondi"],
+    on_missing: Union[str, float] = "raise",
+) -> RadiusResolver:
+    """
+    Get the shared resolver of a pair of radius tables, building it once.
+
+    Tables are identified by object identity, so a table must not be
+    modified after its resolver has been built.
+
+    Parameters
+    ----------
+    primary_dict, secondary_dict, on_missing
+        See `RadiusResolver`.
+
+    Returns
+    -------
+    RadiusResolver
+        The resolver of the table pair.
+    """
+    key = (id(primary_dict), id(secondary_dict), on_missing)
+    resolver = _RESOLVERS.get(key)
+    if resolver is None:
+        resolver = RadiusResolver(primary_dict, secondary_dict, on_missing)
+        _RESOLVERS[key] = resolver
+    return resolver
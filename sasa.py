@@ -0,0 +1,290 @@
+"""Shrake-Rupley solvent-accessible surface area from PQR radii.
+
+Every atom is covered with `n_points` test points on a sphere of radius
+`r + probe`; a point is accessible when it lies outside the expanded sphere
+of every other atom. Neighbouring atoms are found once with a
+`spatial.CellList`, so the points of an atom are only tested against the
+atoms whose expanded spheres overlap its own, and the tests of a whole chunk
+of atoms are one array operation.
+
+Burial by protein atoms and by ligand atoms is recorded separately, so a
+single pass gives the SASA of the complex and of the unbound protein and
+ligand, and therefore the SASA buried on binding.
+
+Compute the SASA of every generated complex::
+
+    python sasa.py --input-dir data/generated --output sasa.csv --residue-dir data/sasa_residues
+"""
+import argparse
+import csv
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from coulomb import residue_labels
+from pqr_arrays import find_complexes, load_complex
+from scheduler import file_cost, map_longest_first
+from spatial import CellList
+
+
+PROBE_RADIUS = 1.4
+DEFAULT_N_POINTS = 200
+
+
+class SASAResult(NamedTuple):
+    """Solvent-accessible surface areas of a complex, in Angstrom^2."""
+
+    #: SASA of each atom in the complex
+    atom_sasa: np.ndarray
+    #: SASA of each atom in its unbound partner (protein or ligand alone)
+    atom_sasa_unbound: np.ndarray
+    #: SASA of each residue in the complex, keyed as in `coulomb.residue_labels`
+    residue_sasa: Dict[str, float]
+    #: SASA of each residue buried on binding
+    residue_delta_sasa: Dict[str, float]
+    #: SASA of the unbound protein
+    protein_sasa: float
+    #: SASA of the unbound ligand
+    ligand_sasa: float
+    #: SASA of the complex
+    complex_sasa: float
+    #: SASA buried on binding, protein + ligand - complex
+    delta_sasa: float
+
+
+def sphere_points(n_points: int) -> np.ndarray:
+    """
+    Distribute points evenly on the unit sphere with the golden spiral.
+
+    Parameters
+    ----------
+    n_points : int
+        Number of points.
+
+    Returns
+    -------
+    np.ndarray
+        Unit vectors, shape (n_points, 3).
+    """
+    k = np.arange(n_points) + 0.5
+    z = 1 - 2 * k / n_points
+    rho = np.sqrt(1 - z * z)
+    phi = np.pi * (3 - np.sqrt(5)) * k
+    return np.column_stack([rho * np.cos(phi), rho * np.sin(phi), z])
+
+
+def _overlapping_neighbours(coords: np.ndarray, radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the ordered pairs (i, j), i != j, of atoms with overlapping spheres,
+    sorted by i.
+    """
+    if len(coords) < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy()
+    reach = 2 * float(radii.max())
+    i, j, dist = CellList(coords, reach).pairs(reach)
+    overlap = dist < radii[i] + radii[j]
+    i, j = i[overlap], j[overlap]
+    source = np.concatenate([i, j])
+    neighbour = np.concatenate([j, i])
+    order = np.argsort(source, kind="stable")
+    return source[order], neighbour[order]
+
+
+def shrake_rupley(
+    atoms: Dict[str, np.ndarray],
+    probe_radius: float = PROBE_RADIUS,
+    n_points: int = DEFAULT_N_POINTS,
+    pair_chunk_size: int = 8192,
+) -> SASAResult:
+    """
+    Compute per-atom, per-residue and total SASA of a complex and its parts.
+
+    Parameters
+    ----------
+    atoms : Dict[str, np.ndarray]
+        Atom arrays with "coords" and "radius" columns, e.g. from
+        `pqr_arrays.load_complex`. Atoms flagged in an "is_ligand" column are
+        the ligand; without it every atom belongs to the protein. The residue
+        columns are only used for the per-residue areas.
+    probe_radius : float
+        Solvent probe radius, in Angstrom.
+    n_points : int
+        Number of test points per atom.
+    pair_chunk_size : int
+        Number of neighbour pairs tested at once, to cap memory.
+
+    Returns
+    -------
+    SASAResult
+        Areas of the complex and of the unbound protein and ligand.
+    """
+    coords = np.asarray(atoms["coords"], dtype=np.float64)
+    n_atoms = len(coords)
+    is_ligand = np.asarray(atoms.get("is_ligand", np.zeros(n_atoms, dtype=bool)), dtype=bool)
+    radii = np.asarray(atoms["radius"], dtype=np.float64) + probe_radius
+    unit = sphere_points(n_points)
+
+    source, neighbour = _overlapping_neighbours(coords, radii)
+    counts = np.bincount(source, minlength=n_atoms)
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    # Fraction of each atom's points that are not buried by protein atoms, by
+    # ligand atoms, and by either
+    free_protein = np.ones(n_atoms)
+    free_ligand = np.ones(n_atoms)
+    free_both = np.ones(n_atoms)
+
+    first = 0
+    while first < n_atoms:
+        # Chunk of whole atoms whose pairs fit the chunk size
+        last = int(np.searchsorted(starts, starts[first] + pair_chunk_size, side="right")) - 1
+        last = min(max(last, first + 1), n_atoms)
+        chunk_atoms = np.arange(first, last)
+        chunk_atoms = chunk_atoms[counts[chunk_atoms] > 0]
+        pair_start, pair_stop = starts[first], starts[last]
+        first = last
+        if not len(chunk_atoms):
+            continue
+        i = source[pair_start:pair_stop]
+        j = neighbour[pair_start:pair_stop]
+        # Point p = c_i + R_i * u lies inside sphere j when
+        # 2 R_i u . (c_i - c_j) < R_j^2 - R_i^2 - |c_i - c_j|^2,
+        # so all tests of the chunk are one matrix product.
+        delta = coords[i] - coords[j]
+        threshold = radii[j] ** 2 - radii[i] ** 2 - np.einsum("ij,ij->i", delta, delta)
+        hit = (2 * radii[i, None] * delta) @ unit.T < threshold[:, None]
+        # Pairs are sorted by atom, so each atom's pairs are one run
+        runs = starts[chunk_atoms] - pair_start
+        by_ligand = np.logical_or.reduceat(hit & is_ligand[j, None], runs, axis=0)
+        by_protein = np.logical_or.reduceat(hit & ~is_ligand[j, None], runs, axis=0)
+        free_protein[chunk_atoms] = 1 - by_protein.mean(axis=1)
+        free_ligand[chunk_atoms] = 1 - by_ligand.mean(axis=1)
+        free_both[chunk_atoms] = 1 - (by_protein | by_ligand).mean(axis=1)
+
+    sphere_area = 4 * np.pi * radii ** 2
+    atom_sasa = sphere_area * free_both
+    atom_sasa_unbound = sphere_area * np.where(is_ligand, free_ligand, free_protein)
+
+    residue_sasa: Dict[str, float] = {}
+    residue_delta_sasa: Dict[str, float] = {}
+    if n_atoms and all(key in atoms for key in ("chain", "res_name", "res_seq", "ins_code")):
+        labels, inverse = np.unique(residue_labels(atoms), return_inverse=True)
+        residue_sasa = dict(zip(labels.tolist(), np.bincount(inverse, atom_sasa).tolist()))
+        residue_delta_sasa = dict(zip(
+            labels.tolist(), np.bincount(inverse, atom_sasa_unbound - atom_sasa).tolist()
+        ))
+
+    protein_sasa = float(atom_sasa_unbound[~is_ligand].sum())
+    ligand_sasa = float(atom_sasa_unbound[is_ligand].sum())
+    complex_sasa = float(atom_sasa.sum())
+    return SASAResult(
+        atom_sasa=atom_sasa,
+        atom_sasa_unbound=atom_sasa_unbound,
+        residue_sasa=residue_sasa,
+        residue_delta_sasa=residue_delta_sasa,
+        protein_sasa=protein_sasa,
+        ligand_sasa=ligand_sasa,
+        complex_sasa=complex_sasa,
+        delta_sasa=protein_sasa + ligand_sasa - complex_sasa,
+    )
+
+
+def _complex_sasa(job: Tuple[str, str, str, float, int]) -> Tuple[str, SASAResult]:
+    pdb_id, protein_file, ligand_file, probe_radius, n_points = job
+    return pdb_id, shrake_rupley(load_complex(protein_file, ligand_file), probe_radius, n_points)
+
+
+def process_dataset(
+    root_dir: str,
+    output_file: str,
+    probe_radius: float = PROBE_RADIUS,
+    n_points: int = DEFAULT_N_POINTS,
+    residue_dir: Optional[str] = None,
+    workers: int = 1,
+    timings_file: Optional[str] = None,
+) -> List[Tuple[str, float]]:
+    """
+    Compute the SASA of every complex in a tree.
+
+    Parameters
+    ----------
+    root_dir : str
+        Root directory of the generated PQR files, e.g. `data/generated`.
+    output_file : str
+        CSV file with one row of totals per complex.
+    probe_radius : float
+        Solvent probe radius, in Angstrom.
+    n_points : int
+        Number of test points per atom.
+    residue_dir : Optional[str]
+        If given, write `<PDB_ID>_residues.csv` with the per-residue areas of
+        each complex into this directory.
+    workers : int
+        Number of worker processes.
+    timings_file : Optional[str]
+        JSON file of run times of earlier runs, used to start the slowest
+        complexes first and updated with this run, see
+        `scheduler.map_longest_first`.
+
+    Returns
+    -------
+    List[Tuple[str, float]]
+        (PDB ID, buried SASA) of each complex.
+    """
+    jobs = [
+        (pdb_id, protein_file, ligand_file, probe_radius, n_points)
+        for pdb_id, protein_file, ligand_file in find_complexes(root_dir)
+    ]
+    if residue_dir is not None:
+        os.makedirs(residue_dir, exist_ok=True)
+
+    buried = []
+    results = map_longest_first(
+        _complex_sasa, jobs, [file_cost(job[1], job[2]) for job in jobs], workers,
+        [job[0] for job in jobs], f"sasa:{probe_radius}:{n_points}", timings_file,
+    )
+    with open(output_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["pdb_id", "protein_sasa", "ligand_sasa", "complex_sasa", "delta_sasa"])
+        for pdb_id, result in results:
+            writer.writerow([pdb_id, f"{result.protein_sasa:.3f}", f"{result.ligand_sasa:.3f}",
+                             f"{result.complex_sasa:.3f}", f"{result.delta_sasa:.3f}"])
+            buried.append((pdb_id, result.delta_sasa))
+            if residue_dir is not None:
+                residue_file = os.path.join(residue_dir, f"{pdb_id}_residues.csv")
+                with open(residue_file, "w", newline="") as residue_csv:
+                    residue_writer = csv.writer(residue_csv)
+                    residue_writer.writerow(["residue", "sasa", "delta_sasa"])
+                    for label, area in result.residue_sasa.items():
+                        residue_writer.writerow(
+                            [label, f"{area:.3f}", f"{result.residue_delta_sasa[label]:.3f}"]
+                        )
+    return buried
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compute Shrake-Rupley SASA and buried SASA of protein-ligand complexes.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Directory of generated PQR files (default: data/generated)")
+    parser.add_argument("--output", default="sasa.csv",
+                        help="CSV file of per-complex areas (default: sasa.csv)")
+    parser.add_argument("--probe-radius", dest="probe_radius", type=float, default=PROBE_RADIUS,
+                        help=f"Solvent probe radius in Angstrom (default: {PROBE_RADIUS})")
+    parser.add_argument("--points", dest="n_points", type=int, default=DEFAULT_N_POINTS,
+                        help=f"Test points per atom (default: {DEFAULT_N_POINTS})")
+    parser.add_argument("--residue-dir", dest="residue_dir", default=None,
+                        help="Directory for per-residue areas (default: not written)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    parser.add_argument("--timings", default=None,
+                        help="JSON file of run times for longest-first scheduling (default: not kept)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = process_dataset(args.input_dir, args.output, args.probe_radius, args.n_points,
+                              args.residue_dir, args.workers, args.timings)
+    print(f"Computed SASA of {len(results)} complexes into {args.output}")
@@ -0,0 +1,232 @@
+"""Longest-job-first scheduling of the per-complex batch stages.
+
+Protein sizes vary about fivefold across the dataset, so running complexes in
+directory order often starts the biggest one last, and that single job then
+sets the wall time. `map_longest_first` instead submits jobs to the process
+pool in order of decreasing estimated cost (the LPT rule), while still
+yielding results in input order so output files do not change.
+
+Costs start from a cheap signal, the line count of a complex's input files,
+and are refined by a `TimingHistory` of earlier runs: a complex that was
+timed before is estimated by its recorded time, scaled by how much its line
+count changed since, and the others by their line count times the median
+seconds per line of the recorded complexes.
+
+Stages that do not go through a process pool, such as the pdb2pqr jobs of
+`tool_runner.py` and the tasks of `work_queue.py`, order their inputs with
+`order_longest_first`.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+from file_io import open_file
+
+T = TypeVar("T")
+
+
+def count_lines(file_path: str, block_size: int = 1 << 20) -> int:
+    """
+    Count the lines of a, possibly compressed, file without parsing it.
+    """
+    n_lines = 0
+    with open_file(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            n_lines += block.count(b"\n")
+    return n_lines
+
+
+def file_cost(*file_paths: str) -> float:
+    """
+    Estimate the cost of a job from the total line count of its input files.
+    """
+    return float(sum(count_lines(file_path) for file_path in file_paths))
+
+
+def longest_first(costs: Sequence[float]) -> List[int]:
+    """
+    Order jobs by decreasing cost, keeping input order among equal costs.
+
+    Parameters
+    ----------
+    costs : Sequence[float]
+        Estimated cost of each job.
+
+    Returns
+    -------
+    List[int]
+        Job indices in submission order.
+    """
+    return np.argsort(-np.asarray(costs, dtype=np.float64), kind="stable").tolist()
+
+
+def order_longest_first(jobs: Iterable[T], cost: Callable[[T], float]) -> List[T]:
+    """
+    Collect jobs and order them by decreasing cost.
+
+    Parameters
+    ----------
+    jobs : Iterable[T]
+        Jobs, e.g. input files.
+    cost : Callable[[T], float]
+        Cost estimate of a job, e.g. `file_cost` of its input file.
+
+    Returns
+    -------
+    List[T]
+        The jobs, most expensive first, in input order among equal costs.
+    """
+    jobs = list(jobs)
+    return [jobs[i] for i in longest_first([cost(job) for job in jobs])]
+
+
+class TimingHistory:
+    """
+    Recorded run times of the jobs of each stage, kept in a JSON file.
+
+    The file maps a stage name to `{key: {"cost": float, "seconds": float}}`;
+    the stage name should include any option that changes the run time, such
+    as a cutoff.
+
+    Parameters
+    ----------
+    file_path : str
+        JSON file of the history; created on `save` if it does not exist.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.stages: Dict[str, Dict[str, Dict[str, float]]] = {}
+        if os.path.isfile(file_path):
+            with open(file_path) as file:
+                self.stages = json.load(file)
+
+    def estimate(self, stage: str, keys: Sequence[str], costs: Sequence[float]) -> List[float]:
+        """
+        Refine cost estimates with the recorded times of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        keys : Sequence[str]
+            Key of each job, e.g. its PDB ID.
+        costs : Sequence[float]
+            Cheap cost estimate of each job, e.g. from `file_cost`.
+
+        Returns
+        -------
+        List[float]
+            Estimated seconds of each job; the plain costs when the stage
+            has no recorded times. A recorded time is scaled by the ratio of
+            the current to the recorded cost, so a complex whose input
+            changed is not estimated by its old run time.
+        """
+        records = self.stages.get(stage, {})
+        rates = [record["seconds"] / record["cost"] for record in records.values() if record["cost"] > 0]
+        if not rates:
+            return [float(cost) for cost in costs]
+        rate = float(np.median(rates))
+        estimates = []
+        for key, cost in zip(keys, costs):
+            record = records.get(key)
+            if record is None or record["cost"] <= 0:
+                estimates.append(rate * float(cost))
+            else:
+                estimates.append(record["seconds"] * float(cost) / record["cost"])
+        return estimates
+
+    def record(self, stage: str, key: str, cost: float, seconds: float) -> None:
+        """
+        Record the run time of a job, replacing any earlier time.
+        """
+        self.stages.setdefault(stage, {})[key] = {"cost": float(cost), "seconds": float(seconds)}
+
+    def save(self) -> None:
+        """
+        Write the history, replacing the file only once it is fully written.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(directory, exist_ok=True)
+        temp_file = f"{self.file_path}.tmp"
+        with open(temp_file, "w") as file:
+            json.dump(self.stages, file, indent=1, sort_keys=True)
+        os.replace(temp_file, self.file_path)
+
+
+def _timed_call(func: Callable[[Any], Any], job: Any) -> Tuple[float, Any]:
+    start = time.perf_counter()
+    result = func(job)
+    return time.perf_counter() - start, result
+
+
+def map_longest_first(
+    func: Callable[[Any], Any],
+    jobs: Sequence[Any],
+    costs: Sequence[float],
+    workers: int = 1,
+    keys: Optional[Sequence[str]] = None,
+    stage: Optional[str] = None,
+    timings_file: Optional[str] = None,
+) -> Iterator[Any]:
+    """
+    Run jobs on a process pool longest-first, yielding results in input order.
+
+    A drop-in replacement for `ProcessPoolExecutor.map`: results come back in
+    the order of `jobs`, and those that finish early are held until their
+    turn.
+
+    Parameters
+    ----------
+    func : Callable[[Any], Any]
+        Picklable function applied to each job.
+    jobs : Sequence[Any]
+        Jobs, in output order.
+    costs : Sequence[float]
+        Cheap cost estimate of each job, e.g. from `file_cost`.
+    workers : int
+        Number of worker processes.
+    keys : Optional[Sequence[str]]
+        Key of each job in the timing history; needed with `timings_file`.
+    stage : Optional[str]
+        Stage name in the timing history; needed with `timings_file`.
+    timings_file : Optional[str]
+        JSON `TimingHistory` used to refine the estimates and updated with
+        the times of this run. Without it, jobs are ordered by `costs`.
+
+    Yields
+    ------
+    Any
+        `func(job)` for each job, in input order.
+    """
+    history = None
+    if timings_file is not None:
+        if keys is None or stage is None:
+            raise ValueError("A timings file needs the job keys and the stage name.")
+        history = TimingHistory(timings_file)
+        costs_estimate = history.estimate(stage, keys, costs)
+    else:
+        costs_estimate = list(costs)
+
+    results: Dict[int, Any] = {}
+    next_index = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # The pool starts queued jobs in submission order
+            futures = {executor.submit(_timed_call, func, jobs[i]): i
+                       for i in longest_first(costs_estimate)}
+            for future in as_completed(futures):
+                i = futures[future]
+                seconds, results[i] = future.result()
+                if history is not None:
+                    history.record(stage, keys[i], costs[i], seconds)
+                while next_index in results:
+                    yield results.pop(next_index)
+                    next_index += 1
+    finally:
+        if history is not None:
+            history.save()
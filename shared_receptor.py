@@ -0,0 +1,285 @@
+"""Share one receptor's atom arrays and cell list across worker processes.
+
+When ligands are charged or scored in a process pool, every worker would
+otherwise read the protein PQR and build its own copy of the arrays and the
+spatial index. `SharedReceptor` loads the receptor once in the parent and
+publishes every array through `multiprocessing.shared_memory`. Workers
+attach to the blocks by name with `attach_receptor` and get NumPy views of
+the same memory, so receptor memory does not grow with the number of
+workers.
+
+The parent owns the blocks: `SharedReceptor.close()` (or leaving its `with`
+block) unlinks them. Workers only close their mappings.
+
+Score many ligands against one receptor::
+
+    python shared_receptor.py --protein data/generated/1bcu/1bcu_protein.pqr \\
+                              --ligands pose1.pqr pose2.pqr ... --workers 16
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from coulomb import DEFAULT_CUTOFF, coulomb_interaction
+from pqr_arrays import read_pqr_atoms
+from spatial import CellList
+
+
+#: Shared array description: (shared memory block name, shape, dtype string).
+BlockSpec = Tuple[str, Tuple[int, ...], str]
+
+
+class ReceptorHandle:
+    """
+    Picklable description of a published receptor, passed to workers.
+
+    Parameters
+    ----------
+    atoms : Dict[str, BlockSpec]
+        Shared blocks of the atom arrays.
+    cell_list : Dict[str, BlockSpec]
+        Shared blocks of the cell list arrays.
+    """
+
+    def __init__(self, atoms: Dict[str, BlockSpec], cell_list: Dict[str, BlockSpec]) -> None:
+        self.atoms = atoms
+        self.cell_list = cell_list
+
+
+def _publish(array: np.ndarray) -> Tuple[SharedMemory, np.ndarray]:
+    array = np.asarray(array)
+    # Zero-size blocks are not allowed
+    block = SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return block, shared
+
+
+def _attach(spec: BlockSpec) -> Tuple[SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    try:
+        # Python 3.13+: do not let this process's resource tracker claim the block
+        block = SharedMemory(name=name, track=False)
+    except TypeError:
+        block = SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+class SharedReceptor:
+    """
+    Owner of a receptor published in shared memory.
+
+    Parameters
+    ----------
+    atoms : Dict[str, np.ndarray]
+        Receptor atom arrays, see `pqr_arrays.read_pqr_atoms`.
+    cell_size : float
+        Cell size of the published `spatial.CellList`.
+    """
+
+    def __init__(self, atoms: Dict[str, np.ndarray], cell_size: float = DEFAULT_CUTOFF) -> None:
+        self._blocks: List[SharedMemory] = []
+        self.atoms: Dict[str, np.ndarray] = {}
+        atom_specs: Dict[str, BlockSpec] = {}
+        cell_specs: Dict[str, BlockSpec] = {}
+        try:
+            for key, array in atoms.items():
+                atom_specs[key] = self._add(key, array, self.atoms)
+            cell_arrays: Dict[str, np.ndarray] = {}
+            for key, array in CellList(self.atoms["coords"], cell_size).to_arrays().items():
+                cell_specs[key] = self._add(key, array, cell_arrays)
+            self.cell_list = CellList.from_arrays(cell_arrays)
+        except BaseException:
+            self.close()
+            raise
+        self.handle = ReceptorHandle(atom_specs, cell_specs)
+
+    def _add(self, key: str, array: np.ndarray, published: Dict[str, np.ndarray]) -> BlockSpec:
+        block, shared = _publish(array)
+        self._blocks.append(block)
+        published[key] = shared
+        return (block.name, shared.shape, shared.dtype.str)
+
+    @classmethod
+    def from_pqr(cls, protein_file: str, cell_size: float = DEFAULT_CUTOFF) -> "SharedReceptor":
+        """
+        Read a receptor PQR file and publish it.
+        """
+        return cls(read_pqr_atoms(protein_file), cell_size)
+
+    def close(self) -> None:
+        """
+        Release and unlink the shared blocks. Attached workers must be done.
+        """
+        self.atoms = {}
+        self.cell_list = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self) -> "SharedReceptor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class AttachedReceptor:
+    """
+    Zero-copy, read-only view of a receptor published by `SharedReceptor`.
+
+    Parameters
+    ----------
+    handle : ReceptorHandle
+        Handle of the published receptor.
+    """
+
+    def __init__(self, handle: ReceptorHandle) -> None:
+        self._blocks: List[SharedMemory] = []
+        self.atoms: Dict[str, np.ndarray] = {}
+        cell_arrays: Dict[str, np.ndarray] = {}
+        for specs, arrays in ((handle.atoms, self.atoms), (handle.cell_list, cell_arrays)):
+            for key, spec in specs.items():
+                block, arrays[key] = _attach(spec)
+                self._blocks.append(block)
+        self.cell_list = CellList.from_arrays(cell_arrays)
+
+    def close(self) -> None:
+        """
+        Close this process's mappings; the blocks stay alive for the owner.
+        """
+        self.atoms = {}
+        self.cell_list = None
+        for block in self._blocks:
+            block.close()
+        self._blocks = []
+
+    def __enter__(self) -> "AttachedReceptor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def attach_receptor(handle: ReceptorHandle) -> AttachedReceptor:
+    """
+    Attach to a published receptor from a worker process.
+    """
+    return AttachedReceptor(handle)
+
+
+#: Receptor attached by `_init_worker` in each pool process.
+_WORKER_RECEPTOR: Optional[AttachedReceptor] = None
+
+
+def _init_worker(handle: ReceptorHandle) -> None:
+    global _WORKER_RECEPTOR
+    _WORKER_RECEPTOR = attach_receptor(handle)
+
+
+def worker_receptor() -> AttachedReceptor:
+    """
+    Get the receptor attached by this pool worker, see `map_with_receptor`.
+    """
+    if _WORKER_RECEPTOR is None:
+        raise RuntimeError("No receptor is attached in this process.")
+    return _WORKER_RECEPTOR
+
+
+def _score_ligand(job: Tuple[str, float]) -> float:
+    ligand_file, cutoff = job
+    receptor = worker_receptor()
+    result = coulomb_interaction(receptor.atoms, read_pqr_atoms(ligand_file),
+                                 cutoff=cutoff, cell_list=receptor.cell_list)
+    return result.energy
+
+
+def map_with_receptor(
+    receptor: SharedReceptor,
+    func: Callable,
+    jobs: List,
+    workers: int,
+) -> List:
+    """
+    Run `func(job)` for every job in a pool whose workers share `receptor`.
+
+    Each worker attaches once, at start-up; `func` gets the receptor from
+    `worker_receptor()` and must be a module-level function.
+
+    Parameters
+    ----------
+    receptor : SharedReceptor
+        The published receptor.
+    func : Callable
+        Function applied to every job.
+    jobs : List
+        Picklable job descriptions.
+    workers : int
+        Number of worker processes.
+
+    Returns
+    -------
+    List
+        Results in job order.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(receptor.handle,)) as executor:
+        return list(executor.map(func, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+def score_ligands(
+    protein_file: str,
+    ligand_files: List[str],
+    workers: int,
+    cutoff: float = DEFAULT_CUTOFF,
+) -> List[float]:
+    """
+    Compute the Coulomb energy of many ligands against one shared receptor.
+
+    Parameters
+    ----------
+    protein_file : str
+        Receptor PQR file, read once.
+    ligand_files : List[str]
+        Ligand PQR files.
+    workers : int
+        Number of worker processes.
+    cutoff : float
+        Interaction cutoff, in Angstrom.
+
+    Returns
+    -------
+    List[float]
+        Interaction energy of each ligand, in kcal/mol.
+    """
+    with SharedReceptor.from_pqr(protein_file, cutoff) as receptor:
+        return map_with_receptor(receptor, _score_ligand,
+                                 [(ligand_file, cutoff) for ligand_file in ligand_files], workers)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Score ligand PQR files against one receptor shared by all workers.")
+    parser.add_argument("--protein", required=True,
+                        help="Receptor PQR file")
+    parser.add_argument("--ligands", nargs="+", required=True,
+                        help="Ligand PQR files")
+    parser.add_argument("--cutoff", type=float, default=DEFAULT_CUTOFF,
+                        help=f"Interaction cutoff in Angstrom (default: {DEFAULT_CUTOFF})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    energies = score_ligands(args.protein, args.ligands, args.workers, args.cutoff)
+    for ligand_file, energy in zip(args.ligands, energies):
+        print(f"{ligand_file}\t{energy:.4f}")
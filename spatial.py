@@ -0,0 +1,248 @@
+"""Cell list for cutoff-based neighbour searches on atom coordinates.
+
+Atoms are binned into cubic cells and sorted by cell, so the atoms near a
+query point are found by visiting the few cells around it instead of every
+atom. All searches are vectorised over the query points: the candidate atoms
+of all queries are gathered cell offset by cell offset and filtered by
+distance in one array operation per offset.
+"""
+from itertools import product
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+def expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Concatenate the integer ranges `starts[i]:starts[i] + counts[i]`.
+
+    Parameters
+    ----------
+    starts : np.ndarray
+        Start of each range.
+    counts : np.ndarray
+        Length of each range.
+
+    Returns
+    -------
+    np.ndarray
+        The concatenated ranges, without a Python loop over the ranges.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    range_starts = np.cumsum(counts) - counts
+    return (
+        np.arange(total, dtype=np.int64)
+        - np.repeat(range_starts, counts)
+        + np.repeat(np.asarray(starts, dtype=np.int64), counts)
+    )
+
+
+class CellList:
+    """
+    Spatial index of a set of atoms binned into cubic cells.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        Atom coordinates, shape (N, 3).
+    cell_size : float
+        Edge length of the cells, in Angstrom. Searches are fastest when the
+        cutoff is close to the cell size.
+    """
+
+    def __init__(self, coords: np.ndarray, cell_size: float) -> None:
+        if cell_size <= 0:
+            raise ValueError(f"Cell size must be positive, got {cell_size}")
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.cell_size = float(cell_size)
+        if len(self.coords):
+            self.origin = self.coords.min(axis=0)
+            cells = self._cells_of(self.coords)
+            self.dims = cells.max(axis=0) + 1
+        else:
+            self.origin = np.zeros(3)
+            cells = np.empty((0, 3), dtype=np.int64)
+            self.dims = np.ones(3, dtype=np.int64)
+        keys = self._keys_of(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+        # Coordinate columns in cell order; 1-D gathers are much faster than
+        # gathering rows of the (N, 3) array.
+        self._sorted_columns = tuple(
+            np.ascontiguousarray(self.coords[self.order, axis]) for axis in range(3)
+        )
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Export the index as arrays, e.g. to place it in shared memory.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            Every array needed by `from_arrays`.
+        """
+        return {
+            "coords": self.coords,
+            "cell_size": np.array(self.cell_size),
+            "origin": self.origin,
+            "dims": self.dims,
+            "order": self.order,
+            "cell_keys": self.cell_keys,
+            "cell_starts": self.cell_starts,
+            "cell_counts": self.cell_counts,
+            "sorted_x": self._sorted_columns[0],
+            "sorted_y": self._sorted_columns[1],
+            "sorted_z": self._sorted_columns[2],
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "CellList":
+        """
+        Rebuild an index from `to_arrays` output without copying or re-sorting.
+
+        Parameters
+        ----------
+        arrays : Dict[str, np.ndarray]
+            Arrays exported by `to_arrays`.
+
+        Returns
+        -------
+        CellList
+            An index that uses the given arrays as its storage.
+        """
+        cell_list = cls.__new__(cls)
+        cell_list.coords = arrays["coords"]
+        cell_list.cell_size = float(arrays["cell_size"])
+        cell_list.origin = arrays["origin"]
+        cell_list.dims = arrays["dims"]
+        cell_list.order = arrays["order"]
+        cell_list.cell_keys = arrays["cell_keys"]
+        cell_list.cell_starts = arrays["cell_starts"]
+        cell_list.cell_counts = arrays["cell_counts"]
+        cell_list._sorted_columns = (arrays["sorted_x"], arrays["sorted_y"], arrays["sorted_z"])
+        return cell_list
+
+    def _cells_of(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def _keys_of(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def query(
+        self,
+        points: np.ndarray,
+        cutoff: float,
+        chunk_size: int = 65536,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all (point, atom) pairs closer than `cutoff`.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            Query coordinates, shape (M, 3).
+        cutoff : float
+            Distance cutoff, in Angstrom.
+        chunk_size : int
+            Number of query points processed at once, to cap memory.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+            Indices into `points`, indices into the indexed atoms, and the
+            pair distances. Pairs are grouped by query point chunk but not
+            otherwise sorted.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        reach = int(np.ceil(cutoff / self.cell_size))
+        offsets = np.array(list(product(range(-reach, reach + 1), repeat=3)), dtype=np.int64)
+        # Skip neighbour cells whose closest corner is beyond the cutoff
+        gap = np.maximum(np.abs(offsets) - 1, 0) * self.cell_size
+        offsets = offsets[np.einsum("ij,ij->i", gap, gap) <= cutoff * cutoff]
+        cutoff_sq = cutoff * cutoff
+        found_i, found_j, found_d = [], [], []
+        for chunk_start in range(0, len(points), chunk_size):
+            chunk = points[chunk_start:chunk_start + chunk_size]
+            point_cells = self._cells_of(chunk)
+            chunk_columns = [np.ascontiguousarray(chunk[:, axis]) for axis in range(3)]
+            for offset in offsets:
+                cells = point_cells + offset
+                valid = np.flatnonzero(np.all((cells >= 0) & (cells < self.dims), axis=1))
+                if not len(valid) or not len(self.cell_keys):
+                    continue
+                keys = self._keys_of(cells[valid])
+                pos = np.searchsorted(self.cell_keys, keys)
+                pos[pos == len(self.cell_keys)] = 0
+                hit = self.cell_keys[pos] == keys
+                valid, pos = valid[hit], pos[hit]
+                counts = self.cell_counts[pos]
+                i = np.repeat(valid, counts)
+                sorted_j = expand_ranges(self.cell_starts[pos], counts)
+                dist_sq = np.zeros(len(i))
+                for axis in range(3):
+                    delta = chunk_columns[axis].take(i) - self._sorted_columns[axis].take(sorted_j)
+                    dist_sq += delta * delta
+                within = dist_sq <= cutoff_sq
+                found_i.append(i[within] + chunk_start)
+                found_j.append(self.order.take(sorted_j[within]))
+                found_d.append(np.sqrt(dist_sq[within]))
+        if not found_i:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty.copy(), np.empty(0, dtype=np.float64)
+        return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d)
+
+    def pairs(self, cutoff: float, chunk_size: int = 65536) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all pairs of indexed atoms closer than `cutoff`, each pair once.
+
+        Parameters
+        ----------
+        cutoff : float
+            Distance cutoff, in Angstrom.
+        chunk_size : int
+            Number of atoms processed at once, to cap memory.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+            Atom indices `i < j` and the pair distances.
+        """
+        i, j, dist = self.query(self.coords, cutoff, chunk_size)
+        upper = i < j
+        return i[upper], j[upper], dist[upper]
+
+
+def neighbour_pairs(
+    coords: np.ndarray,
+    cutoff: float,
+    cell_list: Optional[CellList] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find all pairs of atoms closer than `cutoff`, each pair once.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        Atom coordinates, shape (N, 3).
+    cutoff : float
+        Distance cutoff, in Angstrom.
+    cell_list : Optional[CellList]
+        Prebuilt cell list of `coords`; built with `cell_size=cutoff` if not
+        given.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Atom indices `i < j` and the pair distances.
+    """
+    if cell_list is None:
+        cell_list = CellList(coords, cutoff)
+    return cell_list.pairs(cutoff)
@@ -0,0 +1,34 @@
+import csv
+import logging
+
+from apbs_inputs import SPACING_WARNING_FACTOR, write_apbs_inputs
+
+PROTEIN_LINES = (
+    "ATOM      1  N   GLY     1       0.000   0.000   0.000 -0.3000 1.8240\n"
+    "ATOM      2  CA  GLY     1     {0:7.3f} {0:7.3f} {0:7.3f}  0.1000 1.9080\n"
+)
+LIGAND_LINE = "HETATM    1  C   LIG     1       1.000   1.000   1.000  0.0000 1.9080\n"
+
+
+def _write_complex(root, pdb_id, size):
+    directory = root / pdb_id
+    directory.mkdir()
+    protein = PROTEIN_LINES.format(size)
+    (directory / f"{pdb_id}_protein.pqr").write_text(protein)
+    (directory / f"{pdb_id}_ligand.pqr").write_text(LIGAND_LINE)
+    (directory / f"{pdb_id}_combined.pqr").write_text(protein + LIGAND_LINE)
+
+
+def test_coarsened_grids_are_reported(tmp_path, caplog):
+    _write_complex(tmp_path, "1big", 120.0)
+    _write_complex(tmp_path, "1sml", 5.0)
+    summary_file = tmp_path / "grids.csv"
+    with caplog.at_level(logging.WARNING, logger="apbs_inputs"):
+        write_apbs_inputs(str(tmp_path), memory_mb=100.0, spacing=0.5, summary_file=str(summary_file))
+
+    with open(summary_file, newline="") as file:
+        rows = {row["pdb_id"]: row for row in csv.DictReader(file)}
+    assert float(rows["1big"]["fine_spacing"]) > SPACING_WARNING_FACTOR * 0.5
+    assert (rows["1big"]["coarsened"], rows["1sml"]["coarsened"]) == ("1", "0")
+    warnings = [record.getMessage() for record in caplog.records]
+    assert len(warnings) == 1 and warnings[0].startswith("1big: fine spacing")
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from catalog import Catalog, PQRStats
+from form_complex_pqr import process_directory
+
+#: pdb2pqr line of 3n76 whose x and y coordinates run into each other
+FUSED_LINE = "ATOM  10926  N   GLU     2     -64.019-110.103 -82.358  0.0017 1.8240\n"
+LIGAND_LINE = "HETATM 1 CL UNL 1 -44.156 -10.384 -18.927 -0.08352117 1.820000 Cl\n"
+
+
+def test_stats_of_fused_coordinates():
+    stats = PQRStats()
+    stats.add_line(FUSED_LINE)
+    stats.add_line(LIGAND_LINE)
+    assert (stats.n_atoms, stats.n_hetatm, stats.n_zero_radius) == (2, 1, 0)
+    assert stats.net_charge == pytest.approx(0.0017 - 0.08352117)
+    assert stats.bounding_box() == pytest.approx((-64.019, -110.103, -82.358, -44.156, -10.384, -18.927))
+
+
+def test_failed_combine_leaves_no_combined_file(tmp_path, monkeypatch):
+    directory = tmp_path / "3n76"
+    directory.mkdir()
+    (directory / "3n76_protein.pqr").write_text(FUSED_LINE * 3)
+    (directory / "3n76_ligand.pqr").write_text(LIGAND_LINE)
+
+    def fail(self, line):
+        raise ValueError("bad line")
+
+    monkeypatch.setattr(PQRStats, "add_line", fail)
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    with pytest.raises(ValueError):
+        process_directory(str(directory), catalog=catalog)
+    catalog.close()
+    assert sorted(os.listdir(directory)) == ["3n76_ligand.pqr", "3n76_protein.pqr"]
+
+
+def test_pdb2pqr_job_records_protein(tmp_path):
+    from tool_runner import _finish_protein
+
+    pdb_file = tmp_path / "1abc_protein.pdb"
+    pdb_file.write_text("ATOM\n")
+    partial_file = tmp_path / ".tmp-1-1abc_protein.pqr"
+    partial_file.write_text(FUSED_LINE * 2)
+    output_file = str(tmp_path / "1abc_protein.pqr")
+    with Catalog(str(tmp_path / "catalog.db")) as catalog:
+        _finish_protein(str(partial_file), output_file, str(pdb_file), catalog)
+        (row,) = catalog.query()
+    assert (row["pdb_id"], row["kind"], row["n_atoms"]) == ("1abc", "protein", 2)
+    assert str(pdb_file) in row["inputs"]
@@ -0,0 +1,58 @@
+import os
+import stat
+from pathlib import Path
+
+import pytest
+
+from batch_journal import QUARANTINED, BatchJournal
+from convert_sdf_to_pqr import process_files, update_pqr_radii
+
+#: Open Babel stand-in that writes part of its output, then fails
+FAILING_OBABEL = """#!/bin/sh
+while [ "$#" -gt 0 ]; do [ "$1" = "-O" ] && echo "HETATM 1 C UNL 1" > "$2"; shift; done
+echo "Open Babel Error in ReadMolecule: bad atom block" >&2
+exit {status}
+"""
+
+
+@pytest.mark.parametrize("status, message", [(1, "exit status 1"), (0, "wrote no molecule")])
+def test_failed_obabel_is_journaled_with_its_error(tmp_path, monkeypatch, status, message):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    obabel = bin_dir / "obabel"
+    # With status 0 the fake writes nothing, as Open Babel does for unreadable molecules
+    obabel.write_text(FAILING_OBABEL.format(status=status) if status else
+                      "#!/bin/sh\necho '0 molecules converted' >&2\n")
+    obabel.chmod(obabel.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    # Outputs mirror the tree under data/pdbbind of the working directory
+    monkeypatch.chdir(tmp_path)
+    sdf_file = Path("data", "pdbbind", "1abc", "1abc_ligand.sdf")
+    sdf_file.parent.mkdir(parents=True)
+    sdf_file.write_text("1abc\n")
+    output_dir = tmp_path / "generated"
+
+    with BatchJournal(str(tmp_path / "journal.jsonl"), max_attempts=1, backoff=0.0) as journal:
+        process_files([sdf_file], str(output_dir), "AMBER", journal=journal)
+        state = journal.state("obabel", "1abc_ligand")
+
+    assert state.status == QUARANTINED
+    assert state.error.startswith("RuntimeError: ") and message in state.error
+    if status:
+        assert "bad atom block" in state.error
+    # Neither the final PQR file nor the raw Open Babel output is left behind
+    assert not [path for path in output_dir.rglob("*") if path.is_file()]
+
+
+@pytest.mark.parametrize("on_missing, radius", [(0.0, "0.000000"), (1.5, "1.500000")])
+def test_missing_radius_fallback(tmp_path, on_missing, radius):
+    raw_file = tmp_path / "raw.pqr"
+    raw_file.write_text("HETATM 1 C UNL 1 0.0 0.0 0.0 0.1 1.9 C\nHETATM 2 Xx UNL 1 1.0 0.0 0.0 -0.1 1.9 Xx\n")
+    output_file = tmp_path / "ligand.pqr"
+    update_pqr_radii(str(raw_file), str(output_file), on_missing=on_missing)
+    radii = [line.split()[-2] for line in output_file.read_text().splitlines()]
+    assert radii == ["1.870000", radius]
+
+    with pytest.raises(KeyError, match="Xx"):
+        update_pqr_radii(str(raw_file), str(output_file), on_missing="raise")
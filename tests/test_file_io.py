@@ -0,0 +1,19 @@
+import pytest
+
+from file_io import open_file
+
+LINES = ["ATOM      1  N   ALA A   1       1.000   2.000   3.000 -0.3000 1.8240\n", "END\n"]
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_compressed_round_trip_by_line(suffix, tmp_path):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    file_path = tmp_path / f"protein.pqr{suffix}"
+    with open_file(file_path, "w") as file:
+        file.writelines(LINES)
+
+    with open_file(file_path, "r") as file:
+        assert list(file) == LINES
+    with open_file(file_path, "rb") as file:
+        assert list(file) == [line.encode() for line in LINES]
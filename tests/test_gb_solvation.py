@@ -0,0 +1,58 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from gb_solvation import gb_solvation
+from pqr_arrays import crop_pocket, load_complex
+
+GENERATED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "generated")
+
+
+@pytest.fixture(scope="module")
+def atoms():
+    complex_dir = os.path.join(GENERATED_DIR, "1bcu")
+    return load_complex(os.path.join(complex_dir, "1bcu_protein.pqr"),
+                        os.path.join(complex_dir, "1bcu_ligand.pqr"))
+
+
+@pytest.fixture(scope="module")
+def pocket(atoms):
+    return crop_pocket(atoms, 8.0)
+
+
+def test_complex_energy_is_negative_and_stable_in_cutoff(atoms):
+    short = gb_solvation(atoms, cutoff=12.0)
+    long = gb_solvation(atoms, cutoff=30.0)
+
+    assert short.complex_energy < 0
+    assert long.complex_energy < 0
+    assert short.complex_energy == pytest.approx(long.complex_energy, rel=0.1)
+    assert 1.0 < float(short.born_radii.mean()) < 6.0
+
+
+def test_descreening_cutoff_matches_uncut_integral(pocket):
+    cut = gb_solvation(pocket)
+    uncut = gb_solvation(pocket, descreen_cutoff=None)
+
+    assert cut.complex_energy == pytest.approx(uncut.complex_energy, rel=0.01)
+    assert cut.delta_energy == pytest.approx(uncut.delta_energy, rel=0.01)
+    assert np.all(cut.born_radii <= uncut.born_radii + 1e-12)
+
+
+def test_blocks_give_same_energies_in_less_memory(pocket):
+    def run(block_size):
+        tracemalloc.start()
+        result = gb_solvation(pocket, descreen_cutoff=None, block_size=block_size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, peak
+
+    small, small_peak = run(32)
+    large, large_peak = run(len(pocket["coords"]))
+
+    assert small.complex_energy == pytest.approx(large.complex_energy, rel=1e-12)
+    assert small.delta_energy == pytest.approx(large.delta_energy, rel=1e-9)
+    np.testing.assert_allclose(small.born_radii, large.born_radii, rtol=1e-12)
+    assert small_peak < large_peak / 3
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from ligand_variants import ProtonationVariant, VariantTopology, read_ligand
+
+LIGAND_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "data", "pdbbind", "1bcu", "1bcu_ligand.mol2")
+
+
+def test_remove_hydrogen_drops_one_charge(tmp_path):
+    topology = VariantTopology(read_ligand(LIGAND_FILE))
+    # A hydrogen on the aromatic nitrogen N10, by serial since every
+    # hydrogen of the ligand is named "H"
+    nitrogen = topology.index["N10"]
+    hydrogen = next(int(b if a == nitrogen else a) for a, b in topology.bonds
+                    if nitrogen in (a, b) and topology.hydrogen[b if a == nitrogen else a])
+    serial = str(topology.atoms[hydrogen].serial)
+    variants = [ProtonationVariant("protonated"), ProtonationVariant("neutral", remove_hydrogens=(serial,))]
+
+    charges = topology.charges(variants)
+
+    assert np.isnan(charges[1, hydrogen])
+    assert np.isnan(charges).sum() == 1
+    assert np.nansum(charges[1]) == pytest.approx(np.nansum(charges[0]) - 1.0)
+
+    output_file = tmp_path / "neutral.pqr"
+    topology.write_pqr(charges[1], str(output_file))
+    lines = output_file.read_text().splitlines()
+    assert len(lines) == len(topology.atoms) - 1
+    written = [tuple(float(value) for value in line.split()[5:8]) for line in lines]
+    kept = [(round(atom.x, 3), round(atom.y, 3), round(atom.z, 3))
+            for i, atom in enumerate(topology.atoms) if i != hydrogen]
+    assert written == kept
@@ -0,0 +1,63 @@
+import math
+
+import polars as pl
+
+from mol2_to_pqr import append_ligand_to_protein_pqr
+
+
+def test_append_ligand_maps_radii_and_renumbers():
+    protein = pl.DataFrame({
+        "recordName": ["ATOM", "ATOM"],
+        "serial": [7, 9],
+        "atomName": ["N", "CA"],
+        "residueName": ["GLY", "GLY"],
+        "residueNumber": [3.0, 3.0],
+        "X": [0.0, 1.0], "Y": [0.0, 1.0], "Z": [0.0, 1.0],
+        "charge": [-0.3, 0.1],
+        "radius": [1.824, 1.908],
+    })
+    ligand = pl.DataFrame({
+        "atom_id": [1, 2, 3],
+        "atom_name": ["C12", "N1", "Br"],
+        "x": [2.0, 3.0, 4.0], "y": [2.0, 3.0, 4.0], "z": [2.0, 3.0, 4.0],
+        "atom_type": ["C.3", "N.am", "Br"],
+        "subst_id": [1, 1, 1],
+        "subst_name": ["UNL", "UNL", "UNL"],
+        "charge": [0.05, -0.4, -0.1],
+    })
+    combined = append_ligand_to_protein_pqr(protein, ligand, {"C": 1.908, "N": 1.824})
+
+    assert combined.columns == protein.columns
+    assert combined["serial"].to_list() == [1, 2, 3, 4, 5]
+    assert combined["recordName"].to_list() == ["ATOM", "ATOM", "HETATM", "HETATM", "HETATM"]
+    assert combined["residueName"].to_list()[2:] == ["LIG"] * 3
+    assert combined["atomName"].to_list()[2:] == ["C12", "N1", "Br"]
+    radii = combined["radius"].to_list()
+    assert radii[:4] == [1.824, 1.908, 1.908, 1.824]
+    assert math.isnan(radii[4])
+
+
+def test_write_pqr_from_columns(tmp_path):
+    from catalog import PQRStats
+    from mol2_to_pqr import create_atom_info_mapping, write_pqr
+
+    atoms = pl.DataFrame({
+        "recordName": ["ATOM", "ATOM", "HETATM"],
+        "serial": [1, 2, 3],
+        "atomName": ["CA", "CA1", "HA"],
+        "residueName": ["GLY", "GLY", "LIG"],
+        "residueNumber": [3.0, 3.0, 1.0],
+        "X": [0.0, 1.5, -2.0], "Y": [0.0, 1.0, 4.0], "Z": [0.0, 1.0, 1.0],
+        "charge": [-0.3, 0.1, 0.2],
+        "radius": [1.908, 1.7, 0.0],
+    })
+    assert create_atom_info_mapping(atoms) == {"CA": 1.908}
+
+    output_file = tmp_path / "complex.pqr"
+    stats = PQRStats()
+    write_pqr(atoms, str(output_file), stats)
+    lines = output_file.read_text().splitlines()
+    assert lines[0] == "ATOM      1   CA GLY    3       0.000    0.000    0.000  -0.3000  1.9080"
+    assert lines[2].startswith("HETATM    3   HA LIG    1")
+    assert (stats.n_atoms, stats.n_hetatm, stats.n_zero_radius) == (3, 1, 1)
+    assert stats.bounding_box() == (-2.0, 0.0, 0.0, 1.5, 4.0, 1.0)
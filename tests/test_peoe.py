@@ -0,0 +1,29 @@
+import glob
+import os
+
+import numpy as np
+
+import peoe
+from ligand_variants import VariantTopology, read_ligand
+
+PDBBIND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "pdbbind")
+
+
+def test_batch_matches_scalar_equilibrate():
+    n_compared = 0
+    for mol2_file in sorted(glob.glob(os.path.join(PDBBIND_DIR, "*", "*_ligand.mol2"))):
+        molecule = read_ligand(mol2_file)
+        try:
+            topology = VariantTopology(molecule)
+            terms = peoe.term_array(topology.types)
+        except KeyError:
+            # Atom types without radii or PEOE terms fail in both paths
+            continue
+        formal_charges = np.tile(topology.formal_charges, (2, 1))
+        batch = peoe.equilibrate_batch(formal_charges, terms, topology.hydrogen, topology.bonds)
+
+        molecule.assign_charges()
+        scalar = np.array([atom.charge for atom in topology.atoms])
+        np.testing.assert_allclose(batch, np.tile(scalar, (2, 1)), rtol=0, atol=1e-12, err_msg=mol2_file)
+        n_compared += 1
+    assert n_compared > 200
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+
+from pqr_arrays import crop_pocket, load_complex
+from sasa import PROBE_RADIUS, shrake_rupley, sphere_points
+
+GENERATED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "generated")
+
+
+def _brute_force_free(coords, radii, buried_by, n_points):
+    """Fraction of each atom's points outside every other atom in `buried_by`."""
+    unit = sphere_points(n_points)
+    free = np.ones(len(coords))
+    for i in range(len(coords)):
+        points = coords[i] + radii[i] * unit
+        others = np.flatnonzero(buried_by & (np.arange(len(coords)) != i))
+        dist = np.linalg.norm(points[:, None, :] - coords[None, others, :], axis=2)
+        free[i] = 1 - (dist < radii[others]).any(axis=1).mean()
+    return free
+
+
+def test_matches_brute_force_on_pocket():
+    complex_dir = os.path.join(GENERATED_DIR, "1bcu")
+    atoms = crop_pocket(load_complex(os.path.join(complex_dir, "1bcu_protein.pqr"),
+                                     os.path.join(complex_dir, "1bcu_ligand.pqr")), 6.0)
+    n_points = 100
+    # A small chunk size, so the pairs are split over many chunks
+    result = shrake_rupley(atoms, n_points=n_points, pair_chunk_size=500)
+
+    coords = np.asarray(atoms["coords"], dtype=np.float64)
+    radii = np.asarray(atoms["radius"], dtype=np.float64) + PROBE_RADIUS
+    is_ligand = np.asarray(atoms["is_ligand"], dtype=bool)
+    area = 4 * np.pi * radii ** 2
+    free_both = _brute_force_free(coords, radii, np.ones(len(coords), dtype=bool), n_points)
+    free_protein = _brute_force_free(coords, radii, ~is_ligand, n_points)
+    free_ligand = _brute_force_free(coords, radii, is_ligand, n_points)
+
+    np.testing.assert_allclose(result.atom_sasa, area * free_both, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(result.atom_sasa_unbound, area * np.where(is_ligand, free_ligand, free_protein),
+                               rtol=0, atol=1e-9)
+    assert result.delta_sasa > 0
+    assert sum(result.residue_sasa.values()) == pytest.approx(result.complex_sasa)
+
+
+def test_isolated_spheres_are_fully_exposed():
+    radius = 1.7
+    atoms = {
+        "coords": np.array([[0.0, 0.0, 0.0], [50.0, 0.0, 0.0]]),
+        "radius": np.array([radius, radius]),
+        "is_ligand": np.array([False, True]),
+    }
+    result = shrake_rupley(atoms)
+
+    sphere_area = 4 * np.pi * (radius + PROBE_RADIUS) ** 2
+    np.testing.assert_allclose(result.atom_sasa, sphere_area)
+    assert result.protein_sasa == pytest.approx(sphere_area)
+    assert result.ligand_sasa == pytest.approx(sphere_area)
+    assert result.delta_sasa == pytest.approx(0.0)
@@ -0,0 +1,11 @@
+from scheduler import TimingHistory
+
+
+def test_estimate_scales_recorded_time_by_cost(tmp_path):
+    history = TimingHistory(str(tmp_path / "timings.json"))
+    history.record("sasa", "1abc", 1000.0, 10.0)
+    history.record("sasa", "2xyz", 2000.0, 40.0)
+
+    # 1abc doubled in size since it was timed; 3new was never timed
+    estimates = history.estimate("sasa", ["1abc", "2xyz", "3new"], [2000.0, 2000.0, 100.0])
+    assert estimates == [20.0, 40.0, 1.5]
@@ -0,0 +1,76 @@
+import asyncio
+import sys
+
+from batch_journal import QUARANTINED, STARTED, BatchJournal
+from tool_runner import ToolJob, run_jobs
+
+
+def test_resume_quarantines_job_out_of_attempts(tmp_path):
+    # "crash" was started on its last allowed attempt and never finished,
+    # as when it crashed the whole run
+    journal_file = str(tmp_path / "journal.jsonl")
+    with BatchJournal(journal_file) as journal:
+        journal.record("tool", "crash", STARTED)
+
+    marker = tmp_path / "ran"
+    jobs = [
+        ToolJob("ok", [sys.executable, "-c", "pass"]),
+        ToolJob("crash", [sys.executable, "-c", f"open({str(marker)!r}, 'w')"]),
+    ]
+    seen = []
+    with BatchJournal(journal_file, resume=True, max_attempts=1, backoff=0.0) as journal:
+        results = asyncio.run(run_jobs(jobs, concurrency=1, on_result=seen.append, journal=journal, stage="tool"))
+        assert journal.state("tool", "crash").status == QUARANTINED
+
+    assert [result.name for result in results] == ["ok"]
+    assert [result.name for result in seen] == ["ok"]
+    assert not marker.exists()
+
+
+def test_failed_job_removes_partial_output(tmp_path):
+    partial = tmp_path / ".raw-1-ligand.pqr"
+    write_partial = f"open({str(partial)!r}, 'w').write('ATOM')"
+    failed_hooks = []
+
+    def remove_partial(job):
+        failed_hooks.append(job.name)
+        partial.unlink()
+
+    jobs = [
+        ToolJob("exits", [sys.executable, "-c", f"{write_partial}; raise SystemExit(1)"],
+                on_success=lambda job: failed_hooks.append("success"), on_failure=remove_partial),
+        ToolJob("hangs", [sys.executable, "-c", f"{write_partial}; import time; time.sleep(30)"],
+                on_failure=remove_partial),
+    ]
+    results = asyncio.run(run_jobs(jobs, concurrency=1, timeout=2.0))
+
+    assert [(result.name, result.ok) for result in results] == [("exits", False), ("hangs", False)]
+    assert results[1].timed_out
+    assert failed_hooks == ["exits", "hangs"]
+    assert not partial.exists()
+
+
+def test_tool_seconds_are_recorded_per_complex(tmp_path):
+    from instrumentation import tracing
+
+    jobs = [ToolJob("1abc_protein", [sys.executable, "-c", "pass"]),
+            ToolJob("2xyz_protein", [sys.executable, "-c", "raise SystemExit(1)"])]
+    with tracing(str(tmp_path)) as recorder:
+        results = asyncio.run(run_jobs(jobs, concurrency=2, stage="pdb2pqr"))
+
+    seconds = {result.name.partition("_")[0]: result.seconds for result in results}
+    assert {key: row["pdb2pqr_seconds"] for key, row in recorder.metrics.items()} == seconds
+    assert (tmp_path / "trace.json").exists()
+
+
+def test_backoff_does_not_hold_a_worker(tmp_path):
+    jobs = [ToolJob("fails", [sys.executable, "-c", "raise SystemExit(1)"])]
+    jobs += [ToolJob(f"ok{i}", [sys.executable, "-c", "pass"]) for i in range(3)]
+    with BatchJournal(str(tmp_path / "journal.jsonl"), max_attempts=2, backoff=1.0) as journal:
+        results = asyncio.run(run_jobs(jobs, concurrency=1, journal=journal, stage="tool"))
+        assert journal.state("tool", "fails").status == QUARANTINED
+        assert journal.state("tool", "fails").attempts == 2
+
+    # The only worker runs the other jobs while "fails" waits to be retried
+    assert [(result.name, result.ok) for result in results] == [
+        ("ok0", True), ("ok1", True), ("ok2", True), ("fails", False)]
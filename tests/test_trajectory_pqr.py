@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from file_io import open_file
+from mol2_classes import Mol2Molecule
+from trajectory_pqr import write_trajectory_pqr
+
+PDBBIND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "pdbbind")
+
+
+def _no_ring_perception(self):
+    raise AssertionError("ring perception ran while charging a conformer")
+
+
+@pytest.mark.parametrize("pdb_id", ["1nvq", "2xys"])
+def test_fused_ring_mol2_trajectory(pdb_id, tmp_path, monkeypatch):
+    # Ring perception is exponential on these fused ring systems, and
+    # charges and radii do not use it
+    monkeypatch.setattr(Mol2Molecule, "set_rings", _no_ring_perception)
+    with open(os.path.join(PDBBIND_DIR, pdb_id, f"{pdb_id}_ligand.mol2")) as mol2:
+        text = mol2.read()
+    n_atoms = int(text.split("@<TRIPOS>MOLECULE")[1].splitlines()[2].split()[0])
+    trajectory_file = tmp_path / f"{pdb_id}_conformers.mol2"
+    trajectory_file.write_text(text + text)
+
+    output_file = tmp_path / f"{pdb_id}.pqr"
+    assert write_trajectory_pqr(str(trajectory_file), str(output_file)) == 2
+
+    frames = output_file.read_text().split("ENDMDL")[:-1]
+    assert len(frames) == 2
+    charges = [[float(line.split()[-2]) for line in frame.splitlines() if line.startswith("HETATM")]
+               for frame in frames]
+    assert [len(frame) for frame in charges] == [n_atoms, n_atoms]
+    assert charges[0] == charges[1]
+    assert sum(charges[0]) == pytest.approx(round(sum(charges[0])), abs=1e-3)
+
+
+@pytest.mark.parametrize("suffix", ["", ".gz", ".zst"])
+def test_compressed_pdb_trajectory(suffix, tmp_path):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    topology_file = tmp_path / "system.pqr"
+    topology_file.write_text(
+        "ATOM      1  N   ALA     1       0.000   0.000   0.000  0.1414 1.8240\n"
+        "ATOM      2  CA  ALA     1       1.458   0.000   0.000  0.0962 1.9080\n"
+    )
+    frames = []
+    for k in range(3):
+        frames.append(
+            f"MODEL     {k + 1:>4}\n"
+            f"ATOM      1  N   ALA A   1    {k:8.3f}   0.000   0.000  1.00  0.00           N\n"
+            f"ATOM      2  CA  ALA A   1    {k + 1.458:8.3f}   0.000   0.000  1.00  0.00           C\n"
+            "ENDMDL\n"
+        )
+    trajectory_file = tmp_path / f"md.pdb{suffix}"
+    with open_file(trajectory_file, "w") as trajectory:
+        trajectory.write("".join(frames))
+
+    output_file = tmp_path / "md.pqr"
+    assert write_trajectory_pqr(str(trajectory_file), str(output_file), str(topology_file)) == 3
+
+    x = [float(line[30:38]) for line in output_file.read_text().splitlines() if line.startswith("ATOM")]
+    assert x == pytest.approx([0.0, 1.458, 1.0, 2.458, 2.0, 3.458])
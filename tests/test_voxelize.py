@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+from pqr_arrays import ELEMENT_CODES, load_complex
+from voxelize import (CHANNELS_PER_SIDE, CUTOFF_SCALE, ELEMENT_CHANNELS, N_CHANNELS, SparseVoxels, load_voxels,
+                      save_voxels, voxelize)
+
+GENERATED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "generated")
+
+
+def test_single_atom_gaussian():
+    radius, charge = 1.5, -0.4
+    atoms = {
+        # Centre of voxel (4, 5, 3) of an 8 A grid centred on the origin
+        "coords": np.array([[0.5, 1.5, -0.5]]),
+        "radius": np.array([radius]),
+        "charge": np.array([charge]),
+        "element": np.array([ELEMENT_CODES["N"]]),
+        "is_ligand": np.array([True]),
+    }
+    grid = voxelize(atoms, center=(0.0, 0.0, 0.0), size=8.0, spacing=1.0, dtype="float64")
+    assert grid.shape == (N_CHANNELS, 8, 8, 8)
+
+    occupancy_channel = CHANNELS_PER_SIDE + 1
+    charge_channel = CHANNELS_PER_SIDE + len(ELEMENT_CHANNELS)
+    assert np.unravel_index(np.argmax(grid), grid.shape) == (occupancy_channel, 4, 5, 3)
+    assert grid[occupancy_channel, 4, 5, 3] == 1.0
+    assert set(np.flatnonzero(grid.reshape(N_CHANNELS, -1).any(axis=1))) == {occupancy_channel, charge_channel}
+
+    # Every voxel centre within the cutoff gets the Gaussian, and no other
+    centres = np.stack(np.meshgrid(*[np.arange(8) - 3.5] * 3, indexing="ij"), axis=-1)
+    dist_sq = ((centres - atoms["coords"][0]) ** 2).sum(axis=-1)
+    expected = np.where(dist_sq <= (CUTOFF_SCALE * radius) ** 2, np.exp(-2 * dist_sq / radius ** 2), 0.0)
+    np.testing.assert_allclose(grid[occupancy_channel], expected, atol=1e-12)
+    np.testing.assert_allclose(grid[charge_channel], charge * expected, atol=1e-12)
+
+
+def test_save_load_round_trip(tmp_path):
+    complex_dir = os.path.join(GENERATED_DIR, "1bcu")
+    atoms = load_complex(os.path.join(complex_dir, "1bcu_protein.pqr"),
+                         os.path.join(complex_dir, "1bcu_ligand.pqr"))
+    sparse = voxelize(atoms, sparse=True)
+    dense = voxelize(atoms)
+
+    save_voxels(str(tmp_path / "sparse.npz"), sparse)
+    loaded = load_voxels(str(tmp_path / "sparse.npz"))
+    assert isinstance(loaded, SparseVoxels)
+    assert loaded.shape == sparse.shape
+    np.testing.assert_array_equal(loaded.indices, sparse.indices)
+    np.testing.assert_array_equal(loaded.values, sparse.values)
+    np.testing.assert_allclose(loaded.to_dense(), dense, rtol=1e-6, atol=1e-6)
+
+    save_voxels(str(tmp_path / "dense.npz"), dense)
+    np.testing.assert_array_equal(load_voxels(str(tmp_path / "dense.npz")), dense)
@@ -0,0 +1,80 @@
+import os
+
+from watch_inputs import InputWatcher, changed_stages, list_inputs, stale_stages
+
+
+def _complex(input_dir, output_dir, pdb_id="1abc"):
+    source = input_dir / pdb_id
+    target = output_dir / pdb_id
+    source.mkdir(parents=True)
+    target.mkdir(parents=True)
+    (source / f"{pdb_id}_protein.pdb").write_text("ATOM\n")
+    (source / f"{pdb_id}_ligand.sdf").write_text("ligand\n")
+    return source, target
+
+
+def _touch(path, mtime):
+    path.write_text(path.read_text() if path.exists() else "")
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_poll_debounces_changes(tmp_path):
+    source, _ = _complex(tmp_path / "in", tmp_path / "out")
+    watcher = InputWatcher(str(tmp_path / "in"), debounce=2.0)
+
+    assert watcher.poll(now=0.0) == {"1abc"}
+    assert watcher.poll(now=1.0) == set()
+    assert watcher.ready(now=1.5) == []
+
+    # An edit in place restarts the quiet period
+    (source / "1abc_ligand.sdf").write_text("edited ligand\n")
+    assert watcher.poll(now=1.5) == {"1abc"}
+    assert watcher.ready(now=3.0) == []
+    assert watcher.ready(now=3.5) == ["1abc"]
+    assert not watcher.has_pending()
+
+    # So does a new file, found by re-listing the directory
+    (source / "1abc_ligand.mol2").write_text("mol2\n")
+    os.utime(source, ns=(10 ** 18, 10 ** 18))
+    assert watcher.poll(now=4.0) == {"1abc"}
+    assert set(watcher.inputs("1abc")) == {"1abc_protein.pdb", "1abc_ligand.sdf", "1abc_ligand.mol2"}
+
+    watcher.defer("1abc", now=7.0)
+    assert watcher.ready(now=8.0) == []
+    assert watcher.ready(now=9.0) == ["1abc"]
+
+
+def test_stale_stages(tmp_path):
+    source, target = _complex(tmp_path / "in", tmp_path / "out")
+    input_dir, output_dir = str(tmp_path / "in"), str(tmp_path / "out")
+    assert stale_stages("1abc", input_dir, output_dir) == ["protein", "ligand", "complex"]
+
+    for name in ("1abc_protein.pdb", "1abc_ligand.sdf"):
+        _touch(source / name, 1_000)
+    for name in ("1abc_protein.pqr", "1abc_ligand.pqr", "1abc_combined.pqr"):
+        _touch(target / name, 2_000)
+    assert stale_stages("1abc", input_dir, output_dir) == []
+    assert stale_stages("1abc", input_dir, output_dir, force={"protein"}) == ["protein", "complex"]
+
+    _touch(source / "1abc_ligand.sdf", 3_000)
+    assert stale_stages("1abc", input_dir, output_dir) == ["ligand", "complex"]
+
+
+def test_input_edited_during_rebuild_is_forced(tmp_path):
+    source, target = _complex(tmp_path / "in", tmp_path / "out")
+    input_dir, output_dir = str(tmp_path / "in"), str(tmp_path / "out")
+    for name in ("1abc_protein.pdb", "1abc_ligand.sdf"):
+        _touch(source / name, 1_000)
+    started_from = list_inputs(input_dir, "1abc")
+
+    # The ligand is edited after the rebuild read it, before its output was
+    # renamed into place, so the output is newer than the edit
+    (source / "1abc_ligand.sdf").write_text("edited ligand\n")
+    os.utime(source / "1abc_ligand.sdf", ns=(1_500, 1_500))
+    for name in ("1abc_protein.pqr", "1abc_ligand.pqr", "1abc_combined.pqr"):
+        _touch(target / name, 2_000)
+    assert stale_stages("1abc", input_dir, output_dir) == []
+
+    force = changed_stages(started_from, list_inputs(input_dir, "1abc"))
+    assert force == {"ligand"}
+    assert stale_stages("1abc", input_dir, output_dir, force) == ["ligand", "complex"]
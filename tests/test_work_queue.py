@@ -0,0 +1,68 @@
+import json
+import multiprocessing
+import os
+import time
+
+from work_queue import STAGES, WorkQueue
+
+N_WORKERS = 4
+N_TASKS = 60
+LEASE_TIMEOUT = 5.0
+
+
+def _record_run(args):
+    # One line per run; appends this short are atomic
+    with open(args["log"], "a") as log:
+        log.write(f"{args['task']} {os.getpid()}\n")
+    time.sleep(0.01)
+
+
+def _worker(queue_dir):
+    STAGES["record"] = _record_run
+    WorkQueue(queue_dir, LEASE_TIMEOUT).work(poll_interval=0.05)
+
+
+def test_workers_run_each_task_once(tmp_path, monkeypatch):
+    monkeypatch.setitem(STAGES, "record", _record_run)
+    queue_dir = str(tmp_path / "queue")
+    log = str(tmp_path / "runs.log")
+    queue = WorkQueue(queue_dir, LEASE_TIMEOUT)
+    tasks = [f"task{i:03d}" for i in range(N_TASKS)]
+    for task in tasks:
+        assert queue.enqueue(task, "record", {"log": log, "task": task})
+
+    # A worker crashed while holding the lease of the first task
+    stale_lease = os.path.join(queue_dir, "leases", f"{tasks[0]}.lease")
+    with open(stale_lease, "w") as file:
+        json.dump({"worker": "crashed:1", "time": time.time() - 60}, file)
+    os.utime(stale_lease, (time.time() - 60, time.time() - 60))
+    assert queue.status()["stale"] == 1
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_worker, args=(queue_dir,)) for _ in range(N_WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    with open(log) as file:
+        runs = [line.split()[0] for line in file]
+    assert sorted(runs) == tasks
+    status = queue.status()
+    assert (status["done"], status["failed"], status["running"], status["stale"], status["pending"]) == \
+        (N_TASKS, 0, 0, 0, 0)
+    assert os.listdir(os.path.join(queue_dir, "leases")) == []
+
+
+
+def test_worker_claims_most_expensive_task_first(tmp_path, monkeypatch):
+    monkeypatch.setitem(STAGES, "record", _record_run)
+    log = str(tmp_path / "runs.log")
+    queue = WorkQueue(str(tmp_path / "queue"), LEASE_TIMEOUT)
+    for task, cost in [("a", 10.0), ("b", 500.0), ("c", 50.0)]:
+        queue.enqueue(task, "record", {"log": log, "task": task}, cost)
+
+    assert queue.work(poll_interval=0.05) == 3
+    with open(log) as file:
+        assert [line.split()[0] for line in file] == ["b", "c", "a"]
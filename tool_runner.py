@@ -0,0 +1,543 @@
+"""Run external tools (Open Babel, pdb2pqr) concurrently with asyncio.
+
+Every invocation is a `ToolJob`: a command line, an optional file streamed
+into its stdin, and a log file that receives its stdout and stderr as they
+are written. `run_jobs` feeds jobs from a bounded queue to a fixed number of
+workers, so a lazily walked input tree is consumed only as fast as the tools
+finish and the full job list is never built. Each job has a timeout after
+which its process is killed, and cancelling the run (e.g. Ctrl-C) kills the
+running processes instead of leaving them behind. The Open Babel jobs follow
+the lazy walk of the SDF tree, while the pdb2pqr jobs, whose run times vary
+with protein size, start with the largest protein.
+
+Charge every ligand SDF file with 8 Open Babel processes, or protonate every
+protein with pdb2pqr::
+
+    python tool_runner.py obabel --input-dir data/pdbbind --output-dir data/generated --jobs 8
+    python tool_runner.py pdb2pqr --input-dir data/pdbbind --output-dir data/generated --jobs 8
+"""
+import argparse
+import logging
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+from batch_journal import (DEFAULT_BACKOFF, DEFAULT_MAX_ATTEMPTS, FAILED, QUARANTINED, STARTED,
+                           SUCCEEDED, BatchJournal)
+from file_io import COMPRESSION_SUFFIXES, compression_of, open_file, temp_path
+from instrumentation import add_span, tracing
+
+if TYPE_CHECKING:
+    import asyncio
+
+    from catalog import Catalog
+
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 600.0
+
+#: Bytes read from a process pipe or stdin file at a time.
+_CHUNK_SIZE = 1 << 16
+
+
+class ToolJob(NamedTuple):
+    """One invocation of an external tool."""
+
+    #: Name of the job, used in logs and results
+    name: str
+    #: Command line, executed without a shell
+    command: List[str]
+    #: File for the stdout and stderr of the tool; discarded if None
+    log_file: Optional[str] = None
+    #: File streamed into the stdin of the tool, decompressed by suffix
+    stdin_file: Optional[str] = None
+    #: Called with the job after the tool exits with status 0
+    on_success: Optional[Callable[["ToolJob"], None]] = None
+    #: Called with the job after the tool fails or times out, or
+    #: `on_success` raises, e.g. to remove partial output
+    on_failure: Optional[Callable[["ToolJob"], None]] = None
+
+
+class ToolResult(NamedTuple):
+    """Outcome of a `ToolJob`."""
+
+    name: str
+    #: Exit status of the tool; negative if it was killed by a signal
+    returncode: Optional[int]
+    #: Wall time of the job, in seconds
+    seconds: float
+    #: Whether the job was killed for exceeding its timeout
+    timed_out: bool = False
+    #: Error raised while starting the tool or in `on_success`
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and self.error is None
+
+
+async def _pump(stream: "asyncio.StreamReader", log) -> None:
+    while True:
+        chunk = await stream.read(_CHUNK_SIZE)
+        if not chunk:
+            return
+        if log is not None:
+            log.write(chunk)
+            log.flush()
+
+
+async def _feed(stdin: "asyncio.StreamWriter", stdin_file: str) -> None:
+    try:
+        with open_file(stdin_file, "rb") as source:
+            for chunk in iter(lambda: source.read(_CHUNK_SIZE), b""):
+                stdin.write(chunk)
+                await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # The tool exited without reading all of its input
+        pass
+    finally:
+        stdin.close()
+
+
+async def _kill(process: "asyncio.subprocess.Process") -> None:
+    if process.returncode is None:
+        process.kill()
+        await process.wait()
+
+
+async def _call_hook(hook: Callable[[ToolJob], None], job: ToolJob) -> None:
+    """
+    Run a job hook in the default executor, so file work such as
+    `convert_sdf_to_pqr.finish_pqr` does not block the event loop.
+    """
+    import asyncio
+
+    await asyncio.get_running_loop().run_in_executor(None, hook, job)
+
+
+async def _failed(job: ToolJob, result: ToolResult) -> ToolResult:
+    if job.on_failure is not None:
+        try:
+            await _call_hook(job.on_failure, job)
+        except Exception as exception:
+            _LOGGER.warning(f"Cleaning up after {job.name} failed: {type(exception).__name__}: {exception}")
+    return result
+
+
+def _remove_file(file_path: str) -> None:
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def _finish_ligand(raw_file: str, output_file: str, compress: Optional[str], sdf_file: str,
+                   catalog: Optional["Catalog"]) -> None:
+    from catalog import PQRStats
+    from convert_sdf_to_pqr import finish_pqr
+
+    stats = PQRStats() if catalog is not None else None
+    final_file = finish_pqr(raw_file, output_file, compress, stats)
+    if catalog is not None:
+        catalog.record(final_file, stats, [sdf_file])
+
+
+def _finish_protein(partial_file: str, output_file: str, pdb_file: str,
+                    catalog: Optional["Catalog"]) -> None:
+    os.replace(partial_file, output_file)
+    if catalog is not None:
+        from catalog import PQRStats
+
+        # Written by pdb2pqr, so its statistics take one read of the file
+        catalog.record(output_file, PQRStats.from_file(output_file), [pdb_file])
+
+
+async def run_job(
+    job: ToolJob,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    semaphore: Optional["asyncio.Semaphore"] = None,
+) -> ToolResult:
+    """
+    Run one external tool, streaming its output into its log file.
+
+    Parameters
+    ----------
+    job : ToolJob
+        The invocation.
+    timeout : Optional[float]
+        Seconds after which the tool is killed; no limit if None.
+    semaphore : Optional[asyncio.Semaphore]
+        Held while the tool runs, to share a concurrency limit between
+        callers.
+
+    Returns
+    -------
+    ToolResult
+        Exit status and wall time. Failing to start the tool is reported in
+        `error` rather than raised. The `on_success` and `on_failure` hooks
+        run in the default executor.
+    """
+    import asyncio
+
+    if semaphore is not None:
+        async with semaphore:
+            return await run_job(job, timeout)
+
+    start = time.perf_counter()
+    log = None
+    if job.log_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(job.log_file)), exist_ok=True)
+        log = open(job.log_file, "wb")
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *job.command,
+                stdin=asyncio.subprocess.PIPE if job.stdin_file else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        except OSError as error:
+            return await _failed(job, ToolResult(job.name, None, time.perf_counter() - start,
+                                                 error=str(error)))
+
+        tasks = [asyncio.ensure_future(_pump(process.stdout, log))]
+        if job.stdin_file:
+            tasks.append(asyncio.ensure_future(_feed(process.stdin, job.stdin_file)))
+        tasks.append(asyncio.ensure_future(process.wait()))
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+        finally:
+            # Kill the tool on a timeout or when the run is cancelled
+            if any(not task.done() for task in tasks):
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await _kill(process)
+        if pending:
+            return await _failed(job, ToolResult(job.name, process.returncode,
+                                                 time.perf_counter() - start, timed_out=True))
+        for task in done:
+            task.result()
+    finally:
+        if log is not None:
+            log.close()
+
+    error = None
+    if process.returncode == 0 and job.on_success is not None:
+        try:
+            await _call_hook(job.on_success, job)
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+    result = ToolResult(job.name, process.returncode, time.perf_counter() - start, error=error)
+    return result if result.ok else await _failed(job, result)
+
+
+async def run_jobs(
+    jobs: Iterable[ToolJob],
+    concurrency: int = 1,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    queue_size: Optional[int] = None,
+    on_result: Optional[Callable[[ToolResult], None]] = None,
+    journal: Optional[BatchJournal] = None,
+    stage: str = "tool",
+) -> List[ToolResult]:
+    """
+    Run external tools with at most `concurrency` of them at a time.
+
+    A producer takes jobs from `jobs` into a queue of `queue_size` while
+    `concurrency` workers run them, so a lazy iterable is only advanced as
+    workers free up.
+
+    Parameters
+    ----------
+    jobs : Iterable[ToolJob]
+        Jobs to run, e.g. a generator over a directory walk.
+    concurrency : int
+        Number of tools running at once.
+    timeout : Optional[float]
+        Per-job timeout in seconds, see `run_job`.
+    queue_size : Optional[int]
+        Jobs taken from `jobs` ahead of the workers; `2 * concurrency` if None.
+    on_result : Optional[Callable[[ToolResult], None]]
+        Called with each result as soon as its job finishes.
+    journal : Optional[BatchJournal]
+        Journal of the run, keyed by job name. Jobs that succeeded or were
+        quarantined in an earlier run are skipped, and failed jobs are
+        retried by its back-off and quarantine policy. A failed job goes
+        back into the queue once its back-off has passed; the workers run
+        other jobs meanwhile.
+    stage : str
+        Stage of the jobs in the journal, and name of their spans when
+        tracing; each attempt is recorded with its `ToolResult.seconds`,
+        attributed to the complex `<ID>` of a job named `<ID>_<kind>`.
+
+    Returns
+    -------
+    List[ToolResult]
+        Result of the last attempt of each job that ran, in order of
+        completion.
+    """
+    import asyncio
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or 2 * concurrency)
+    results: List[ToolResult] = []
+    # Jobs taken from `jobs` and not yet finished, including those waiting
+    # out their back-off; the workers are stopped once none are left
+    unfinished = 0
+    all_taken = False
+    drained = asyncio.Event()
+    retries: List["asyncio.Task"] = []
+
+    def finish(result: Optional[ToolResult]) -> None:
+        nonlocal unfinished
+        unfinished -= 1
+        if all_taken and unfinished == 0:
+            drained.set()
+        if result is not None:
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+    async def requeue(job: ToolJob, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await queue.put(job)
+
+    def retry_later(job: ToolJob) -> None:
+        # The back-off runs in its own task, so a worker is not held by it
+        retries.append(asyncio.ensure_future(requeue(job, journal.retry_delay(stage, job.name))))
+
+    async def produce() -> None:
+        nonlocal unfinished, all_taken
+        for job in jobs:
+            if journal is None or journal.is_pending(stage, job.name):
+                unfinished += 1
+                await queue.put(job)
+        all_taken = True
+        if unfinished == 0:
+            drained.set()
+        await drained.wait()
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work() -> None:
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            if journal is not None:
+                state = journal.state(stage, job.name)
+                if state is not None and state.attempts >= journal.max_attempts:
+                    # Out of attempts in an earlier run, so it does not run again
+                    journal.record(stage, job.name, QUARANTINED)
+                    _LOGGER.warning(f"Quarantined {job.name} after {state.attempts} attempts")
+                    finish(None)
+                    continue
+                if journal.retry_delay(stage, job.name) > 0:
+                    # Failed in an earlier run, within its back-off
+                    retry_later(job)
+                    continue
+                journal.record(stage, job.name, STARTED)
+            result = await run_job(job, timeout)
+            add_span(stage, result.seconds, job.name.partition("_")[0], job=job.name, ok=result.ok)
+            if result.ok:
+                if journal is not None:
+                    journal.record(stage, job.name, SUCCEEDED)
+            else:
+                failure = "timed out" if result.timed_out else result.error or f"exit status {result.returncode}"
+                _LOGGER.warning(f"{result.name} failed: {failure}"
+                                + (f", see {job.log_file}" if job.log_file else ""))
+                if journal is not None:
+                    journal.record(stage, job.name, FAILED, failure)
+                    attempts = journal.state(stage, job.name).attempts
+                    if attempts < journal.max_attempts:
+                        retry_later(job)
+                        continue
+                    journal.record(stage, job.name, QUARANTINED)
+                    _LOGGER.warning(f"Quarantined {job.name} after {attempts} attempts")
+            finish(result)
+
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # On an error or cancellation, stop the other workers and their tools
+        for task in tasks + retries:
+            task.cancel()
+        await asyncio.gather(*tasks, *retries, return_exceptions=True)
+    return results
+
+
+def obabel_jobs(
+    input_dir: str,
+    output_dir: str,
+    forcefield: str = "AMBER",
+    log_dir: Optional[str] = None,
+    compress: Optional[str] = None,
+    catalog: Optional["Catalog"] = None,
+) -> Iterator[ToolJob]:
+    """
+    Lazily create the Open Babel jobs of `convert_sdf_to_pqr.py`.
+
+    Compressed SDF files are streamed into the stdin of Open Babel. The
+    radii of each PQR file are replaced, and the file compressed, as soon
+    as its job succeeds; the raw Open Babel output is removed if it fails,
+    so no partial `_ligand.pqr` file is left for `form_complex_pqr.py`.
+
+    Parameters
+    ----------
+    input_dir : str
+        Directory tree of .sdf files, e.g. `data/pdbbind`.
+    output_dir : str
+        Directory where the PQR files are written, mirroring `input_dir`.
+    forcefield : str
+        Forcefield for the charges.
+    log_dir : Optional[str]
+        Directory of the `<stem>.log` files; output is discarded if None.
+    compress : Optional[str]
+        Write the PQR files compressed, "gz" or "zst".
+    catalog : Optional[Catalog]
+        Catalog in which the PQR files are recorded.
+
+    Yields
+    ------
+    ToolJob
+        One job per .sdf file, as the tree is walked.
+    """
+    from convert_sdf_to_pqr import iter_sdf_files, pqr_output_file
+
+    for sdf_path in iter_sdf_files(input_dir):
+        output_file = pqr_output_file(sdf_path, output_dir, input_dir)
+        stem = Path(output_file).stem
+        compressed = compression_of(sdf_path) is not None
+        command = ["obabel", "-isdf"] + ([] if compressed else [str(sdf_path)])
+        raw_file = temp_path(output_file, "raw")
+        command += ["-opqr", "-O", raw_file, "--FF", forcefield]
+        yield ToolJob(
+            name=stem,
+            command=command,
+            log_file=os.path.join(log_dir, f"{stem}.log") if log_dir else None,
+            stdin_file=str(sdf_path) if compressed else None,
+            on_success=lambda job, raw_file=raw_file, output_file=output_file, sdf_file=str(sdf_path):
+                _finish_ligand(raw_file, output_file, compress, sdf_file, catalog),
+            on_failure=lambda job, raw_file=raw_file: _remove_file(raw_file),
+        )
+
+
+def pdb2pqr_jobs(
+    input_dir: str,
+    output_dir: str,
+    forcefield: str = "AMBER",
+    log_dir: Optional[str] = None,
+    catalog: Optional["Catalog"] = None,
+) -> Iterator[ToolJob]:
+    """
+    Create the pdb2pqr jobs of `pdb2pqr_loop.sh`, largest protein first.
+
+    Protein sizes vary about fivefold, so the proteins are listed and ordered
+    by the line count of their PDB files before the first job starts, rather
+    than run in directory order; see `scheduler.order_longest_first`.
+
+    Parameters
+    ----------
+    input_dir : str
+        Directory of `<ID>/<ID>_protein.pdb` files, e.g. `data/pdbbind`.
+    output_dir : str
+        Directory where `<ID>/<ID>_protein.pqr` files are written.
+    forcefield : str
+        Forcefield of pdb2pqr.
+    log_dir : Optional[str]
+        Directory of the `<ID>_protein.log` files; output is discarded if None.
+    catalog : Optional[Catalog]
+        Catalog in which the PQR files are recorded.
+
+    Yields
+    ------
+    ToolJob
+        One job per protein, largest first.
+    """
+    # Imported here to keep numpy out of the start-up; see benchmark_startup.py
+    from scheduler import file_cost, order_longest_first
+
+    with os.scandir(input_dir) as entries:
+        proteins = [
+            (entry.name, os.path.join(entry.path, f"{entry.name}_protein.pdb"))
+            for entry in entries if entry.is_dir()
+        ]
+    proteins = [(pdb_id, input_file) for pdb_id, input_file in proteins if os.path.isfile(input_file)]
+    for pdb_id, input_file in order_longest_first(proteins, lambda protein: file_cost(protein[1])):
+        output_file = os.path.join(output_dir, pdb_id, f"{pdb_id}_protein.pqr")
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        partial_file = temp_path(output_file)
+        yield ToolJob(
+            name=f"{pdb_id}_protein",
+            command=["pdb2pqr", f"--ff={forcefield}", input_file, partial_file],
+            log_file=os.path.join(log_dir, f"{pdb_id}_protein.log") if log_dir else None,
+            on_success=lambda job, partial_file=partial_file, output_file=output_file, input_file=input_file:
+                _finish_protein(partial_file, output_file, input_file, catalog),
+            on_failure=lambda job, partial_file=partial_file: _remove_file(partial_file),
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run Open Babel or pdb2pqr over a directory tree with concurrent processes.")
+    parser.add_argument("tool", choices=("obabel", "pdb2pqr"),
+                        help="obabel charges the ligand .sdf files, pdb2pqr the protein .pdb files")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/pdbbind",
+                        help="Input directory (default: data/pdbbind)")
+    parser.add_argument("--output-dir", dest="output_dir", default="data/generated",
+                        help="Output directory for .pqr files (default: data/generated)")
+    parser.add_argument("--FF", dest="forcefield", default="AMBER",
+                        help="Forcefield for calculating charges (default: AMBER)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="Number of tools running at once (default: all CPUs)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Seconds before a tool is killed (default: {DEFAULT_TIMEOUT:g})")
+    parser.add_argument("--log-dir", dest="log_dir", default="data/logs",
+                        help="Directory of the per-job logs (default: data/logs)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                        help="Compress the ligand .pqr files (default: not compressed)")
+    parser.add_argument("--journal", default=None,
+                        help="Journal of the run (default: <output-dir>/<tool>.journal.jsonl)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip jobs finished by an earlier run and retry failed ones")
+    parser.add_argument("--max-attempts", dest="max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f"Attempts before a job is quarantined (default: {DEFAULT_MAX_ATTEMPTS})")
+    parser.add_argument("--backoff", type=float, default=DEFAULT_BACKOFF,
+                        help=f"Seconds before the first retry, doubling after each (default: {DEFAULT_BACKOFF:g})")
+    parser.add_argument("--catalog", default=None,
+                        help="Record the .pqr files in this SQLite catalog (default: none)")
+    parser.add_argument("--trace", default=None,
+                        help="Write a Chrome trace and per-complex metrics CSV to this directory (default: off)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    # Only imported once there are tools to run, so --help and argument
+    # errors return quickly; see benchmark_startup.py
+    import asyncio
+
+    from catalog import Catalog
+
+    logging.basicConfig(level=logging.INFO)
+    run_catalog = Catalog(args.catalog) if args.catalog is not None else None
+    if args.tool == "obabel":
+        tool_jobs = obabel_jobs(args.input_dir, args.output_dir, args.forcefield,
+                                args.log_dir, args.compress, run_catalog)
+    else:
+        tool_jobs = pdb2pqr_jobs(args.input_dir, args.output_dir, args.forcefield, args.log_dir,
+                                 run_catalog)
+    journal_file = args.journal or os.path.join(args.output_dir, f"{args.tool}.journal.jsonl")
+    with tracing(args.trace), \
+            BatchJournal(journal_file, args.resume, args.max_attempts, args.backoff) as run_journal:
+        all_results = asyncio.run(run_jobs(tool_jobs, args.jobs, args.timeout,
+                                           journal=run_journal, stage=args.tool))
+    if run_catalog is not None:
+        run_catalog.close()
+    n_failed = sum(not result.ok for result in all_results)
+    print(f"Ran {len(all_results)} {args.tool} jobs, {n_failed} failed")
+
+
+if __name__ == "__main__":
+    main()
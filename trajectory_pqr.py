@@ -0,0 +1,276 @@
+"""Stream PQR files for every frame of a trajectory.
+
+Charges and radii depend only on the topology, so they are computed once:
+for a multi-MODEL PDB trajectory they are read from a PQR file of the same
+system (e.g. pdb2pqr run on the first frame), and for a multi-conformer MOL2
+or SDF ligand they are assigned to the first conformer as in
+`multi_pose_complex.py`. Every frame then only contributes its coordinate
+columns, which are written into a `pqr_arrays.PQRTemplate` of preformatted
+lines; PDB coordinates are even copied as text, without parsing them. Frames
+are read and written one at a time, so memory does not grow
+with the length of the trajectory.
+
+Write one multi-MODEL PQR file, or one file per frame with `--output-dir`::
+
+    python trajectory_pqr.py --topology system.pqr --trajectory md.pdb --output md.pqr.gz
+    python trajectory_pqr.py --trajectory conformers.mol2 --output-dir frames/
+"""
+import argparse
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from file_io import (COMPRESSION_SUFFIXES, has_suffix, open_file, strip_compression,
+                     with_compression)
+from mol2_classes import RADII
+from multi_pose_complex import (LIGAND_RES_NAME, LIGAND_RES_SEQ, _mol2_charges,
+                                _parse_mol2_pose, _parse_sdf_pose, _sdf_charges, split_records)
+from pqr_arrays import PQRTemplate, read_pqr_atoms
+
+
+#: How topology atoms are matched to trajectory atoms.
+MATCH_MODES = ("name", "index")
+
+
+def _atom_key(chain: str, res_seq: str, res_name: str, atom_name: str,
+              use_chain: bool) -> Tuple[str, ...]:
+    key = (res_seq, res_name, atom_name)
+    return (chain,) + key if use_chain else key
+
+
+def iter_pdb_frames(trajectory_file: str) -> Iterator[List[bytes]]:
+    """
+    Stream the ATOM/HETATM lines of each MODEL of a PDB trajectory.
+
+    A file without MODEL records is a single frame.
+
+    Parameters
+    ----------
+    trajectory_file : str
+        Path of the multi-MODEL PDB file, optionally compressed.
+
+    Yields
+    ------
+    List[bytes]
+        The atom lines of one frame.
+    """
+    lines: List[bytes] = []
+    with open_file(trajectory_file, "rb") as trajectory:
+        for line in trajectory:
+            if line.startswith((b"ATOM", b"HETATM")):
+                lines.append(line)
+            elif line.startswith(b"ENDMDL") and lines:
+                yield lines
+                lines = []
+    if lines:
+        yield lines
+
+
+def frame_fields(lines: List[bytes], index: np.ndarray) -> bytes:
+    """
+    Cut the coordinate text of selected atoms out of a PDB frame.
+
+    Parameters
+    ----------
+    lines : List[bytes]
+        Atom lines of the frame.
+    index : np.ndarray
+        Positions of the atoms to read, in output order.
+
+    Returns
+    -------
+    bytes
+        Columns 31-54 (x, y, z) of the selected lines, joined, as taken by
+        `PQRTemplate.format_fields`.
+    """
+    return b"".join([lines[i][30:54] for i in index.tolist()])
+
+
+def match_topology(topology: Dict[str, np.ndarray], lines: List[bytes], match: str = "name") -> np.ndarray:
+    """
+    Find the trajectory atom of every topology atom.
+
+    Parameters
+    ----------
+    topology : Dict[str, np.ndarray]
+        Atom arrays of the topology PQR file.
+    lines : List[bytes]
+        Atom lines of the first frame.
+    match : str
+        "name" matches by chain (when the topology has chains), residue
+        number, insertion code, residue name and atom name, in order of
+        occurrence for repeated keys, ignoring extra trajectory atoms such as
+        solvent; "index" requires the same atoms in the same order.
+
+    Returns
+    -------
+    np.ndarray
+        Position in the frame of each topology atom.
+    """
+    n_atoms = len(topology["charge"])
+    if match == "index":
+        if len(lines) != n_atoms:
+            raise ValueError(f"Topology has {n_atoms} atoms but the first frame has {len(lines)}")
+        return np.arange(n_atoms)
+    if match not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode '{match}', expected one of {MATCH_MODES}")
+
+    use_chain = bool(np.all(topology["chain"] != ""))
+    # Without chain IDs (as written by pdb2pqr) residue numbers can repeat, so
+    # the k-th topology atom with a key is the k-th trajectory atom with it
+    positions: Dict[Tuple[str, ...], List[int]] = {}
+    for position, line in enumerate(lines):
+        text = line.decode()
+        key = _atom_key(text[21].strip(), text[22:27].strip(), text[17:20].strip(),
+                        text[12:16].strip(), use_chain)
+        positions.setdefault(key, []).append(position)
+    used: Dict[Tuple[str, ...], int] = {}
+    index = np.empty(n_atoms, dtype=np.int64)
+    missing = []
+    for i, (chain, res_seq, ins_code, res_name, atom_name) in enumerate(zip(
+        topology["chain"], topology["res_seq"], topology["ins_code"],
+        topology["res_name"], topology["atom_name"]
+    )):
+        key = _atom_key(str(chain), f"{res_seq}{ins_code}", str(res_name), str(atom_name), use_chain)
+        occurrence = used.get(key, 0)
+        candidates = positions.get(key, [])
+        if occurrence >= len(candidates):
+            missing.append(key)
+            continue
+        index[i] = candidates[occurrence]
+        used[key] = occurrence + 1
+    if missing:
+        raise ValueError(
+            f"{len(missing)} topology atoms are not in the trajectory, e.g. {missing[:5]}"
+        )
+    return index
+
+
+def _pdb_frames(topology_file: str, trajectory_file: str, match: str) -> Iterator[bytes]:
+    topology = read_pqr_atoms(topology_file)
+    template = PQRTemplate(topology["record"], topology["serial"], topology["atom_name"],
+                           topology["res_name"], topology["res_seq"],
+                           topology["charge"], topology["radius"])
+    index = None
+    for lines in iter_pdb_frames(trajectory_file):
+        if index is None:
+            index = match_topology(topology, lines, match)
+        yield template.format_fields(frame_fields(lines, index))
+
+
+def _ligand_frames(trajectory_file: str, forcefield: str) -> Iterator[bytes]:
+    fmt = os.path.splitext(strip_compression(trajectory_file))[1].lstrip(".").lower()
+    if fmt not in ("mol2", "sdf"):
+        raise ValueError(f"Unsupported trajectory file format: {trajectory_file}")
+    parse = _parse_mol2_pose if fmt == "mol2" else _parse_sdf_pose
+    template: Optional[PQRTemplate] = None
+    topology = None
+    for k, text in enumerate(split_records(trajectory_file, fmt), start=1):
+        pose = parse(text)
+        if template is None:
+            if fmt == "mol2":
+                charges, radii = _mol2_charges(text, RADII["zap9"], RADII["bondi"])
+            else:
+                charged = _sdf_charges(text, forcefield)
+                charges, radii = charged["charge"], charged["radius"]
+            n_atoms = len(pose.coords)
+            template = PQRTemplate(["HETATM"] * n_atoms, range(1, n_atoms + 1), pose.atom_names,
+                                   [LIGAND_RES_NAME] * n_atoms, [LIGAND_RES_SEQ] * n_atoms,
+                                   charges, radii)
+            topology = pose.topology
+        elif pose.topology != topology:
+            raise ValueError(f"Conformer {k} of {trajectory_file} has a different topology")
+        yield template.format(pose.coords).encode()
+
+
+def write_trajectory_pqr(
+    trajectory_file: str,
+    output: str,
+    topology_file: Optional[str] = None,
+    split: bool = False,
+    match: str = "name",
+    forcefield: str = "AMBER",
+    compress: Optional[str] = None,
+) -> int:
+    """
+    Write PQR lines for every frame of a trajectory.
+
+    Parameters
+    ----------
+    trajectory_file : str
+        Multi-MODEL `.pdb` trajectory, or multi-conformer `.mol2`/`.sdf`
+        ligand; optionally compressed.
+    output : str
+        Multi-MODEL PQR file, or with `split` the directory of the
+        `<stem>_frame<k>.pqr` files. A `.gz`/`.zst` output file is compressed.
+    topology_file : Optional[str]
+        PQR file with the charges and radii of a PDB trajectory.
+    split : bool
+        Write one file per frame instead of one multi-MODEL file.
+    match : str
+        How topology atoms are found in a PDB trajectory, see `match_topology`.
+    forcefield : str
+        Open Babel forcefield for charging an SDF ligand.
+    compress : Optional[str]
+        Compress the per-frame files, "gz" or "zst"; a single output file is
+        compressed by its own suffix.
+
+    Returns
+    -------
+    int
+        Number of frames written.
+    """
+    if has_suffix(trajectory_file, (".pdb", ".ent")):
+        if topology_file is None:
+            raise ValueError("A PDB trajectory needs a topology PQR file for its charges and radii.")
+        frames = _pdb_frames(topology_file, trajectory_file, match)
+    else:
+        frames = _ligand_frames(trajectory_file, forcefield)
+
+    n_frames = 0
+    if split:
+        os.makedirs(output, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(strip_compression(trajectory_file)))[0]
+        for n_frames, block in enumerate(frames, start=1):
+            frame_file = with_compression(os.path.join(output, f"{stem}_frame{n_frames}.pqr"), compress)
+            with open_file(frame_file, "wb") as frame_output:
+                frame_output.write(block)
+        return n_frames
+    with open_file(output, "wb") as output_file:
+        for n_frames, block in enumerate(frames, start=1):
+            output_file.write(f"MODEL     {n_frames:>4}\n".encode())
+            output_file.write(block)
+            output_file.write(b"ENDMDL\n")
+        output_file.write(b"END\n")
+    return n_frames
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Write PQR frames of a trajectory, computing charges and radii once.")
+    parser.add_argument("--trajectory", required=True,
+                        help="Multi-MODEL PDB trajectory or multi-conformer MOL2/SDF ligand")
+    parser.add_argument("--topology", default=None,
+                        help="PQR file with the charges and radii of a PDB trajectory")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", default=None,
+                        help="Multi-MODEL PQR output file (.gz/.zst to compress)")
+    output.add_argument("--output-dir", dest="output_dir", default=None,
+                        help="Directory for one PQR file per frame")
+    parser.add_argument("--match", choices=MATCH_MODES, default="name",
+                        help="Match topology atoms to trajectory atoms by name or index (default: name)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                        help="Compress the per-frame files of --output-dir (default: not compressed)")
+    parser.add_argument("--FF", dest="forcefield", default="AMBER",
+                        help="Forcefield for charging SDF ligands with Open Babel (default: AMBER)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    split_frames = args.output_dir is not None
+    written = write_trajectory_pqr(args.trajectory, args.output_dir if split_frames else args.output,
+                                   args.topology, split_frames, args.match, args.forcefield,
+                                   args.compress)
+    print(f"Wrote {written} frames")
@@ -0,0 +1,336 @@
+"""Voxel grid featurization of protein-ligand complexes for 3D CNNs.
+
+Each atom is spread onto a fixed-size grid centred on the ligand as a
+Gaussian density of its PQR radius, `exp(-2 d^2 / r^2)`, truncated at
+`CUTOFF_SCALE * r`. Every atom adds its density to an occupancy channel of
+its element group and its charge-weighted density to a charge channel, with
+separate channel sets for protein and ligand atoms.
+
+Only the voxels within an atom's cutoff are evaluated: atoms are grouped by
+the size of their voxel stencil, and the densities of a whole group are
+computed as one array operation and accumulated with `np.bincount`.
+
+Channel layout, for `n = len(ELEMENT_CHANNELS)`::
+
+    0 .. n-1        protein occupancy per element group
+    n               protein charge
+    n+1 .. 2n       ligand occupancy per element group
+    2n+1            ligand charge
+
+Featurize every generated complex into sparse `.npz` files::
+
+    python voxelize.py --input-dir data/generated --output-dir data/voxels --sparse
+"""
+import argparse
+import os
+from itertools import product
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from pack_complexes import PackedComplexStore
+from pqr_arrays import ELEMENT_CODES, ELEMENTS, find_complexes, load_complex, read_combined_pqr
+from scheduler import file_cost, map_longest_first
+
+
+#: Element groups with their own occupancy channel; any other element goes
+#: to the last, catch-all group.
+ELEMENT_CHANNELS: Tuple[Tuple[str, ...], ...] = (
+    ("C",), ("N",), ("O",), ("S",), ("P",), ("F", "Cl", "Br", "I"), ("H",), (),
+)
+
+DEFAULT_SIZE = 24.0
+DEFAULT_SPACING = 1.0
+#: Densities are truncated at this multiple of the atom radius.
+CUTOFF_SCALE = 1.5
+#: Radius given to atoms with a smaller (e.g. zero) PQR radius, in Angstrom.
+MIN_RADIUS = 0.6
+
+
+def _element_channel_lookup() -> np.ndarray:
+    lookup = np.full(len(ELEMENTS), len(ELEMENT_CHANNELS) - 1, dtype=np.int64)
+    for channel, symbols in enumerate(ELEMENT_CHANNELS):
+        for symbol in symbols:
+            lookup[ELEMENT_CODES[symbol]] = channel
+    return lookup
+
+
+#: Occupancy channel of every element code.
+_ELEMENT_CHANNEL = _element_channel_lookup()
+
+#: Number of channels of one side (protein or ligand): occupancies and charge.
+CHANNELS_PER_SIDE = len(ELEMENT_CHANNELS) + 1
+N_CHANNELS = 2 * CHANNELS_PER_SIDE
+
+
+class SparseVoxels(NamedTuple):
+    """Nonzero voxels of a voxel grid in coordinate (COO) format."""
+
+    #: (channel, x, y, z) index of each nonzero voxel, shape (nnz, 4)
+    indices: np.ndarray
+    #: Value of each nonzero voxel, shape (nnz,)
+    values: np.ndarray
+    #: Shape of the dense grid, (channels, n, n, n)
+    shape: Tuple[int, int, int, int]
+
+    def to_dense(self) -> np.ndarray:
+        """
+        Expand into a dense array of shape `self.shape`.
+        """
+        dense = np.zeros(self.shape, dtype=self.values.dtype)
+        dense[tuple(self.indices.T)] = self.values
+        return dense
+
+
+def _stencil(reach: int) -> np.ndarray:
+    return np.array(list(product(range(-reach, reach + 1), repeat=3)), dtype=np.int64)
+
+
+def _contributions(
+    atoms: Dict[str, np.ndarray],
+    origin: np.ndarray,
+    n_voxels: int,
+    spacing: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the flat voxel indices and values added by every atom.
+    """
+    coords = np.asarray(atoms["coords"], dtype=np.float64)
+    radii = np.maximum(np.asarray(atoms["radius"], dtype=np.float64), MIN_RADIUS)
+    cutoffs = CUTOFF_SCALE * radii
+    # Drop the atoms whose density cannot reach the grid
+    low, high = origin, origin + n_voxels * spacing
+    near = np.flatnonzero(np.all(
+        (coords > low - cutoffs[:, None]) & (coords < high + cutoffs[:, None]), axis=1
+    ))
+    coords, radii, cutoffs = coords[near], radii[near], cutoffs[near]
+    charges = np.asarray(atoms["charge"], dtype=np.float64)[near]
+    side = np.asarray(atoms["is_ligand"], dtype=bool)[near].astype(np.int64) * CHANNELS_PER_SIDE
+    occupancy_channel = side + _ELEMENT_CHANNEL[np.asarray(atoms["element"], dtype=np.int64)[near]]
+    charge_channel = side + len(ELEMENT_CHANNELS)
+
+    voxel_volume = n_voxels ** 3
+    # Voxel containing each atom; voxel centres are at origin + (i + 0.5) * spacing
+    base = np.floor((coords - origin) / spacing).astype(np.int64)
+    reaches = np.ceil(cutoffs / spacing).astype(np.int64)
+    found_index, found_value = [], []
+    for reach in np.unique(reaches):
+        group = np.flatnonzero(reaches == reach)
+        voxels = base[group, None, :] + _stencil(int(reach))[None, :, :]
+        delta = origin + (voxels + 0.5) * spacing - coords[group, None, :]
+        dist_sq = np.einsum("ijk,ijk->ij", delta, delta)
+        keep = (dist_sq <= (cutoffs[group] ** 2)[:, None]) & np.all(
+            (voxels >= 0) & (voxels < n_voxels), axis=2
+        )
+        atom, stencil_index = np.nonzero(keep)
+        voxel = voxels[atom, stencil_index]
+        flat = (voxel[:, 0] * n_voxels + voxel[:, 1]) * n_voxels + voxel[:, 2]
+        density = np.exp(-2.0 * dist_sq[atom, stencil_index] / radii[group][atom] ** 2)
+        atom = group[atom]
+        found_index += [occupancy_channel[atom] * voxel_volume + flat,
+                        charge_channel[atom] * voxel_volume + flat]
+        found_value += [density, charges[atom] * density]
+    if not found_index:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    return np.concatenate(found_index), np.concatenate(found_value)
+
+
+def voxelize(
+    atoms: Dict[str, np.ndarray],
+    center: Optional[Sequence[float]] = None,
+    size: float = DEFAULT_SIZE,
+    spacing: float = DEFAULT_SPACING,
+    sparse: bool = False,
+    dtype: str = "float32",
+) -> Union[np.ndarray, SparseVoxels]:
+    """
+    Rasterise a complex onto a voxel grid.
+
+    Parameters
+    ----------
+    atoms : Dict[str, np.ndarray]
+        Complex atom arrays with "coords", "charge", "radius", "element" and
+        "is_ligand" columns, e.g. from `pqr_arrays.load_complex` or a
+        `PackedComplexStore`.
+    center : Optional[Sequence[float]]
+        Centre of the grid; the ligand centroid if not given.
+    size : float
+        Edge length of the grid box, in Angstrom.
+    spacing : float
+        Voxel edge length, in Angstrom.
+    sparse : bool
+        Return the nonzero voxels as `SparseVoxels` instead of a dense array.
+    dtype : str
+        Floating point type of the voxel values.
+
+    Returns
+    -------
+    Union[np.ndarray, SparseVoxels]
+        Dense grid of shape (N_CHANNELS, n, n, n) with `n = ceil(size / spacing)`,
+        or its nonzero voxels.
+    """
+    if center is None:
+        is_ligand = np.asarray(atoms["is_ligand"], dtype=bool)
+        if not is_ligand.any():
+            raise ValueError("Complex has no ligand atoms to centre the grid on.")
+        center = np.asarray(atoms["coords"], dtype=np.float64)[is_ligand].mean(axis=0)
+    n_voxels = int(np.ceil(size / spacing))
+    origin = np.asarray(center, dtype=np.float64) - n_voxels * spacing / 2
+    shape = (N_CHANNELS, n_voxels, n_voxels, n_voxels)
+
+    flat, values = _contributions(atoms, origin, n_voxels, spacing)
+    if not sparse:
+        dense = np.bincount(flat, values, minlength=int(np.prod(shape)))
+        return dense.reshape(shape).astype(dtype)
+    unique_flat, inverse = np.unique(flat, return_inverse=True)
+    summed = np.bincount(inverse, values)
+    nonzero = summed != 0
+    indices = np.column_stack(np.unravel_index(unique_flat[nonzero], shape)).astype(np.int32)
+    return SparseVoxels(indices, summed[nonzero].astype(dtype), shape)
+
+
+def voxelize_batch(
+    complexes: Iterable[Dict[str, np.ndarray]],
+    size: float = DEFAULT_SIZE,
+    spacing: float = DEFAULT_SPACING,
+    sparse: bool = False,
+    dtype: str = "float32",
+) -> Union[np.ndarray, List[SparseVoxels]]:
+    """
+    Rasterise many complexes, each centred on its own ligand.
+
+    Parameters
+    ----------
+    complexes : Iterable[Dict[str, np.ndarray]]
+        Complex atom arrays, e.g. a `PackedComplexStore`.
+    size, spacing, sparse, dtype
+        See `voxelize`.
+
+    Returns
+    -------
+    Union[np.ndarray, List[SparseVoxels]]
+        Dense grids stacked into shape (batch, N_CHANNELS, n, n, n), or the
+        sparse grid of every complex.
+    """
+    grids = [voxelize(atoms, None, size, spacing, sparse, dtype) for atoms in complexes]
+    if sparse:
+        return grids
+    if not grids:
+        n_voxels = int(np.ceil(size / spacing))
+        return np.zeros((0, N_CHANNELS, n_voxels, n_voxels, n_voxels), dtype=dtype)
+    return np.stack(grids)
+
+
+def save_voxels(output_file: str, grid: Union[np.ndarray, SparseVoxels]) -> None:
+    """
+    Save a dense or sparse voxel grid to an `.npz` file.
+    """
+    if isinstance(grid, SparseVoxels):
+        np.savez_compressed(output_file, indices=grid.indices, values=grid.values,
+                            shape=np.array(grid.shape))
+    else:
+        np.savez_compressed(output_file, grid=grid)
+
+
+def load_voxels(file_path: str) -> Union[np.ndarray, SparseVoxels]:
+    """
+    Load a voxel grid saved with `save_voxels`.
+    """
+    with np.load(file_path) as data:
+        if "grid" in data:
+            return data["grid"]
+        return SparseVoxels(data["indices"], data["values"], tuple(int(n) for n in data["shape"]))
+
+
+def _voxelize_job(job: Tuple[str, Tuple[str, ...], str, float, float, bool]) -> str:
+    pdb_id, paths, output_dir, size, spacing, sparse = job
+    atoms = read_combined_pqr(paths[0]) if len(paths) == 1 else load_complex(*paths)
+    output_file = os.path.join(output_dir, f"{pdb_id}_voxels.npz")
+    save_voxels(output_file, voxelize(atoms, None, size, spacing, sparse))
+    return output_file
+
+
+def voxelize_dataset(
+    input_dir: str,
+    output_dir: str,
+    size: float = DEFAULT_SIZE,
+    spacing: float = DEFAULT_SPACING,
+    sparse: bool = False,
+    workers: int = 1,
+    timings_file: Optional[str] = None,
+) -> int:
+    """
+    Write `<PDB_ID>_voxels.npz` for every complex of a generated tree or a
+    packed store.
+
+    Parameters
+    ----------
+    input_dir : str
+        `data/generated`-style tree, or a store written by `pack_complexes.py`.
+    output_dir : str
+        Directory of the voxel files.
+    size, spacing, sparse
+        See `voxelize`.
+    workers : int
+        Number of worker processes for a generated tree.
+    timings_file : Optional[str]
+        JSON file of run times of earlier runs, used to start the slowest
+        complexes first and updated with this run, see
+        `scheduler.map_longest_first`.
+
+    Returns
+    -------
+    int
+        Number of complexes written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if os.path.isfile(os.path.join(input_dir, "manifest.json")):
+        store = PackedComplexStore(input_dir)
+        for pdb_id, atoms in zip(store.ids, store):
+            save_voxels(os.path.join(output_dir, f"{pdb_id}_voxels.npz"),
+                        voxelize(atoms, None, size, spacing, sparse))
+        return len(store)
+
+    jobs = [(pdb_id, (protein_file, ligand_file), output_dir, size, spacing, sparse)
+            for pdb_id, protein_file, ligand_file in find_complexes(input_dir)]
+    return len(list(map_longest_first(
+        _voxelize_job, jobs, [file_cost(*job[1]) for job in jobs], workers,
+        [job[0] for job in jobs], f"voxelize:{size}:{spacing}:{sparse}", timings_file,
+    )))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Rasterise protein-ligand complexes onto voxel grids for 3D CNNs.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/generated",
+                        help="Generated PQR tree or packed store (default: data/generated)")
+    parser.add_argument("--input", default=None,
+                        help="Single combined PQR file to voxelize instead of a directory")
+    parser.add_argument("--output-dir", dest="output_dir", default="data/voxels",
+                        help="Directory of the voxel files (default: data/voxels)")
+    parser.add_argument("--size", type=float, default=DEFAULT_SIZE,
+                        help=f"Grid edge length in Angstrom (default: {DEFAULT_SIZE})")
+    parser.add_argument("--spacing", type=float, default=DEFAULT_SPACING,
+                        help=f"Voxel edge length in Angstrom (default: {DEFAULT_SPACING})")
+    parser.add_argument("--sparse", action="store_true",
+                        help="Store only the nonzero voxels")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPUs)")
+    parser.add_argument("--timings", default=None,
+                        help="JSON file of run times for longest-first scheduling (default: not kept)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.input is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        pdb_id = os.path.basename(args.input).split("_")[0]
+        written = _voxelize_job((pdb_id, (args.input,), args.output_dir,
+                                 args.size, args.spacing, args.sparse))
+        print(f"Wrote {written}")
+    else:
+        n_written = voxelize_dataset(args.input_dir, args.output_dir, args.size,
+                                     args.spacing, args.sparse, args.workers,
+                                     args.timings)
+        print(f"Voxelized {n_written} complexes into {args.output_dir}")
@@ -0,0 +1,422 @@
+"""Keep the generated PQR files up to date with the input tree, continuously.
+
+The watcher polls `data/pdbbind/<ID>/` for new or changed inputs and rebuilds
+only the outputs that depend on them, in `data/generated/<ID>/`:
+
+- `<ID>_protein.pdb` -> `<ID>_protein.pqr` (pdb2pqr)
+- `<ID>_ligand.sdf` -> `<ID>_ligand.pqr` (Open Babel and the radius fix);
+  `<ID>_ligand.mol2` is the ligand source only when there is no SDF file
+- either PQR file -> `<ID>_combined.pqr`
+
+Like `make`, an output is stale when it is missing or older than any of its
+inputs, so a restarted watcher catches up on what changed while it was down
+and an up-to-date complex costs a few `stat` calls.
+
+Each poll lists the top-level input directory once and re-lists only the
+complex directories whose modification time changed, i.e. where a file was
+added, removed or renamed; files edited in place are caught by `stat` on the
+known inputs. A changed complex is scheduled once its inputs have been quiet
+for `--debounce` seconds, so a curator copying a directory in triggers one
+rebuild, not one per file. Rebuilds run on a process pool, at most one per
+complex at a time::
+
+    python watch_inputs.py --input-dir data/pdbbind --output-dir data/generated --workers 4
+"""
+import argparse
+import logging
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Collection, Dict, List, Optional, Set, Tuple
+
+from catalog import Catalog, PQRStats
+from convert_sdf_to_pqr import convert_one, finish_pqr
+from file_io import atomic_output, temp_path
+from form_complex_pqr import combine_pqr_files
+from work_queue import run_pdb2pqr
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_DEBOUNCE = 2.0
+
+#: Stage of the input files of a complex, by suffix after its PDB ID
+INPUT_STAGES = {"_protein.pdb": "protein", "_ligand.sdf": "ligand", "_ligand.mol2": "ligand"}
+INPUT_SUFFIXES = tuple(INPUT_STAGES)
+
+#: Stages in the order they run
+STAGES = ("protein", "ligand", "complex")
+
+
+def _mtime(file_path: str) -> Optional[int]:
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def list_inputs(input_dir: str, pdb_id: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Get the (modification time, size) of each input file of a complex, by
+    file name.
+    """
+    files = {}
+    try:
+        with os.scandir(os.path.join(input_dir, pdb_id)) as entries:
+            for entry in entries:
+                if entry.name.endswith(INPUT_SUFFIXES) and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        pass
+    return files
+
+
+def changed_stages(before: Dict[str, Tuple[int, int]], after: Dict[str, Tuple[int, int]]) -> Set[str]:
+    """
+    Get the stages whose input files differ between two `list_inputs` results.
+    """
+    return {stage for suffix, stage in INPUT_STAGES.items()
+            for name in set(before) | set(after)
+            if name.endswith(suffix) and before.get(name) != after.get(name)}
+
+
+def stage_files(pdb_id: str, input_dir: str, output_dir: str) -> Dict[str, Tuple[List[str], str]]:
+    """
+    Get the input files and the output file of each stage of a complex.
+
+    Stages without an input file on disk are left out.
+
+    Parameters
+    ----------
+    pdb_id : str
+        PDB ID of the complex, the name of its directory.
+    input_dir : str
+        Input tree, e.g. `data/pdbbind`.
+    output_dir : str
+        Output tree, e.g. `data/generated`.
+
+    Returns
+    -------
+    Dict[str, Tuple[List[str], str]]
+        (input files, output file) by stage name.
+    """
+    source_dir = os.path.join(input_dir, pdb_id)
+    target_dir = os.path.join(output_dir, pdb_id)
+    protein_pdb = os.path.join(source_dir, f"{pdb_id}_protein.pdb")
+    ligand_sdf = os.path.join(source_dir, f"{pdb_id}_ligand.sdf")
+    ligand_mol2 = os.path.join(source_dir, f"{pdb_id}_ligand.mol2")
+    protein_pqr = os.path.join(target_dir, f"{pdb_id}_protein.pqr")
+    ligand_pqr = os.path.join(target_dir, f"{pdb_id}_ligand.pqr")
+
+    stages = {}
+    if os.path.isfile(protein_pdb):
+        stages["protein"] = ([protein_pdb], protein_pqr)
+    if os.path.isfile(ligand_sdf):
+        stages["ligand"] = ([ligand_sdf], ligand_pqr)
+    elif os.path.isfile(ligand_mol2):
+        stages["ligand"] = ([ligand_mol2], ligand_pqr)
+    if "protein" in stages and "ligand" in stages:
+        stages["complex"] = ([protein_pqr, ligand_pqr], os.path.join(target_dir, f"{pdb_id}_combined.pqr"))
+    return stages
+
+
+def stale_stages(pdb_id: str, input_dir: str, output_dir: str, force: Collection[str] = ()) -> List[str]:
+    """
+    List the stages of a complex whose output is missing or older than an
+    input, or that are in `force`, including the stages downstream of a
+    stale one.
+    """
+    stale: List[str] = []
+    for stage, (inputs, output) in stage_files(pdb_id, input_dir, output_dir).items():
+        output_mtime = _mtime(output)
+        upstream_stale = stage == "complex" and bool(stale)
+        input_mtimes = [_mtime(file_path) for file_path in inputs]
+        if (upstream_stale or stage in force or output_mtime is None
+                or any(mtime is not None and mtime > output_mtime for mtime in input_mtimes)):
+            stale.append(stage)
+    return stale
+
+
+def convert_mol2_ligand(mol2_file: str, output_file: str, forcefield: str = "AMBER",
+                        stats: Optional[PQRStats] = None) -> str:
+    """
+    Convert a ligand MOL2 file to PQR with Open Babel and fix its radii.
+    """
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    raw_file = temp_path(output_file, "raw")
+    subprocess.run(["obabel", "-imol2", mol2_file, "-opqr", "-O", raw_file, "--FF", forcefield],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return finish_pqr(raw_file, output_file, stats=stats)
+
+
+def update_complex(pdb_id: str, input_dir: str, output_dir: str, forcefield: str = "AMBER",
+                   catalog_file: Optional[str] = None, force: Collection[str] = ()) -> List[str]:
+    """
+    Rebuild the stale outputs of a complex, in stage order.
+
+    Parameters
+    ----------
+    pdb_id : str
+        PDB ID of the complex.
+    input_dir : str
+        Input tree, e.g. `data/pdbbind`.
+    output_dir : str
+        Output tree, e.g. `data/generated`.
+    forcefield : str
+        Forcefield for the charges.
+    catalog_file : Optional[str]
+        SQLite catalog in which the rebuilt files are recorded.
+    force : Collection[str]
+        Stages to rebuild even if their output is newer than their inputs.
+
+    Returns
+    -------
+    List[str]
+        The stages that were run.
+    """
+    stages = stage_files(pdb_id, input_dir, output_dir)
+    stale = stale_stages(pdb_id, input_dir, output_dir, force)
+    catalog = Catalog(catalog_file) if catalog_file is not None else None
+    try:
+        for stage in stale:
+            inputs, output = stages[stage]
+            stats = PQRStats() if catalog is not None else None
+            if stage == "protein":
+                run_pdb2pqr(inputs[0], output, forcefield)
+                if catalog is not None:
+                    # pdb2pqr writes the file itself, so it is read back once
+                    stats = PQRStats.from_file(output)
+            elif stage == "ligand" and inputs[0].endswith(".sdf"):
+                # Writes the same path as `output`, mirroring the input tree,
+                # and records it itself
+                convert_one(Path(inputs[0]), output_dir, forcefield, input_dir=input_dir, catalog=catalog)
+                continue
+            elif stage == "ligand":
+                convert_mol2_ligand(inputs[0], output, forcefield, stats)
+            else:
+                with atomic_output(output) as partial_file:
+                    combine_pqr_files(inputs[1], inputs[0], partial_file, stats)
+            if catalog is not None:
+                catalog.record(output, stats, inputs)
+    finally:
+        if catalog is not None:
+            catalog.close()
+    return stale
+
+
+def _update_job(pdb_id: str, input_dir: str, output_dir: str, forcefield: str, catalog_file: Optional[str],
+                force: Collection[str]) -> Tuple[Dict[str, Tuple[int, int]], List[str]]:
+    """
+    Run `update_complex` in a worker and also return the inputs it started
+    from, before any of them was read.
+    """
+    inputs = list_inputs(input_dir, pdb_id)
+    return inputs, update_complex(pdb_id, input_dir, output_dir, forcefield, catalog_file, force)
+
+
+class InputWatcher:
+    """
+    Detect changed complexes in an input tree by polling, with debouncing.
+
+    Parameters
+    ----------
+    input_dir : str
+        Input tree with one directory per complex.
+    debounce : float
+        Seconds a complex must go without changes before it is ready.
+    """
+
+    def __init__(self, input_dir: str, debounce: float = DEFAULT_DEBOUNCE) -> None:
+        self.input_dir = input_dir
+        self.debounce = debounce
+        #: Modification time of each complex directory
+        self._dirs: Dict[str, int] = {}
+        #: (modification time, size) of each input file, by complex
+        self._files: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        #: Time of the last change of each complex not yet returned by `ready`
+        self._pending: Dict[str, float] = {}
+
+    def _stat_inputs(self, pdb_id: str) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for name in self._files.get(pdb_id, {}):
+            try:
+                stat = os.stat(os.path.join(self.input_dir, pdb_id, name))
+            except FileNotFoundError:
+                continue
+            files[name] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def poll(self, now: Optional[float] = None) -> Set[str]:
+        """
+        Check the input tree once and mark the changed complexes as pending.
+
+        The first poll marks every complex with inputs.
+
+        Returns
+        -------
+        Set[str]
+            PDB IDs of the complexes that changed since the last poll.
+        """
+        now = time.monotonic() if now is None else now
+        changed = set()
+        seen = set()
+        with os.scandir(self.input_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                pdb_id = entry.name
+                seen.add(pdb_id)
+                dir_mtime = entry.stat().st_mtime_ns
+                if self._dirs.get(pdb_id) != dir_mtime:
+                    self._dirs[pdb_id] = dir_mtime
+                    files = list_inputs(self.input_dir, pdb_id)
+                else:
+                    files = self._stat_inputs(pdb_id)
+                if files and files != self._files.get(pdb_id):
+                    changed.add(pdb_id)
+                self._files[pdb_id] = files
+        for pdb_id in set(self._dirs) - seen:
+            del self._dirs[pdb_id]
+            self._files.pop(pdb_id, None)
+            self._pending.pop(pdb_id, None)
+        for pdb_id in changed:
+            self._pending[pdb_id] = now
+        return changed
+
+    def ready(self, now: Optional[float] = None) -> List[str]:
+        """
+        Take the pending complexes that have been quiet for `debounce` seconds.
+        """
+        now = time.monotonic() if now is None else now
+        ready = sorted(pdb_id for pdb_id, changed_at in self._pending.items()
+                       if now - changed_at >= self.debounce)
+        for pdb_id in ready:
+            del self._pending[pdb_id]
+        return ready
+
+    def defer(self, pdb_id: str, now: Optional[float] = None) -> None:
+        """
+        Mark a complex as pending again, e.g. while its rebuild is running.
+        """
+        self._pending[pdb_id] = time.monotonic() if now is None else now
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def inputs(self, pdb_id: str) -> Dict[str, Tuple[int, int]]:
+        """
+        Get the (modification time, size) of each input file of a complex, as
+        of the last poll.
+        """
+        return self._files.get(pdb_id, {})
+
+
+def watch(
+    input_dir: str,
+    output_dir: str,
+    forcefield: str = "AMBER",
+    workers: int = 1,
+    interval: float = DEFAULT_INTERVAL,
+    debounce: float = DEFAULT_DEBOUNCE,
+    once: bool = False,
+    catalog_file: Optional[str] = None,
+) -> None:
+    """
+    Rebuild the stale outputs of changed complexes as the input tree changes.
+
+    Parameters
+    ----------
+    input_dir : str
+        Input tree, e.g. `data/pdbbind`.
+    output_dir : str
+        Output tree, e.g. `data/generated`.
+    forcefield : str
+        Forcefield for the charges.
+    workers : int
+        Number of worker processes.
+    interval : float
+        Seconds between polls.
+    debounce : float
+        Seconds a complex must go without changes before it is rebuilt.
+    once : bool
+        Bring every complex up to date and return instead of watching.
+    catalog_file : Optional[str]
+        SQLite catalog in which the rebuilt files are recorded.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    watcher = InputWatcher(input_dir, 0.0 if once else debounce)
+    running: Dict[str, "Future"] = {}
+    # Inputs each complex was last rebuilt from. An input edited during its
+    # rebuild, after being read, can end up older than the output, so the
+    # stages of inputs that differ from these are rebuilt whatever the mtimes.
+    built: Dict[str, Dict[str, Tuple[int, int]]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        watcher.poll()
+        while True:
+            for pdb_id, future in list(running.items()):
+                if not future.done():
+                    continue
+                del running[pdb_id]
+                try:
+                    built[pdb_id], stages = future.result()
+                except Exception as error:
+                    # Retried when the inputs of the complex change again
+                    _LOGGER.warning(f"Failed to update {pdb_id}: {type(error).__name__}: {error}")
+                else:
+                    _LOGGER.info(f"Updated {pdb_id}: {', '.join(stages)}")
+                    if changed_stages(built[pdb_id], watcher.inputs(pdb_id)):
+                        watcher.defer(pdb_id)
+
+            for pdb_id in watcher.ready():
+                if pdb_id in running:
+                    watcher.defer(pdb_id)
+                    continue
+                force = changed_stages(built[pdb_id], watcher.inputs(pdb_id)) if pdb_id in built else set()
+                if stale_stages(pdb_id, input_dir, output_dir, force):
+                    running[pdb_id] = executor.submit(_update_job, pdb_id, input_dir, output_dir,
+                                                      forcefield, catalog_file, force)
+
+            if once and not running and not watcher.has_pending():
+                return
+            time.sleep(interval)
+            if not once:
+                watcher.poll()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Watch the input tree and rebuild the PQR files of changed complexes.")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/pdbbind",
+                        help="Input directory with one directory per complex (default: data/pdbbind)")
+    parser.add_argument("--output-dir", dest="output_dir", default="data/generated",
+                        help="Output directory for the PQR files (default: data/generated)")
+    parser.add_argument("--FF", dest="forcefield", default="AMBER",
+                        help="Forcefield for the charges (default: AMBER)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between polls of the input tree (default: {DEFAULT_INTERVAL:g})")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help=f"Seconds a complex must go unchanged before it is rebuilt (default: {DEFAULT_DEBOUNCE:g})")
+    parser.add_argument("--catalog", default=None,
+                        help="Record the rebuilt files in this SQLite catalog (default: none)")
+    parser.add_argument("--once", action="store_true",
+                        help="Bring every complex up to date, then exit")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    try:
+        watch(args.input_dir, args.output_dir, args.forcefield, args.workers,
+              args.interval, args.debounce, args.once, args.catalog)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,471 @@
+"""Distribute the conversion stages over many nodes through a shared directory.
+
+A queue directory on a shared filesystem holds one JSON file per task in
+`tasks/`. Any number of workers, on any number of nodes, claim tasks by
+creating `leases/<task>.lease` with `O_CREAT | O_EXCL`, which succeeds for
+exactly one of them. A worker touches its lease every `lease_timeout / 4`
+seconds while the task runs. A lease that has not been touched for
+`lease_timeout` seconds belongs to a crashed worker and is reclaimed by the
+next worker that finds it. Finished tasks leave a marker in `done/` or, with
+their error, in `failed/`. Outputs are written atomically, so a task that
+runs twice after a reclaimed lease does no harm. Each task records the cost
+of its input, see `scheduler.file_cost`, and workers claim the most
+expensive unfinished task first, so the largest proteins do not start last.
+
+Create-exclusive and rename are atomic on local filesystems and on NFSv3 or
+later, which is all the queue relies on; no broker is needed. Fill a queue,
+start workers on every node, and follow their progress::
+
+    python work_queue.py enqueue --queue /shared/queue --stage obabel --input-dir data/pdbbind --output-dir data/generated
+    python work_queue.py worker --queue /shared/queue
+    python work_queue.py status --queue /shared/queue
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from file_io import COMPRESSION_SUFFIXES, atomic_output, strip_compression
+from instrumentation import span
+
+if TYPE_CHECKING:
+    from catalog import Catalog
+
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_LEASE_TIMEOUT = 300.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+def run_pdb2pqr(input_file: str, output_file: str, forcefield: str = "AMBER",
+                catalog: Optional["Catalog"] = None) -> None:
+    """
+    Run pdb2pqr on one protein, writing its PQR file atomically, and record
+    it in `catalog` if given.
+    """
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with atomic_output(output_file) as partial_file, span("pdb2pqr", input_file=input_file):
+        subprocess.run(["pdb2pqr", f"--ff={forcefield}", input_file, partial_file],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if catalog is not None:
+        from catalog import PQRStats
+
+        # Written by pdb2pqr, so its statistics take one read of the file
+        catalog.record(output_file, PQRStats.from_file(output_file), [input_file])
+
+
+def _open_catalog(args: Dict[str, Any]) -> Optional["Catalog"]:
+    # The conversion modules and sqlite3 are only imported by the workers,
+    # not by --help or status; see benchmark_startup.py
+    from catalog import Catalog
+
+    return Catalog(args["catalog"]) if args.get("catalog") else None
+
+
+def _run_obabel(args: Dict[str, Any]) -> None:
+    from convert_sdf_to_pqr import convert_one
+
+    catalog = _open_catalog(args)
+    try:
+        convert_one(Path(args["sdf_file"]), args["output_dir"], args["forcefield"],
+                    args.get("compress"), args["input_dir"], catalog)
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+
+def _run_pdb2pqr(args: Dict[str, Any]) -> None:
+    catalog = _open_catalog(args)
+    try:
+        run_pdb2pqr(args["pdb_file"], args["output_file"], args["forcefield"], catalog)
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+
+#: Function running each stage, called with the arguments of a task.
+STAGES: Dict[str, Callable[[Dict[str, Any]], None]] = {
+    "obabel": _run_obabel,
+    "pdb2pqr": _run_pdb2pqr,
+}
+
+
+class WorkQueue:
+    """
+    Task queue kept as files in a shared directory.
+
+    Parameters
+    ----------
+    queue_dir : str
+        Queue directory; its `tasks/`, `leases/`, `done/` and `failed/`
+        subdirectories are created if missing.
+    lease_timeout : float
+        Seconds without a heartbeat after which a lease is reclaimed.
+    worker_id : Optional[str]
+        Name of this worker in leases and markers; "<host>:<pid>" if None.
+    """
+
+    def __init__(self, queue_dir: str, lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                 worker_id: Optional[str] = None) -> None:
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        # Cost of each task seen so far; task files never change
+        self._costs: Dict[str, float] = {}
+        for subdir in ("tasks", "leases", "done", "failed"):
+            os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+
+    def _path(self, subdir: str, task: str, suffix: str = ".json") -> str:
+        return os.path.join(self.queue_dir, subdir, task + suffix)
+
+    def _write_marker(self, subdir: str, task: str, record: Dict[str, Any]) -> None:
+        with atomic_output(self._path(subdir, task)) as partial_file:
+            with open(partial_file, "w") as file:
+                json.dump(record, file)
+
+    def enqueue(self, task: str, stage: str, args: Dict[str, Any], cost: float = 0.0) -> bool:
+        """
+        Add a task unless a task of that name already exists.
+
+        Parameters
+        ----------
+        task : str
+            Unique name of the task, used for its files.
+        stage : str
+            Stage running the task, a key of `STAGES`.
+        args : Dict[str, Any]
+            JSON-serialisable arguments of the stage.
+        cost : float
+            Estimated cost of the task; workers run expensive tasks first.
+
+        Returns
+        -------
+        bool
+            Whether the task was added.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {sorted(STAGES)}")
+        if os.path.exists(self._path("tasks", task)):
+            return False
+        self._write_marker("tasks", task, {"stage": stage, "args": args, "cost": float(cost)})
+        return True
+
+    def task_cost(self, task: str) -> float:
+        """
+        Get the estimated cost of a task, reading its file only once.
+        """
+        cost = self._costs.get(task)
+        if cost is None:
+            with open(self._path("tasks", task)) as file:
+                cost = float(json.load(file).get("cost", 0.0))
+            self._costs[task] = cost
+        return cost
+
+    def tasks(self) -> List[str]:
+        """
+        List the names of all tasks, sorted.
+        """
+        return sorted(name[:-len(".json")] for name in os.listdir(os.path.join(self.queue_dir, "tasks"))
+                      if name.endswith(".json") and not name.startswith("."))
+
+    def is_finished(self, task: str) -> bool:
+        return (os.path.exists(self._path("done", task))
+                or os.path.exists(self._path("failed", task)))
+
+    def lease_age(self, task: str) -> Optional[float]:
+        """
+        Get the seconds since the lease of a task was last touched, or None
+        if the task is not leased.
+        """
+        try:
+            return time.time() - os.stat(self._path("leases", task, ".lease")).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _reclaim(self, task: str) -> bool:
+        """
+        Remove the lease of a task if it is stale; return whether it was.
+        """
+        lease = self._path("leases", task, ".lease")
+        age = self.lease_age(task)
+        if age is None:
+            return True
+        if age < self.lease_timeout:
+            return False
+        # Rename first: only one of several reclaiming workers wins it
+        grave = f"{lease}.{self.worker_id.replace(os.sep, '_')}.stale"
+        try:
+            os.rename(lease, grave)
+        except FileNotFoundError:
+            return True
+        if time.time() - os.stat(grave).st_mtime < self.lease_timeout:
+            # Another worker reclaimed the lease and claimed the task in the
+            # meantime; give its fresh lease back unless it already has one
+            try:
+                os.link(grave, lease)
+            except FileExistsError:
+                pass
+            os.remove(grave)
+            return False
+        os.remove(grave)
+        _LOGGER.info(f"Reclaimed the stale lease of {task} ({age:.0f} s old)")
+        return True
+
+    def claim(self, task: str) -> bool:
+        """
+        Try to lease a task for this worker.
+
+        Returns
+        -------
+        bool
+            Whether this worker now holds the lease of an unfinished task.
+        """
+        if self.is_finished(task):
+            return False
+        lease = self._path("leases", task, ".lease")
+        for _ in range(2):
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._reclaim(task):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as file:
+                json.dump({"worker": self.worker_id, "time": time.time()}, file)
+            if self.is_finished(task):
+                # Finished between the check and the claim
+                os.remove(lease)
+                return False
+            return True
+        return False
+
+    def _heartbeat(self, task: str, stop: threading.Event) -> None:
+        lease = self._path("leases", task, ".lease")
+        while not stop.wait(self.lease_timeout / 4):
+            try:
+                os.utime(lease)
+            except FileNotFoundError:
+                _LOGGER.warning(f"Lost the lease of {task}; it may run twice")
+                return
+
+    def run_task(self, task: str) -> bool:
+        """
+        Run a leased task, mark it done or failed, and release its lease.
+
+        Returns
+        -------
+        bool
+            Whether the task succeeded.
+        """
+        with open(self._path("tasks", task)) as file:
+            spec = json.load(file)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task, stop), daemon=True)
+        heartbeat.start()
+        start = time.time()
+        try:
+            STAGES[spec["stage"]](spec["args"])
+        except Exception as error:
+            self._write_marker("failed", task, {
+                "worker": self.worker_id, "seconds": time.time() - start,
+                "error": f"{type(error).__name__}: {error}",
+            })
+            _LOGGER.warning(f"{task} failed: {error}")
+            return False
+        else:
+            self._write_marker("done", task, {"worker": self.worker_id, "seconds": time.time() - start})
+            return True
+        finally:
+            stop.set()
+            heartbeat.join()
+            try:
+                os.remove(self._path("leases", task, ".lease"))
+            except FileNotFoundError:
+                pass
+
+    def work(self, poll_interval: float = DEFAULT_POLL_INTERVAL, max_tasks: Optional[int] = None) -> int:
+        """
+        Claim and run tasks until every task is finished.
+
+        Unfinished tasks are claimed most expensive first. While the
+        remaining tasks are leased by other workers, the worker waits for
+        them to finish or for their leases to go stale.
+
+        Parameters
+        ----------
+        poll_interval : float
+            Seconds between scans when no task can be claimed.
+        max_tasks : Optional[int]
+            Stop after running this many tasks.
+
+        Returns
+        -------
+        int
+            Number of tasks this worker ran.
+        """
+        n_run = 0
+        while max_tasks is None or n_run < max_tasks:
+            unfinished = [task for task in self.tasks() if not self.is_finished(task)]
+            if not unfinished:
+                break
+            unfinished.sort(key=self.task_cost, reverse=True)
+            claimed = next((task for task in unfinished if self.claim(task)), None)
+            if claimed is None:
+                time.sleep(poll_interval)
+                continue
+            self.run_task(claimed)
+            n_run += 1
+        return n_run
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Count the tasks by state.
+
+        Returns
+        -------
+        Dict[str, Any]
+            "total", "done", "failed", "running" (live leases), "stale"
+            (leases to be reclaimed) and "pending" counts, plus "errors",
+            the error of each failed task.
+        """
+        counts = {"total": 0, "done": 0, "failed": 0, "running": 0, "stale": 0, "pending": 0}
+        errors = {}
+        for task in self.tasks():
+            counts["total"] += 1
+            if os.path.exists(self._path("done", task)):
+                counts["done"] += 1
+            elif os.path.exists(self._path("failed", task)):
+                counts["failed"] += 1
+                with open(self._path("failed", task)) as file:
+                    errors[task] = json.load(file)["error"]
+            else:
+                age = self.lease_age(task)
+                if age is None:
+                    counts["pending"] += 1
+                elif age < self.lease_timeout:
+                    counts["running"] += 1
+                else:
+                    counts["stale"] += 1
+        return {**counts, "errors": errors}
+
+    def retry_failed(self) -> int:
+        """
+        Put the failed tasks back in the queue; return how many there were.
+        """
+        failed_dir = os.path.join(self.queue_dir, "failed")
+        names = [name for name in os.listdir(failed_dir) if name.endswith(".json")]
+        for name in names:
+            os.remove(os.path.join(failed_dir, name))
+        return len(names)
+
+
+def enqueue_stage(queue: WorkQueue, stage: str, input_dir: str, output_dir: str,
+                  forcefield: str = "AMBER", compress: Optional[str] = None,
+                  catalog: Optional[str] = None) -> int:
+    """
+    Add a task for every input of a conversion stage, with the line count of
+    its input file as its cost.
+
+    Parameters
+    ----------
+    queue : WorkQueue
+        The queue.
+    stage : str
+        "obabel" for the ligand .sdf files, "pdb2pqr" for the protein .pdb files.
+    input_dir : str
+        Input tree, e.g. `data/pdbbind`.
+    output_dir : str
+        Output tree, e.g. `data/generated`.
+    forcefield : str
+        Forcefield for the charges.
+    compress : Optional[str]
+        Write the ligand PQR files compressed, "gz" or "zst".
+    catalog : Optional[str]
+        SQLite catalog in which the workers record the PQR files; it must be
+        on a filesystem with working locks, since every worker writes to it.
+
+    Returns
+    -------
+    int
+        Number of tasks added.
+    """
+    # Imported here to keep numpy out of the start-up; see benchmark_startup.py
+    from convert_sdf_to_pqr import iter_sdf_files
+    from scheduler import file_cost
+
+    n_added = 0
+    if stage == "obabel":
+        for sdf_path in iter_sdf_files(input_dir):
+            stem = Path(strip_compression(sdf_path.name)).stem
+            n_added += queue.enqueue(f"obabel-{stem}", stage, {
+                "sdf_file": str(sdf_path), "input_dir": input_dir, "output_dir": output_dir,
+                "forcefield": forcefield, "compress": compress, "catalog": catalog,
+            }, file_cost(str(sdf_path)))
+    elif stage == "pdb2pqr":
+        for pdb_id in sorted(os.listdir(input_dir)):
+            pdb_file = os.path.join(input_dir, pdb_id, f"{pdb_id}_protein.pdb")
+            if os.path.isfile(pdb_file):
+                n_added += queue.enqueue(f"pdb2pqr-{pdb_id}", stage, {
+                    "pdb_file": pdb_file,
+                    "output_file": os.path.join(output_dir, pdb_id, f"{pdb_id}_protein.pqr"),
+                    "forcefield": forcefield, "catalog": catalog,
+                }, file_cost(pdb_file))
+    else:
+        raise ValueError(f"Unknown stage '{stage}', expected one of {sorted(STAGES)}")
+    return n_added
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the conversion stages on many nodes through a shared queue directory.")
+    parser.add_argument("command", choices=("enqueue", "worker", "status", "retry-failed"),
+                        help="enqueue tasks, run a worker, report progress or requeue failed tasks")
+    parser.add_argument("--queue", required=True,
+                        help="Queue directory on the shared filesystem")
+    parser.add_argument("--stage", choices=sorted(STAGES), default="obabel",
+                        help="Stage to enqueue (default: obabel)")
+    parser.add_argument("--input-dir", dest="input_dir", default="data/pdbbind",
+                        help="Input directory of the enqueued stage (default: data/pdbbind)")
+    parser.add_argument("--output-dir", dest="output_dir", default="data/generated",
+                        help="Output directory of the enqueued stage (default: data/generated)")
+    parser.add_argument("--FF", dest="forcefield", default="AMBER",
+                        help="Forcefield for calculating charges (default: AMBER)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSION_SUFFIXES), default=None,
+                        help="Compress the ligand .pqr files (default: not compressed)")
+    parser.add_argument("--catalog", default=None,
+                        help="SQLite catalog in which the enqueued tasks record their .pqr files (default: none)")
+    parser.add_argument("--lease-timeout", dest="lease_timeout", type=float,
+                        default=DEFAULT_LEASE_TIMEOUT,
+                        help=f"Seconds before a silent lease is reclaimed (default: {DEFAULT_LEASE_TIMEOUT:g})")
+    parser.add_argument("--poll-interval", dest="poll_interval", type=float,
+                        default=DEFAULT_POLL_INTERVAL,
+                        help=f"Seconds between scans of a busy queue (default: {DEFAULT_POLL_INTERVAL:g})")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    work_queue = WorkQueue(args.queue, args.lease_timeout)
+    if args.command == "enqueue":
+        n_tasks = enqueue_stage(work_queue, args.stage, args.input_dir, args.output_dir,
+                                args.forcefield, args.compress, args.catalog)
+        print(f"Enqueued {n_tasks} {args.stage} tasks in {args.queue}")
+    elif args.command == "worker":
+        n_tasks = work_queue.work(args.poll_interval)
+        print(f"Worker {work_queue.worker_id} ran {n_tasks} tasks")
+    elif args.command == "retry-failed":
+        print(f"Requeued {work_queue.retry_failed()} failed tasks")
+    else:
+        queue_status = work_queue.status()
+        errors = queue_status.pop("errors")
+        print(", ".join(f"{count} {state}" for state, count in queue_status.items()))
+        for task, error in errors.items():
+            print(f"{task}: {error}")